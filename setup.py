@@ -72,6 +72,14 @@ else:
     with open(fn_version, 'w') as fh:
         fh.write(version_template.format(__version__))
 
+# OpenMP is used for the optional multithreaded evaluation of some force-field
+# terms. It is only enabled on Linux, where GCC supports it out of the box.
+# Without OpenMP, the C code falls back to a serial implementation.
+if sys.platform.startswith('linux'):
+    openmp_flags = ['-fopenmp']
+else:
+    openmp_flags = []
+
 
 setup(
     name='yaff',
@@ -112,6 +120,8 @@ setup(
                      'yaff/pes/slater.h', 'yaff/pes/slater.pxd',
                      'yaff/pes/constants.h', 'yaff/pes/tailcorr.h'],
             include_dirs=[np.get_include()],
+            extra_compile_args=openmp_flags,
+            extra_link_args=openmp_flags,
         ),
     ],
     classifiers=[
@@ -26,6 +26,8 @@
 
 from __future__ import division
 
+from multiprocessing import Pool
+
 import numpy as np
 import h5py as h5
 
@@ -35,6 +37,38 @@ from yaff.log import log
 __all__ = ['SumHills']
 
 
+def _sum_hills_chunk(args):
+    '''Sum the hills on a chunk of grid points, for a series of snapshots
+
+       This is a module-level function, such that it can be sent to worker
+       processes. Periodicities of non-periodic collective variables are NaN.
+    '''
+    grid, q0s, Ks, sigmas, periodicities, ends, nhill_block = args
+    result = np.zeros((len(ends), grid.shape[0]))
+    current = np.zeros(grid.shape[0])
+    begin = 0
+    for isnap, end in enumerate(ends):
+        for block in range(begin, end, nhill_block):
+            block_end = min(block+nhill_block, end)
+            # Compute exponential argument
+            deltas = grid[:,None,:] - q0s[None,block:block_end,:]
+            # Apply minimum image convention
+            if periodicities is not None:
+                for icv in range(grid.shape[1]):
+                    if np.isnan(periodicities[icv]): continue
+                    # Translate (q-q0) over integer multiple of the period P, so it
+                    # ends up in [-P/2,P/2]
+                    deltas[:,:,icv] -= np.floor(0.5+deltas[:,:,icv]/
+                        periodicities[icv])*periodicities[icv]
+            exparg = deltas*deltas
+            exparg = np.multiply(exparg, 0.5/sigmas**2)
+            exparg = np.sum(exparg, axis=2)
+            current += np.dot(np.exp(-exparg), Ks[block:block_end])
+        result[isnap] = current
+        begin = end
+    return result
+
+
 class SumHills(object):
     def __init__(self, grid):
         """
@@ -53,30 +87,87 @@ class SumHills(object):
         self.ncv = self.grid.shape[1]
         self.q0s = None
 
-    def compute_fes(self):
+    def compute_fes(self, chunksize=1000000, nproc=1):
+        """
+           Compute the free energy surface on the grid, using all hills
+
+           **Optional arguments:**
+
+           chunksize
+                The maximal number of (grid point, hill) pairs that is treated
+                at once. This bounds the memory usage.
+
+           nproc
+                The number of processes used to treat chunks of grid points
+                in parallel.
+        """
+        if self.q0s is None:
+            raise ValueError("Hills not initialized")
+        return self.compute_fes_series(max(1, self.q0s.shape[0]), chunksize, nproc)[-1]
+
+    def compute_fes_series(self, every, chunksize=1000000, nproc=1):
+        """
+           Compute the free energy surface on the grid as a function of time
+
+           **Arguments:**
+
+           every
+                A snapshot of the free energy surface is made every time this
+                number of hills is added.
+
+           **Optional arguments:**
+
+           chunksize
+                The maximal number of (grid point, hill) pairs that is treated
+                at once. This bounds the memory usage.
+
+           nproc
+                The number of processes used to treat chunks of grid points
+                in parallel.
+
+           A [M, N] NumPy array is returned, where M is the number of snapshots
+           and N is the number of grid points. Row i contains the free energy
+           surface estimated from the first min((i+1)*every, Nhills) hills.
+           Each snapshot is obtained by adding the contributions of the new
+           hills to the previous snapshot.
+        """
         if self.q0s is None:
             raise ValueError("Hills not initialized")
+        if every < 1:
+            raise ValueError("The number of hills between two snapshots must be at least one.")
+        if chunksize < 1:
+            raise ValueError("The chunk size must be at least one.")
+        if nproc < 1:
+            raise ValueError("The number of processes must be at least one.")
         ngauss = self.q0s.shape[0]
         if self.tempering != 0.0:
             prefactor = self.tempering/(self.tempering+self.T)
         else: prefactor = 1.0
-        # Compute exponential argument
-        deltas = np.diagonal(np.subtract.outer(self.grid, self.q0s), axis1=1, axis2=3).copy()
-        # Apply minimum image convention
-        if self.periodicities is not None:
-            for icv in range(self.ncv):
-                if self.periodicities[icv] is None: continue
-                # Translate (q-q0) over integer multiple of the period P, so it
-                # ends up in [-P/2,P/2]
-                deltas[:,:,icv] -= np.floor(0.5+deltas[:,:,icv]/
-                    self.periodicities[icv])*self.periodicities[icv]
-        exparg = deltas*deltas
-        exparg = np.multiply(exparg, 0.5/self.sigmas**2)
-        exparg = np.sum(exparg, axis=2)
-        exponents = np.exp(-exparg)
-        # Compute the bias energy
-        fes = -prefactor*np.sum(np.multiply(exponents, self.Ks),axis=1)
-        return fes
+        # The hills are processed in blocks that do not cross a snapshot and
+        # the grid is split in chunks, such that each block of pairs contains
+        # at most chunksize elements.
+        ends = list(range(every, ngauss, every)) + [ngauss]
+        nhill_block = max(1, min(ngauss, every, chunksize, 1000))
+        ngrid_chunk = max(1, chunksize//nhill_block)
+        if nproc > 1:
+            # Make sure there is work for all processes.
+            ngrid_chunk = max(1, min(ngrid_chunk, -(-self.grid.shape[0]//nproc)))
+        periodicities = self.periodicities
+        if periodicities is not None:
+            periodicities = np.array([np.nan if p is None else p for p in periodicities], dtype=float)
+        tasks = [(self.grid[begin:begin+ngrid_chunk], self.q0s, self.Ks,
+                  self.sigmas, periodicities, ends, nhill_block)
+                 for begin in range(0, self.grid.shape[0], ngrid_chunk)]
+        if nproc > 1:
+            pool = Pool(nproc)
+            try:
+                results = pool.map(_sum_hills_chunk, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_sum_hills_chunk(task) for task in tasks]
+        return -prefactor*np.concatenate(results, axis=1)
 
     def set_hills(self, q0s, Ks, sigmas, tempering=0.0, T=None, periodicities=None):
         # Safety checks
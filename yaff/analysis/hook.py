@@ -94,6 +94,9 @@ class AnalysisHook(Hook):
         self.analysis_inputs = analysis_inputs
         self.outpath = outpath
         self.do_timestep = do_timestep
+        self.state_keys = [ai.key for ai in self.analysis_inputs.values() if ai.key is not None]
+        if do_timestep:
+            self.state_keys.append('time')
 
         self.online = self.f is None
         if not self.online:
@@ -29,6 +29,7 @@ import shutil, os
 import pkg_resources
 import h5py
 import numpy as np
+from nose.tools import assert_raises
 
 from yaff import *
 from yaff.analysis.test.common import run_mtd_alanine
@@ -61,3 +62,68 @@ def test_sum_hills_alanin():
                 deltas -= np.floor(0.5+deltas/periodicities)*periodicities
                 f -= Ks[ihill]*np.exp(-np.sum(deltas**2/2.0/sigmas**2))
             assert np.abs(f-fes[igrid])<1e-10*kjmol
+
+
+def get_sum_hills_random():
+    grid = np.random.uniform(-np.pi, np.pi, (57, 2))
+    mtd = SumHills(grid)
+    q0s = np.random.uniform(-np.pi, np.pi, (23, 2))
+    Ks = np.random.uniform(0.5, 1.5, 23)*kjmol
+    sigmas = np.array([0.35, 0.5])
+    mtd.set_hills(q0s, Ks, sigmas, periodicities=np.array([2.0*np.pi, None]))
+    return mtd
+
+
+def get_fes_reference(mtd, nhill):
+    fes = np.zeros(mtd.grid.shape[0])
+    for igrid in range(mtd.grid.shape[0]):
+        for ihill in range(nhill):
+            deltas = mtd.grid[igrid]-mtd.q0s[ihill]
+            deltas[0] -= np.floor(0.5+deltas[0]/(2.0*np.pi))*2.0*np.pi
+            fes[igrid] -= mtd.Ks[ihill]*np.exp(-np.sum(deltas**2/2.0/mtd.sigmas**2))
+    return fes
+
+
+def test_sum_hills_chunks():
+    mtd = get_sum_hills_random()
+    fes_ref = get_fes_reference(mtd, 23)
+    for chunksize in 1, 7, 100, 1000000:
+        fes = mtd.compute_fes(chunksize=chunksize)
+        assert abs(fes - fes_ref).max() < 1e-10*kjmol
+
+
+def test_sum_hills_nproc():
+    mtd = get_sum_hills_random()
+    fes_ref = get_fes_reference(mtd, 23)
+    fes = mtd.compute_fes(chunksize=50, nproc=2)
+    assert abs(fes - fes_ref).max() < 1e-10*kjmol
+
+
+def test_sum_hills_series():
+    mtd = get_sum_hills_random()
+    fes = mtd.compute_fes_series(5, chunksize=30)
+    assert fes.shape == (5, 57)
+    for isnap, nhill in enumerate([5, 10, 15, 20, 23]):
+        fes_ref = get_fes_reference(mtd, nhill)
+        assert abs(fes[isnap] - fes_ref).max() < 1e-10*kjmol
+
+
+def test_sum_hills_tempering():
+    mtd = get_sum_hills_random()
+    fes = mtd.compute_fes()
+    mtd.set_hills(mtd.q0s, mtd.Ks, mtd.sigmas, tempering=600.0, T=300.0,
+        periodicities=mtd.periodicities)
+    assert abs(mtd.compute_fes() - 2.0/3.0*fes).max() < 1e-10*kjmol
+
+
+def test_sum_hills_invalid():
+    mtd = SumHills(np.zeros((10, 2)))
+    with assert_raises(ValueError):
+        mtd.compute_fes()
+    mtd = get_sum_hills_random()
+    with assert_raises(ValueError):
+        mtd.compute_fes_series(0)
+    with assert_raises(ValueError):
+        mtd.compute_fes(chunksize=0)
+    with assert_raises(ValueError):
+        mtd.compute_fes(nproc=0)
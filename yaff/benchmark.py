@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+'''Benchmark suite for force fields and the Verlet integrator
+
+   A few test systems are repeated in a ladder of supercells, generated with
+   ``System.supercell``. For each supercell, the wall time of the following
+   operations is measured:
+
+   * ``nlist rebuild`` and ``nlist recompute``: a full rebuild of the neighbor
+     list and a recomputation of the relative vectors.
+   * ``part <name>``: the ``compute`` method of every part of the force field,
+     including energy, gradient and virial.
+   * ``ff compute``: the complete force field, including the neighbor list
+     update.
+   * ``verlet step``: one step of a ``VerletIntegrator``.
+
+   Each operation is repeated a few times and the fastest time is kept. The
+   results are a list of records, which can be written to and read from JSON
+   files with ``dump_results`` and ``load_results``. Two sets of results, e.g.
+   of different Yaff versions, are compared with ``compare_results``. The
+   script ``yaff-bench`` is a command-line interface to this module.
+'''
+
+
+from __future__ import division
+
+import json
+import platform
+import time
+
+import numpy as np
+import pkg_resources
+
+from molmod.units import angstrom, femtosecond
+
+import yaff
+from yaff.log import log
+from yaff.pes.ff import ForceField
+from yaff.sampling.verlet import VerletIntegrator
+from yaff.system import System
+
+
+__all__ = [
+    'cases', 'default_supercells', 'load_forcefield', 'run_benchmarks',
+    'dump_results', 'load_results', 'compare_results', 'get_scaling',
+]
+
+
+# The system and parameter files of each benchmark, relative to yaff/data.
+# The water case combines all common pair potentials in one force field.
+cases = {
+    'water': ('bench/water32.chk', [
+        'test/parameters_water.txt', 'test/parameters_water_lj.txt',
+        'test/parameters_water_mm3.txt', 'test/parameters_water_ljcross.txt',
+    ]),
+    'mil53': ('test/system_mil53.chk', ['test/parameters_mil53.txt']),
+}
+
+
+default_supercells = [(1, 1, 1), (2, 1, 1), (2, 2, 1), (2, 2, 2)]
+
+
+def load_forcefield(case, supercell, **kwargs):
+    '''Return the force field of a benchmark case
+
+       **Arguments:**
+
+       case
+            The name of the case, a key of ``cases``.
+
+       supercell
+            A tuple with the number of repetitions of the unit cell along the
+            three cell vectors.
+
+       All optional arguments are passed on to ``ForceField.generate``.
+    '''
+    fn_system, fns_pars = cases[case]
+    system = System.from_file(pkg_resources.resource_filename(yaff.__name__, 'data/' + fn_system))
+    system = system.supercell(*supercell)
+    fns_pars = [pkg_resources.resource_filename(yaff.__name__, 'data/' + fn) for fn in fns_pars]
+    return ForceField.generate(system, fns_pars, **kwargs)
+
+
+def _time_call(fn, nrep):
+    '''Return the smallest wall time of nrep calls'''
+    timings = []
+    for irep in range(nrep):
+        start = time.time()
+        fn()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def _benchmark_forcefield(ff, nrep, nstep):
+    '''Return a list of (label, wall time) pairs for one force field'''
+    result = []
+    nlist = ff.nlist
+    gpos = np.zeros(ff.system.pos.shape)
+    vtens = np.zeros((3, 3))
+    if nlist is not None:
+        def rebuild():
+            nlist.rebuild_next = True
+            nlist.update()
+        result.append(('nlist rebuild', _time_call(rebuild, nrep)))
+        # Without displacements, the update is always a recomputation.
+        result.append(('nlist recompute', _time_call(nlist.update, nrep)))
+    for part in ff.parts:
+        result.append(('part %s' % part.name, _time_call(lambda: part.compute(gpos, vtens), nrep)))
+    pos = ff.system.pos.copy()
+    def compute():
+        ff.update_pos(pos)
+        ff.compute(gpos, vtens)
+    result.append(('ff compute', _time_call(compute, nrep)))
+    verlet = VerletIntegrator(ff, 0.5*femtosecond, temp0=300.0)
+    result.append(('verlet step', _time_call(lambda: verlet.run(nstep), nrep)/nstep))
+    return result
+
+
+def run_benchmarks(case_names=None, supercells=None, nrep=3, nstep=10, skin=2.0*angstrom):
+    '''Run the benchmarks
+
+       **Optional arguments:**
+
+       case_names
+            A list of case names. All cases are included by default.
+
+       supercells
+            A list of supercells, see ``load_forcefield``. Defaults to
+            ``default_supercells``.
+
+       nrep
+            The number of repetitions of each timing.
+
+       nstep
+            The number of Verlet steps in each repetition.
+
+       skin
+            The skin of the neighbor lists.
+
+       **Returns:** a dictionary with information on the platform and the
+       Yaff version, and a list of records under the key ``records``. Each
+       record is a dictionary with the keys ``case``, ``supercell``,
+       ``natom``, ``label`` and ``time`` (wall time in seconds).
+    '''
+    if case_names is None:
+        case_names = sorted(cases)
+    if supercells is None:
+        supercells = default_supercells
+    records = []
+    with log.section('BENCH'):
+        for case in case_names:
+            for supercell in supercells:
+                sc = '.'.join('%i' % n for n in supercell)
+                ff = load_forcefield(case, supercell, skin=skin)
+                timings = _benchmark_forcefield(ff, nrep, nstep)
+                for label, wall in timings:
+                    records.append({
+                        'case': case, 'supercell': sc, 'natom': ff.system.natom,
+                        'label': label, 'time': wall,
+                    })
+                if log.do_low:
+                    log('Case %s, supercell %s, %i atoms' % (case, sc, ff.system.natom))
+                    for label, wall in timings:
+                        log('  %-20s %12.6f s' % (label, wall))
+    return {
+        'yaff_version': yaff.__version__,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'node': platform.node(),
+        'records': records,
+    }
+
+
+def dump_results(results, fn):
+    '''Write the results of ``run_benchmarks`` to a JSON file'''
+    with open(fn, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+
+def load_results(fn):
+    '''Load results written by ``dump_results``'''
+    with open(fn) as f:
+        return json.load(f)
+
+
+def compare_results(results, baseline, threshold=1.2):
+    '''Compare timings with those of a baseline
+
+       **Arguments:**
+
+       results, baseline
+            Two results of ``run_benchmarks``.
+
+       **Optional arguments:**
+
+       threshold
+            A timing is a regression when it is more than threshold times
+            slower than in the baseline.
+
+       **Returns:** a list with a tuple (case, supercell, label, time,
+       baseline time, ratio, regression) for every record present in both
+       results.
+    '''
+    def get_key(record):
+        return record['case'], record['supercell'], record['label']
+    baseline_times = dict((get_key(record), record['time']) for record in baseline['records'])
+    comparison = []
+    for record in results['records']:
+        key = get_key(record)
+        if key not in baseline_times:
+            continue
+        time0 = baseline_times[key]
+        ratio = record['time']/time0 if time0 > 0 else np.inf
+        comparison.append(key + (record['time'], time0, ratio, ratio > threshold))
+    return comparison
+
+
+def get_scaling(results):
+    '''Estimate how the timings scale with the number of atoms
+
+       **Returns:** a dictionary with (case, label) keys and the exponent of
+       a power-law fit of the time versus the number of atoms. Only cases
+       with at least two supercells of different size are included.
+    '''
+    data = {}
+    for record in results['records']:
+        key = record['case'], record['label']
+        data.setdefault(key, []).append((record['natom'], record['time']))
+    scaling = {}
+    for key, points in data.items():
+        natoms, times = np.array(points).T
+        if len(set(natoms)) > 1 and (times > 0).all():
+            scaling[key] = np.polyfit(np.log(natoms), np.log(times), 1)[0]
+    return scaling
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+'''Compare the all-pairs and the cell-list neighbor list builders
+
+   Usage: python bench.py [largest supercell, default 3.3.3]
+
+   The MIL-53 unit cell from ../mil53_quickff is repeated in a series of
+   supercells and the wall time of a full neighbor list rebuild is measured
+   for both build modes of the NeighborList class. The all-pairs builder
+   scales quadratically with the number of atoms, the cell-list builder
+   linearly. Both neighbor lists are checked to be identical.
+'''
+
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from molmod.units import angstrom
+
+from yaff import System, NeighborList, log
+
+
+log.set_level(log.silent)
+
+
+def time_rebuild(system, rcut, cell_list, nrep=3):
+    '''Return the smallest wall time of nrep rebuilds and the neighbor list'''
+    nlist = NeighborList(system, cell_list=cell_list)
+    nlist.request_rcut(rcut)
+    timings = []
+    for irep in range(nrep):
+        nlist.update_rmax()
+        start = time.time()
+        nlist.update()
+        timings.append(time.time() - start)
+    return min(timings), nlist
+
+
+def main():
+    if len(sys.argv) > 1:
+        nmax = [int(s) for s in sys.argv[1].split('.')]
+    else:
+        nmax = [3, 3, 3]
+    fn_chk = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mil53_quickff', 'system.chk')
+    system0 = System.from_file(fn_chk)
+    rcut = 15.0*angstrom
+    supercells = [(1, 1, 1)]
+    while list(supercells[-1]) != nmax:
+        # Grow the supercell along the shortest direction that can still grow.
+        sc = list(supercells[-1])
+        candidates = [i for i in range(3) if sc[i] < nmax[i]]
+        i = min(candidates, key=lambda i: sc[i])
+        sc[i] += 1
+        supercells.append(tuple(sc))
+    print('%10s %8s %10s %12s %12s %8s' % ('supercell', 'natom', 'nneigh', 'all pairs [s]', 'cell list [s]', 'speedup'))
+    for sc in supercells:
+        system = system0.supercell(*sc)
+        t_pairs, nlist_pairs = time_rebuild(system, rcut, False)
+        t_cells, nlist_cells = time_rebuild(system, rcut, True)
+        assert nlist_pairs.nneigh == nlist_cells.nneigh
+        assert (nlist_pairs.neighs[:nlist_pairs.nneigh] == nlist_cells.neighs[:nlist_cells.nneigh]).all()
+        print('%10s %8i %10i %12.4f %12.4f %8.1f' % (
+            '.'.join('%i' % n for n in sc), system.natom, nlist_cells.nneigh,
+            t_pairs, t_cells, t_pairs/t_cells))
+
+
+if __name__ == '__main__':
+    main()
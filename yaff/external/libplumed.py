@@ -40,6 +40,8 @@ __all__ = ['ForcePartPlumed']
 
 class ForcePartPlumed(ForcePart, Hook):
     '''Biasing energies computed by PLUMED'''
+    state_keys = ()
+
     def __init__(self, system, timestep=0.0, restart=0,
                        fn='plumed.dat', kernel=None, fn_log='plumed.log'):
         r'''Initialize a PLUMED ForcePart. More information on the interface
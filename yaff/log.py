@@ -26,20 +26,33 @@
    This module holds the main screen loging object of Yaff. The ``log`` object
    is an instance off the ``ScreenLog`` class in the module ``molmod.log``.
    The logger also comes with a timer infrastructure, which is also implemented
-   in the ``molmod.log`` module.
+   in the ``molmod.log`` module. The ``timer`` object can also be used in
+   worker threads, see ``ThreadTimerGroup``.
+
+   The timer only reports the total time spent in each section. The
+   ``profiler`` object records the wall and CPU time of individual calls in the
+   most important code paths, together with some sizes such as the number of
+   pairs in the neighbor list. It is disabled by default, see ``Profiler``.
 """
 
 
 from __future__ import division
 
 import atexit
+from collections import deque
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
 
-from molmod.log import ScreenLog, TimerGroup
+from molmod.log import ScreenLog, TimerGroup, SubTimer
 
 import yaff
 
 
-__all__ = ['log', 'timer']
+__all__ = ['log', 'timer', 'profiler']
 
 
 head_banner = r"""
@@ -73,6 +86,338 @@ __/\\\__________________________________________________________________/\\\____
 ____\///__________________________________________________________________\///__
 """
 
-timer = TimerGroup()
+# CPU time of the current thread, used for the sections in worker threads. It
+# is not available on Python 2 and on some platforms, in which case only the
+# wall time of these sections is recorded.
+if hasattr(time, 'thread_time'):
+    _thread_time = time.thread_time
+elif hasattr(time, 'CLOCK_THREAD_CPUTIME_ID'):
+    def _thread_time():
+        return time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID)
+else:
+    def _thread_time():
+        return 0.0
+
+
+class ThreadTimerGroup(TimerGroup):
+    '''A TimerGroup that can also be used in worker threads
+
+       Sections in the thread that created the timer group are timed as in
+       the ``TimerGroup`` class of ``molmod.log``. In other threads, the shared
+       stack of timers can not be used. Instead, the sections executed in the
+       body of ``collect`` are recorded in a list that is private to the
+       thread. These records are added to the timers by calling ``merge`` in
+       the main thread. Sections in other threads, outside ``collect``, are not
+       timed.
+
+       The CPU time of a section in a worker thread is the CPU time of that
+       thread, which is added to the (CPU) timers. The wall time of these
+       sections is accumulated in the ``wall`` attribute, a dictionary with
+       a list [total, own] for every label.
+    '''
+    def __init__(self):
+        self._main = threading.current_thread()
+        self._local = threading.local()
+        self.wall = {}
+        TimerGroup.__init__(self)
+
+    def reset(self):
+        TimerGroup.reset(self)
+        self.wall = {}
+
+    @contextmanager
+    def section(self, label):
+        if threading.current_thread() is self._main:
+            self._start(label)
+            try:
+                yield
+            finally:
+                self._stop(label)
+            return
+        local = self._get_local()
+        if local.records is None:
+            yield
+            return
+        # Each item on the stack: label, start times and the times spent in
+        # subsections, both for the wall and the CPU time.
+        frame = [label, time.time(), _thread_time(), 0.0, 0.0]
+        local.stack.append(frame)
+        try:
+            yield
+        finally:
+            local.stack.pop()
+            wall = time.time() - frame[1]
+            cpu = _thread_time() - frame[2]
+            if len(local.stack) > 0:
+                local.stack[-1][3] += wall
+                local.stack[-1][4] += cpu
+            local.records.append((label, wall, wall - frame[3], cpu, cpu - frame[4]))
+
+    def _get_local(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+            self._local.records = None
+        return self._local
+
+    @contextmanager
+    def collect(self):
+        '''Record the sections executed by the current thread in the body
+
+           This yields a list to which a record is appended for every section.
+           Each record is a tuple with the label, the total and the own wall
+           time, and the total and the own CPU time of a section.
+        '''
+        local = self._get_local()
+        old = local.records
+        local.records = []
+        try:
+            yield local.records
+        finally:
+            local.records = old
+
+    def merge(self, records):
+        '''Add records obtained with ``collect`` to the timers'''
+        for label, total_wall, own_wall, total_cpu, own_cpu in records:
+            timer = self.parts.get(label)
+            if timer is None:
+                timer = SubTimer(label)
+                self.parts[label] = timer
+            timer.total.cpu += total_cpu
+            timer.own.cpu += own_cpu
+            wall = self.wall.setdefault(label, [0.0, 0.0])
+            wall[0] += total_wall
+            wall[1] += own_wall
+
+
+# CPU time of the process, time.clock is only used on Python 2.
+_process_time = getattr(time, 'process_time', None) or time.clock
+
+
+class _NullSection(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+class _ProfileSection(object):
+    def __init__(self, profiler, label):
+        self.profiler = profiler
+        self.label = label
+
+    def __enter__(self):
+        self.record = {}
+        self.profiler._get_stack().append(self.record)
+        self.cpu0 = _process_time()
+        self.wall0 = time.time()
+
+    def __exit__(self, *args):
+        wall = time.time() - self.wall0
+        cpu = _process_time() - self.cpu0
+        self.profiler._get_stack().pop()
+        self.record['start'] = self.wall0 - self.profiler.time0
+        self.record['wall'] = wall
+        self.record['cpu'] = cpu
+        self.profiler._add_record(self.label, self.record)
+
+
+class Profiler(object):
+    '''Records the timings of individual calls in the hot paths of Yaff
+
+       The following sections are recorded:
+
+       * ``ForcePart <name>``: the ``compute`` method of every part of the
+         force field, and ``ForcePart all`` for the complete force field. For
+         pair potentials, the number of pairs (``nneigh``) is included.
+       * ``NeighborList``: every update, with the number of pairs (``nneigh``),
+         the allocated size of the neighbor list (``nalloc``) and whether the
+         list was rebuilt (``rebuild``).
+       * ``Hook <class>``: every call of a hook in an iterative algorithm or a
+         Monte Carlo simulation, and ``State items`` for the update of the
+         state items before the hooks are called.
+
+       For each call, the start time (relative to the last ``reset``), the
+       wall time and the CPU time of the process are stored. The CPU time
+       includes the work done by other threads in the same period. Extra
+       numbers can be added to the innermost section with ``annotate``.
+
+       Only the records of the last ``maxrecords`` calls of each section are
+       kept, such that the memory usage is bounded in long runs. Every
+       recorded field takes about 32 bytes per call, so a section with the
+       start, wall and CPU time takes about 1 MB with the default of 10000
+       calls. All records are kept when ``maxrecords`` is None, e.g. 10^6
+       steps then take about 100 MB per section. The summary (see
+       ``get_summary``) always includes all calls since the last ``reset``.
+
+       The profiler is disabled by default, in which case the overhead is
+       negligible::
+
+           profiler.enable()
+           verlet.run(1000)
+           profiler.log_summary()
+           profiler.dump_json('profile.json')
+    '''
+    def __init__(self, maxrecords=10000):
+        """
+           **Optional arguments:**
+
+           maxrecords
+                The maximum number of records kept for each section, or None
+                to keep all records. A change of this attribute takes effect
+                at the next ``reset``.
+        """
+        self.enabled = False
+        self.maxrecords = maxrecords
+        self._null = _NullSection()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        '''Start recording'''
+        self.enabled = True
+
+    def disable(self):
+        '''Stop recording, the records are kept'''
+        self.enabled = False
+
+    def reset(self):
+        '''Discard all records'''
+        with self._lock:
+            self.tables = {}
+            self._maxrecords = self.maxrecords
+        self.time0 = time.time()
+
+    def section(self, label):
+        '''Return a context manager that records the execution of its body'''
+        if not self.enabled:
+            return self._null
+        return _ProfileSection(self, label)
+
+    def annotate(self, **kwargs):
+        '''Add numbers to the record of the innermost section in this thread'''
+        if not self.enabled:
+            return
+        stack = self._get_stack()
+        if len(stack) > 0:
+            stack[-1].update(kwargs)
+
+    def _get_stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _add_record(self, label, record):
+        with self._lock:
+            table = self.tables.get(label)
+            if table is None:
+                table = {'ncall': 0, 'wall': 0.0, 'wall_max': 0.0, 'cpu': 0.0,
+                         'nrecord': 0, 'columns': {}}
+                self.tables[label] = table
+            table['ncall'] += 1
+            table['wall'] += record['wall']
+            table['wall_max'] = max(table['wall_max'], record['wall'])
+            table['cpu'] += record['cpu']
+            nrecord = table['nrecord']
+            columns = table['columns']
+            for key, value in record.items():
+                column = columns.get(key)
+                if column is None:
+                    column = deque([np.nan]*nrecord, self._maxrecords)
+                    columns[key] = column
+                column.append(value)
+            for key, column in columns.items():
+                if key not in record:
+                    column.append(np.nan)
+            if self._maxrecords is None or nrecord < self._maxrecords:
+                table['nrecord'] = nrecord + 1
+
+    def get_labels(self):
+        '''Return a sorted list with the labels of all recorded sections'''
+        with self._lock:
+            return sorted(self.tables)
+
+    def get_records(self, label):
+        '''Return the records of a section
+
+           **Arguments:**
+
+           label
+                The label of the section.
+
+           **Returns:** a dictionary with one array for each recorded field,
+           e.g. ``start``, ``wall`` and ``cpu``, for the last ``maxrecords``
+           calls. Fields that are missing for some calls are set to nan.
+        '''
+        with self._lock:
+            columns = self.tables[label]['columns']
+            return dict((key, np.array(column, float)) for key, column in columns.items())
+
+    def get_summary(self):
+        '''Return a dictionary with aggregated results for every section
+
+           For every label, the values are dictionaries with the number of
+           calls (``ncall``), the total and maximum wall time (``wall`` and
+           ``wall_max``) and the total CPU time (``cpu``). These include the
+           calls whose records are no longer kept.
+        '''
+        result = {}
+        with self._lock:
+            for label, table in self.tables.items():
+                result[label] = dict((key, table[key]) for key in
+                                     ('ncall', 'wall', 'wall_max', 'cpu'))
+        return result
+
+    def log_summary(self):
+        '''Write the aggregated results to the screen logger'''
+        if log.do_low:
+            with log.section('PROFILE'):
+                log('Wall and CPU time in s, mean and max wall time per call in ms.')
+                log('Label                     Calls     Wall     Mean      Max      CPU')
+                log.hline()
+                for label, summary in sorted(self.get_summary().items()):
+                    log('%-24s %6i %8.3f %8.3f %8.3f %8.3f' % (
+                        label[:24], summary['ncall'], summary['wall'],
+                        summary['wall']/summary['ncall']*1e3,
+                        summary['wall_max']*1e3, summary['cpu'],
+                    ))
+                log.hline()
+
+    def dump_json(self, fn):
+        '''Write all records to a JSON file
+
+           The file contains one object for every label, with one list for
+           every field. Missing values are written as ``null``.
+        '''
+        data = {}
+        for label in self.get_labels():
+            data[label] = dict(
+                (key, [None if np.isnan(v) else float(v) for v in values])
+                for key, values in self.get_records(label).items()
+            )
+        with open(fn, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+    def dump_hdf5(self, grp):
+        '''Write all records to an HDF5 group
+
+           **Arguments:**
+
+           grp
+                An h5py Group or File object. A subgroup is created for every
+                label, with one dataset per field. The total number of calls
+                is stored in the attribute ``ncall`` of the subgroup.
+        '''
+        summary = self.get_summary()
+        for label in self.get_labels():
+            sgrp = grp.create_group(label)
+            sgrp.attrs['ncall'] = summary[label]['ncall']
+            for key, values in self.get_records(label).items():
+                sgrp.create_dataset(key, data=values)
+
+
+timer = ThreadTimerGroup()
+profiler = Profiler()
 log = ScreenLog('YAFF', yaff.__version__, head_banner, foot_banner, timer)
 atexit.register(log.print_footer)
@@ -34,7 +34,7 @@ from yaff.pes.colvar import CollectiveVariable
 
 __all__ = [
     'BiasPotential', 'HarmonicBias', 'PathDeviationBias', 'LowerWallBias',
-    'UpperWallBias', 'GaussianHills'
+    'UpperWallBias', 'GaussianHills', 'GridGaussianHills'
 ]
 
 
@@ -429,12 +429,25 @@ class GaussianHills(BiasPotential):
         assert np.all(sigmas>0)
         self.sigmas = sigmas
         self.sigmas_isq = 1.0/(2.0*sigmas**2.0)
-        self.Ks = np.zeros((0,))
-        self.q0s = np.zeros((0, self.ncv))
+        # The hills are stored in arrays that are over-allocated, such that
+        # depositing a hill has an amortized constant cost.
+        self.nhill = 0
+        self._Ks = np.zeros((0,))
+        self._q0s = np.zeros((0, self.ncv))
         if periodicities is not None:
             assert periodicities.shape[0]==self.ncv
         self.periodicities = periodicities
 
+    def _get_Ks(self):
+        return self._Ks[:self.nhill]
+
+    Ks = property(_get_Ks)
+
+    def _get_q0s(self):
+        return self._q0s[:self.nhill]
+
+    q0s = property(_get_q0s)
+
     def add_hill(self, q0, K):
         '''
             Deposit a single hill
@@ -454,8 +467,7 @@ class GaussianHills(BiasPotential):
             q0 = np.array([q0])
         assert q0.ndim==1
         assert q0.shape[0]==self.ncv
-        self.q0s = np.append(self.q0s, [q0], axis=0)
-        self.Ks = np.append(self.Ks, [K], axis=0)
+        self.add_hills(q0.reshape(1, self.ncv), np.array([K]))
 
     def add_hills(self, q0s, Ks):
         '''
@@ -473,10 +485,21 @@ class GaussianHills(BiasPotential):
         '''
         assert q0s.ndim==2
         assert q0s.shape[1]==self.ncv
-        self.q0s = np.concatenate((self.q0s, q0s), axis=0)
         assert Ks.ndim==1
         assert Ks.shape[0]==q0s.shape[0]
-        self.Ks = np.concatenate((self.Ks, Ks), axis=0)
+        nhill = self.nhill + q0s.shape[0]
+        if nhill > self._Ks.shape[0]:
+            # Double the size of the storage arrays when they are full.
+            size = max(nhill, 2*self._Ks.shape[0])
+            new_q0s = np.zeros((size, self.ncv))
+            new_q0s[:self.nhill] = self.q0s
+            self._q0s = new_q0s
+            new_Ks = np.zeros(size)
+            new_Ks[:self.nhill] = self.Ks
+            self._Ks = new_Ks
+        self._q0s[self.nhill:nhill] = q0s
+        self._Ks[self.nhill:nhill] = Ks
+        self.nhill = nhill
 
     def get_log(self):
         res = self.__class__.__name__
@@ -538,3 +561,214 @@ class GaussianHills(BiasPotential):
             # i: hill index, j: cv index, a: cartesian index, b: cartesian index
             vtens[:] = np.einsum('i,ij,jab->ab',self.Ks*exponents,prefactors,myvtens)
         return energy
+
+
+class GridGaussianHills(GaussianHills):
+    '''A sum of Gaussian hills, accumulated on a regular grid
+
+       The same bias as in ``GaussianHills`` is constructed, but each deposited
+       hill is added to a grid instead of being evaluated at every step. The
+       cost of ``compute`` therefore does not depend on the number of hills.
+
+       Besides the bias itself, all mixed first-order derivatives towards the
+       collective variables are stored at the grid points. (For two collective
+       variables, these are dV/dq_1, dV/dq_2 and d^2V/dq_1dq_2.) They are
+       computed analytically when a hill is deposited and they are used for a
+       tricubic (or bicubic, cubic) Hermite interpolation. The gradient of the
+       bias is the analytic derivative of this interpolant, which is
+       continuous. Hills are truncated at ``cutoff`` times their width.
+    '''
+    def __init__(self, cvs, sigmas, bounds, npoints, periodicities=None, cutoff=6.0):
+        '''
+           **Arguments:**
+
+           cvs
+                A single ``CollectiveVariable`` or a list of ``CollectiveVariable``
+                instances. At most three collective variables are supported.
+
+           sigmas
+                The width of the Gaussian or a NumPy array [Ncv] specifying the
+                widths of the Gaussians
+
+           bounds
+                A NumPy array [Ncv,2] with the lower and upper bound of the
+                grid for each collective variable. For a single collective
+                variable, a pair of floats may be given. For a periodic
+                collective variable, the upper bound must be equal to the
+                lower bound plus the period. When a non-periodic collective
+                variable is outside the grid, the bias is evaluated at the
+                nearest bound, i.e. the bias is constant outside the grid and
+                does not exert a force along that collective variable. A
+                warning is printed the first time this happens and the number
+                of such evaluations is counted in the attribute ``noutside``.
+
+           npoints
+                The number of grid points for each collective variable, an
+                integer or an integer NumPy array [Ncv].
+
+           **Optional arguments:**
+
+           periodicities
+                The periodicity of the single collective variable or a [Ncv]
+                NumPy array specifying the periodicity of each
+                collective variable. Specifying None means the CV is not
+                periodic.
+
+           cutoff
+                Hills are only deposited on grid points within cutoff*sigma
+                of their center.
+        '''
+        GaussianHills.__init__(self, cvs, sigmas, periodicities=periodicities)
+        if self.ncv > 3:
+            raise ValueError('GridGaussianHills supports at most three collective variables.')
+        bounds = np.array(bounds, dtype=float).reshape(self.ncv, 2)
+        npoints = np.zeros(self.ncv, int) + npoints
+        self.periodic = np.zeros(self.ncv, bool)
+        self.spacings = np.zeros(self.ncv)
+        for icv in range(self.ncv):
+            lower, upper = bounds[icv]
+            if upper <= lower:
+                raise ValueError('The upper bound of the grid must be larger than the lower bound.')
+            if self.periodicities is not None and self.periodicities[icv] is not None:
+                period = self.periodicities[icv]
+                if abs(upper - lower - period) > 1e-10*period:
+                    raise ValueError('The grid of a periodic collective variable must span one period.')
+                self.periodic[icv] = True
+                if npoints[icv] < 3:
+                    raise ValueError('A periodic grid needs at least three points.')
+                self.spacings[icv] = period/npoints[icv]
+            else:
+                if npoints[icv] < 2:
+                    raise ValueError('A grid needs at least two points.')
+                self.spacings[icv] = (upper - lower)/(npoints[icv] - 1)
+        self.bounds = bounds
+        self.npoints = npoints
+        self.cutoff = cutoff
+        self.noutside = 0
+        # The first Ncv axes select the derivative: 0 for the function, 1 for
+        # the derivative towards the corresponding collective variable.
+        self.grid = np.zeros((2,)*self.ncv + tuple(npoints))
+
+    def get_log(self):
+        res = GaussianHills.get_log(self)[:-1]
+        res += 'npoints=%s)' % (','.join('%i' % n for n in self.npoints))
+        return res
+
+    def add_hills(self, q0s, Ks):
+        GaussianHills.add_hills(self, q0s, Ks)
+        for q0, K in zip(q0s, Ks):
+            self._deposit(q0, K)
+
+    def _deposit(self, q0, K):
+        '''Add a single truncated Gaussian hill to the grid'''
+        indexes = []
+        factors = []
+        for icv in range(self.ncv):
+            spacing = self.spacings[icv]
+            npoint = self.npoints[icv]
+            u = (q0[icv] - self.bounds[icv,0])/spacing
+            if self.periodic[icv]:
+                u -= np.floor(u/npoint)*npoint
+            width = int(np.ceil(self.cutoff*self.sigmas[icv]/spacing))
+            if self.periodic[icv]:
+                # Avoid that one grid point is visited twice.
+                width = min(width, (npoint - 2)//2)
+            index = np.arange(int(np.floor(u)) - width, int(np.floor(u)) + width + 2)
+            delta = (index - u)*spacing
+            if self.periodic[icv]:
+                index %= npoint
+            else:
+                mask = (index >= 0) & (index < npoint)
+                index = index[mask]
+                delta = delta[mask]
+            if index.size == 0:
+                # The hill does not overlap with the grid.
+                return
+            gauss = np.exp(-self.sigmas_isq[icv]*delta**2)
+            # The function and its derivative towards the collective variable
+            factors.append(np.array([gauss, -2.0*self.sigmas_isq[icv]*delta*gauss]))
+            indexes.append(index)
+        # Outer products of the one-dimensional factors give all mixed
+        # derivatives of the Gaussian.
+        stencil = K*factors[0]
+        for icv in range(1, self.ncv):
+            stencil = np.multiply.outer(stencil, factors[icv])
+        # Reorder axes from (deriv_0, index_0, deriv_1, index_1, ...) to
+        # (deriv_0, deriv_1, ..., index_0, index_1, ...).
+        stencil = stencil.transpose(list(range(0, 2*self.ncv, 2)) + list(range(1, 2*self.ncv, 2)))
+        self.grid[(Ellipsis,) + np.ix_(*indexes)] += stencil
+
+    def _interpolate(self, qs):
+        '''Compute the interpolated bias and its gradient towards the CVs'''
+        indexes = []
+        basis = []
+        dbasis = []
+        outside = np.zeros(self.ncv, bool)
+        for icv in range(self.ncv):
+            spacing = self.spacings[icv]
+            npoint = self.npoints[icv]
+            u = (qs[icv] - self.bounds[icv,0])/spacing
+            if self.periodic[icv]:
+                u -= np.floor(u/npoint)*npoint
+                i0 = min(int(np.floor(u)), npoint - 1)
+                i1 = (i0 + 1) % npoint
+            else:
+                if u < 0 or u > npoint - 1:
+                    # Continue with the nearest point on the grid.
+                    outside[icv] = True
+                    u = min(max(u, 0), npoint - 1)
+                i0 = min(int(np.floor(u)), npoint - 2)
+                i1 = i0 + 1
+            t = u - i0
+            indexes.append([i0, i1])
+            # Cubic Hermite basis functions, first index: corner, second
+            # index: function value or derivative.
+            basis.append(np.array([
+                [(1 + 2*t)*(1 - t)**2, spacing*t*(1 - t)**2],
+                [t**2*(3 - 2*t), spacing*t**2*(t - 1)],
+            ]))
+            dbasis.append(np.array([
+                [-6*t*(1 - t), spacing*(1 - t)*(1 - 3*t)],
+                [6*t*(1 - t), spacing*t*(3*t - 2)],
+            ])/spacing)
+        # Axes: (deriv_0, ..., deriv_n, corner_0, ..., corner_n)
+        block = self.grid[(Ellipsis,) + np.ix_(*indexes)]
+        def contract(factors):
+            result = block
+            for factor in factors:
+                # Contract the leading derivative and corner axes.
+                result = np.tensordot(result, factor.T, axes=([0, result.ndim//2], [0, 1]))
+            return result
+        energy = contract(basis)
+        grad = np.zeros(self.ncv)
+        for icv in range(self.ncv):
+            factors = list(basis)
+            factors[icv] = dbasis[icv]
+            grad[icv] = contract(factors)
+        if outside.any():
+            if self.noutside == 0 and log.do_warning:
+                log.warn('Collective variable(s) %s outside the grid of the bias. '
+                         'The bias is evaluated at the nearest bound.' %
+                         ', '.join('%i' % icv for icv in outside.nonzero()[0]))
+            self.noutside += 1
+            grad[outside] = 0.0
+        return float(energy), grad
+
+    def compute(self, gpos=None, vtens=None):
+        # Prepare a gpos array for each collective variable
+        if gpos is not None:
+            mygpos = np.zeros(((self.ncv,)+gpos.shape))
+        else: mygpos = [None]*self.ncv
+        # Prepare a vtens array for each collective variable
+        if vtens is not None:
+            myvtens = np.zeros(((self.ncv,)+vtens.shape))
+        else: myvtens = [None]*self.ncv
+        qs = np.array([cv.compute(gpos=mygpos[icv],vtens=myvtens[icv])
+             for icv, cv in enumerate(self.cvs)])
+        energy, grad = self._interpolate(qs)
+        # j: cv index, a: atom index, b: cartesian index
+        if gpos is not None:
+            gpos[:] = np.einsum('j,jab->ab', grad, mygpos)
+        if vtens is not None:
+            vtens[:] = np.einsum('j,jab->ab', grad, myvtens)
+        return energy
@@ -31,6 +31,6 @@ cdef extern from "comlist.h":
         double w
 
     void comlist_forward(dlist.dlist_row_type* deltas, double *pos, double* compos,
-        long* comsizes, comlist_row_type* comtab, long ncom)
+        long* comsizes, comlist_row_type* comtab, long ncom) nogil
     void comlist_back(dlist.dlist_row_type* deltas, double *gpos, double* gcompos,
-        long* comsizes, comlist_row_type* comtab, long ncom)
+        long* comsizes, comlist_row_type* comtab, long ncom) nogil
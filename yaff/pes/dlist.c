@@ -67,3 +67,66 @@ void dlist_back(double *gpos, double *vtens, dlist_row_type* deltas, long ndelta
     }
   }
 }
+
+
+// Multithreaded evaluation
+// ------------------------
+//
+// The delta list is split into nthread contiguous chunks that are processed by
+// different OpenMP threads. In the forward step, each row only depends on the
+// atomic positions, such that the chunks are independent. In the back step,
+// each thread has its own gradient (a slice of work with size 3*natom) and
+// virial accumulators, which are added up at the end. When Yaff is compiled
+// without OpenMP support, the chunks are processed sequentially.
+
+void dlist_forward_parallel(double *pos, cell_type *unitcell, dlist_row_type* deltas,
+                            long ndelta, int nthread) {
+  long ithread, begin, end;
+#ifdef _OPENMP
+  #pragma omp parallel for num_threads(nthread) schedule(static,1) private(begin, end)
+#endif
+  for (ithread=0; ithread<nthread; ithread++) {
+    begin = (ndelta*ithread)/nthread;
+    end = (ndelta*(ithread+1))/nthread;
+    dlist_forward(pos, unitcell, deltas + begin, end - begin);
+  }
+}
+
+void dlist_back_parallel(double *gpos, double *vtens, dlist_row_type* deltas,
+                         long ndelta, long natom, double *work, int nthread) {
+  long ithread, j, begin, end;
+  double vtens_thread[9];
+  if (gpos!=NULL) {
+    for (j=0; j<3*natom*nthread; j++) work[j] = 0.0;
+  }
+#ifdef _OPENMP
+  #pragma omp parallel for num_threads(nthread) schedule(static,1) private(j, begin, end, vtens_thread)
+#endif
+  for (ithread=0; ithread<nthread; ithread++) {
+    begin = (ndelta*ithread)/nthread;
+    end = (ndelta*(ithread+1))/nthread;
+    for (j=0; j<9; j++) vtens_thread[j] = 0.0;
+    dlist_back(
+      (gpos==NULL) ? NULL : work + 3*natom*ithread,
+      (vtens==NULL) ? NULL : vtens_thread,
+      deltas + begin, end - begin
+    );
+    if (vtens!=NULL) {
+#ifdef _OPENMP
+      #pragma omp critical
+#endif
+      for (j=0; j<9; j++) vtens[j] += vtens_thread[j];
+    }
+  }
+  // Reduction of the gradients.
+  if (gpos!=NULL) {
+#ifdef _OPENMP
+    #pragma omp parallel for num_threads(nthread) private(ithread)
+#endif
+    for (j=0; j<3*natom; j++) {
+      for (ithread=0; ithread<nthread; ithread++) {
+        gpos[j] += work[3*natom*ithread + j];
+      }
+    }
+  }
+}
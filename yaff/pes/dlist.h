@@ -35,5 +35,9 @@ typedef struct {
 
 void dlist_forward(double *pos, cell_type *unitcell, dlist_row_type* deltas, long ndelta);
 void dlist_back(double *gpos, double *vtens, dlist_row_type* deltas, long ndelta);
+void dlist_forward_parallel(double *pos, cell_type *unitcell, dlist_row_type* deltas,
+                            long ndelta, int nthread);
+void dlist_back_parallel(double *gpos, double *vtens, dlist_row_type* deltas,
+                         long ndelta, long natom, double *work, int nthread);
 
 #endif
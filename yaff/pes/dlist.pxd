@@ -32,5 +32,9 @@ cdef extern from "dlist.h":
         double gx, gy, gz
 
     void dlist_forward(double *pos, cell.cell_type *unitcell,
-                       dlist_row_type* deltas, long ndelta)
-    void dlist_back(double *gpos, double *vtens, dlist_row_type* deltas, long ndelta)
+                       dlist_row_type* deltas, long ndelta) nogil
+    void dlist_back(double *gpos, double *vtens, dlist_row_type* deltas, long ndelta) nogil
+    void dlist_forward_parallel(double *pos, cell.cell_type *unitcell,
+                                dlist_row_type* deltas, long ndelta, int nthread) nogil
+    void dlist_back_parallel(double *gpos, double *vtens, dlist_row_type* deltas,
+                             long ndelta, long natom, double *work, int nthread) nogil
@@ -62,15 +62,23 @@ __all__ = ['DeltaList']
 class DeltaList(object):
     """Class to store, manage and evaluate the delta list."""
 
-    def __init__(self, system):
+    def __init__(self, system, nthread=1):
         """
             **Arguments:**
 
             system
                     A ``System`` instance.
 
+            **Optional arguments:**
+
+            nthread
+                    The number of OpenMP threads used in the forward and back
+                    steps. Each thread processes a contiguous part of the
+                    delta list.
+
         """
         self.system = system
+        self.nthread = nthread
         self.deltas = np.zeros(10, delta_dtype)
         self.lookup = {}
         self.ndelta = 0
@@ -122,14 +130,14 @@ class DeltaList(object):
 
            The actual computation is carried out by a low-level C routine.
         """
-        dlist_forward(self.system.pos, self.system.cell, self.deltas, self.ndelta)
+        dlist_forward(self.system.pos, self.system.cell, self.deltas, self.ndelta, self.nthread)
 
     def back(self, gpos, vtens):
         """Derive gpos and virial from the derivatives towards the relative vectors
 
            The actual computation is carried out by a low-level C routine.
         """
-        dlist_back(gpos, vtens, self.deltas, self.ndelta)
+        dlist_back(gpos, vtens, self.deltas, self.ndelta, self.nthread)
 
     def lookup_atoms(self, row):
         """Look up the atom for a given row index."""
@@ -29,21 +29,19 @@
 #include "cell.h"
 #include <stdio.h>
 
-double compute_ewald_reci(double *pos, long natom, long nlow, long nhigh, double *charges,
-                          cell_type* cell, double alpha, long *gmax, double
-                          gcut, double dielectric, double *gpos, double *work,
-                          double* vtens) {
-  long g0, g1, g2, i;
-  double energy, k[3], ksq, cosfac, sinfac, cosfac_low, sinfac_low, cosfac_high, sinfac_high, x, c, s, fac1, fac2, dielectric_factor;
-  double kvecs[9];
+long compute_ewald_kvecs(cell_type* cell, double alpha, long *gmax, double gcut,
+                         long *gints, double *kvecs, double *kfacs) {
+  long g0, g1, g2, i, nk;
+  double k[3], ksq, fac1, fac2;
+  double rkvecs[9];
   for (i=0; i<9; i++) {
-    kvecs[i] = M_TWO_PI*(*cell).gvecs[i];
+    rkvecs[i] = M_TWO_PI*(*cell).gvecs[i];
   }
-  energy = 0.0;
   fac1 = M_FOUR_PI/(*cell).volume;
   fac2 = 0.25/alpha/alpha;
   gcut *= M_TWO_PI;
   gcut *= gcut;
+  nk = 0;
   for (g0=-gmax[0]; g0 <= gmax[0]; g0++) {
     for (g1=-gmax[1]; g1 <= gmax[1]; g1++) {
       for (g2=0; g2 <= gmax[2]; g2++) {
@@ -51,82 +49,183 @@ double compute_ewald_reci(double *pos, long natom, long nlow, long nhigh, double
           if (g1<0) continue;
           if ((g1==0)&&(g0<=0)) continue;
         }
-        k[0] = (g0*kvecs[0] + g1*kvecs[3] + g2*kvecs[6]);
-        k[1] = (g0*kvecs[1] + g1*kvecs[4] + g2*kvecs[7]);
-        k[2] = (g0*kvecs[2] + g1*kvecs[5] + g2*kvecs[8]);
+        k[0] = (g0*rkvecs[0] + g1*rkvecs[3] + g2*rkvecs[6]);
+        k[1] = (g0*rkvecs[1] + g1*rkvecs[4] + g2*rkvecs[7]);
+        k[2] = (g0*rkvecs[2] + g1*rkvecs[5] + g2*rkvecs[8]);
         ksq = k[0]*k[0] + k[1]*k[1] + k[2]*k[2];
         if (ksq > gcut) continue;
-        cosfac = 0.0; cosfac_low = 0.0; cosfac_high = 0.0;
-        sinfac = 0.0; sinfac_low = 0.0; sinfac_high = 0.0;
-        for (i=0; i<natom; i++) {
-          x = k[0]*pos[3*i] + k[1]*pos[3*i+1] + k[2]*pos[3*i+2];
-          c = charges[i]*cos(x);
-          s = charges[i]*sin(x);
-          if (i < nlow) {
-              cosfac_low += c;
-              sinfac_low += s;
-          }
-          else if (i >= nhigh) {
-              cosfac_high += c;
-              sinfac_high += s;
-          }
-          else {
-            cosfac += c;
-            sinfac += s;
-          }
-          if (gpos != NULL) {
-            work[2*i] = c;
-            work[2*i+1] = -s;
-          }
-        }
-        c = fac1*exp(-ksq*fac2)/ksq;
-        /*
-        Let's call S0 = sum_{i=nlow..nhigh-1} q_i cos(kr_i)
-                   S1 = sum_{i=0..nlow-1} q_i cos(kr_i)
-                   S2 = sum_{i=nhigh..natom} q_i cos(kr_i)
-        The energy contribution we want is then the energy of the whole system
-        minus the energy of the excluded subsystems
-                   E = (S0+S1+S2)^2 - S1^2 - S2^2
-                     = S0*(S0+2*(S1+S2)) + 2*S1*S2
-        and a similar contribution for the sine terms
-        */
-        s = cosfac*(cosfac+2.0*(cosfac_low+cosfac_high)) + sinfac*(sinfac+2.0*(sinfac_low+sinfac_high));
-        s += 2.0*(cosfac_low*cosfac_high + sinfac_low*sinfac_high);
-        energy += c*s;
-        if (gpos != NULL) {
-          x = 2.0*c;
-          cosfac *= x;
-          sinfac *= x;
-          cosfac_low *= x;
-          sinfac_low *= x;
-          cosfac_high *= x;
-          sinfac_high *= x;
-          for (i=0; i<natom; i++) {
-            x = cosfac*work[2*i+1] + sinfac*work[2*i];
-            if (i<nhigh) x += cosfac_high*work[2*i+1] + sinfac_high*work[2*i];
-            if (i>=nlow) x += cosfac_low*work[2*i+1] + sinfac_low*work[2*i];
-            gpos[3*i] += k[0]*x;
-            gpos[3*i+1] += k[1]*x;
-            gpos[3*i+2] += k[2]*x;
-          }
-        }
-        if (vtens != NULL) {
-          c *= 2.0*(1.0/ksq+fac2)*s;
-          vtens[0] += c*k[0]*k[0];
-          vtens[4] += c*k[1]*k[1];
-          vtens[8] += c*k[2]*k[2];
-          x = c*k[1]*k[0];
-          vtens[1] += x;
-          vtens[3] += x;
-          x = c*k[2]*k[0];
-          vtens[2] += x;
-          vtens[6] += x;
-          x = c*k[2]*k[1];
-          vtens[5] += x;
-          vtens[7] += x;
+        gints[3*nk] = g0;
+        gints[3*nk+1] = g1;
+        gints[3*nk+2] = g2;
+        kvecs[3*nk] = k[0];
+        kvecs[3*nk+1] = k[1];
+        kvecs[3*nk+2] = k[2];
+        kfacs[nk] = fac1*exp(-ksq*fac2)/ksq;
+        nk++;
+      }
+    }
+  }
+  return nk;
+}
+
+void compute_ewald_phases(double *pos, long natom, cell_type* cell, long *gmax,
+                          double *phases) {
+  /*
+  The complex phases exp(i*g*s_a) are computed for all atoms, where s_a is
+  2*pi times the fractional coordinate along cell vector a. Only one cosine
+  and sine are evaluated per atom and per cell vector. The other phases follow
+  from the recurrence exp(i*(g+1)*s_a) = exp(i*g*s_a)*exp(i*s_a). The
+  tables for a=0,1 contain g=-gmax[a]..gmax[a], for a=2 only g=0..gmax[2].
+  Each row of a table contains the (real, imaginary) pairs of all atoms.
+  */
+  long a, g, i, glow, gcenter;
+  double x, c1, s1, *table, *row, *prev, *mirror;
+  table = phases;
+  for (a=0; a<3; a++) {
+    glow = (a==2)?0:-gmax[a];
+    gcenter = -glow;
+    row = table + 2*natom*gcenter;
+    for (i=0; i<natom; i++) {
+      row[2*i] = 1.0;
+      row[2*i+1] = 0.0;
+    }
+    for (i=0; i<natom; i++) {
+      x = M_TWO_PI*((*cell).gvecs[3*a]*pos[3*i] +
+                    (*cell).gvecs[3*a+1]*pos[3*i+1] +
+                    (*cell).gvecs[3*a+2]*pos[3*i+2]);
+      c1 = cos(x);
+      s1 = sin(x);
+      for (g=1; g<=gmax[a]; g++) {
+        prev = table + 2*natom*(gcenter+g-1) + 2*i;
+        row = table + 2*natom*(gcenter+g) + 2*i;
+        row[0] = prev[0]*c1 - prev[1]*s1;
+        row[1] = prev[0]*s1 + prev[1]*c1;
+        if (a<2) {
+          mirror = table + 2*natom*(gcenter-g) + 2*i;
+          mirror[0] = row[0];
+          mirror[1] = -row[1];
         }
       }
     }
+    table += 2*natom*(gmax[a]-glow+1);
+  }
+}
+
+static double* ewald_update_phase(long natom, long *gmax, long *gint, long *gint_prev,
+                                  double *phases, double *phase01) {
+  /*
+  Return a pointer to the table row for the third reciprocal index. The product
+  of the phases for the first two indexes is stored in phase01 and is only
+  recomputed when these indexes change.
+  */
+  long i;
+  double *row0, *row1;
+  row0 = phases + 2*natom*(gint[0]+gmax[0]);
+  row1 = phases + 2*natom*(2*gmax[0]+1+gint[1]+gmax[1]);
+  if ((gint[0] != gint_prev[0]) || (gint[1] != gint_prev[1])) {
+    for (i=0; i<natom; i++) {
+      phase01[2*i] = row0[2*i]*row1[2*i] - row0[2*i+1]*row1[2*i+1];
+      phase01[2*i+1] = row0[2*i]*row1[2*i+1] + row0[2*i+1]*row1[2*i];
+    }
+    gint_prev[0] = gint[0];
+    gint_prev[1] = gint[1];
+  }
+  return phases + 2*natom*(2*gmax[0]+2*gmax[1]+2+gint[2]);
+}
+
+double compute_ewald_reci(double *pos, long natom, long nlow, long nhigh, double *charges,
+                          cell_type* cell, double alpha, long *gmax, long nk,
+                          long *gints, double *kvecs, double *kfacs,
+                          double dielectric, double *gpos, double *work,
+                          double* vtens) {
+  long ik, i, gint_prev[2];
+  double energy, *k, ksq, cosfac, sinfac, cosfac_low, sinfac_low, cosfac_high, sinfac_high, x, c, s, fac2, dielectric_factor;
+  double cosx, sinx, *phase01, *phase2, *phases;
+  energy = 0.0;
+  fac2 = 0.25/alpha/alpha;
+  // Layout of the work array: see compute_ewald_phases, followed by the
+  // phases for the first two indexes and the structure factor terms of each
+  // atom.
+  phases = work;
+  phase01 = work + 2*natom*(2*gmax[0]+2*gmax[1]+gmax[2]+3);
+  work = phase01 + 2*natom;
+  compute_ewald_phases(pos, natom, cell, gmax, phases);
+  gint_prev[0] = gmax[0]+1;
+  gint_prev[1] = gmax[1]+1;
+  for (ik=0; ik<nk; ik++) {
+    k = kvecs + 3*ik;
+    phase2 = ewald_update_phase(natom, gmax, gints + 3*ik, gint_prev, phases, phase01);
+    cosfac = 0.0; cosfac_low = 0.0; cosfac_high = 0.0;
+    sinfac = 0.0; sinfac_low = 0.0; sinfac_high = 0.0;
+    for (i=0; i<natom; i++) {
+      cosx = phase01[2*i]*phase2[2*i] - phase01[2*i+1]*phase2[2*i+1];
+      sinx = phase01[2*i]*phase2[2*i+1] + phase01[2*i+1]*phase2[2*i];
+      c = charges[i]*cosx;
+      s = charges[i]*sinx;
+      if (i < nlow) {
+          cosfac_low += c;
+          sinfac_low += s;
+      }
+      else if (i >= nhigh) {
+          cosfac_high += c;
+          sinfac_high += s;
+      }
+      else {
+        cosfac += c;
+        sinfac += s;
+      }
+      if (gpos != NULL) {
+        work[2*i] = c;
+        work[2*i+1] = -s;
+      }
+    }
+    c = kfacs[ik];
+    /*
+    Let's call S0 = sum_{i=nlow..nhigh-1} q_i cos(kr_i)
+               S1 = sum_{i=0..nlow-1} q_i cos(kr_i)
+               S2 = sum_{i=nhigh..natom} q_i cos(kr_i)
+    The energy contribution we want is then the energy of the whole system
+    minus the energy of the excluded subsystems
+               E = (S0+S1+S2)^2 - S1^2 - S2^2
+                 = S0*(S0+2*(S1+S2)) + 2*S1*S2
+    and a similar contribution for the sine terms
+    */
+    s = cosfac*(cosfac+2.0*(cosfac_low+cosfac_high)) + sinfac*(sinfac+2.0*(sinfac_low+sinfac_high));
+    s += 2.0*(cosfac_low*cosfac_high + sinfac_low*sinfac_high);
+    energy += c*s;
+    if (gpos != NULL) {
+      x = 2.0*c;
+      cosfac *= x;
+      sinfac *= x;
+      cosfac_low *= x;
+      sinfac_low *= x;
+      cosfac_high *= x;
+      sinfac_high *= x;
+      for (i=0; i<natom; i++) {
+        x = cosfac*work[2*i+1] + sinfac*work[2*i];
+        if (i<nhigh) x += cosfac_high*work[2*i+1] + sinfac_high*work[2*i];
+        if (i>=nlow) x += cosfac_low*work[2*i+1] + sinfac_low*work[2*i];
+        gpos[3*i] += k[0]*x;
+        gpos[3*i+1] += k[1]*x;
+        gpos[3*i+2] += k[2]*x;
+      }
+    }
+    if (vtens != NULL) {
+      ksq = k[0]*k[0] + k[1]*k[1] + k[2]*k[2];
+      c *= 2.0*(1.0/ksq+fac2)*s;
+      vtens[0] += c*k[0]*k[0];
+      vtens[4] += c*k[1]*k[1];
+      vtens[8] += c*k[2]*k[2];
+      x = c*k[1]*k[0];
+      vtens[1] += x;
+      vtens[3] += x;
+      x = c*k[2]*k[0];
+      vtens[2] += x;
+      vtens[6] += x;
+      x = c*k[2]*k[1];
+      vtens[5] += x;
+      vtens[7] += x;
+    }
   }
   if (vtens != NULL) {
     vtens[0] -= energy;
@@ -154,118 +253,131 @@ double compute_ewald_reci(double *pos, long natom, long nlow, long nhigh, double
 //If it turns out that adding zero dipoles does not increase computational cost, this separate
 //code should become the main.
 double compute_ewald_reci_dd(double *pos, long natom, long nlow, long nhigh, double *charges, double *dipoles,
-                          cell_type* cell, double alpha, long *gmax,
-                          double gcut, double *gpos, double *work,
-                          double* vtens) {
-  long g0, g1, g2, i;
-  double energy, k[3], ksq, cosfac_dd[3], sinfac_dd[3], x, c, s, fac1, fac2;
+                          cell_type* cell, double alpha, long *gmax, long nk,
+                          long *gints, double *kvecs, double *kfacs,
+                          double *gpos, double *work, double* vtens) {
+  long ik, i, iseg, gint_prev[2];
+  double energy, *k, ksq, cosfac_dd[9], sinfac_dd[9], dcos[3], dsin[3], vdip[3], x, c, s, fac2, kmu;
   double cosfac, sinfac, cosfac_low, sinfac_low, cosfac_high, sinfac_high;
-  double kvecs[9];
-  for (i=0; i<9; i++) {
-    kvecs[i] = M_TWO_PI*(*cell).gvecs[i];
-  }
+  double cosx, sinx, *phase01, *phase2, *phases;
   energy = 0.0;
-  fac1 = M_FOUR_PI/(*cell).volume;
   fac2 = 0.25/alpha/alpha;
-  gcut *= M_TWO_PI;
-  gcut *= gcut;
-  for (g0=-gmax[0]; g0 <= gmax[0]; g0++) {
-    for (g1=-gmax[1]; g1 <= gmax[1]; g1++) {
-      for (g2=0; g2 <= gmax[2]; g2++) {
-        if (g2==0) {
-          if (g1<0) continue;
-          if ((g1==0)&&(g0<=0)) continue;
-        }
-        k[0] = (g0*kvecs[0] + g1*kvecs[3] + g2*kvecs[6]);
-        k[1] = (g0*kvecs[1] + g1*kvecs[4] + g2*kvecs[7]);
-        k[2] = (g0*kvecs[2] + g1*kvecs[5] + g2*kvecs[8]);
-        ksq = k[0]*k[0] + k[1]*k[1] + k[2]*k[2];
-        if (ksq > gcut) continue;
-        cosfac_dd[0] = 0.0;
-        cosfac_dd[1] = 0.0;
-        cosfac_dd[2] = 0.0;
-        sinfac_dd[0] = 0.0;
-        sinfac_dd[1] = 0.0;
-        sinfac_dd[2] = 0.0;
-        cosfac = 0.0; cosfac_low = 0.0; cosfac_high = 0.0;
-        sinfac = 0.0; sinfac_low = 0.0; cosfac_high = 0.0;
-        for (i=0; i<natom; i++) {
-          x = k[0]*pos[3*i] + k[1]*pos[3*i+1] + k[2]*pos[3*i+2];
-          c = charges[i]*cos(x) + (k[0]*dipoles[3*i+0] + k[1]*dipoles[3*i+1] + k[2]*dipoles[3*i+2])*sin(x);
-          s = charges[i]*sin(x) - (k[0]*dipoles[3*i+0] + k[1]*dipoles[3*i+1] + k[2]*dipoles[3*i+2])*cos(x);
-          if (i < nlow) {
-              cosfac_low += c;
-              sinfac_low += s;
-          }
-          else if (i >= nhigh) {
-              cosfac_high += c;
-              sinfac_high += s;
-          }
-          else {
-            cosfac += c;
-            sinfac += s;
-          }
-          if (gpos != NULL) {
-            work[2*i+0] = charges[i]*cos(x) + (k[0]*dipoles[3*i+0] + k[1]*dipoles[3*i+1] + k[2]*dipoles[3*i+2])*sin(x);
-            work[2*i+1] =-charges[i]*sin(x) + (k[0]*dipoles[3*i+0] + k[1]*dipoles[3*i+1] + k[2]*dipoles[3*i+2])*cos(x);
-          }
-          if (vtens != NULL){
-              cosfac_dd[0] +=-dipoles[3*i+0]*sin(x);
-              cosfac_dd[1] +=-dipoles[3*i+1]*sin(x);
-              cosfac_dd[2] +=-dipoles[3*i+2]*sin(x);
-              sinfac_dd[0] += dipoles[3*i+0]*cos(x);
-              sinfac_dd[1] += dipoles[3*i+1]*cos(x);
-              sinfac_dd[2] += dipoles[3*i+2]*cos(x);
-          }
-        }
-        c = fac1*exp(-ksq*fac2)/ksq;
-        /*
-        Let's call S0 = sum_{i=nlow..nhigh-1} q_i cos(kr_i)
-                   S1 = sum_{i=0..nlow-1} q_i cos(kr_i)
-                   S2 = sum_{i=nhigh..natom} q_i cos(kr_i)
-        The energy contribution we want is then the energy of the whole system
-        minus the energy of the excluded subsystems
-                   E = (S0+S1+S2)^2 - S1^2 - S2^2
-                     = S0*(S0+2*(S1+S2)) + 2*S1*S2
-        and a similar contribution for the sine terms
-        */
-        s = cosfac*(cosfac+2.0*(cosfac_low+cosfac_high)) + sinfac*(sinfac+2.0*(sinfac_low+sinfac_high));
-        s += 2.0*(cosfac_low*cosfac_high + sinfac_low*sinfac_high);
-        energy += c*s;
-        if (gpos != NULL) {
-          x = 2.0*c;
-          cosfac *= x;
-          sinfac *= x;
-          cosfac_low *= x;
-          sinfac_low *= x;
-          cosfac_high *= x;
-          sinfac_high *= x;
-          for (i=0; i<natom; i++) {
-            x = cosfac*work[2*i+1] + sinfac*work[2*i];
-            if (i<nhigh) x += cosfac_high*work[2*i+1] + sinfac_high*work[2*i];
-            if (i>=nlow) x += cosfac_low*work[2*i+1] + sinfac_low*work[2*i];
-            gpos[3*i] += k[0]*x;
-            gpos[3*i+1] += k[1]*x;
-            gpos[3*i+2] += k[2]*x;
-          }
-        }
-        if (vtens != NULL) {
-          c *= 2.0*(1.0/ksq+fac2)*s;
-          vtens[0] += c*k[0]*k[0] + cosfac_dd[0]*k[0]*cosfac + sinfac_dd[0]*k[0]*sinfac;
-          vtens[4] += c*k[1]*k[1] + cosfac_dd[1]*k[1]*cosfac + sinfac_dd[1]*k[1]*sinfac;
-          vtens[8] += c*k[2]*k[2] + cosfac_dd[2]*k[2]*cosfac + sinfac_dd[2]*k[2]*sinfac;
-          x = c*k[1]*k[0];
-          vtens[1] += x + cosfac_dd[0]*k[1]*cosfac + sinfac_dd[0]*k[1]*sinfac;
-          vtens[3] += x + cosfac_dd[1]*k[0]*cosfac + sinfac_dd[1]*k[0]*sinfac;
-          x = c*k[2]*k[0];
-          vtens[2] += x + cosfac_dd[0]*k[2]*cosfac + sinfac_dd[0]*k[2]*sinfac;
-          vtens[6] += x + cosfac_dd[2]*k[0]*cosfac + sinfac_dd[2]*k[0]*sinfac;
-          x = c*k[2]*k[1];
-          vtens[5] += x + cosfac_dd[1]*k[2]*cosfac + sinfac_dd[1]*k[2]*sinfac;
-          vtens[7] += x + cosfac_dd[2]*k[1]*cosfac + sinfac_dd[2]*k[1]*sinfac;
+  // Same layout of the work array as in compute_ewald_reci
+  phases = work;
+  phase01 = work + 2*natom*(2*gmax[0]+2*gmax[1]+gmax[2]+3);
+  work = phase01 + 2*natom;
+  compute_ewald_phases(pos, natom, cell, gmax, phases);
+  gint_prev[0] = gmax[0]+1;
+  gint_prev[1] = gmax[1]+1;
+  for (ik=0; ik<nk; ik++) {
+    k = kvecs + 3*ik;
+    phase2 = ewald_update_phase(natom, gmax, gints + 3*ik, gint_prev, phases, phase01);
+    // Dipole terms in the derivative of the structure factors towards the
+    // reciprocal vector, separately for the three subsystems.
+    for (i=0; i<9; i++) {
+      cosfac_dd[i] = 0.0;
+      sinfac_dd[i] = 0.0;
+    }
+    cosfac = 0.0; cosfac_low = 0.0; cosfac_high = 0.0;
+    sinfac = 0.0; sinfac_low = 0.0; sinfac_high = 0.0;
+    for (i=0; i<natom; i++) {
+      cosx = phase01[2*i]*phase2[2*i] - phase01[2*i+1]*phase2[2*i+1];
+      sinx = phase01[2*i]*phase2[2*i+1] + phase01[2*i+1]*phase2[2*i];
+      kmu = k[0]*dipoles[3*i+0] + k[1]*dipoles[3*i+1] + k[2]*dipoles[3*i+2];
+      c = charges[i]*cosx + kmu*sinx;
+      s = charges[i]*sinx - kmu*cosx;
+      if (i < nlow) {
+          cosfac_low += c;
+          sinfac_low += s;
+          iseg = 1;
+      }
+      else if (i >= nhigh) {
+          cosfac_high += c;
+          sinfac_high += s;
+          iseg = 2;
+      }
+      else {
+        cosfac += c;
+        sinfac += s;
+        iseg = 0;
+      }
+      if (gpos != NULL) {
+        work[2*i+0] = c;
+        work[2*i+1] =-charges[i]*sinx + kmu*cosx;
+      }
+      if (vtens != NULL){
+          cosfac_dd[3*iseg+0] +=-dipoles[3*i+0]*sinx;
+          cosfac_dd[3*iseg+1] +=-dipoles[3*i+1]*sinx;
+          cosfac_dd[3*iseg+2] +=-dipoles[3*i+2]*sinx;
+          sinfac_dd[3*iseg+0] += dipoles[3*i+0]*cosx;
+          sinfac_dd[3*iseg+1] += dipoles[3*i+1]*cosx;
+          sinfac_dd[3*iseg+2] += dipoles[3*i+2]*cosx;
+      }
+    }
+    c = kfacs[ik];
+    /*
+    Let's call S0 = sum_{i=nlow..nhigh-1} q_i cos(kr_i)
+               S1 = sum_{i=0..nlow-1} q_i cos(kr_i)
+               S2 = sum_{i=nhigh..natom} q_i cos(kr_i)
+    The energy contribution we want is then the energy of the whole system
+    minus the energy of the excluded subsystems
+               E = (S0+S1+S2)^2 - S1^2 - S2^2
+                 = S0*(S0+2*(S1+S2)) + 2*S1*S2
+    and a similar contribution for the sine terms
+    */
+    s = cosfac*(cosfac+2.0*(cosfac_low+cosfac_high)) + sinfac*(sinfac+2.0*(sinfac_low+sinfac_high));
+    s += 2.0*(cosfac_low*cosfac_high + sinfac_low*sinfac_high);
+    energy += c*s;
+    if (vtens != NULL) {
+      // Derivatives of the energy towards the structure factors of the three
+      // subsystems.
+      x = 2.0*c;
+      dcos[0] = x*(cosfac+cosfac_low+cosfac_high);
+      dcos[1] = x*(cosfac+cosfac_high);
+      dcos[2] = x*(cosfac+cosfac_low);
+      dsin[0] = x*(sinfac+sinfac_low+sinfac_high);
+      dsin[1] = x*(sinfac+sinfac_high);
+      dsin[2] = x*(sinfac+sinfac_low);
+      for (i=0; i<3; i++) {
+        vdip[i] = 0.0;
+        for (iseg=0; iseg<3; iseg++) {
+          vdip[i] += dcos[iseg]*cosfac_dd[3*iseg+i] + dsin[iseg]*sinfac_dd[3*iseg+i];
         }
       }
     }
+    if (gpos != NULL) {
+      x = 2.0*c;
+      cosfac *= x;
+      sinfac *= x;
+      cosfac_low *= x;
+      sinfac_low *= x;
+      cosfac_high *= x;
+      sinfac_high *= x;
+      for (i=0; i<natom; i++) {
+        x = cosfac*work[2*i+1] + sinfac*work[2*i];
+        if (i<nhigh) x += cosfac_high*work[2*i+1] + sinfac_high*work[2*i];
+        if (i>=nlow) x += cosfac_low*work[2*i+1] + sinfac_low*work[2*i];
+        gpos[3*i] += k[0]*x;
+        gpos[3*i+1] += k[1]*x;
+        gpos[3*i+2] += k[2]*x;
+      }
+    }
+    if (vtens != NULL) {
+      ksq = k[0]*k[0] + k[1]*k[1] + k[2]*k[2];
+      c *= 2.0*(1.0/ksq+fac2)*s;
+      vtens[0] += c*k[0]*k[0] + vdip[0]*k[0];
+      vtens[4] += c*k[1]*k[1] + vdip[1]*k[1];
+      vtens[8] += c*k[2]*k[2] + vdip[2]*k[2];
+      x = c*k[1]*k[0];
+      vtens[1] += x + vdip[0]*k[1];
+      vtens[3] += x + vdip[1]*k[0];
+      x = c*k[2]*k[0];
+      vtens[2] += x + vdip[0]*k[2];
+      vtens[6] += x + vdip[2]*k[0];
+      x = c*k[2]*k[1];
+      vtens[5] += x + vdip[1]*k[2];
+      vtens[7] += x + vdip[2]*k[1];
+    }
   }
   if (vtens != NULL) {
     vtens[0] -= energy;
@@ -505,6 +617,36 @@ void compute_ewald_structurefactors(double *pos, long natom, double *charges,
   }
 }
 
+void compute_ewald_structurefactors_kvecs(double *pos, long natom,
+                          double *charges, cell_type* cell, long *gmax,
+                          long nk, long *gints, double *work, double *cosfacs,
+                          double *sinfacs) {
+  /*
+  Same as compute_ewald_structurefactors, but only for the reciprocal vectors
+  in the table gints, see compute_ewald_kvecs. Instead of evaluating a cosine
+  and a sine for every atom and every reciprocal vector, the phases are built
+  with the recurrences of compute_ewald_phases.
+  */
+  long ik, i, gint_prev[2];
+  double cosfac, sinfac, *phase01, *phase2, *phases;
+  phases = work;
+  phase01 = work + 2*natom*(2*gmax[0]+2*gmax[1]+gmax[2]+3);
+  compute_ewald_phases(pos, natom, cell, gmax, phases);
+  gint_prev[0] = gmax[0]+1;
+  gint_prev[1] = gmax[1]+1;
+  for (ik=0; ik<nk; ik++) {
+    phase2 = ewald_update_phase(natom, gmax, gints + 3*ik, gint_prev, phases, phase01);
+    cosfac = 0.0;
+    sinfac = 0.0;
+    for (i=0; i<natom; i++) {
+      cosfac += charges[i]*(phase01[2*i]*phase2[2*i] - phase01[2*i+1]*phase2[2*i+1]);
+      sinfac += charges[i]*(phase01[2*i]*phase2[2*i+1] + phase01[2*i+1]*phase2[2*i]);
+    }
+    cosfacs[ik] += cosfac;
+    sinfacs[ik] += sinfac;
+  }
+}
+
 double compute_ewald_deltae(double *deltacosfacs,
                         double *cosfacs,
                         double *deltasinfacs,
@@ -28,14 +28,19 @@
 #include "pair_pot.h"
 #include "cell.h"
 
+long compute_ewald_kvecs(cell_type* cell, double alpha, long *gmax, double gcut,
+                         long *gints, double *kvecs, double *kfacs);
+void compute_ewald_phases(double *pos, long natom, cell_type* cell, long *gmax,
+                          double *phases);
 double compute_ewald_reci(double *pos, long natom, long nlow, long nhigh, double *charges,
-                          cell_type* unitcell, double alpha, long *gmax, double
-                          gcut, double dielectric, double *gpos, double *work,
+                          cell_type* unitcell, double alpha, long *gmax, long nk,
+                          long *gints, double *kvecs, double *kfacs,
+                          double dielectric, double *gpos, double *work,
                           double* vtens);
 double compute_ewald_reci_dd(double *pos, long natom, long nlow, long nhigh, double *charges, double *dipoles,
-                          cell_type* unitcell, double alpha, long *gmax,
-                          double gcut, double *gpos, double *work,
-                          double* vtens);
+                          cell_type* unitcell, double alpha, long *gmax, long nk,
+                          long *gints, double *kvecs, double *kfacs,
+                          double *gpos, double *work, double* vtens);
 double compute_ewald_corr(double *pos, double *charges,
                           cell_type *unitcell, double alpha,
                           scaling_row_type *stab, long stab_size,
@@ -50,6 +55,10 @@ void compute_ewald_prefactors(cell_type* cell, double alpha, long *gmax, double
 void compute_ewald_structurefactors(double *pos, long natom, double *charges,
                           cell_type* cell, double alpha, long *gmax, double
                           gcut, double *cosfacs, double* sinfacs);
+void compute_ewald_structurefactors_kvecs(double *pos, long natom,
+                          double *charges, cell_type* cell, long *gmax,
+                          long nk, long *gints, double *work, double *cosfacs,
+                          double *sinfacs);
 double compute_ewald_deltae(double *deltacosfacs,
                         double *cosfacs,
                         double *deltasinfacs,
@@ -27,37 +27,48 @@ cimport pair_pot
 cimport cell
 
 cdef extern from "ewald.h":
+    long compute_ewald_kvecs(cell.cell_type* cell, double alpha, long *gmax,
+                              double gcut, long *gints, double *kvecs,
+                              double *kfacs) nogil
+
     double compute_ewald_reci(double *pos, long natom, long nlow, long nhigh, double *charges,
                               cell.cell_type *unitcell, double alpha,
-                              long *gmax, double gcut, double dielectric,
-                              double *gpos, double *work, double* vtens)
+                              long *gmax, long nk, long *gints, double *kvecs,
+                              double *kfacs, double dielectric,
+                              double *gpos, double *work, double* vtens) nogil
 
     double compute_ewald_reci_dd(double *pos, long natom, long nlow, long nhigh, double *charges, double *dipoles,
                               cell.cell_type *unitcell, double alpha,
-                              long *gmax, double gcut, double *gpos,
-                              double *work, double* vtens)
+                              long *gmax, long nk, long *gints, double *kvecs,
+                              double *kfacs, double *gpos,
+                              double *work, double* vtens) nogil
 
     double compute_ewald_corr(double *pos, double *charges,
                               cell.cell_type *unitcell, double alpha,
                               pair_pot.scaling_row_type *stab, long stab_size,
                               double dielectric, double *gpos, double *vtens,
-                              long natom, long nlow, long nhigh)
+                              long natom, long nlow, long nhigh) nogil
 
     double compute_ewald_corr_dd(double *pos, double *charges, double *dipoles,
                               cell.cell_type *unitcell, double alpha,
                               pair_pot.scaling_row_type *stab,
                               long stab_size, double *gpos, double *vtens,
-                              long natom, long nlow, long nhigh)
+                              long natom, long nlow, long nhigh) nogil
 
     void compute_ewald_prefactors(cell.cell_type* cell, double alpha, long *gmax, double
-                              gcut, double *prefactors)
+                              gcut, double *prefactors) nogil
 
     void compute_ewald_structurefactors(double *pos, long natom, double *charges,
                               cell.cell_type* cell, double alpha, long *gmax, double
-                              gcut, double *cosfacs, double* sinfacs)
+                              gcut, double *cosfacs, double* sinfacs) nogil
+
+    void compute_ewald_structurefactors_kvecs(double *pos, long natom,
+                              double *charges, cell.cell_type* cell,
+                              long *gmax, long nk, long *gints, double *work,
+                              double *cosfacs, double *sinfacs) nogil
 
     double compute_ewald_deltae(double *deltacosfacs,
                                 double *cosfacs,
                                 double *deltasinfacs,
                                 double *sinfacs,
-                                double *prefactors, long nk)
+                                double *prefactors, long nk) nogil
@@ -50,21 +50,23 @@ from yaff.log import log
 
 __all__ = [
     'Cell',
-    'neigh_dtype', 'nlist_status_init', 'nlist_build', 'nlist_status_finish',
-    'nlist_recompute', 'nlist_inc_r',
+    'neigh_dtype', 'nlist_status_init', 'nlist_build', 'nlist_build_cells',
+    'nlist_build_subset', 'nlist_status_finish', 'nlist_recompute', 'nlist_inc_r',
     'Hammer', 'Switch3',
     'scaling_dtype', 'PairPot', 'PairPotLJ', 'PairPotMM3', 'PairPotMM3CAP', 'PairPotGrimme',
     'PairPotExpRep', 'PairPotQMDFFRep', 'PairPotLJCross', 'PairPotDampDisp',
     'PairPotDisp68BJDamp', 'PairPotEI', 'PairPotEIDip', 'PairPotEiSlater1s1sCorr',
     'PairPotEiSlater1sp1spCorr', 'PairPotOlpSlater1s1s','PairPotChargeTransferSlater1s1s',
+    'pair_pot_compute_multi',
+    'compute_ewald_kvecs', 'get_ewald_work_size',
     'compute_ewald_reci', 'compute_ewald_reci_dd',  'compute_ewald_corr_dd',
     'compute_ewald_corr', 'compute_ewald_prefactors', 'compute_ewald_structurefactors',
-    'compute_ewald_deltae',
+    'compute_ewald_structurefactors_kvecs', 'compute_ewald_deltae',
     'comlist_dtype', 'comlist_forward', 'comlist_back',
     'delta_dtype', 'dlist_forward', 'dlist_back',
     'iclist_dtype', 'iclist_forward', 'iclist_back',
     'vlist_dtype', 'vlist_forward', 'vlist_back',
-    'compute_grid3d',
+    'compute_grid3d', 'compute_grid3d_multi',
 ]
 
 
@@ -292,6 +294,7 @@ cdef class Cell:
            applicable.
         """
         cdef long* pairs_pointer
+        cdef long natom0, natom1, npair
 
         assert pos0.shape[1] == 3
         assert pos0.flags['C_CONTIGUOUS']
@@ -327,9 +330,10 @@ cdef class Cell:
                 assert factor*(natom0*(natom0-1))//2 - npair == output.shape[0]
             if cell.is_invalid_exclude(pairs_pointer, natom0, natom0, npair, True):
                 raise ValueError('The pairs array must countain indices within proper bounds and must be lexicographically sorted.')
-            cell.cell_compute_distances1(self._c_cell, <double*> pos0.data,
-                                         <double*> output.data, natom0,
-                                         <long*> pairs_pointer, npair, do_include, nimage)
+            with nogil:
+                cell.cell_compute_distances1(self._c_cell, <double*> pos0.data,
+                                             <double*> output.data, natom0,
+                                             <long*> pairs_pointer, npair, do_include, nimage)
         else:
             assert pos1.shape[1] == 3
             assert pos1.flags['C_CONTIGUOUS']
@@ -341,10 +345,11 @@ cdef class Cell:
                 assert factor*natom0*natom1 - npair == output.shape[0]
             if cell.is_invalid_exclude(pairs_pointer, natom0, natom1, npair, False):
                 raise ValueError('The pairs array must countain indices within proper bounds and must be lexicographically sorted.')
-            cell.cell_compute_distances2(self._c_cell, <double*> pos0.data,
-                                         <double*> pos1.data,
-                                         <double*> output.data, natom0, natom1,
-                                         <long*> pairs_pointer, npair, do_include, nimage)
+            with nogil:
+                cell.cell_compute_distances2(self._c_cell, <double*> pos0.data,
+                                             <double*> pos1.data,
+                                             <double*> output.data, natom0, natom1,
+                                             <long*> pairs_pointer, npair, do_include, nimage)
 
 
 #
@@ -423,6 +428,7 @@ def nlist_build(np.ndarray[double, ndim=2] pos, double rcut,
 
        ``True`` if the neighbor list is complete. ``False`` otherwise
     '''
+    cdef bint result
     assert pos.shape[1] == 3
     assert pos.flags['C_CONTIGUOUS']
     assert rcut > 0
@@ -432,11 +438,121 @@ def nlist_build(np.ndarray[double, ndim=2] pos, double rcut,
     assert status.flags['C_CONTIGUOUS']
     assert neighs.flags['C_CONTIGUOUS']
     assert rmax.shape[0] == unitcell.nvec
-    return nlist.nlist_build_low(
-        <double*>pos.data, rcut, <long*>rmax.data,
-        unitcell._c_cell, <long*>status.data,
-        <nlist.neigh_row_type*>neighs.data, len(pos), nlow, nhigh, len(neighs)
-    )
+    with nogil:
+        result = nlist.nlist_build_low(
+            <double*>pos.data, rcut, <long*>rmax.data,
+            unitcell._c_cell, <long*>status.data,
+            <nlist.neigh_row_type*>neighs.data, pos.shape[0], nlow, nhigh,
+            neighs.shape[0]
+        )
+    return result
+
+
+def nlist_build_cells(np.ndarray[double, ndim=2] pos, double rcut,
+                      np.ndarray[long, ndim=1] rmax,
+                      Cell unitcell, np.ndarray[long, ndim=1] status,
+                      np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
+                      int nlow, int nhigh):
+    '''Same as ``nlist_build``, but using cell lists to find neighbors
+
+       The atoms are first sorted into bins in fractional coordinates, such
+       that only pairs of atoms in nearby bins need to be considered. The
+       computational cost scales linearly with the number of atoms, while
+       ``nlist_build`` scales quadratically. The resulting neighbor list is
+       identical to the one of ``nlist_build``, including the order of the
+       rows.
+
+       All arguments and the return value have the same meaning as in
+       ``nlist_build``. When the ``neighs`` array is full, the status array
+       is updated such that the next call restarts with the first atom whose
+       neighbors could not be stored completely. The number of rows that is
+       actually used can be obtained with ``nlist_status_finish``.
+    '''
+    cdef int result
+    assert pos.shape[1] == 3
+    assert pos.flags['C_CONTIGUOUS']
+    assert rcut > 0
+    assert rmax.shape[0] <= 3
+    assert rmax.flags['C_CONTIGUOUS']
+    assert status.shape[0] == 7
+    assert status.flags['C_CONTIGUOUS']
+    assert neighs.flags['C_CONTIGUOUS']
+    assert rmax.shape[0] == unitcell.nvec
+    with nogil:
+        result = nlist.nlist_build_cells_low(
+            <double*>pos.data, rcut, <long*>rmax.data,
+            unitcell._c_cell, <long*>status.data,
+            <nlist.neigh_row_type*>neighs.data, pos.shape[0], nlow, nhigh,
+            neighs.shape[0]
+        )
+    if result < 0:
+        raise MemoryError()
+    return result == 1
+
+
+def nlist_build_subset(np.ndarray[double, ndim=2] pos, double rcut,
+                       np.ndarray[long, ndim=1] rmax,
+                       Cell unitcell, np.ndarray[long, ndim=1] iatoms,
+                       np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
+                       int nlow, int nhigh):
+    '''Scan the system for all pairs with at least one atom in a given subset
+       that have a distance smaller than rcut
+
+       **Arguments:**
+
+       pos
+            The numpy array with the atomic positions, shape (natom, 3)
+
+       rcut
+            The cutoff radius
+
+       rmax
+            The number of periodic images to visit along each cell vector, shape
+            (nrvec,)
+
+       unitcell
+            An instance of the UnitCell class, describing the periodic boundary
+            conditions.
+
+       iatoms
+            A sorted array with the indexes of the atoms in the subset.
+
+       neighs
+            The neighbor list array. One element is of the datatype
+            nlist.neigh_row_type.
+
+       nlow, nhigh
+            See ``nlist_build``.
+
+       Only a single pass over all atoms is needed, such that the cost scales
+       linearly with the size of the subset. The rows are ordered as in
+       ``nlist_build``, such that they can be used with the scaling table in
+       ``PairPot.compute``.
+
+       **Returns:** the number of pairs that were found. If this is larger
+       than the size of ``neighs``, the array was too small and only the
+       first rows were stored.
+    '''
+    cdef long result
+    cdef np.ndarray[int, ndim=1] insubset
+    assert pos.shape[1] == 3
+    assert pos.flags['C_CONTIGUOUS']
+    assert rcut > 0
+    assert rmax.shape[0] <= 3
+    assert rmax.flags['C_CONTIGUOUS']
+    assert iatoms.flags['C_CONTIGUOUS']
+    assert neighs.flags['C_CONTIGUOUS']
+    assert rmax.shape[0] == unitcell.nvec
+    insubset = np.zeros(pos.shape[0], np.intc)
+    insubset[iatoms] = 1
+    with nogil:
+        result = nlist.nlist_build_subset_low(
+            <double*>pos.data, rcut, <long*>rmax.data, unitcell._c_cell,
+            <long*>iatoms.data, iatoms.shape[0], <int*>insubset.data,
+            <nlist.neigh_row_type*>neighs.data, pos.shape[0], nlow, nhigh,
+            neighs.shape[0]
+        )
+    return result
 
 
 def nlist_status_finish(status):
@@ -452,7 +568,8 @@ def nlist_status_finish(status):
 def nlist_recompute(np.ndarray[double, ndim=2] pos,
                     np.ndarray[double, ndim=2] pos_old,
                     Cell unitcell,
-                    np.ndarray[nlist.neigh_row_type, ndim=1] neighs):
+                    np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
+                    np.ndarray[int, ndim=1] moved=None):
     '''Recompute all relative vectors and distances in the neighbor list.
 
        **Arguments:**
@@ -472,17 +589,32 @@ def nlist_recompute(np.ndarray[double, ndim=2] pos,
        neighs
             The neighbor list array. One element is of the datatype
             nlist.neigh_row_type.
+
+       **Optional arguments:**
+
+       moved
+            An integer array with shape (natom,). When given, only the pairs
+            in which at least one atom has a non-zero entry in this array
+            are recomputed.
     '''
+    cdef int *my_moved
     assert pos.shape[1] == 3
     assert pos.flags['C_CONTIGUOUS']
     assert pos_old.shape[1] == 3
     assert pos_old.flags['C_CONTIGUOUS']
     assert pos.shape[0] == pos_old.shape[0]
     assert neighs.flags['C_CONTIGUOUS']
-    nlist.nlist_recompute_low(
-        <double*>pos.data, <double*>pos_old.data, unitcell._c_cell,
-        <nlist.neigh_row_type*>neighs.data, len(neighs)
-    )
+    if moved is None:
+        my_moved = NULL
+    else:
+        assert moved.flags['C_CONTIGUOUS']
+        assert moved.shape[0] == pos.shape[0]
+        my_moved = <int*>moved.data
+    with nogil:
+        nlist.nlist_recompute_low(
+            <double*>pos.data, <double*>pos_old.data, unitcell._c_cell,
+            <nlist.neigh_row_type*>neighs.data, neighs.shape[0], my_moved
+        )
 
 
 def nlist_inc_r(Cell unitcell, np.ndarray[long, ndim=1] r, np.ndarray[long, ndim=1] rmax):
@@ -689,7 +821,7 @@ cdef class PairPot:
     def compute(self, np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
                 np.ndarray[pair_pot.scaling_row_type, ndim=1] stab,
                 np.ndarray[double, ndim=2] gpos,
-                np.ndarray[double, ndim=2] vtens, long nneigh):
+                np.ndarray[double, ndim=2] vtens, long nneigh, int nthread=1):
         '''Compute the pairwise interactions
 
            **Arguments:**
@@ -713,10 +845,23 @@ cdef class PairPot:
            nneigh
                 The number of records to consider in the neighbor list.
 
+           **Optional arguments:**
+
+           nthread
+                The number of OpenMP threads used to compute the interactions.
+                The neighbor list is split in nthread parts and each thread
+                accumulates its own contributions to gpos and vtens, which are
+                added up at the end. The result is the same as with one
+                thread, up to round-off errors. When Yaff is compiled without
+                OpenMP support, the parts are just computed one after the
+                other.
+
            **Returns:** the energy.
         '''
         cdef double *my_gpos
         cdef double *my_vtens
+        cdef double energy
+        cdef np.ndarray[double, ndim=3] work
 
         assert pair_pot.pair_pot_ready(self._c_pair_pot)
         assert neighs.flags['C_CONTIGUOUS']
@@ -737,11 +882,138 @@ cdef class PairPot:
             assert vtens.shape[1] == 3
             my_vtens = <double*>vtens.data
 
-        return pair_pot.pair_pot_compute(
+        assert nthread > 0
+        if nthread == 1:
+            with nogil:
+                energy = pair_pot.pair_pot_compute(
+                    <nlist.neigh_row_type*>neighs.data, nneigh,
+                    <pair_pot.scaling_row_type*>stab.data, stab.shape[0],
+                    self._c_pair_pot, my_gpos, my_vtens
+                )
+        else:
+            # Thread-local gradient buffers
+            if gpos is None:
+                work = np.zeros((nthread, 0, 3))
+            else:
+                work = np.zeros((nthread, gpos.shape[0], 3))
+            with nogil:
+                energy = pair_pot.pair_pot_compute_parallel(
+                    <nlist.neigh_row_type*>neighs.data, nneigh,
+                    <pair_pot.scaling_row_type*>stab.data, stab.shape[0],
+                    self._c_pair_pot, my_gpos, my_vtens, work.shape[1],
+                    <double*>work.data, nthread
+                )
+        return energy
+
+
+def pair_pot_compute_multi(pair_pots, stabs,
+                           np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
+                           np.ndarray[double, ndim=2] gpos,
+                           np.ndarray[double, ndim=2] vtens, long nneigh,
+                           int nthread=1):
+    '''Compute several pairwise interactions in a single pass over the
+       neighbor list
+
+       **Arguments:**
+
+       pair_pots
+            A list of PairPot instances.
+
+       stabs
+            A list with one array of short-range scalings for each pair
+            potential. Each element is of the datatype
+            pair_pot.scaling_row_type
+
+       neighs
+            The neighbor list array. One element is of the datatype
+            nlist.neigh_row_type.
+
+       gpos
+            The output array for the derivative of the energy towards the
+            atomic positions. If None, these derivatives are not computed.
+
+       vtens
+            The output array for the virial tensor. If none, it is not
+            computed.
+
+       nneigh
+            The number of records to consider in the neighbor list.
+
+       **Optional arguments:**
+
+       nthread
+            The number of OpenMP threads, see PairPot.compute.
+
+       Each record in the neighbor list is loaded once. The cutoff, the
+       scaling and the truncation of each pair potential are applied
+       separately and the contributions to gpos and vtens are summed before
+       they are added to the output arrays. The result is the same as with
+       separate calls to PairPot.compute, up to round-off errors.
+
+       **Returns:** an array with the energy of each pair potential.
+    '''
+    cdef long ipot, npot
+    cdef double *my_gpos
+    cdef double *my_vtens
+    cdef np.ndarray[np.intp_t, ndim=1] pot_ptrs
+    cdef np.ndarray[np.intp_t, ndim=1] stab_ptrs
+    cdef np.ndarray[long, ndim=1] nstabs
+    cdef np.ndarray[long, ndim=1] srows
+    cdef np.ndarray[double, ndim=2] energies
+    cdef np.ndarray[double, ndim=3] work
+    cdef np.ndarray[pair_pot.scaling_row_type, ndim=1] stab
+    cdef PairPot pp
+
+    npot = len(pair_pots)
+    assert len(stabs) == npot
+    assert neighs.flags['C_CONTIGUOUS']
+    assert nthread > 0
+
+    # Arrays with the C pointers to the pair potentials and scaling tables.
+    # The Python lists keep the referenced objects alive during the call.
+    pot_ptrs = np.zeros(npot, np.intp)
+    stab_ptrs = np.zeros(npot, np.intp)
+    nstabs = np.zeros(npot, int)
+    for ipot in range(npot):
+        pp = pair_pots[ipot]
+        assert pair_pot.pair_pot_ready(pp._c_pair_pot)
+        pot_ptrs[ipot] = <np.intp_t>pp._c_pair_pot
+        stab = stabs[ipot]
+        assert stab.flags['C_CONTIGUOUS']
+        stab_ptrs[ipot] = <np.intp_t>stab.data
+        nstabs[ipot] = len(stab)
+
+    if gpos is None:
+        my_gpos = NULL
+    else:
+        assert gpos.flags['C_CONTIGUOUS']
+        assert gpos.shape[1] == 3
+        my_gpos = <double*>gpos.data
+
+    if vtens is None:
+        my_vtens = NULL
+    else:
+        assert vtens.flags['C_CONTIGUOUS']
+        assert vtens.shape[0] == 3
+        assert vtens.shape[1] == 3
+        my_vtens = <double*>vtens.data
+
+    energies = np.zeros((nthread, npot), float)
+    srows = np.zeros(nthread*npot, int)
+    # Thread-local gradient buffers
+    if gpos is None or nthread == 1:
+        work = np.zeros((nthread, 0, 3))
+    else:
+        work = np.zeros((nthread, gpos.shape[0], 3))
+    with nogil:
+        pair_pot.pair_pot_compute_multi(
             <nlist.neigh_row_type*>neighs.data, nneigh,
-            <pair_pot.scaling_row_type*>stab.data, len(stab),
-            self._c_pair_pot, my_gpos, my_vtens
+            <pair_pot.scaling_row_type**>stab_ptrs.data, <long*>nstabs.data,
+            <pair_pot.pair_pot_type**>pot_ptrs.data, npot, my_gpos, my_vtens,
+            work.shape[1], <double*>energies.data, <long*>srows.data,
+            <double*>work.data, nthread
         )
+    return energies.sum(axis=0)
 
 
 cdef class PairPotLJ(PairPot):
@@ -1916,11 +2188,11 @@ cdef class PairPotEIDip(PairPot):
     def compute(self, np.ndarray[nlist.neigh_row_type, ndim=1] neighs,
                 np.ndarray[pair_pot.scaling_row_type, ndim=1] stab,
                 np.ndarray[double, ndim=2] gpos,
-                np.ndarray[double, ndim=2] vtens, long nneigh):
+                np.ndarray[double, ndim=2] vtens, long nneigh, int nthread=1):
         #Override parents method to add dipole creation energy
         #TODO: Does this contribute to gpos or vtens?
         log("Computing PairPotEIDip energy and gradient")
-        E = PairPot.compute(self, neighs, stab, gpos, vtens, nneigh)
+        E = PairPot.compute(self, neighs, stab, gpos, vtens, nneigh, nthread)
         E += 0.5*np.dot( np.transpose(np.reshape( self._c_dipoles, (-1,) )) , np.dot( self.poltens_i, np.reshape( self._c_dipoles, (-1,) ) ) )
         return E
 
@@ -2348,11 +2620,80 @@ cdef class PairPotChargeTransferSlater1s1s(PairPot):
 #
 
 
+def compute_ewald_kvecs(Cell unitcell, double alpha,
+                        np.ndarray[long, ndim=1] gmax, double gcut):
+    '''Compute the table of reciprocal vectors used in the Ewald summation
+
+       **Arguments:**
+
+       unitcell
+            An instance of the ``Cell`` class that describes the periodic
+            boundary conditions.
+
+       alpha
+            The :math:`\\alpha` parameter from the Ewald summation scheme.
+
+       gmax
+            The maximum range of periodic images in reciprocal space to be
+            considered for the Ewald sum. integer numpy array with shape (3,).
+            Each element gives the range along the corresponding reciprocal
+            cell vector. The range along each axis goes from -gmax[0] to
+            gmax[0] (inclusive).
+
+       gcut
+            The cutoff in reciprocal space. The caller is responsible for the
+            compatibility of ``gcut`` with ``gmax``.
+
+       **Returns:** three arrays with one row for each reciprocal vector in
+       one half of reciprocal space and within the cutoff: integer indexes
+       with shape (nk, 3), Cartesian reciprocal vectors (including the factor
+       :math:`2\\pi`) with shape (nk, 3) and the prefactors
+       :math:`4\\pi\\exp(-k^2/4\\alpha^2)/(Vk^2)` with shape (nk,).
+    '''
+    cdef np.ndarray[long, ndim=2] gints
+    cdef np.ndarray[double, ndim=2] kvecs
+    cdef np.ndarray[double, ndim=1] kfacs
+    cdef long nk
+
+    assert unitcell.nvec == 3
+    assert alpha > 0
+    assert gmax.flags['C_CONTIGUOUS']
+    assert gmax.shape[0] == 3
+
+    nk = (2*gmax[0]+1)*(2*gmax[1]+1)*(gmax[2]+1)
+    gints = np.zeros((nk, 3), int)
+    kvecs = np.zeros((nk, 3), float)
+    kfacs = np.zeros(nk, float)
+    with nogil:
+        nk = ewald.compute_ewald_kvecs(unitcell._c_cell, alpha, <long*>gmax.data,
+                                       gcut, <long*>gints.data,
+                                       <double*>kvecs.data, <double*>kfacs.data)
+    return gints[:nk].copy(), kvecs[:nk].copy(), kfacs[:nk].copy()
+
+
+def get_ewald_work_size(long natom, np.ndarray[long, ndim=1] gmax):
+    '''Return the size of the work array for the reciprocal Ewald sum
+
+       **Arguments:**
+
+       natom
+            The number of atoms.
+
+       gmax
+            The maximum range of periodic images in reciprocal space, see
+            ``compute_ewald_kvecs``.
+    '''
+    return 2*natom*(2*gmax[0] + 2*gmax[1] + gmax[2] + 5)
+
+
 def compute_ewald_reci(np.ndarray[double, ndim=2] pos,
                        np.ndarray[double, ndim=1] charges,
                        Cell unitcell, double alpha,
                        np.ndarray[long, ndim=1] gmax,
-                       double gcut, double dielectric,
+                       np.ndarray[long, ndim=2] gints,
+                       np.ndarray[double, ndim=2] kvecs,
+                       np.ndarray[double, ndim=1] kfacs,
+                       double dielectric,
                        np.ndarray[double, ndim=2] gpos,
                        np.ndarray[double, ndim=1] work,
                        np.ndarray[double, ndim=2] vtens,
@@ -2381,9 +2722,9 @@ def compute_ewald_reci(np.ndarray[double, ndim=2] pos,
             cell vector. The range along each axis goes from -gmax[0] to
             gmax[0] (inclusive).
 
-       gcut
-            The cutoff in reciprocal space. The caller is responsible for the
-            compatibility of ``gcut`` with ``gmax``.
+       gints, kvecs, kfacs
+            The table of reciprocal vectors, as computed by
+            ``compute_ewald_kvecs`` for the same unitcell, alpha and gmax.
 
        dielectric
             The scalar relative permittivity of the system.
@@ -2393,8 +2734,8 @@ def compute_ewald_reci(np.ndarray[double, ndim=2] pos,
             stored in this array. numpy array with shape (natom, 3).
 
        work
-            If gpos is given, this work array must also be present. Its
-            contents will be overwritten. numpy array with shape (2*natom,).
+            A work array whose contents will be overwritten. numpy array
+            with shape (get_ewald_work_size(natom, gmax),).
 
        vtens
             If not set to None, the virial tensor is computed and stored in
@@ -2410,8 +2751,8 @@ def compute_ewald_reci(np.ndarray[double, ndim=2] pos,
             smaller than nhigh. The default nhigh=-1 means no exclusion.
     '''
     cdef double *my_gpos
-    cdef double *my_work
     cdef double *my_vtens
+    cdef double energy
 
     assert pos.flags['C_CONTIGUOUS']
     assert pos.shape[1] == 3
@@ -2422,18 +2763,17 @@ def compute_ewald_reci(np.ndarray[double, ndim=2] pos,
     assert dielectric >= 1.0
     assert gmax.flags['C_CONTIGUOUS']
     assert gmax.shape[0] == 3
+    check_ewald_kvecs(gmax, gints, kvecs, kfacs)
+    assert work.flags['C_CONTIGUOUS']
+    assert work.shape[0] >= get_ewald_work_size(pos.shape[0], gmax)
 
     if gpos is None:
         my_gpos = NULL
-        my_work = NULL
     else:
         assert gpos.flags['C_CONTIGUOUS']
         assert gpos.shape[1] == 3
         assert gpos.shape[0] == pos.shape[0]
-        assert work.flags['C_CONTIGUOUS']
-        assert gpos.shape[0]*2 == work.shape[0]
         my_gpos = <double*>gpos.data
-        my_work = <double*>work.data
 
     if vtens is None:
         my_vtens = NULL
@@ -2443,18 +2783,27 @@ def compute_ewald_reci(np.ndarray[double, ndim=2] pos,
         assert vtens.shape[1] == 3
         my_vtens = <double*>vtens.data
 
-    return ewald.compute_ewald_reci(<double*>pos.data, len(pos), nlow, nhigh,
-                                    <double*>charges.data,
-                                    unitcell._c_cell, alpha, <long*>gmax.data,
-                                    gcut, dielectric, my_gpos, my_work,
-                                    my_vtens)
+    with nogil:
+        energy = ewald.compute_ewald_reci(<double*>pos.data, pos.shape[0],
+                                          nlow, nhigh, <double*>charges.data,
+                                          unitcell._c_cell, alpha,
+                                          <long*>gmax.data, kfacs.shape[0],
+                                          <long*>gints.data,
+                                          <double*>kvecs.data,
+                                          <double*>kfacs.data, dielectric,
+                                          my_gpos, <double*>work.data,
+                                          my_vtens)
+    return energy
 
 
 def compute_ewald_reci_dd(np.ndarray[double, ndim=2] pos,
                        np.ndarray[double, ndim=1] charges,
                        np.ndarray[double, ndim=2] dipoles,
                        Cell unitcell, double alpha,
-                       np.ndarray[long, ndim=1] gmax, double gcut,
+                       np.ndarray[long, ndim=1] gmax,
+                       np.ndarray[long, ndim=2] gints,
+                       np.ndarray[double, ndim=2] kvecs,
+                       np.ndarray[double, ndim=1] kfacs,
                        np.ndarray[double, ndim=2] gpos,
                        np.ndarray[double, ndim=1] work,
                        np.ndarray[double, ndim=2] vtens,
@@ -2486,17 +2835,17 @@ def compute_ewald_reci_dd(np.ndarray[double, ndim=2] pos,
             cell vector. The range along each axis goes from -gmax[0] to
             gmax[0] (inclusive).
 
-       gcut
-            The cutoff in reciprocal space. The caller is responsible for the
-            compatibility of ``gcut`` with ``gmax``.
+       gints, kvecs, kfacs
+            The table of reciprocal vectors, as computed by
+            ``compute_ewald_kvecs`` for the same unitcell, alpha and gmax.
 
        gpos
             If not set to None, the Cartesian gradient of the energy is
             stored in this array. numpy array with shape (natom, 3).
 
        work
-            If gpos is given, this work array must also be present. Its
-            contents will be overwritten. numpy array with shape (2*natom,).
+            A work array whose contents will be overwritten. numpy array
+            with shape (get_ewald_work_size(natom, gmax),).
 
        vtens
             If not set to None, the virial tensor is computed and stored in
@@ -2512,8 +2861,8 @@ def compute_ewald_reci_dd(np.ndarray[double, ndim=2] pos,
             smaller than nhigh. The default nhigh=-1 means no exclusion.
     '''
     cdef double *my_gpos
-    cdef double *my_work
     cdef double *my_vtens
+    cdef double energy
 
     assert pos.flags['C_CONTIGUOUS']
     assert pos.shape[1] == 3
@@ -2525,18 +2874,17 @@ def compute_ewald_reci_dd(np.ndarray[double, ndim=2] pos,
     assert alpha > 0
     assert gmax.flags['C_CONTIGUOUS']
     assert gmax.shape[0] == 3
+    check_ewald_kvecs(gmax, gints, kvecs, kfacs)
+    assert work.flags['C_CONTIGUOUS']
+    assert work.shape[0] >= get_ewald_work_size(pos.shape[0], gmax)
 
     if gpos is None:
         my_gpos = NULL
-        my_work = NULL
     else:
         assert gpos.flags['C_CONTIGUOUS']
         assert gpos.shape[1] == 3
         assert gpos.shape[0] == pos.shape[0]
-        assert work.flags['C_CONTIGUOUS']
-        assert gpos.shape[0]*2 == work.shape[0]
         my_gpos = <double*>gpos.data
-        my_work = <double*>work.data
 
     if vtens is None:
         my_vtens = NULL
@@ -2546,12 +2894,34 @@ def compute_ewald_reci_dd(np.ndarray[double, ndim=2] pos,
         assert vtens.shape[1] == 3
         my_vtens = <double*>vtens.data
 
-    return ewald.compute_ewald_reci_dd(<double*>pos.data, len(pos), nlow, nhigh,
-                                    <double*>charges.data,
-                                    <double*>dipoles.data,
-                                    unitcell._c_cell, alpha,
-                                    <long*>gmax.data, gcut, my_gpos, my_work,
-                                    my_vtens)
+    with nogil:
+        energy = ewald.compute_ewald_reci_dd(<double*>pos.data, pos.shape[0],
+                                             nlow, nhigh,
+                                             <double*>charges.data,
+                                             <double*>dipoles.data,
+                                             unitcell._c_cell, alpha,
+                                             <long*>gmax.data, kfacs.shape[0],
+                                             <long*>gints.data,
+                                             <double*>kvecs.data,
+                                             <double*>kfacs.data, my_gpos,
+                                             <double*>work.data, my_vtens)
+    return energy
+
+
+def check_ewald_kvecs(np.ndarray[long, ndim=1] gmax,
+                      np.ndarray[long, ndim=2] gints,
+                      np.ndarray[double, ndim=2] kvecs,
+                      np.ndarray[double, ndim=1] kfacs):
+    '''Check the consistency of a table of reciprocal vectors'''
+    assert gints.flags['C_CONTIGUOUS']
+    assert kvecs.flags['C_CONTIGUOUS']
+    assert kfacs.flags['C_CONTIGUOUS']
+    assert gints.shape[1] == 3
+    assert kvecs.shape[1] == 3
+    assert gints.shape[0] == kfacs.shape[0]
+    assert kvecs.shape[0] == kfacs.shape[0]
+    if len(gints) > 0:
+        assert (abs(gints) <= gmax).all()
 
 
 def compute_ewald_corr(np.ndarray[double, ndim=2] pos,
@@ -2610,6 +2980,7 @@ def compute_ewald_corr(np.ndarray[double, ndim=2] pos,
 
     cdef double *my_gpos
     cdef double *my_vtens
+    cdef double energy
 
     assert pos.flags['C_CONTIGUOUS']
     assert pos.shape[1] == 3
@@ -2634,11 +3005,13 @@ def compute_ewald_corr(np.ndarray[double, ndim=2] pos,
         assert vtens.shape[1] == 3
         my_vtens = <double*>vtens.data
 
-    return ewald.compute_ewald_corr(
-        <double*>pos.data, <double*>charges.data, unitcell._c_cell, alpha,
-        <pair_pot.scaling_row_type*>stab.data, len(stab), dielectric,
-        my_gpos, my_vtens, len(pos), nlow, nhigh
-    )
+    with nogil:
+        energy = ewald.compute_ewald_corr(
+            <double*>pos.data, <double*>charges.data, unitcell._c_cell, alpha,
+            <pair_pot.scaling_row_type*>stab.data, stab.shape[0], dielectric,
+            my_gpos, my_vtens, pos.shape[0], nlow, nhigh
+        )
+    return energy
 
 def compute_ewald_corr_dd(np.ndarray[double, ndim=2] pos,
                        np.ndarray[double, ndim=1] charges,
@@ -2692,6 +3065,7 @@ def compute_ewald_corr_dd(np.ndarray[double, ndim=2] pos,
 
     cdef double *my_gpos
     cdef double *my_vtens
+    cdef double energy
 
     assert pos.flags['C_CONTIGUOUS']
     assert pos.shape[1] == 3
@@ -2717,11 +3091,13 @@ def compute_ewald_corr_dd(np.ndarray[double, ndim=2] pos,
         assert vtens.shape[1] == 3
         my_vtens = <double*>vtens.data
 
-    return ewald.compute_ewald_corr_dd(
-        <double*>pos.data, <double*>charges.data, <double*>dipoles.data, unitcell._c_cell, alpha,
-        <pair_pot.scaling_row_type*>stab.data, len(stab), my_gpos,
-        my_vtens, len(pos), nlow, nhigh
-    )
+    with nogil:
+        energy = ewald.compute_ewald_corr_dd(
+            <double*>pos.data, <double*>charges.data, <double*>dipoles.data, unitcell._c_cell, alpha,
+            <pair_pot.scaling_row_type*>stab.data, stab.shape[0], my_gpos,
+            my_vtens, pos.shape[0], nlow, nhigh
+        )
+    return energy
 
 
 def compute_ewald_prefactors(Cell unitcell, double alpha,
@@ -2768,8 +3144,9 @@ def compute_ewald_prefactors(Cell unitcell, double alpha,
     assert prefactors.shape[1] == 2*gmax[1]+1
     assert prefactors.shape[2] == gmax[2]+1
 
-    ewald.compute_ewald_prefactors(unitcell._c_cell, alpha,
-                 <long*>gmax.data, gcut, <double*>prefactors.data)
+    with nogil:
+        ewald.compute_ewald_prefactors(unitcell._c_cell, alpha,
+                     <long*>gmax.data, gcut, <double*>prefactors.data)
 
 
 def compute_ewald_structurefactors(np.ndarray[double, ndim=2] pos,
@@ -2835,65 +3212,139 @@ def compute_ewald_structurefactors(np.ndarray[double, ndim=2] pos,
     assert sinfacs.shape[1] == 2*gmax[1]+1
     assert sinfacs.shape[2] == gmax[2]+1
 
-    ewald.compute_ewald_structurefactors(<double*>pos.data, len(pos),
-                 <double*>charges.data, unitcell._c_cell, alpha,
-                 <long*>gmax.data, gcut, <double*>cosfacs.data,
-                 <double*>sinfacs.data)
+    with nogil:
+        ewald.compute_ewald_structurefactors(<double*>pos.data, pos.shape[0],
+                     <double*>charges.data, unitcell._c_cell, alpha,
+                     <long*>gmax.data, gcut, <double*>cosfacs.data,
+                     <double*>sinfacs.data)
+
+
+def compute_ewald_structurefactors_kvecs(np.ndarray[double, ndim=2] pos,
+                       np.ndarray[double, ndim=1] charges,
+                       Cell unitcell,
+                       np.ndarray[long, ndim=1] gmax,
+                       np.ndarray[long, ndim=2] gints,
+                       np.ndarray[double, ndim=1] cosfacs,
+                       np.ndarray[double, ndim=1] sinfacs,
+                       np.ndarray[double, ndim=1] work=None):
+    '''Compute structure factors of the reciprocal interaction term in the Ewald
+       summation scheme for a compact list of reciprocal vectors
+
+       **Arguments:**
+
+       pos
+            The atomic positions. numpy array with shape (natom,3).
+
+       charges
+            The atomic charges. numpy array with shape (natom,).
+
+       unitcell
+            An instance of the ``Cell`` class that describes the periodic
+            boundary conditions.
+
+       gmax
+            The maximum range of periodic images in reciprocal space, see
+            ``compute_ewald_kvecs``.
+
+       gints
+            The integer coefficients of the reciprocal vectors, computed with
+            ``compute_ewald_kvecs``. integer numpy array with shape (nk,3).
+
+       cosfacs
+            The cosine structure factors will be ADDED to this NumPy array with
+            shape (nk,).
+
+       sinfacs
+            The sine structure factors will be ADDED to this NumPy array with
+            shape (nk,).
+
+       **Optional arguments:**
+
+       work
+            A work array with shape (get_ewald_work_size(natom, gmax),). When
+            not given, it is allocated on the fly.
+
+       Unlike ``compute_ewald_structurefactors``, only one cosine and one sine
+       are evaluated per atom and per cell vector. All other phases follow from
+       recurrences.
+    '''
+    assert pos.flags['C_CONTIGUOUS']
+    assert pos.shape[1] == 3
+    assert charges.flags['C_CONTIGUOUS']
+    assert charges.shape[0] == pos.shape[0]
 
+    assert unitcell.nvec == 3
+    assert gmax.flags['C_CONTIGUOUS']
+    assert gmax.shape[0] == 3
+    assert gints.flags['C_CONTIGUOUS']
+    assert gints.shape[1] == 3
 
-def compute_ewald_deltae(np.ndarray[double, ndim=3] prefactors,
-                         np.ndarray[double, ndim=3] deltacosfacs,
-                         np.ndarray[double, ndim=3] cosfacs,
-                         np.ndarray[double, ndim=3] deltasinfacs,
-                         np.ndarray[double, ndim=3] sinfacs):
+    assert cosfacs.flags['C_CONTIGUOUS']
+    assert cosfacs.shape[0] == gints.shape[0]
+    assert sinfacs.flags['C_CONTIGUOUS']
+    assert sinfacs.shape[0] == gints.shape[0]
+    if work is None:
+        work = np.zeros(get_ewald_work_size(pos.shape[0], gmax))
+    assert work.flags['C_CONTIGUOUS']
+    assert work.shape[0] >= get_ewald_work_size(pos.shape[0], gmax)
+
+    with nogil:
+        ewald.compute_ewald_structurefactors_kvecs(<double*>pos.data,
+                     pos.shape[0], <double*>charges.data, unitcell._c_cell,
+                     <long*>gmax.data, gints.shape[0], <long*>gints.data,
+                     <double*>work.data, <double*>cosfacs.data,
+                     <double*>sinfacs.data)
+
+
+def compute_ewald_deltae(np.ndarray prefactors not None,
+                         np.ndarray deltacosfacs not None,
+                         np.ndarray cosfacs not None,
+                         np.ndarray deltasinfacs not None,
+                         np.ndarray sinfacs not None):
     '''Compute the energy difference arising if deltacosfacs and deltasinfacs
        would be added to cosfacs and sinfacs
 
        **Arguments:**
 
        prefactors
-            Numpy array [2*gmax[0]+1,2*gmax[1]+1,gmax[2]+1] computed with
-            compute_ewald_prefactor
+            Numpy array with the prefactors of all reciprocal vectors, either
+            with shape (nk,) computed with compute_ewald_kvecs or with shape
+            [2*gmax[0]+1,2*gmax[1]+1,gmax[2]+1] computed with
+            compute_ewald_prefactors
 
        deltacosfacs
             Cosine structure factors of the additional atoms, computed with
-            compute_ewald_structurefactors
+            compute_ewald_structurefactors(_kvecs)
 
        cosfacs
             Cosine structure factors of the original atoms, computed with
-            compute_ewald_structurefactors
+            compute_ewald_structurefactors(_kvecs)
 
        deltasinfacs
             Sine structure factors of the additional atoms, computed with
-            compute_ewald_structurefactors
+            compute_ewald_structurefactors(_kvecs)
 
        sinfacs
             Sine structure factors of the original atoms, computed with
-            compute_ewald_structurefactors
-    '''
-    assert deltacosfacs.flags['C_CONTIGUOUS']
-    nk = deltacosfacs.shape[0]*deltacosfacs.shape[1]*deltacosfacs.shape[2]
-
-    assert cosfacs.flags['C_CONTIGUOUS']
-    assert cosfacs.shape[0] == deltacosfacs.shape[0]
-    assert cosfacs.shape[1] == deltacosfacs.shape[1]
-    assert cosfacs.shape[2] == deltacosfacs.shape[2]
+            compute_ewald_structurefactors(_kvecs)
 
-    assert deltasinfacs.flags['C_CONTIGUOUS']
-    assert deltasinfacs.shape[0] == deltacosfacs.shape[0]
-    assert deltasinfacs.shape[1] == deltacosfacs.shape[1]
-    assert deltasinfacs.shape[2] == deltacosfacs.shape[2]
-
-    assert sinfacs.flags['C_CONTIGUOUS']
-    assert sinfacs.shape[0] == deltacosfacs.shape[0]
-    assert sinfacs.shape[1] == deltacosfacs.shape[1]
-    assert sinfacs.shape[2] == deltacosfacs.shape[2]
-
-    return ewald.compute_ewald_deltae(<double*>deltacosfacs.data,
-                        <double*>cosfacs.data,
-                        <double*>deltasinfacs.data,
-                        <double*>sinfacs.data,
-                        <double*>prefactors.data, nk)
+       All arrays must be contiguous double arrays with the same size.
+    '''
+    cdef long nk
+    cdef double energy
+    for array in prefactors, deltacosfacs, cosfacs, deltasinfacs, sinfacs:
+        assert array.dtype == np.float64
+        assert array.flags['C_CONTIGUOUS']
+        assert array.size == deltacosfacs.size
+    nk = deltacosfacs.size
+
+    with nogil:
+        energy = ewald.compute_ewald_deltae(<double*>deltacosfacs.data,
+                            <double*>cosfacs.data,
+                            <double*>deltasinfacs.data,
+                            <double*>sinfacs.data,
+                            <double*>prefactors.data, nk)
+    return energy
 
 
 #
@@ -2936,13 +3387,14 @@ def comlist_forward(np.ndarray[dlist.dlist_row_type, ndim=1] deltas not None,
     assert compos.shape[1] == 3
     assert comsizes.flags['C_CONTIGUOUS']
     assert comtab.flags['C_CONTIGUOUS']
-    comlist.comlist_forward(
-        <dlist.dlist_row_type*>deltas.data,
-        <double*>pos.data,
-        <double*>compos.data,
-        <long*>comsizes.data,
-        <comlist.comlist_row_type*>comtab.data,
-        len(comsizes))
+    with nogil:
+        comlist.comlist_forward(
+            <dlist.dlist_row_type*>deltas.data,
+            <double*>pos.data,
+            <double*>compos.data,
+            <long*>comsizes.data,
+            <comlist.comlist_row_type*>comtab.data,
+            comsizes.shape[0])
 
 
 def comlist_back(np.ndarray[dlist.dlist_row_type, ndim=1] deltas not None,
@@ -2978,13 +3430,14 @@ def comlist_back(np.ndarray[dlist.dlist_row_type, ndim=1] deltas not None,
     assert gcompos.shape[1] == 3
     assert comsizes.flags['C_CONTIGUOUS']
     assert comtab.flags['C_CONTIGUOUS']
-    comlist.comlist_back(
-        <dlist.dlist_row_type*>deltas.data,
-        <double*>gpos.data,
-        <double*>gcompos.data,
-        <long*>comsizes.data,
-        <comlist.comlist_row_type*>comtab.data,
-        len(comsizes))
+    with nogil:
+        comlist.comlist_back(
+            <dlist.dlist_row_type*>deltas.data,
+            <double*>gpos.data,
+            <double*>gcompos.data,
+            <long*>comsizes.data,
+            <comlist.comlist_row_type*>comtab.data,
+            comsizes.shape[0])
 
 
 #
@@ -2998,7 +3451,8 @@ delta_dtype = np.asarray(<dlist.dlist_row_type[:1]>(&_dlist_row_tmp)).dtype
 
 def dlist_forward(np.ndarray[double, ndim=2] pos,
                   Cell unitcell,
-                  np.ndarray[dlist.dlist_row_type, ndim=1] deltas, long ndelta):
+                  np.ndarray[dlist.dlist_row_type, ndim=1] deltas, long ndelta,
+                  int nthread=1):
     '''Compute the relative vectors in the delta list
 
        **Arguments:**
@@ -3015,16 +3469,31 @@ def dlist_forward(np.ndarray[double, ndim=2] pos,
 
        ndelta
             The number of records in the delta list that need to be computed.
+
+       **Optional arguments:**
+
+       nthread
+            The number of OpenMP threads. The delta list is split in nthread
+            parts that are computed independently.
     '''
     assert pos.flags['C_CONTIGUOUS']
     assert pos.shape[1] == 3
     assert deltas.flags['C_CONTIGUOUS']
-    dlist.dlist_forward(<double*>pos.data, unitcell._c_cell,
-                        <dlist.dlist_row_type*>deltas.data, ndelta)
+    assert nthread > 0
+    if nthread == 1:
+        with nogil:
+            dlist.dlist_forward(<double*>pos.data, unitcell._c_cell,
+                                <dlist.dlist_row_type*>deltas.data, ndelta)
+    else:
+        with nogil:
+            dlist.dlist_forward_parallel(<double*>pos.data, unitcell._c_cell,
+                                         <dlist.dlist_row_type*>deltas.data,
+                                         ndelta, nthread)
 
 def dlist_back(np.ndarray[double, ndim=2] gpos,
                np.ndarray[double, ndim=2] vtens,
-               np.ndarray[dlist.dlist_row_type, ndim=1] deltas, long ndelta):
+               np.ndarray[dlist.dlist_row_type, ndim=1] deltas, long ndelta,
+               int nthread=1):
     '''The back-propagation step of the delta list
 
        **Arguments:**
@@ -3042,9 +3511,18 @@ def dlist_back(np.ndarray[double, ndim=2] gpos,
 
        ndelta
             The number of records in the delta list that need to be computed.
+
+       **Optional arguments:**
+
+       nthread
+            The number of OpenMP threads. The delta list is split in nthread
+            parts and each thread accumulates its own contributions to gpos
+            and vtens, which are added up at the end. The result is the same
+            as with one thread, up to round-off errors.
     '''
     cdef double *my_gpos
     cdef double *my_vtens
+    cdef np.ndarray[double, ndim=3] work
 
     assert deltas.flags['C_CONTIGUOUS']
     if gpos is None and vtens is None:
@@ -3065,8 +3543,21 @@ def dlist_back(np.ndarray[double, ndim=2] gpos,
         assert vtens.shape[1] == 3
         my_vtens = <double*>vtens.data
 
-    dlist.dlist_back(my_gpos, my_vtens,
-                     <dlist.dlist_row_type*>deltas.data, ndelta)
+    assert nthread > 0
+    if nthread == 1:
+        with nogil:
+            dlist.dlist_back(my_gpos, my_vtens,
+                             <dlist.dlist_row_type*>deltas.data, ndelta)
+    else:
+        # Thread-local gradient buffers
+        if gpos is None:
+            work = np.zeros((nthread, 0, 3))
+        else:
+            work = np.zeros((nthread, gpos.shape[0], 3))
+        with nogil:
+            dlist.dlist_back_parallel(my_gpos, my_vtens,
+                                      <dlist.dlist_row_type*>deltas.data, ndelta,
+                                      work.shape[1], <double*>work.data, nthread)
 
 
 #
@@ -3078,7 +3569,8 @@ iclist_dtype = np.asarray(<iclist.iclist_row_type[:1]>(&_iclist_row_tmp)).dtype
 
 
 def iclist_forward(np.ndarray[dlist.dlist_row_type, ndim=1] deltas,
-                   np.ndarray[iclist.iclist_row_type, ndim=1] ictab, long nic):
+                   np.ndarray[iclist.iclist_row_type, ndim=1] ictab, long nic,
+                   int nthread=1):
     '''Compute internal coordinates based on relative vectors
 
        **Arguments:**
@@ -3092,14 +3584,29 @@ def iclist_forward(np.ndarray[dlist.dlist_row_type, ndim=1] deltas,
 
        nic
             The number of records in the ``ictab`` array to compute.
+
+       **Optional arguments:**
+
+       nthread
+            The number of OpenMP threads. The table is split in nthread parts
+            that are computed independently.
     '''
     assert deltas.flags['C_CONTIGUOUS']
     assert ictab.flags['C_CONTIGUOUS']
-    iclist.iclist_forward(<dlist.dlist_row_type*>deltas.data,
-                          <iclist.iclist_row_type*>ictab.data, nic)
+    assert nthread > 0
+    if nthread > 1:
+        with nogil:
+            iclist.iclist_forward_parallel(<dlist.dlist_row_type*>deltas.data,
+                                           <iclist.iclist_row_type*>ictab.data,
+                                           nic, nthread)
+    else:
+        with nogil:
+            iclist.iclist_forward(<dlist.dlist_row_type*>deltas.data,
+                                  <iclist.iclist_row_type*>ictab.data, nic)
 
 def iclist_back(np.ndarray[dlist.dlist_row_type, ndim=1] deltas,
-                np.ndarray[iclist.iclist_row_type, ndim=1] ictab, long nic):
+                np.ndarray[iclist.iclist_row_type, ndim=1] ictab, long nic,
+                int nthread=1):
     '''The back-propagation step in the internal coordinate list
 
        deltas
@@ -3111,14 +3618,34 @@ def iclist_back(np.ndarray[dlist.dlist_row_type, ndim=1] deltas,
        nic
             The number of records in the ``ictab`` array to compute.
 
+       **Optional arguments:**
+
+       nthread
+            The number of OpenMP threads. The table is split in nthread parts.
+            All threads but the first one accumulate their contributions in
+            a private copy of the delta list, which are added up at the end.
+            The result is the same as with one thread, up to round-off errors.
+
        This routine transforms the partial derivatives of the energy towards the
        internal coordinates, stored in ``ictab``, into partial derivatives of
        the energy towards relative vectors, added to ``deltas``.
     '''
+    cdef np.ndarray[dlist.dlist_row_type, ndim=1] work
     assert deltas.flags['C_CONTIGUOUS']
     assert ictab.flags['C_CONTIGUOUS']
-    iclist.iclist_back(<dlist.dlist_row_type*>deltas.data,
-                       <iclist.iclist_row_type*>ictab.data, nic)
+    assert nthread > 0
+    if nthread > 1:
+        # Thread-local copies of the delta list
+        work = np.zeros((nthread-1)*deltas.shape[0], deltas.dtype)
+        with nogil:
+            iclist.iclist_back_parallel(<dlist.dlist_row_type*>deltas.data,
+                                        <iclist.iclist_row_type*>ictab.data,
+                                        nic, deltas.shape[0],
+                                        <dlist.dlist_row_type*>work.data, nthread)
+    else:
+        with nogil:
+            iclist.iclist_back(<dlist.dlist_row_type*>deltas.data,
+                               <iclist.iclist_row_type*>ictab.data, nic)
 
 
 #
@@ -3130,7 +3657,8 @@ vlist_dtype = np.asarray(<vlist.vlist_row_type[:1]>(&_vlist_row_tmp)).dtype
 
 
 def vlist_forward(np.ndarray[iclist.iclist_row_type, ndim=1] ictab,
-                  np.ndarray[vlist.vlist_row_type, ndim=1] vtab, long nv):
+                  np.ndarray[vlist.vlist_row_type, ndim=1] vtab, long nv,
+                  int nthread=1):
     '''Computes valence energy terms based on a list of internal coordinates
 
        **Arguments:**
@@ -3143,14 +3671,32 @@ def vlist_forward(np.ndarray[iclist.iclist_row_type, ndim=1] ictab,
 
        nv
             The number of records to consider in ``vtab``.
+
+       **Optional arguments:**
+
+       nthread
+            The number of OpenMP threads. The table is split in nthread parts
+            that are computed independently. The energy is the same as with
+            one thread, up to round-off errors.
     '''
+    cdef double energy
     assert ictab.flags['C_CONTIGUOUS']
     assert vtab.flags['C_CONTIGUOUS']
-    return vlist.vlist_forward(<iclist.iclist_row_type*>ictab.data,
-                               <vlist.vlist_row_type*>vtab.data, nv)
+    assert nthread > 0
+    if nthread > 1:
+        with nogil:
+            energy = vlist.vlist_forward_parallel(<iclist.iclist_row_type*>ictab.data,
+                                                  <vlist.vlist_row_type*>vtab.data,
+                                                  nv, nthread)
+    else:
+        with nogil:
+            energy = vlist.vlist_forward(<iclist.iclist_row_type*>ictab.data,
+                                         <vlist.vlist_row_type*>vtab.data, nv)
+    return energy
 
 def vlist_back(np.ndarray[iclist.iclist_row_type, ndim=1] ictab,
-               np.ndarray[vlist.vlist_row_type, ndim=1] vtab, long nv):
+               np.ndarray[vlist.vlist_row_type, ndim=1] vtab, long nv,
+               int nthread=1):
     '''The back-propagation step in the valence list.
 
        **Arguments:**
@@ -3164,13 +3710,33 @@ def vlist_back(np.ndarray[iclist.iclist_row_type, ndim=1] ictab,
        nv
             The number of records to consider in ``vtab``.
 
+       **Optional arguments:**
+
+       nthread
+            The number of OpenMP threads. The table is split in nthread parts.
+            All threads but the first one accumulate their contributions in
+            a private copy of ``ictab``, which are added up at the end. The
+            result is the same as with one thread, up to round-off errors.
+
        This routine computes the derivatives of the energy of each term towards
        the internal coordinates and adds the results to the ``ictab`` array.
     '''
+    cdef np.ndarray[iclist.iclist_row_type, ndim=1] work
     assert ictab.flags['C_CONTIGUOUS']
     assert vtab.flags['C_CONTIGUOUS']
-    vlist.vlist_back(<iclist.iclist_row_type*>ictab.data,
-                     <vlist.vlist_row_type*>vtab.data, nv)
+    assert nthread > 0
+    if nthread > 1:
+        # Thread-local copies of the internal coordinates
+        work = np.zeros((nthread-1)*ictab.shape[0], ictab.dtype)
+        with nogil:
+            vlist.vlist_back_parallel(<iclist.iclist_row_type*>ictab.data,
+                                      <vlist.vlist_row_type*>vtab.data,
+                                      nv, ictab.shape[0],
+                                      <iclist.iclist_row_type*>work.data, nthread)
+    else:
+        with nogil:
+            vlist.vlist_back(<iclist.iclist_row_type*>ictab.data,
+                             <vlist.vlist_row_type*>vtab.data, nv)
 
 #
 # grid
@@ -3178,8 +3744,79 @@ def vlist_back(np.ndarray[iclist.iclist_row_type, ndim=1] ictab,
 
 def compute_grid3d(double[::1] center not None,
                    Cell unitcell,
-                   double[:,:,::1] egrid not None):
+                   const double[:,:,::1] egrid not None):
     assert center.shape[0] == 3
     cdef size_t shape[3]
+    cdef double energy
+    shape[:] = egrid.shape
+    with nogil:
+        energy = grid.compute_grid3d(&center[0], unitcell._c_cell, <double*>&egrid[0, 0, 0], &shape[0])
+    return energy
+
+
+def compute_grid3d_multi(double[:,::1] pos not None,
+                         long[::1] iatoms not None,
+                         Cell unitcell,
+                         const double[:,:,::1] egrid not None,
+                         double[:,::1] gpos=None,
+                         bint tricubic=False,
+                         double[::1] energies=None):
+    '''Interpolate an energy grid at the positions of several atoms
+
+       **Arguments:**
+
+       pos
+            The Cartesian coordinates of all atoms, shape (natom, 3).
+
+       iatoms
+            The indexes of the atoms at which the grid is interpolated.
+
+       unitcell
+            The unit cell spanned by the grid, the grid points are equally
+            spaced in fractional coordinates.
+
+       egrid
+            A three-dimensional array with energies. A read-only array, e.g. a
+            memory-mapped file, is allowed.
+
+       **Optional arguments:**
+
+       gpos
+            When given, the derivatives of the interpolated energies towards
+            the Cartesian coordinates are added to this array.
+
+       tricubic
+            When True, a tricubic (Catmull-Rom) interpolation is used instead
+            of a trilinear one. The gradient is continuous in that case.
+
+       energies
+            When given, the interpolated energy of each atom in iatoms is
+            stored in this array, which has the same length as iatoms.
+
+       Returns the sum of the interpolated energies.
+    '''
+    assert pos.shape[1] == 3
+    if iatoms.shape[0] > 0:
+        assert np.asarray(iatoms).min() >= 0
+        assert np.asarray(iatoms).max() < pos.shape[0]
+    cdef size_t shape[3]
+    cdef double energy
+    cdef double* my_gpos = NULL
+    cdef double* my_energies = NULL
     shape[:] = egrid.shape
-    return grid.compute_grid3d(&center[0], unitcell._c_cell, &egrid[0, 0, 0], &shape[0])
+    if gpos is not None:
+        assert gpos.shape[0] == pos.shape[0]
+        assert gpos.shape[1] == 3
+        my_gpos = &gpos[0, 0]
+    if energies is not None:
+        assert energies.shape[0] == iatoms.shape[0]
+    if iatoms.shape[0] == 0:
+        return 0.0
+    if energies is not None:
+        my_energies = &energies[0]
+    with nogil:
+        energy = grid.compute_grid3d_multi(
+            &pos[0, 0], &iatoms[0], iatoms.shape[0], unitcell._c_cell,
+            <double*>&egrid[0, 0, 0], &shape[0], my_gpos, my_energies,
+            tricubic)
+    return energy
@@ -40,13 +40,18 @@
 
 from __future__ import division
 
+from multiprocessing.pool import ThreadPool
+import weakref
+
 import numpy as np
 
-from yaff.log import log, timer
+from yaff.log import log, timer, profiler
 from yaff.pes.ext import compute_ewald_reci, compute_ewald_reci_dd, \
-    compute_ewald_corr, compute_ewald_corr_dd, compute_ewald_prefactors, \
-    compute_ewald_structurefactors, compute_ewald_deltae, PairPotEI, \
-    PairPotLJ, PairPotMM3, PairPotMM3CAP, PairPotGrimme, compute_grid3d
+    compute_ewald_kvecs, get_ewald_work_size, \
+    compute_ewald_corr, compute_ewald_corr_dd, \
+    compute_ewald_structurefactors_kvecs, compute_ewald_deltae, PairPotEI, \
+    PairPotEIDip, PairPotLJ, PairPotMM3, PairPotMM3CAP, PairPotGrimme, \
+    pair_pot_compute_multi, compute_grid3d_multi
 from yaff.pes.dlist import DeltaList
 from yaff.pes.iclist import InternalCoordinateList
 from yaff.pes.vlist import ValenceList, ValenceTerm
@@ -54,7 +59,9 @@ from yaff.pes.bias import BiasPotential
 
 
 __all__ = [
-    'ForcePart', 'ForceField', 'ForcePartPair', 'ForcePartEwaldReciprocal',
+    'ForcePart', 'ForceField', 'ForcePartPair', 'ForcePartPairFused',
+    'ForcePartEwaldReciprocal',
+    'ForcePartEwaldReciprocalPME',
     'ForcePartEwaldReciprocalDD', 'ForcePartEwaldCorrectionDD',
     'ForcePartEwaldCorrection', 'ForcePartEwaldNeutralizing',
     'ForcePartValence', 'ForcePartBias', 'ForcePartPressure', 'ForcePartGrid',
@@ -154,7 +161,8 @@ class ForcePart(object):
         else:
             my_vtens = self.vtens
             my_vtens[:] = 0.0
-        self.energy = self._internal_compute(my_gpos, my_vtens)
+        with profiler.section('ForcePart %s' % self.name):
+            self.energy = self._internal_compute(my_gpos, my_vtens)
         if np.isnan(self.energy):
             raise ValueError('The energy is not-a-number (nan).')
         if gpos is not None:
@@ -171,10 +179,54 @@ class ForcePart(object):
         '''Subclasses implement their compute code here.'''
         raise NotImplementedError
 
+    def compute_subset(self, iatoms):
+        '''Compute the energy of all interactions that involve at least one
+           atom of a subset.
+
+           **Arguments:**
+
+           iatoms
+                An array with the indexes of the atoms in the subset.
+
+           The energy is returned. No derivatives are computed and the cached
+           results of the last call to ``compute`` are not modified. When
+           only the atoms in the subset are displaced, the change in energy is
+           the same as the change in the result of ``compute``. Subclasses
+           that can identify the relevant interactions override this method,
+           such that the cost scales with the size of the subset. The default
+           implementation just computes the complete energy.
+        '''
+        return self._internal_compute(None, None)
+
+    def compute_batch(self, iatoms, batch):
+        '''Compute ``compute_subset`` for several positions of the subset at
+           once.
+
+           **Arguments:**
+
+           iatoms
+                An array with the indexes of the atoms in the subset.
+
+           batch
+                An array with shape (nbatch, len(iatoms), 3) with positions of
+                the atoms in the subset.
+
+           Subclasses that can evaluate all positions in one pass return an
+           array with nbatch energies. The default implementation returns
+           None, in which case :meth:`yaff.pes.ff.ForceField.compute_batch`
+           calls ``compute_subset`` for each position.
+        '''
+        return None
+
+
+def _close_pool(pool):
+    pool.close()
+    pool.join()
+
 
 class ForceField(ForcePart):
     '''A complete force field model.'''
-    def __init__(self, system, parts, nlist=None):
+    def __init__(self, system, parts, nlist=None, nworker=1):
         """
            **Arguments:**
 
@@ -191,12 +243,31 @@ class ForceField(ForcePart):
            nlist
                 A ``NeighborList`` instance. This is required if some items in the
                 parts list use this nlist object.
+
+           nworker
+                The number of threads used to compute the parts concurrently,
+                after the neighbor list is updated. Each part has its own
+                gradient and virial buffer, which are added up in the order of
+                the parts, such that the result is identical to a sequential
+                evaluation. This only results in a speedup when the parts spend
+                most of their time in the low-level C routines, which are
+                executed without the global interpreter lock. The parts must
+                not share any state that is modified during their computation.
+                This attribute may also be changed after the construction of
+                the force field, e.g. ``ff.nworker = 4``. The worker threads
+                are stopped with the ``close`` method.
         """
+        if nworker < 1:
+            raise ValueError('The number of workers must be at least one.')
         ForcePart.__init__(self, 'all', system)
         self.system = system
         self.parts = []
         self.nlist = nlist
         self.needs_nlist_update = nlist is not None
+        self.nworker = nworker
+        self._pool = None
+        self._pool_size = 0
+        self._pool_finalizer = None
         for part in parts:
             self.add_part(part)
         if log.do_medium:
@@ -205,6 +276,7 @@ class ForceField(ForcePart):
                     len(self.parts), ', '.join(part.name for part in self.parts)
                 ))
                 log('Neighborlist present: %s' % (self.nlist is not None))
+                log('Workers: %i' % self.nworker)
 
     def add_part(self, part):
         self.parts.append(part)
@@ -230,7 +302,8 @@ class ForceField(ForcePart):
                 the Parameters class.
 
            See the constructor of the :class:`yaff.pes.generator.FFArgs` class
-           for the available optional arguments.
+           for the available optional arguments. The optional argument
+           ``nworker`` is passed on to the ``ForceField`` constructor.
 
            This method takes care of setting up the FF object, and configuring
            all the necessary FF parts. This is a lot easier than creating an FF
@@ -246,9 +319,10 @@ class ForceField(ForcePart):
                 log('Generating force field from %s' % str(parameters))
             if not isinstance(parameters, Parameters):
                 parameters = Parameters.from_file(parameters)
+            nworker = kwargs.pop('nworker', 1)
             ff_args = FFArgs(**kwargs)
             apply_generators(system, parameters, ff_args)
-            return ForceField(system, ff_args.parts, ff_args.nlist)
+            return ForceField(system, ff_args.parts, ff_args.nlist, nworker)
 
     def update_rvecs(self, rvecs):
         '''See :meth:`yaff.pes.ff.ForcePart.update_rvecs`'''
@@ -269,9 +343,109 @@ class ForceField(ForcePart):
         if self.needs_nlist_update:
             self.nlist.update()
             self.needs_nlist_update = False
+        if self.nworker > 1 and len(self.parts) > 1:
+            return self._concurrent_compute(gpos, vtens)
         result = sum([part.compute(gpos, vtens) for part in self.parts])
         return result
 
+    def compute_subset(self, iatoms):
+        '''See :meth:`yaff.pes.ff.ForcePart.compute_subset`
+
+           The positions must be set with ``update_pos`` before calling this
+           method. Instead of updating the full neighbor list, only the pairs
+           that involve an atom of the subset are searched.
+        '''
+        if self.nlist is not None:
+            self.nlist.update_subset(iatoms)
+        return sum([part.compute_subset(iatoms) for part in self.parts])
+
+    def compute_batch(self, iatoms, batch):
+        '''See :meth:`yaff.pes.ff.ForcePart.compute_batch`
+
+           Returns an array with nbatch energies. The parts that do not
+           support batches are evaluated with ``compute_subset`` after moving
+           the atoms in the subset to each position in the batch. The original
+           positions are restored at the end.
+        '''
+        batch = np.asarray(batch, dtype=float)
+        assert batch.shape[1:] == (len(iatoms), 3)
+        energies = np.zeros(len(batch))
+        others = []
+        for part in self.parts:
+            part_energies = part.compute_batch(iatoms, batch)
+            if part_energies is None:
+                others.append(part)
+            else:
+                energies += part_energies
+        if len(others) > 0:
+            pos0 = self.system.pos[iatoms].copy()
+            pos = self.system.pos.copy()
+            for ibatch in range(len(batch)):
+                pos[iatoms] = batch[ibatch]
+                self.update_pos(pos)
+                if self.nlist is not None:
+                    self.nlist.update_subset(iatoms)
+                energies[ibatch] += sum([part.compute_subset(iatoms) for part in others])
+            pos[iatoms] = pos0
+            self.update_pos(pos)
+        return energies
+
+    def _get_pool(self):
+        nworker = min(self.nworker, len(self.parts))
+        if self._pool is None or self._pool_size != nworker:
+            self.close()
+            self._pool = ThreadPool(nworker)
+            self._pool_size = nworker
+            # Stop the threads when the force field is garbage collected.
+            # (Not supported on Python 2, where close must be called.)
+            if hasattr(weakref, 'finalize'):
+                self._pool_finalizer = weakref.finalize(self, _close_pool, self._pool)
+        return self._pool
+
+    def close(self):
+        '''Stop the worker threads used to compute the parts concurrently
+
+           The force field remains usable: new threads are started when
+           needed.
+        '''
+        if self._pool is not None:
+            if self._pool_finalizer is not None:
+                self._pool_finalizer.detach()
+                self._pool_finalizer = None
+            _close_pool(self._pool)
+            self._pool = None
+            self._pool_size = 0
+
+    def _concurrent_compute(self, gpos, vtens):
+        nparts = len(self.parts)
+        # Private output arrays for each part.
+        if gpos is None:
+            part_gposs = [None]*nparts
+        else:
+            part_gposs = np.zeros((nparts,) + gpos.shape)
+        if vtens is None:
+            part_vtenss = [None]*nparts
+        else:
+            part_vtenss = np.zeros((nparts, 3, 3))
+
+        def compute_part(ipart):
+            with timer.collect() as records:
+                energy = self.parts[ipart].compute(part_gposs[ipart], part_vtenss[ipart])
+            return energy, records
+
+        results = self._get_pool().map(compute_part, range(nparts))
+        # Reduction, in the same order as in the sequential code path.
+        result = 0.0
+        for ipart in range(nparts):
+            energy, records = results[ipart]
+            timer.merge(records)
+            result += energy
+            if gpos is not None:
+                gpos += part_gposs[ipart]
+            if vtens is not None:
+                vtens += part_vtenss[ipart]
+        return result
+
 
 class ForcePartPair(ForcePart):
     '''A pairwise (short-range) non-bonding interaction term.
@@ -280,10 +454,10 @@ class ForcePartPair(ForcePart):
        terms, etc. Currently, one has to use multiple ``ForcePartPair``
        objects in a ``ForceField`` in order to combine different types of pairwise
        energy terms, e.g. to combine an electrostatic term with a Van der
-       Waals term. (This may be changed in future to improve the computational
-       efficiency.)
+       Waals term. Such combinations can be evaluated more efficiently with
+       a ``ForcePartPairFused`` object.
     '''
-    def __init__(self, system, nlist, scalings, pair_pot):
+    def __init__(self, system, nlist, scalings, pair_pot, nthread=1):
         '''
            **Arguments:**
 
@@ -303,11 +477,21 @@ class ForcePartPair(ForcePart):
            pair_pot
                 An instance of the ``PairPot`` built-in class from
                 :mod:`yaff.pes.ext`.
+
+           **Optional arguments:**
+
+           nthread
+                The number of OpenMP threads used to compute the interactions.
+                This attribute may also be changed after the construction of
+                the force part, e.g. ``ff.part_pair_mm3.nthread = 8``.
         '''
         ForcePart.__init__(self, 'pair_%s' % pair_pot.name, system)
+        if nthread < 1:
+            raise ValueError('The number of threads must be at least one.')
         self.nlist = nlist
         self.scalings = scalings
         self.pair_pot = pair_pot
+        self.nthread = nthread
         self.nlist.request_rcut(pair_pot.rcut)
         if log.do_medium:
             with log.section('FPINIT'):
@@ -320,12 +504,112 @@ class ForcePartPair(ForcePart):
                     log('  truncation:     none')
                 else:
                     log('  truncation:     %s' % tr.get_log())
+                log('  threads:        %i' % self.nthread)
                 self.pair_pot.log()
                 log.hline()
 
     def _internal_compute(self, gpos, vtens):
+        profiler.annotate(nneigh=self.nlist.nneigh)
+        with timer.section('PP %s' % self.pair_pot.name):
+            return self.pair_pot.compute(self.nlist.neighs, self.scalings.stab, gpos, vtens, self.nlist.nneigh, self.nthread)
+
+    def compute_subset(self, iatoms):
+        '''See :meth:`yaff.pes.ff.ForcePart.compute_subset`
+
+           The pairs are taken from the ``subset_neighs`` attribute of the
+           neighbor list, which must be updated first with
+           :meth:`yaff.pes.nlist.NeighborList.update_subset`. This is done
+           by :meth:`yaff.pes.ff.ForceField.compute_subset`.
+        '''
         with timer.section('PP %s' % self.pair_pot.name):
-            return self.pair_pot.compute(self.nlist.neighs, self.scalings.stab, gpos, vtens, self.nlist.nneigh)
+            return self.pair_pot.compute(self.nlist.subset_neighs, self.scalings.stab, None, None, self.nlist.subset_nneigh)
+
+
+class ForcePartPairFused(ForcePart):
+    '''Several pairwise (short-range) non-bonding interactions, evaluated in
+       a single pass over the neighbor list.
+
+       The distance and relative vector of each pair in the neighbor list are
+       loaded only once, after which the cutoff, the scaling and the truncation
+       of every pair potential are applied. The contributions of all pair
+       potentials to the gradient and the virial are added up before they are
+       stored. The result is the same as with the corresponding
+       ``ForcePartPair`` objects, up to round-off errors.
+    '''
+    def __init__(self, system, nlist, parts, nthread=1):
+        '''
+           **Arguments:**
+
+           system
+                The system to which the pairwise interactions apply.
+
+           nlist
+                A ``NeighborList`` object. This has to be the same as the one
+                passed to the ForceField object that contains this part.
+
+           parts
+                A list of ``ForcePartPair`` objects, whose pair potentials are
+                computed by this part. They must all use the given neighbor
+                list. (Pair potentials with dipoles, ``PairPotEIDip``, are not
+                supported.)
+
+           **Optional arguments:**
+
+           nthread
+                The number of OpenMP threads used to compute the interactions.
+                This attribute may also be changed after the construction of
+                the force part.
+
+           After each call to compute, the energies of the individual pair
+           potentials are stored in the ``energy`` attributes of the given
+           parts and in the ``energies`` array of this part.
+        '''
+        ForcePart.__init__(self, 'pair_fused', system)
+        if nthread < 1:
+            raise ValueError('The number of threads must be at least one.')
+        if len(parts) == 0:
+            raise ValueError('At least one ForcePartPair object is needed.')
+        for part in parts:
+            if not isinstance(part, ForcePartPair):
+                raise TypeError('Only ForcePartPair objects can be fused.')
+            if part.nlist is not nlist:
+                raise ValueError('All pair parts must use the same neighbor list.')
+            if isinstance(part.pair_pot, PairPotEIDip):
+                raise TypeError('Pair potentials with dipoles can not be fused.')
+        self.nlist = nlist
+        self.parts = list(parts)
+        self.nthread = nthread
+        self.energies = np.zeros(len(self.parts), float)
+        if log.do_medium:
+            with log.section('FPINIT'):
+                log('Force part: %s' % self.name)
+                log.hline()
+                for part in self.parts:
+                    log('  %s' % part.name)
+                log('  threads:        %i' % self.nthread)
+                log.hline()
+
+    def _internal_compute(self, gpos, vtens):
+        profiler.annotate(nneigh=self.nlist.nneigh)
+        with timer.section('PP fused'):
+            self.energies[:] = pair_pot_compute_multi(
+                [part.pair_pot for part in self.parts],
+                [part.scalings.stab for part in self.parts],
+                self.nlist.neighs, gpos, vtens, self.nlist.nneigh,
+                self.nthread)
+            for part, energy in zip(self.parts, self.energies):
+                part.energy = energy
+            return self.energies.sum()
+
+    def compute_subset(self, iatoms):
+        '''See :meth:`yaff.pes.ff.ForcePartPair.compute_subset`'''
+        with timer.section('PP fused'):
+            energies = pair_pot_compute_multi(
+                [part.pair_pot for part in self.parts],
+                [part.scalings.stab for part in self.parts],
+                self.nlist.subset_neighs, None, None,
+                self.nlist.subset_nneigh)
+            return energies.sum()
 
 
 class ForcePartEwaldReciprocal(ForcePart):
@@ -369,7 +653,6 @@ class ForcePartEwaldReciprocal(ForcePart):
         self.gcut = gcut
         self.dielectric = dielectric
         self.update_gmax()
-        self.work = np.empty(system.natom*2)
         self.nlow, self.nhigh = check_nlow_nhigh(system, nlow, nhigh)
         if log.do_medium:
             with log.section('FPINIT'):
@@ -384,23 +667,251 @@ class ForcePartEwaldReciprocal(ForcePart):
     def update_gmax(self):
         '''This routine must be called after the attribute self.gmax is modified.'''
         self.gmax = np.ceil(self.gcut/self.system.cell.gspacings-0.5).astype(int)
+        self._rvecs = None
         if log.do_debug:
             with log.section('EWALD'):
                 log('gmax a,b,c   = %i,%i,%i' % tuple(self.gmax))
 
+    def update_kvecs(self):
+        '''Recompute the cached table of reciprocal vectors and prefactors.
+
+           The table only depends on the cell vectors and the Ewald parameters.
+           It is refreshed automatically when the cell vectors have changed.
+        '''
+        self.gints, self.kvecs, self.kfacs = compute_ewald_kvecs(
+            self.system.cell, self.alpha, self.gmax, self.gcut)
+        self.work = np.empty(get_ewald_work_size(self.system.natom, self.gmax))
+        self._rvecs = self.system.cell.rvecs.copy()
+        if log.do_debug:
+            with log.section('EWALD'):
+                log('Number of reciprocal vectors: %i' % len(self.kfacs))
+
     def update_rvecs(self, rvecs):
         '''See :meth:`yaff.pes.ff.ForcePart.update_rvecs`'''
         ForcePart.update_rvecs(self, rvecs)
         self.update_gmax()
 
+    def _check_kvecs(self):
+        # The cell may also be modified directly, without calling update_rvecs.
+        if self._rvecs is None or (self._rvecs != self.system.cell.rvecs).any():
+            self.update_gmax()
+            self.update_kvecs()
+
     def _internal_compute(self, gpos, vtens):
         with timer.section('Ewald reci.'):
+            self._check_kvecs()
             return compute_ewald_reci(
                 self.system.pos, self.system.charges, self.system.cell, self.alpha,
-                self.gmax, self.gcut, self.dielectric, gpos, self.work, vtens, self.nlow, self.nhigh
+                self.gmax, self.gints, self.kvecs, self.kfacs, self.dielectric,
+                gpos, self.work, vtens, self.nlow, self.nhigh
             )
 
 
+class ForcePartEwaldReciprocalPME(ForcePart):
+    '''The long-range contribution to the electrostatic interaction in 3D
+       periodic systems, computed with the smooth particle-mesh Ewald method.
+
+       The charges are spread on a regular grid in fractional coordinates with
+       cardinal B-splines, after which the reciprocal-space sum is evaluated
+       with fast Fourier transforms. The cost scales as O(N log N) instead of
+       O(N*N_k) for :class:`ForcePartEwaldReciprocal`, which makes this part
+       preferable for large systems. See Essmann et al., J. Chem. Phys. 103,
+       8577 (1995).
+    '''
+    def __init__(self, system, alpha, gcut=0.35, dielectric=1.0, nlow=0,
+                 nhigh=-1, order=6, gridsize=None):
+        '''
+           **Arguments:**
+
+           system
+                The system to which this interaction applies.
+
+           alpha
+                The alpha parameter in the Ewald summation method.
+
+           **Optional arguments:**
+
+           gcut
+                The cutoff in reciprocal space. This determines the default
+                size of the grid, such that all reciprocal vectors within gcut
+                are resolved. Contrary to :class:`ForcePartEwaldReciprocal`, all
+                reciprocal vectors compatible with the grid contribute.
+
+           dielectric
+                The scalar relative permittivity of the system.
+
+           nlow
+                Atom pairs are only included if at least one atom index is
+                higher than or equal to nlow. The default nlow=0 means no
+                exclusion.
+
+           nhigh
+                Atom pairs are only included if at least one atom index is
+                smaller than nhigh. The default nhigh=-1 means no exclusion.
+
+           order
+                The order of the B-splines used to spread the charges on the
+                grid. This must be an even number, at least 4.
+
+           gridsize
+                An array with three integers, the number of grid points along
+                each cell vector. When given, gcut is ignored.
+        '''
+        ForcePart.__init__(self, 'ewald_reci', system)
+        if not system.cell.nvec == 3:
+            raise TypeError('The system must have a 3D periodic cell.')
+        if system.charges is None:
+            raise ValueError('The system does not have charges.')
+        if order < 4 or order % 2 != 0:
+            raise ValueError('The B-spline order must be an even number, at least 4.')
+        self.system = system
+        self.alpha = alpha
+        self.gcut = gcut
+        self.dielectric = dielectric
+        self.order = order
+        if gridsize is None:
+            gmax = np.ceil(gcut/system.cell.gspacings-0.5).astype(int)
+            gridsize = [get_fft_size(max(2*g+1, order)) for g in gmax]
+        self.gridsize = np.array(gridsize, int)
+        if self.gridsize.shape != (3,) or (self.gridsize < order).any():
+            raise ValueError('The grid must have three dimensions with at least order points each.')
+        self.nlow, self.nhigh = check_nlow_nhigh(system, nlow, nhigh)
+        self._init_bspline_moduli()
+        self._rvecs = None
+        if log.do_medium:
+            with log.section('FPINIT'):
+                log('Force part: %s' % self.name)
+                log.hline()
+                log('  alpha:                 %s' % log.invlength(self.alpha))
+                log('  grid:                  %i x %i x %i' % tuple(self.gridsize))
+                log('  B-spline order:        %i' % self.order)
+                log('  relative permittivity: %5.3f' % self.dielectric)
+                log.hline()
+
+    def _compute_bsplines(self, w):
+        '''Compute the cardinal B-splines and their derivatives
+
+           **Arguments:**
+
+           w
+                An array with fractional parts of the scaled coordinates,
+                values in the interval [0, 1[.
+
+           **Returns:** two arrays, with one additional trailing axis compared
+           to w. The element j of the trailing axis contains M_n(w+j) and its
+           derivative, respectively.
+        '''
+        x = w[..., None] + np.arange(self.order)
+        theta = np.zeros(x.shape)
+        theta[..., 0] = 1.0
+        for n in range(2, self.order + 1):
+            shifted = np.zeros(x.shape)
+            shifted[..., 1:] = theta[..., :-1]
+            if n == self.order:
+                dtheta = theta - shifted
+            theta = (x*theta + (n-x)*shifted)/(n-1)
+        return theta, dtheta
+
+    def _init_bspline_moduli(self):
+        '''Precompute the squared moduli of the B-spline Fourier coefficients'''
+        theta0 = self._compute_bsplines(np.zeros(1))[0][0]
+        self.bsmoduli = []
+        for size in self.gridsize:
+            m = np.arange(size)
+            phases = np.exp(2j*np.pi*np.outer(m, np.arange(self.order-1))/size)
+            self.bsmoduli.append(1.0/abs(np.dot(phases, theta0[1:]))**2)
+
+    def update_rvecs(self, rvecs):
+        '''See :meth:`yaff.pes.ff.ForcePart.update_rvecs`'''
+        ForcePart.update_rvecs(self, rvecs)
+        self._rvecs = None
+
+    def _update_prefactors(self):
+        '''Recompute the cell-dependent factors on the (real FFT) grid'''
+        cell = self.system.cell
+        if self._rvecs is not None and (self._rvecs == cell.rvecs).all():
+            return
+        self._rvecs = cell.rvecs.copy()
+        # integer indices of the reciprocal vectors, last axis is halved
+        # because the charge grid is real.
+        ms = []
+        for size in self.gridsize[:2]:
+            m = np.arange(size)
+            ms.append(np.where(m > size//2, m - size, m))
+        ms.append(np.arange(self.gridsize[2]//2 + 1))
+        mgrid = np.meshgrid(*ms, indexing='ij')
+        self._mvecs = sum(mgrid[i][..., None]*cell.gvecs[i] for i in range(3))
+        msq = (self._mvecs**2).sum(axis=3)
+        msq[0, 0, 0] = 1.0
+        bfac = np.multiply.outer(np.multiply.outer(
+            self.bsmoduli[0], self.bsmoduli[1]), self.bsmoduli[2][:len(ms[2])])
+        # convolution kernel of the reciprocal sum, see Essmann1995
+        self._kernel = bfac*np.exp(-(np.pi/self.alpha)**2*msq)/(np.pi*cell.volume*msq)
+        self._kernel[0, 0, 0] = 0.0
+        # prefactor for the virial tensor
+        self._vfac = 2.0*(1.0/msq + (np.pi/self.alpha)**2)
+        # weights of the terms in the half-complex sum
+        self._weights = np.full(self._kernel.shape, 2.0)
+        self._weights[..., 0] = 1.0
+        if self.gridsize[2] % 2 == 0:
+            self._weights[..., -1] = 1.0
+
+    def _internal_compute(self, gpos, vtens):
+        with timer.section('Ewald PME'):
+            self._update_prefactors()
+            shape = tuple(self.gridsize)
+            size = np.prod(self.gridsize)
+            charges = self.system.charges
+            # B-spline weights and grid indices of all atoms
+            frac = np.dot(self.system.pos, self.system.cell.gvecs.T)*self.gridsize
+            ifrac = np.floor(frac)
+            theta, dtheta = self._compute_bsplines(frac - ifrac)
+            ks = (ifrac.astype(int)[..., None] - np.arange(self.order)) % self.gridsize[:, None]
+            indexes = (ks[:, 0, :, None, None]*shape[1] + ks[:, 1, None, :, None])*shape[2] + ks[:, 2, None, None, :]
+            spline = theta[:, 0, :, None, None]*theta[:, 1, None, :, None]*theta[:, 2, None, None, :]
+            # charge grids: the full system and the excluded subsystems
+            segments = [(0, self.system.natom, 1.0)]
+            if self.nlow > 0:
+                segments.append((0, self.nlow, -1.0))
+            if self.nhigh < self.system.natom:
+                segments.append((self.nhigh, self.system.natom, -1.0))
+            energy = 0.0
+            sfac = np.zeros(self._kernel.shape)
+            if gpos is not None:
+                pot = np.zeros((self.system.natom,) + spline.shape[1:])
+            for begin, end, sign in segments:
+                if begin == end:
+                    continue
+                qgrid = np.bincount(
+                    indexes[begin:end].ravel(),
+                    (charges[begin:end, None, None, None]*spline[begin:end]).ravel(),
+                    minlength=size
+                ).reshape(shape)
+                qfft = np.fft.rfftn(qgrid)
+                sfac += sign*(qfft.real**2 + qfft.imag**2)
+                if gpos is not None:
+                    # electrostatic potential on the grid
+                    phi = np.fft.irfftn(self._kernel*qfft, shape)*size
+                    if sign > 0:
+                        pot += phi.ravel()[indexes]
+                    else:
+                        pot[begin:end] -= phi.ravel()[indexes[begin:end]]
+            terms = 0.5*self._weights*self._kernel*sfac
+            energy = terms.sum()
+            if gpos is not None:
+                grad = np.zeros(frac.shape)
+                grad[:, 0] = (pot*dtheta[:, 0, :, None, None]*theta[:, 1, None, :, None]*theta[:, 2, None, None, :]).sum(axis=(1, 2, 3))
+                grad[:, 1] = (pot*theta[:, 0, :, None, None]*dtheta[:, 1, None, :, None]*theta[:, 2, None, None, :]).sum(axis=(1, 2, 3))
+                grad[:, 2] = (pot*theta[:, 0, :, None, None]*theta[:, 1, None, :, None]*dtheta[:, 2, None, None, :]).sum(axis=(1, 2, 3))
+                grad *= charges[:, None]*self.gridsize
+                gpos += np.dot(grad, self.system.cell.gvecs)/self.dielectric
+            if vtens is not None:
+                terms *= self._vfac
+                vtens += np.einsum('ijk,ijka,ijkb->ab', terms, self._mvecs, self._mvecs)/self.dielectric
+                vtens.ravel()[::4] -= energy/self.dielectric
+            return energy/self.dielectric
+
+
 class ForcePartEwaldReciprocalDD(ForcePart):
     '''The long-range contribution to the dipole-dipole
        electrostatic interaction in 3D periodic systems.
@@ -438,7 +949,6 @@ class ForcePartEwaldReciprocalDD(ForcePart):
         self.alpha = alpha
         self.gcut = gcut
         self.update_gmax()
-        self.work = np.empty(system.natom*2)
         self.nlow, self.nhigh = check_nlow_nhigh(system, nlow, nhigh)
         if log.do_medium:
             with log.section('FPINIT'):
@@ -452,20 +962,43 @@ class ForcePartEwaldReciprocalDD(ForcePart):
     def update_gmax(self):
         '''This routine must be called after the attribute self.gmax is modified.'''
         self.gmax = np.ceil(self.gcut/self.system.cell.gspacings-0.5).astype(int)
+        self._rvecs = None
         if log.do_debug:
             with log.section('EWALD'):
                 log('gmax a,b,c   = %i,%i,%i' % tuple(self.gmax))
 
+    def update_kvecs(self):
+        '''Recompute the cached table of reciprocal vectors and prefactors.
+
+           The table only depends on the cell vectors and the Ewald parameters.
+           It is refreshed automatically when the cell vectors have changed.
+        '''
+        self.gints, self.kvecs, self.kfacs = compute_ewald_kvecs(
+            self.system.cell, self.alpha, self.gmax, self.gcut)
+        self.work = np.empty(get_ewald_work_size(self.system.natom, self.gmax))
+        self._rvecs = self.system.cell.rvecs.copy()
+        if log.do_debug:
+            with log.section('EWALD'):
+                log('Number of reciprocal vectors: %i' % len(self.kfacs))
+
     def update_rvecs(self, rvecs):
         '''See :meth:`yaff.pes.ff.ForcePart.update_rvecs`'''
         ForcePart.update_rvecs(self, rvecs)
         self.update_gmax()
 
+    def _check_kvecs(self):
+        # The cell may also be modified directly, without calling update_rvecs.
+        if self._rvecs is None or (self._rvecs != self.system.cell.rvecs).any():
+            self.update_gmax()
+            self.update_kvecs()
+
     def _internal_compute(self, gpos, vtens):
         with timer.section('Ewald reci.'):
+            self._check_kvecs()
             return compute_ewald_reci_dd(
                 self.system.pos, self.system.charges, self.system.dipoles, self.system.cell, self.alpha,
-                self.gmax, self.gcut, gpos, self.work, vtens, self.nlow, self.nhigh
+                self.gmax, self.gints, self.kvecs, self.kfacs, gpos, self.work, vtens,
+                self.nlow, self.nhigh
             )
 
 
@@ -707,7 +1240,7 @@ class ForcePartValence(ForcePart):
        comes from the field of neural networks. More details can be found in the
        chapter, :ref:`dg_sec_backprop`.
     '''
-    def __init__(self, system, comlist=None):
+    def __init__(self, system, comlist=None, nthread=1):
         '''
            Parameters
            ----------
@@ -718,15 +1251,26 @@ class ForcePartValence(ForcePart):
                 An optional layer to derive centers of mass from the atomic positions.
                 These centers of mass are used as input for the first layer, the relative
                 vectors.
+           nthread
+                The number of OpenMP threads used to evaluate the three
+                layers. Each table is split in nthread contiguous parts and
+                the contributions of the threads to the gradients are
+                accumulated separately and added up at the end. The result is
+                the same as with one thread, up to round-off errors. This
+                attribute may also be changed after the construction of the
+                force part.
         '''
+        if nthread < 1:
+            raise ValueError('The number of threads must be at least one.')
         ForcePart.__init__(self, 'valence', system)
         self.comlist = comlist
-        self.dlist = DeltaList(system if comlist is None else comlist)
-        self.iclist = InternalCoordinateList(self.dlist)
-        self.vlist = ValenceList(self.iclist)
+        self.dlist = DeltaList(system if comlist is None else comlist, nthread)
+        self.iclist = InternalCoordinateList(self.dlist, nthread)
+        self.vlist = ValenceList(self.iclist, nthread)
         if log.do_medium:
             with log.section('FPINIT'):
                 log('Force part: %s' % self.name)
+                log('  threads:        %i' % self.nthread)
                 log.hline()
 
     def add_term(self, term):
@@ -746,6 +1290,18 @@ class ForcePartValence(ForcePart):
                 log('%7i&%s %s' % (self.vlist.nv, term.get_log(), ' '.join(ic.get_log() for ic in term.ics)))
         self.vlist.add_term(term)
 
+    def _get_nthread(self):
+        return self.vlist.nthread
+
+    def _set_nthread(self, nthread):
+        if nthread < 1:
+            raise ValueError('The number of threads must be at least one.')
+        self.dlist.nthread = nthread
+        self.iclist.nthread = nthread
+        self.vlist.nthread = nthread
+
+    nthread = property(_get_nthread, _set_nthread)
+
     def _internal_compute(self, gpos, vtens):
         with timer.section('Valence'):
             if self.comlist is not None:
@@ -969,7 +1525,7 @@ class ForcePartPressure(ForcePart):
 
 class ForcePartGrid(ForcePart):
     '''Energies obtained by grid interpolation.'''
-    def __init__(self, system, grids):
+    def __init__(self, system, grids, tricubic=False):
         '''
            **Arguments:**
 
@@ -978,36 +1534,108 @@ class ForcePartGrid(ForcePart):
 
            grids
                 A dictionary with (ffatype, grid) items. Each grid must be a
-                three-dimensional array with energies.
+                three-dimensional array with energies, or the filename of
+                such an array stored with ``numpy.save``. Files are
+                memory-mapped, such that a large grid is loaded only once
+                when several processes use it.
+
+           **Optional arguments:**
+
+           tricubic
+                When True, a tricubic interpolation with a continuous gradient
+                is used instead of a trilinear interpolation.
 
            This force part is only applicable to systems that are 3D periodic.
         '''
         if system.cell.nvec != 3:
             raise ValueError('The system must be 3d periodic for the grid term.')
+        grids = dict((ffatype, load_grid(grid)) for ffatype, grid in grids.items())
         for grid in grids.values():
             if grid.ndim != 3:
                 raise ValueError('The energy grids must be 3D numpy arrays.')
         ForcePart.__init__(self, 'grid', system)
         self.system = system
         self.grids = grids
+        self.tricubic = tricubic
+        # Atom indexes for each grid
+        self.iatoms = {}
+        for ffatype_id, ffatype in enumerate(system.ffatypes):
+            iatoms = (system.ffatype_ids == ffatype_id).nonzero()[0]
+            if len(iatoms) == 0:
+                continue
+            if ffatype not in grids:
+                raise ValueError('No energy grid for atom type %s.' % ffatype)
+            self.iatoms[ffatype] = iatoms
         if log.do_medium:
             with log.section('FPINIT'):
                 log('Force part: %s' % self.name)
+                log('  interpolation: %s' % ('tricubic' if tricubic else 'trilinear'))
                 log.hline()
 
     def _internal_compute(self, gpos, vtens):
         with timer.section('Grid'):
-            if gpos is not None:
-                raise NotImplementedError('Cartesian gradients are not supported yet in ForcePartGrid')
             if vtens is not None:
                 raise NotImplementedError('Cell deformation are not supported by ForcePartGrid')
             cell = self.system.cell
             result = 0
-            for i in range(self.system.natom):
-                grid = self.grids[self.system.get_ffatype(i)]
-                result += compute_grid3d(self.system.pos[i], cell, grid)
+            for ffatype, iatoms in self.iatoms.items():
+                result += compute_grid3d_multi(
+                    self.system.pos, iatoms, cell, self.grids[ffatype], gpos,
+                    self.tricubic)
+            return result
+
+    def compute_subset(self, iatoms):
+        '''See :meth:`yaff.pes.ff.ForcePart.compute_subset`'''
+        with timer.section('Grid'):
+            cell = self.system.cell
+            result = 0
+            for ffatype, my_iatoms in self.iatoms.items():
+                my_iatoms = np.intersect1d(my_iatoms, iatoms)
+                if len(my_iatoms) > 0:
+                    result += compute_grid3d_multi(
+                        self.system.pos, my_iatoms, cell, self.grids[ffatype],
+                        None, self.tricubic)
             return result
 
+    def compute_batch(self, iatoms, batch):
+        '''See :meth:`yaff.pes.ff.ForcePart.compute_batch`
+
+           All positions in the batch are interpolated with a single call per
+           atom type.
+        '''
+        with timer.section('Grid'):
+            iatoms = np.asarray(iatoms)
+            nbatch = len(batch)
+            pos = np.ascontiguousarray(batch, dtype=float).reshape(-1, 3)
+            energies = np.zeros((nbatch, len(iatoms)))
+            for ffatype, my_iatoms in self.iatoms.items():
+                columns = np.in1d(iatoms, my_iatoms).nonzero()[0]
+                if len(columns) == 0:
+                    continue
+                rows = (np.arange(nbatch)[:,None]*len(iatoms) + columns).ravel()
+                my_energies = np.zeros(len(rows))
+                compute_grid3d_multi(pos, rows, self.system.cell,
+                    self.grids[ffatype], None, self.tricubic, my_energies)
+                energies[:,columns] = my_energies.reshape(nbatch, len(columns))
+            return energies.sum(axis=1)
+
+
+def load_grid(grid):
+    '''Return a grid as a C-contiguous array of doubles
+
+       **Arguments:**
+
+       grid
+            A NumPy array, or the filename of an array stored with
+            ``numpy.save``. In the latter case, the file is memory-mapped in
+            read-only mode.
+    '''
+    if isinstance(grid, str):
+        grid = np.load(grid, mmap_mode='r')
+    if grid.dtype != float or not grid.flags.c_contiguous:
+        grid = np.ascontiguousarray(grid, dtype=float)
+    return grid
+
 
 class ForcePartTailCorrection(ForcePart):
     '''Corrections to energy and virial tensor to compensate for neglecting
@@ -1042,6 +1670,7 @@ class ForcePartTailCorrection(ForcePart):
         super(ForcePartTailCorrection, self).__init__('tailcorr_%s'%(part_pair.name), system)
         self.nlow, self.nhigh = check_nlow_nhigh(system, nlow, nhigh)
         self.ecorr, self.wcorr = part_pair.pair_pot.prepare_tailcorrections(system.natom, self.nlow, self.nhigh)
+        self.part_pair = part_pair
         self.system = system
         if log.do_medium:
             with log.section('FPINIT'):
@@ -1164,13 +1793,16 @@ class ForcePartEwaldReciprocalInteraction(ForcePart):
 
     def initialize(self):
         # Prepare the prefactors \frac{e^{-\frac{k^2}{4\alpha^2}}}{k^2}
+        # only for the reciprocal vectors within the cutoff. These are stored
+        # contiguously, such that the structure factors and the energy
+        # differences are computed with flat loops over nk vectors.
         self.update_gmax()
-        self.prefactors = np.zeros((2*self.gmax[0]+1,2*self.gmax[1]+1,self.gmax[2]+1))
-        compute_ewald_prefactors(self.cell, self.alpha, self.gmax, self.gcut,
-                self.prefactors)
+        self.gints, self.kvecs, self.prefactors = compute_ewald_kvecs(
+            self.cell, self.alpha, self.gmax, self.gcut)
         # Prepare the structure factors
         self.cosfacs = np.zeros(self.prefactors.shape)
         self.sinfacs = np.zeros(self.prefactors.shape)
+        self.work = np.zeros(0)
         self.rvecs0 = self.cell.rvecs.copy()
 
     def compute_structurefactors(self, pos, charges, cosfacs, sinfacs):
@@ -1181,6 +1813,8 @@ class ForcePartEwaldReciprocalInteraction(ForcePart):
 
            for the given coordinates and charges. The resulting real part is
            ADDED to cosfacs, the resulting imaginary part is ADDED to sinfacs.
+           Both arrays have the same shape as the prefactors, i.e. one entry
+           for each reciprocal vector in ``self.gints``.
         '''
         with timer.section('Ew.reci.SF'):
             if not np.all(self.cell.rvecs==self.rvecs0):
@@ -1188,8 +1822,11 @@ class ForcePartEwaldReciprocalInteraction(ForcePart):
                     with log.section('EWALDI'):
                         log('Cell change detected, reinitializing')
                 self.initialize()
-            compute_ewald_structurefactors(pos, charges, self.cell, self.alpha,
-                self.gmax, self.gcut, cosfacs, sinfacs)
+            size = get_ewald_work_size(len(pos), self.gmax)
+            if self.work.shape[0] < size:
+                self.work = np.zeros(size)
+            compute_ewald_structurefactors_kvecs(pos, charges, self.cell,
+                self.gmax, self.gints, cosfacs, sinfacs, self.work)
 
     def compute_deltae(self, cosfacs, sinfacs):
         '''Compute the energy difference arising if the provided structure
@@ -1254,6 +1891,20 @@ class ForcePartEwaldReciprocalInteraction(ForcePart):
         return 0.0
 
 
+def get_fft_size(n):
+    '''Return the smallest integer, not smaller than n, without prime factors
+       larger than 5. Such sizes are handled efficiently by FFT routines.
+    '''
+    while True:
+        m = n
+        for p in 2, 3, 5:
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
 def check_nlow_nhigh(system, nlow, nhigh):
     if nlow < 0:
         raise ValueError('nlow must be positive.')
@@ -40,8 +40,9 @@ from yaff.log import log
 from yaff.pes.ext import PairPotEI, PairPotLJ, PairPotMM3, PairPotMM3CAP, PairPotExpRep, \
     PairPotQMDFFRep, PairPotDampDisp, PairPotDisp68BJDamp, Switch3, PairPotEIDip, \
     PairPotLJCross
-from yaff.pes.ff import ForcePartPair, ForcePartValence, \
-    ForcePartEwaldReciprocal, ForcePartEwaldCorrection, \
+from yaff.pes.ff import ForcePartPair, ForcePartPairFused, ForcePartValence, \
+    ForcePartEwaldReciprocal, ForcePartEwaldReciprocalPME, \
+    ForcePartEwaldCorrection, \
     ForcePartEwaldNeutralizing, ForcePartTailCorrection, \
     ForcePartEwaldReciprocalInteraction
 from yaff.pes.iclist import Bond, BendAngle, BendCos, \
@@ -89,7 +90,8 @@ class FFArgs(object):
     '''
     def __init__(self, rcut=18.89726133921252, tr=Switch3(7.558904535685008),
                  alpha_scale=3.5, gcut_scale=1.1, skin=0, smooth_ei=False,
-                 reci_ei='ewald', nlow=0, nhigh=-1, tailcorrections=False):
+                 reci_ei='ewald', nlow=0, nhigh=-1, tailcorrections=False,
+                 cell_list=False, fuse_pairs=False):
         """
            **Optional arguments:**
 
@@ -124,11 +126,15 @@ class FFArgs(object):
            reci_ei
                 The method to be used for the reciprocal contribution to the
                 electrostatic interactions in the case of periodic systems. This
-                must be one of 'ignore' or 'ewald' or 'ewald_interaction'.
-                The options starting with 'ewald' are only supported for 3D
-                periodic systems. If 'ewald_interaction' is chosen, the
-                reciprocal contribution will not be included and it should be
-                accounted for by using the :class:`EwaldReciprocalInteraction`
+                must be one of 'ignore' or 'ewald' or 'ewald_interaction' or
+                'pme'. The options 'ewald', 'ewald_interaction' and 'pme' are
+                only supported for 3D periodic systems. If 'ewald_interaction'
+                is chosen, the reciprocal contribution will not be included and
+                it should be accounted for by using the
+                :class:`EwaldReciprocalInteraction`. If 'pme' is chosen, the
+                reciprocal contribution is computed with the particle-mesh
+                Ewald method, see :class:`ForcePartEwaldReciprocalPME`, which
+                is recommended for large systems.
 
            nlow
                 Interactions between atom pairs are only included if at least
@@ -151,6 +157,17 @@ class FFArgs(object):
                 pair potentials assuming the system is homogeneous in the
                 region where the truncation modifies the pair potential
 
+           cell_list
+                Boolean: if true, the neighbor list is rebuilt with cell lists
+                instead of scanning all atom pairs. This is recommended for
+                large systems. See :class:`yaff.pes.nlist.NeighborList`.
+
+           fuse_pairs
+                Boolean: if true, all pair potentials are computed in a single
+                pass over the neighbor list by one
+                :class:`yaff.pes.ff.ForcePartPairFused` object, instead of one
+                ``ForcePartPair`` object per pair potential.
+
            The actual value of gcut, which depends on both gcut_scale and
            alpha_scale, determines the computational cost of the reciprocal term
            in the Ewald summation. The default values are just examples. An
@@ -159,8 +176,8 @@ class FFArgs(object):
            that the numerical errors do not depend too much on the real space
            cutoff and the system size.
         """
-        if reci_ei not in ['ignore', 'ewald', 'ewald_interaction']:
-            raise ValueError('The reci_ei option must be one of \'ignore\' or \'ewald\' or \'ewald_interaction\'.')
+        if reci_ei not in ['ignore', 'ewald', 'ewald_interaction', 'pme']:
+            raise ValueError('The reci_ei option must be one of \'ignore\' or \'ewald\' or \'ewald_interaction\' or \'pme\'.')
         self.rcut = rcut
         self.tr = tr
         self.alpha_scale = alpha_scale
@@ -174,11 +191,13 @@ class FFArgs(object):
         self.nlow = nlow
         self.nhigh = nhigh
         self.tailcorrections = tailcorrections
+        self.cell_list = cell_list
+        self.fuse_pairs = fuse_pairs
 
     def get_nlist(self, system):
         if self.nlist is None:
             self.nlist = NeighborList(system, skin=self.skin, nlow=self.nlow,
-                            nhigh=self.nhigh)
+                            nhigh=self.nhigh, cell_list=self.cell_list)
         return self.nlist
 
     def get_part(self, ForcePartClass):
@@ -220,13 +239,15 @@ class FFArgs(object):
         if self.reci_ei == 'ignore':
             # Nothing to do
             pass
-        elif self.reci_ei.startswith('ewald'):
+        elif self.reci_ei.startswith('ewald') or self.reci_ei == 'pme':
             if system.cell.nvec == 3:
                 if self.reci_ei == 'ewald_interaction':
                     part_ewald_reci = ForcePartEwaldReciprocalInteraction(system.cell, alpha, self.gcut_scale*alpha, dielectric=dielectric)
                 elif self.reci_ei == 'ewald':
                     # Reciprocal-space electrostatics
                     part_ewald_reci = ForcePartEwaldReciprocal(system, alpha, self.gcut_scale*alpha, dielectric, self.nlow, self.nhigh)
+                elif self.reci_ei == 'pme':
+                    part_ewald_reci = ForcePartEwaldReciprocalPME(system, alpha, self.gcut_scale*alpha, dielectric, self.nlow, self.nhigh)
                 else: raise NotImplementedError
                 self.parts.append(part_ewald_reci)
                 # Ewald corrections
@@ -2224,6 +2245,17 @@ def apply_generators(system, parameters, ff_args):
         else:
             raise ValueError('Tail corrections not available for 1-D and 2-D periodic systems')
 
+    # If requested, replace all pair parts by a single fused part
+    if ff_args.fuse_pairs:
+        pair_parts = [
+            part for part in ff_args.parts
+            if isinstance(part, ForcePartPair) and not isinstance(part.pair_pot, PairPotEIDip)
+        ]
+        if len(pair_parts) > 1:
+            index = ff_args.parts.index(pair_parts[0])
+            ff_args.parts = [part for part in ff_args.parts if part not in pair_parts]
+            ff_args.parts.insert(index, ForcePartPairFused(system, ff_args.nlist, pair_parts))
+
     part_valence = ff_args.get_part(ForcePartValence)
     if part_valence is not None and log.do_warning:
         # Basic check for missing terms
@@ -73,3 +73,91 @@ double compute_grid3d(double* center, cell_type *cell, double* egrid, size_t* sh
     /* 100 */  (egrid[offset(1,0,0)]*frac[0] +
     /* 000 */   egrid[offset(0,0,0)]*(1-frac[0]))*(1-frac[1]))*(1-frac[2]);
 }
+
+
+static void grid_weights(double t, int tricubic, double* w, double* dw) {
+    // Interpolation weights, and their derivatives towards t, of the grid
+    // points that surround a point at a fractional distance t from the
+    // previous grid point.
+    if (tricubic) {
+        // Catmull-Rom spline, using grid points -1, 0, 1 and 2.
+        w[0] = 0.5*((-t + 2.0)*t - 1.0)*t;
+        w[1] = 0.5*((3.0*t - 5.0)*t*t + 2.0);
+        w[2] = 0.5*((-3.0*t + 4.0)*t + 1.0)*t;
+        w[3] = 0.5*(t - 1.0)*t*t;
+        dw[0] = 0.5*((-3.0*t + 4.0)*t - 1.0);
+        dw[1] = 0.5*(9.0*t - 10.0)*t;
+        dw[2] = 0.5*((-9.0*t + 8.0)*t + 1.0);
+        dw[3] = 0.5*(3.0*t - 2.0)*t;
+    } else {
+        // Linear interpolation, using grid points 0 and 1.
+        w[0] = 1.0 - t;
+        w[1] = t;
+        dw[0] = -1.0;
+        dw[1] = 1.0;
+    }
+}
+
+
+double compute_grid3d_multi(double* pos, long* iatoms, long natom, cell_type *cell,
+                            double* egrid, size_t* shape, double* gpos,
+                            double* energies, int tricubic) {
+    double frac[3], w[3][4], dw[3][4], gfrac[3], energy, e, g, w01, dw01[2];
+    size_t indexes[3][4], offset0, offset1;
+    long i, iatom, start, ibase;
+    int npoint, j, k0, k1, k2;
+
+    npoint = tricubic ? 4 : 2;
+    start = tricubic ? -1 : 0;
+    energy = 0.0;
+    for (i=0; i<natom; i++) {
+        iatom = iatoms[i];
+        cell_to_frac(cell, pos + 3*iatom, frac);
+        for (j=0; j<3; j++) {
+            // Move to ranges [0,1[ and convert to grid indexes
+            frac[j] -= floor(frac[j]);
+            frac[j] *= shape[j];
+            ibase = (long)floor(frac[j]);
+            grid_weights(frac[j] - ibase, tricubic, w[j], dw[j]);
+            for (k0=0; k0<npoint; k0++) {
+                indexes[j][k0] = (ibase + start + k0 + (long)shape[j]) % shape[j];
+            }
+        }
+        e = 0.0;
+        gfrac[0] = 0.0;
+        gfrac[1] = 0.0;
+        gfrac[2] = 0.0;
+        for (k0=0; k0<npoint; k0++) {
+            offset0 = indexes[0][k0]*shape[1];
+            for (k1=0; k1<npoint; k1++) {
+                offset1 = (offset0 + indexes[1][k1])*shape[2];
+                w01 = w[0][k0]*w[1][k1];
+                dw01[0] = dw[0][k0]*w[1][k1];
+                dw01[1] = w[0][k0]*dw[1][k1];
+                for (k2=0; k2<npoint; k2++) {
+                    g = egrid[offset1 + indexes[2][k2]];
+                    e += g*w01*w[2][k2];
+                    gfrac[0] += g*dw01[0]*w[2][k2];
+                    gfrac[1] += g*dw01[1]*w[2][k2];
+                    gfrac[2] += g*w01*dw[2][k2];
+                }
+            }
+        }
+        energy += e;
+        if (energies != NULL) {
+            energies[i] = e;
+        }
+        if (gpos != NULL) {
+            // Chain rule: grid coordinates -> fractional -> Cartesian
+            for (j=0; j<3; j++) {
+                gfrac[j] *= shape[j];
+            }
+            for (j=0; j<3; j++) {
+                gpos[3*iatom + j] += gfrac[0]*(*cell).gvecs[j] +
+                                     gfrac[1]*(*cell).gvecs[3 + j] +
+                                     gfrac[2]*(*cell).gvecs[6 + j];
+            }
+        }
+    }
+    return energy;
+}
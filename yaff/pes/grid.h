@@ -28,5 +28,8 @@
 #include <stddef.h>
 
 double compute_grid3d(double* center, cell_type *cell, double* egrid, size_t* shape);
+double compute_grid3d_multi(double* pos, long* iatoms, long natom, cell_type *cell,
+                            double* egrid, size_t* shape, double* gpos,
+                            double* energies, int tricubic);
 
 #endif
@@ -25,4 +25,7 @@
 cimport cell
 
 cdef extern from "grid.h":
-    double compute_grid3d(double* center, cell.cell_type *cell, double* egrid, size_t* shape)
+    double compute_grid3d(double* center, cell.cell_type *cell, double* egrid, size_t* shape) nogil
+    double compute_grid3d_multi(double* pos, long* iatoms, long natom, cell.cell_type *cell,
+                                double* egrid, size_t* shape, double* gpos,
+                                double* energies, bint tricubic) nogil
@@ -856,3 +856,70 @@ void iclist_back(dlist_row_type* deltas, iclist_row_type* ictab, long nic) {
     ic_back_fns[ictab[i].kind](ictab + i, deltas, ictab[i].value, ictab[i].grad);
   }
 }
+
+
+// Multithreaded evaluation
+// ------------------------
+//
+// The table is split into nthread contiguous chunks that are processed by
+// different OpenMP threads. In the forward step, each row only depends on the
+// delta list, such that the chunks are independent. In the back step, rows in
+// different chunks may contribute to the same relative vector. Therefore, each
+// thread except the first one works on a private copy of the relative vectors
+// (a slice of work with size ndelta), with gradients initialized to zero. These
+// gradients are added to the delta list at the end. When Yaff is compiled
+// without OpenMP support, the chunks are processed sequentially.
+
+void iclist_forward_parallel(dlist_row_type* deltas, iclist_row_type* ictab,
+                             long nic, int nthread) {
+  long ithread, begin, end;
+#ifdef _OPENMP
+  #pragma omp parallel for num_threads(nthread) schedule(static,1) private(begin, end)
+#endif
+  for (ithread=0; ithread<nthread; ithread++) {
+    begin = (nic*ithread)/nthread;
+    end = (nic*(ithread+1))/nthread;
+    iclist_forward(deltas, ictab + begin, end - begin);
+  }
+}
+
+void iclist_back_parallel(dlist_row_type* deltas, iclist_row_type* ictab,
+                          long nic, long ndelta, dlist_row_type* work,
+                          int nthread) {
+  long ithread, k, begin, end;
+  dlist_row_type *my_deltas;
+#ifdef _OPENMP
+  #pragma omp parallel for num_threads(nthread) schedule(static,1) private(k, begin, end, my_deltas)
+#endif
+  for (ithread=0; ithread<nthread; ithread++) {
+    begin = (nic*ithread)/nthread;
+    end = (nic*(ithread+1))/nthread;
+    if (ithread == 0) {
+      my_deltas = deltas;
+    } else {
+      // Only the relative vectors are copied. The gradients in the original
+      // delta list are being updated by the first thread.
+      my_deltas = work + ndelta*(ithread-1);
+      for (k=0; k<ndelta; k++) {
+        my_deltas[k].dx = deltas[k].dx;
+        my_deltas[k].dy = deltas[k].dy;
+        my_deltas[k].dz = deltas[k].dz;
+        my_deltas[k].gx = 0.0;
+        my_deltas[k].gy = 0.0;
+        my_deltas[k].gz = 0.0;
+      }
+    }
+    iclist_back(my_deltas, ictab + begin, end - begin);
+  }
+  // Reduction of the gradients.
+#ifdef _OPENMP
+  #pragma omp parallel for num_threads(nthread) private(ithread)
+#endif
+  for (k=0; k<ndelta; k++) {
+    for (ithread=1; ithread<nthread; ithread++) {
+      deltas[k].gx += work[ndelta*(ithread-1) + k].gx;
+      deltas[k].gy += work[ndelta*(ithread-1) + k].gy;
+      deltas[k].gz += work[ndelta*(ithread-1) + k].gz;
+    }
+  }
+}
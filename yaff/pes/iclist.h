@@ -39,5 +39,10 @@ typedef struct {
 
 void iclist_forward(dlist_row_type* deltas, iclist_row_type* ictab, long nic);
 void iclist_back(dlist_row_type* deltas, iclist_row_type* ictab, long nic);
+void iclist_forward_parallel(dlist_row_type* deltas, iclist_row_type* ictab,
+                             long nic, int nthread);
+void iclist_back_parallel(dlist_row_type* deltas, iclist_row_type* ictab,
+                          long nic, long ndelta, dlist_row_type* work,
+                          int nthread);
 
 #endif
@@ -31,5 +31,10 @@ cdef extern from "iclist.h":
         long i0, sign0, i1, sign1, i2, sign2, i3, sign3
         double value, grad
 
-    void iclist_forward(dlist.dlist_row_type* deltas, iclist_row_type* ictab, long nic)
-    void iclist_back(dlist.dlist_row_type* deltas, iclist_row_type* ictab, long nic)
+    void iclist_forward(dlist.dlist_row_type* deltas, iclist_row_type* ictab, long nic) nogil
+    void iclist_back(dlist.dlist_row_type* deltas, iclist_row_type* ictab, long nic) nogil
+    void iclist_forward_parallel(dlist.dlist_row_type* deltas, iclist_row_type* ictab,
+                                 long nic, int nthread) nogil
+    void iclist_back_parallel(dlist.dlist_row_type* deltas, iclist_row_type* ictab,
+                              long nic, long ndelta, dlist.dlist_row_type* work,
+                              int nthread) nogil
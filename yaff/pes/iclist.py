@@ -79,17 +79,24 @@ class InternalCoordinateList(object):
        field. All computations related to internal coordinates are carried out
        in coordination with a ``DeltaList`` object.
     """
-    def __init__(self, dlist):
+    def __init__(self, dlist, nthread=1):
         """
            **Arugments:**
 
            dlist
                 An instance of the ``DeltaList`` class.
+
+           **Optional arguments:**
+
+           nthread
+                The number of OpenMP threads used in the forward and back
+                steps. Each thread processes a contiguous part of the table.
         """
         self.dlist = dlist
         self.ictab = np.zeros(10, iclist_dtype)
         self.lookup = {}
         self.nic = 0
+        self.nthread = nthread
 
     def add_ic(self, ic):
         '''Register a new or find an existing internal coordinate.
@@ -130,7 +137,10 @@ class InternalCoordinateList(object):
 
            The actual computation is carried out by a low-level C routine.
         """
-        iclist_forward(self.dlist.deltas, self.ictab, self.nic)
+        if self.nthread > 1:
+            iclist_forward(self.dlist.deltas, self.ictab, self.nic, nthread=self.nthread)
+        else:
+            iclist_forward(self.dlist.deltas, self.ictab, self.nic)
 
     def back(self):
         """Transform the derivative of the energy (in ``self.ictab``) to
@@ -139,7 +149,10 @@ class InternalCoordinateList(object):
 
            The actual computation is carried out by a low-level C routine.
         """
-        iclist_back(self.dlist.deltas, self.ictab, self.nic)
+        if self.nthread > 1:
+            iclist_back(self.dlist.deltas, self.ictab, self.nic, nthread=self.nthread)
+        else:
+            iclist_back(self.dlist.deltas, self.ictab, self.nic)
 
     def lookup_atoms(self, row):
         """Look up the atom for a given row index."""
@@ -23,6 +23,7 @@
 
 
 #include <math.h>
+#include <stdlib.h>
 #include "nlist.h"
 #include "cell.h"
 
@@ -134,6 +135,271 @@ int nlist_build_low(double *pos, double rcut, long *rmax,
 
 
 
+static int nlist_half_image(long *r) {
+  // Returns 1 if r is the central image or belongs to the half of the periodic
+  // images that is visited by nlist_inc_r. Returns 0 otherwise.
+  if (r[2] != 0) return r[2] > 0;
+  if (r[1] != 0) return r[1] > 0;
+  return r[0] >= 0;
+}
+
+
+static int nlist_cmp_rows(const void *p0, const void *p1) {
+  // Sort rows belonging to the same center atom in the same order as they
+  // are generated by nlist_build_low: (i) by the other atom index, (ii) by
+  // the image in the order of nlist_inc_r and (iii) by the sign.
+  const neigh_row_type *row0 = (const neigh_row_type*) p0;
+  const neigh_row_type *row1 = (const neigh_row_type*) p1;
+  long other0, other1;
+  other0 = ((*row0).a < (*row0).b) ? (*row0).a : (*row0).b;
+  other1 = ((*row1).a < (*row1).b) ? (*row1).a : (*row1).b;
+  if (other0 != other1) return (other0 < other1) ? -1 : 1;
+  if ((*row0).r2 != (*row1).r2) return ((*row0).r2 < (*row1).r2) ? -1 : 1;
+  if ((*row0).r1 != (*row1).r1) return ((*row0).r1 < (*row1).r1) ? -1 : 1;
+  if ((*row0).r0 != (*row1).r0) return ((*row0).r0 < (*row1).r0) ? -1 : 1;
+  other0 = (*row0).a < (*row0).b;
+  other1 = (*row1).a < (*row1).b;
+  if (other0 != other1) return (other0 < other1) ? -1 : 1;
+  return 0;
+}
+
+
+int nlist_build_cells_low(double *pos, double rcut, long *rmax,
+                          cell_type *unitcell, long *status,
+                          neigh_row_type *neighs, long natom, long nlow,
+                          long nhigh, long nneigh) {
+  // Same functionality as nlist_build_low, but atoms are first sorted into
+  // bins (cell lists) in fractional coordinates, such that only nearby bins
+  // need to be scanned for neighbors. Non-periodic directions are binned in
+  // the range covered by the atoms. The rows of one center atom are sorted
+  // afterwards, which results in exactly the same neighbor list as
+  // nlist_build_low.
+  //
+  // When the neighs array is full, the rows of the current center atom are
+  // discarded and the scan will be resumed with that atom in the next call.
+
+  long a, b, i, k, row, row_begin, nbin_tot, ibin_other, c[3], o[3], bin[3], image[3], r[3];
+  long nbin[3], nstencil[3], *ibin, *bin_start, *bin_fill, *bin_atoms;
+  int nvec, sign, ok, result;
+  double *frac, *rvecs, *gvecs, smin[3], smax[3], ds[3], v[3], delta0[3], delta[3];
+  double d, rcut2, rsearch2, x;
+
+  nvec = (*unitcell).nvec;
+  rvecs = (*unitcell).rvecs;
+  gvecs = (*unitcell).gvecs;
+  rcut2 = rcut*rcut;
+  // Slightly larger cutoff for the screening of candidate pairs, to make
+  // sure no pairs are lost due to round-off errors in fractional coordinates.
+  rsearch2 = rcut2*(1.0 + 1e-8);
+
+  frac = malloc(3*natom*sizeof(double));
+  ibin = malloc(natom*sizeof(long));
+  bin_atoms = malloc(natom*sizeof(long));
+  bin_start = NULL;
+  bin_fill = NULL;
+  result = -1;
+  if ((frac == NULL) || (ibin == NULL) || (bin_atoms == NULL)) goto cleanup;
+
+  // 1) Compute fractional coordinates. Periodic directions are wrapped in
+  //    the interval [0,1[.
+  for (k=0; k<3; k++) {
+    smin[k] = 0.0;
+    smax[k] = 0.0;
+  }
+  for (a=0; a<natom; a++) {
+    for (k=0; k<3; k++) {
+      x = gvecs[3*k]*pos[3*a] + gvecs[3*k+1]*pos[3*a+1] + gvecs[3*k+2]*pos[3*a+2];
+      if (k < nvec) {
+        x -= floor(x);
+      } else if (a == 0) {
+        smin[k] = x;
+        smax[k] = x;
+      } else {
+        if (x < smin[k]) smin[k] = x;
+        if (x > smax[k]) smax[k] = x;
+      }
+      frac[3*a+k] = x;
+    }
+  }
+
+  // 2) Determine the number of bins along each direction. In periodic
+  //    directions, the bins are at least rcut/2 wide (measured perpendicular
+  //    to the other directions), such that neighbors are found within two
+  //    bins. This reduces the number of candidate pairs compared to bins of
+  //    width rcut. When a periodic direction is too short, more bins are
+  //    scanned to cover the periodic images. In non-periodic directions, the
+  //    bins are at least rcut wide.
+  for (k=0; k<3; k++) {
+    if (k < nvec) {
+      nbin[k] = (long)floor(2*(*unitcell).rspacings[k]/rcut);
+    } else {
+      nbin[k] = (long)floor((smax[k] - smin[k])/rcut) + 1;
+    }
+    if (nbin[k] < 1) nbin[k] = 1;
+  }
+  // Avoid excessive numbers of (mostly empty) bins in sparse systems.
+  while (nbin[0]*nbin[1]*nbin[2] > 4*natom + 64) {
+    k = 0;
+    if (nbin[1] > nbin[k]) k = 1;
+    if (nbin[2] > nbin[k]) k = 2;
+    nbin[k] = (nbin[k] + 1)/2;
+  }
+  for (k=0; k<3; k++) {
+    if (k < nvec) {
+      nstencil[k] = (long)ceil(rcut*nbin[k]/(*unitcell).rspacings[k]);
+    } else {
+      nstencil[k] = 1;
+    }
+  }
+  nbin_tot = nbin[0]*nbin[1]*nbin[2];
+
+  // 3) Sort the atoms into the bins (counting sort, atoms remain sorted
+  //    within each bin).
+  bin_start = malloc((nbin_tot + 1)*sizeof(long));
+  if (bin_start == NULL) goto cleanup;
+  for (i=0; i<=nbin_tot; i++) bin_start[i] = 0;
+  for (a=0; a<natom; a++) {
+    for (k=0; k<3; k++) {
+      if (k < nvec) {
+        c[k] = (long)floor(frac[3*a+k]*nbin[k]);
+      } else {
+        c[k] = (long)floor((frac[3*a+k] - smin[k])/(smax[k] - smin[k] + rcut)*nbin[k]);
+      }
+      if (c[k] < 0) c[k] = 0;
+      if (c[k] >= nbin[k]) c[k] = nbin[k] - 1;
+    }
+    ibin[a] = (c[0]*nbin[1] + c[1])*nbin[2] + c[2];
+    bin_start[ibin[a]+1]++;
+  }
+  for (i=0; i<nbin_tot; i++) bin_start[i+1] += bin_start[i];
+  bin_fill = malloc(nbin_tot*sizeof(long));
+  if (bin_fill == NULL) goto cleanup;
+  for (i=0; i<nbin_tot; i++) bin_fill[i] = bin_start[i];
+  for (a=0; a<natom; a++) {
+    bin_atoms[bin_fill[ibin[a]]] = a;
+    bin_fill[ibin[a]]++;
+  }
+
+  // 4) Loop over all center atoms, starting from the status. The center atom
+  //    always has the highest index of the pair, such that each pair is
+  //    found only once.
+  row = 0;
+  r[0] = 0;
+  r[1] = 0;
+  r[2] = 0;
+  for (a=status[3]; a<natom; a++) {
+    row_begin = row;
+    c[2] = ibin[a]%nbin[2];
+    c[1] = (ibin[a]/nbin[2])%nbin[1];
+    c[0] = ibin[a]/(nbin[1]*nbin[2]);
+    for (o[0]=-nstencil[0]; o[0]<=nstencil[0]; o[0]++) {
+    for (o[1]=-nstencil[1]; o[1]<=nstencil[1]; o[1]++) {
+    for (o[2]=-nstencil[2]; o[2]<=nstencil[2]; o[2]++) {
+      // Find the neighboring bin and the corresponding periodic image.
+      ok = 1;
+      for (k=0; k<3; k++) {
+        bin[k] = c[k] + o[k];
+        if (k < nvec) {
+          image[k] = (long)floor(((double)bin[k])/nbin[k]);
+          bin[k] -= image[k]*nbin[k];
+        } else {
+          image[k] = 0;
+          if ((bin[k] < 0) || (bin[k] >= nbin[k])) ok = 0;
+        }
+      }
+      if (!ok) continue;
+      ibin_other = (bin[0]*nbin[1] + bin[1])*nbin[2] + bin[2];
+      for (i=bin_start[ibin_other]; i<bin_start[ibin_other+1]; i++) {
+        b = bin_atoms[i];
+        // Atoms in a bin are sorted, so all remaining atoms have b > a.
+        if (b > a) break;
+        if ((b == a) && (image[0] == 0) && (image[1] == 0) && (image[2] == 0)) continue;
+        if (!((a>=nlow && b<nhigh) || (b>=nlow && a<nhigh))) continue;
+        // Quick screening with the relative vector from fractional
+        // coordinates.
+        for (k=0; k<3; k++) ds[k] = frac[3*b+k] + image[k] - frac[3*a+k];
+        v[0] = ds[0]*rvecs[0] + ds[1]*rvecs[3] + ds[2]*rvecs[6];
+        v[1] = ds[0]*rvecs[1] + ds[1]*rvecs[4] + ds[2]*rvecs[7];
+        v[2] = ds[0]*rvecs[2] + ds[1]*rvecs[5] + ds[2]*rvecs[8];
+        if (v[0]*v[0] + v[1]*v[1] + v[2]*v[2] >= rsearch2) continue;
+        // Express the relative vector as the minimum image plus an
+        // integer linear combination of cell vectors.
+        delta0[0] = pos[3*b  ] - pos[3*a  ];
+        delta0[1] = pos[3*b+1] - pos[3*a+1];
+        delta0[2] = pos[3*b+2] - pos[3*a+2];
+        cell_mic(delta0, unitcell);
+        for (k=0; k<nvec; k++) {
+          r[k] = (long)floor(
+            gvecs[3*k  ]*(v[0] - delta0[0]) +
+            gvecs[3*k+1]*(v[1] - delta0[1]) +
+            gvecs[3*k+2]*(v[2] - delta0[2]) + 0.5);
+        }
+        // Only one of both images r and -r is stored, as in nlist_build_low.
+        if (nlist_half_image(r)) {
+          sign = 1;
+        } else {
+          if (b == a) continue;
+          sign = -1;
+          r[0] = -r[0];
+          r[1] = -r[1];
+          r[2] = -r[2];
+        }
+        ok = 1;
+        for (k=0; k<nvec; k++) {
+          if ((r[k] > rmax[k]) || (r[k] < -rmax[k])) ok = 0;
+        }
+        if (!ok) continue;
+        // Construct delta exactly as in nlist_build_low.
+        delta[0] = sign*delta0[0];
+        delta[1] = sign*delta0[1];
+        delta[2] = sign*delta0[2];
+        cell_add_vec(delta, unitcell, r);
+        d = delta[0]*delta[0] + delta[1]*delta[1] + delta[2]*delta[2];
+        if (d < rcut2) {
+          if (row >= nneigh) {
+            // Out of space, resume with this center atom in the next call.
+            status[3] = a;
+            status[6] += row_begin;
+            result = 0;
+            goto cleanup;
+          }
+          if (sign > 0) {
+            neighs[row].a = a;
+            neighs[row].b = b;
+          } else {
+            neighs[row].a = b;
+            neighs[row].b = a;
+          }
+          neighs[row].d = sqrt(d);
+          neighs[row].dx = delta[0];
+          neighs[row].dy = delta[1];
+          neighs[row].dz = delta[2];
+          neighs[row].r0 = r[0];
+          neighs[row].r1 = r[1];
+          neighs[row].r2 = r[2];
+          row++;
+        }
+      }
+    }
+    }
+    }
+    qsort(neighs + row_begin, row - row_begin, sizeof(neigh_row_type), nlist_cmp_rows);
+  }
+  // Completely done.
+  status[3] = natom;
+  status[6] += row;
+  result = 1;
+
+cleanup:
+  free(frac);
+  free(ibin);
+  free(bin_atoms);
+  free(bin_start);
+  free(bin_fill);
+  return result;
+}
+
+
 int nlist_inc_r(cell_type *unitcell, long *r, long *rmax) {
   // increment the counters for the periodic images.
   // returns 1 when the counters were incremented successfully.
@@ -181,7 +447,7 @@ endloop:
 
 
 void nlist_recompute_low(double *pos, double *pos_old, cell_type* unitcell,
-                         neigh_row_type *neighs, long nneigh) {
+                         neigh_row_type *neighs, long nneigh, int *moved) {
   long i, a, b;
   int update_delta0;
   long center[3];
@@ -192,6 +458,11 @@ void nlist_recompute_low(double *pos, double *pos_old, cell_type* unitcell,
   b = -1;
 
   for (i=nneigh-1; i>=0; i--) {
+    // Skip pairs of atoms that did not move since the previous update.
+    if ((moved != NULL) && (!moved[(*neighs).a]) && (!moved[(*neighs).b])) {
+      neighs++;
+      continue;
+    }
     if ((*neighs).a != a) {
       update_delta0 = 1;
     } else if ((*neighs).b != b) {
@@ -230,3 +501,103 @@ void nlist_recompute_low(double *pos, double *pos_old, cell_type* unitcell,
     neighs++;
   }
 }
+
+
+static long nlist_subset_pair(double *pos, double rcut2, long *rmax,
+                              cell_type *unitcell, neigh_row_type *neighs,
+                              long a, long b, long row, long nneigh) {
+  // Adds the rows for all periodic images of the pair (a, b) within the
+  // cutoff to the neighs array, starting at the given row. Rows that do not
+  // fit in the array are only counted. Returns the new number of rows.
+  long k, r[3], rlow[3], rhigh[3];
+  double delta0[3], delta[3], d;
+  // Compute the relative vector, using the minimum image convention.
+  delta0[0] = pos[3*b  ] - pos[3*a  ];
+  delta0[1] = pos[3*b+1] - pos[3*a+1];
+  delta0[2] = pos[3*b+2] - pos[3*a+2];
+  cell_mic(delta0, unitcell);
+  // Visit all periodic images in the range given by rmax.
+  for (k=0; k<3; k++) {
+    if (k < (*unitcell).nvec) {
+      rlow[k] = -rmax[k];
+      rhigh[k] = rmax[k];
+    } else {
+      rlow[k] = 0;
+      rhigh[k] = 0;
+    }
+  }
+  for (r[2]=rlow[2]; r[2]<=rhigh[2]; r[2]++) {
+    for (r[1]=rlow[1]; r[1]<=rhigh[1]; r[1]++) {
+      for (r[0]=rlow[0]; r[0]<=rhigh[0]; r[0]++) {
+        if (a == b) {
+          // Only add self-interactions with atoms in periodic images, and
+          // only for one of the two images related by inversion.
+          if ((r[0] == 0) && (r[1] == 0) && (r[2] == 0)) continue;
+          if (!nlist_half_image(r)) continue;
+        }
+        delta[0] = delta0[0];
+        delta[1] = delta0[1];
+        delta[2] = delta0[2];
+        cell_add_vec(delta, unitcell, r);
+        d = delta[0]*delta[0] + delta[1]*delta[1] + delta[2]*delta[2];
+        if (d < rcut2) {
+          if (row < nneigh) {
+            neighs[row].a = a;
+            neighs[row].b = b;
+            neighs[row].d = sqrt(d);
+            neighs[row].dx = delta[0];
+            neighs[row].dy = delta[1];
+            neighs[row].dz = delta[2];
+            neighs[row].r0 = r[0];
+            neighs[row].r1 = r[1];
+            neighs[row].r2 = r[2];
+          }
+          row++;
+        }
+      }
+    }
+  }
+  return row;
+}
+
+
+long nlist_build_subset_low(double *pos, double rcut, long *rmax,
+                            cell_type *unitcell, long *iatoms, long nsubset,
+                            int *insubset, neigh_row_type *neighs, long natom,
+                            long nlow, long nhigh, long nneigh) {
+  // Builds the part of the neighbor list that contains all pairs in which at
+  // least one atom belongs to a subset. The subset is given by the sorted
+  // array iatoms and by insubset, which is non-zero for all atoms in the
+  // subset. Only one pass over the other atoms is needed, such that the cost
+  // scales linearly with the size of the subset.
+  //
+  // The rows have the same format as in nlist_build_low: for pairs in the
+  // same image, a > b and the rows are sorted by a and then by b, such that
+  // the scaling table can be used in pair_pot_compute. The number of rows is
+  // returned. When this is larger than nneigh, the neighs array was too small
+  // and the remaining rows were discarded.
+  long a, b, k, row;
+  double rcut2;
+  rcut2 = rcut*rcut;
+  row = 0;
+  for (a=0; a<natom; a++) {
+    if (insubset[a]) {
+      // Pairs with all atoms up to a.
+      for (b=0; b<=a; b++) {
+        if ((a>=nlow && b<nhigh) || (b>=nlow && a<nhigh)) {
+          row = nlist_subset_pair(pos, rcut2, rmax, unitcell, neighs, a, b, row, nneigh);
+        }
+      }
+    } else {
+      // Only pairs with atoms from the subset that come before a.
+      for (k=0; k<nsubset; k++) {
+        b = iatoms[k];
+        if (b >= a) break;
+        if ((a>=nlow && b<nhigh) || (b>=nlow && a<nhigh)) {
+          row = nlist_subset_pair(pos, rcut2, rmax, unitcell, neighs, a, b, row, nneigh);
+        }
+      }
+    }
+  }
+  return row;
+}
@@ -38,8 +38,17 @@ int nlist_build_low(double *pos, double rcut, long *rmax, cell_type *unitcell,
                     long *nlist_status, neigh_row_type *neighs, long pos_size,
                     long nlow, long nhigh, long nneigh);
 
+int nlist_build_cells_low(double *pos, double rcut, long *rmax, cell_type *unitcell,
+                          long *nlist_status, neigh_row_type *neighs, long pos_size,
+                          long nlow, long nhigh, long nneigh);
+
 void nlist_recompute_low(double *pos, double *pos_old, cell_type* unitcell,
-                         neigh_row_type *neighs, long nneigh);
+                         neigh_row_type *neighs, long nneigh, int *moved);
+
+long nlist_build_subset_low(double *pos, double rcut, long *rmax,
+                            cell_type *unitcell, long *iatoms, long nsubset,
+                            int *insubset, neigh_row_type *neighs, long natom,
+                            long nlow, long nhigh, long nneigh);
 
 int nlist_inc_r(cell_type *unitcell, long *r, long *rmax);
 
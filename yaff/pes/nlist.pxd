@@ -34,9 +34,19 @@ cdef extern from "nlist.h":
 
     bint nlist_build_low(double *pos, double rcut, long *rmax,
                          cell.cell_type* cell, long *nlist_status,
-                         neigh_row_type *neighs, long pos_size, long nlow, long nhigh, long nneigh)
+                         neigh_row_type *neighs, long pos_size, long nlow, long nhigh, long nneigh) nogil
+
+    int nlist_build_cells_low(double *pos, double rcut, long *rmax,
+                              cell.cell_type* cell, long *nlist_status,
+                              neigh_row_type *neighs, long pos_size, long nlow, long nhigh, long nneigh) nogil
 
     void nlist_recompute_low(double *pos, double *pos_old, cell.cell_type*
-                             unitcell, neigh_row_type *neighs, long nneigh)
+                             unitcell, neigh_row_type *neighs, long nneigh, int *moved) nogil
+
+    long nlist_build_subset_low(double *pos, double rcut, long *rmax,
+                                cell.cell_type* unitcell, long *iatoms,
+                                long nsubset, int *insubset,
+                                neigh_row_type *neighs, long natom, long nlow,
+                                long nhigh, long nneigh) nogil
 
     bint nlist_inc_r(cell.cell_type *unitcell, long *r, long *rmax)
@@ -36,16 +36,32 @@
    The ``NeighborList`` object contains algorithms to detect whether a full rebuild
    of the neighbor list is required, or whether a recomputation of the distances
    and relative vectors is sufficient.
+
+   A full rebuild either scans all atom pairs, which is the default, or uses
+   cell lists, which is recommended for large systems. In the incremental mode,
+   a recomputation only considers pairs with atoms that moved since the
+   previous update.
+
+   For Monte Carlo simulations, the pairs that involve a small subset of the
+   atoms can also be searched separately, without touching the main neighbor
+   list. See :meth:`NeighborList.update_subset`.
+
+   The number of rebuilds and recomputations, the reasons for the rebuilds and
+   the time spent in both are recorded, which is useful to tune the skin
+   parameter. See :meth:`NeighborList.get_stats`.
 '''
 
 
 from __future__ import division
 
+import time
+
 import numpy as np
 
-from yaff.log import log, timer
+from yaff.log import log, timer, profiler
 from yaff.pes.ext import neigh_dtype, nlist_status_init,\
-        nlist_status_finish, nlist_build, nlist_recompute
+        nlist_status_finish, nlist_build, nlist_build_cells, nlist_build_subset, \
+        nlist_recompute
 
 
 __all__ = ['NeighborList','BondedNeighborList']
@@ -54,7 +70,8 @@ __all__ = ['NeighborList','BondedNeighborList']
 class NeighborList(object):
     '''Algorithms to keep track of all pair distances below a given rcut
     '''
-    def __init__(self, system, skin=0, nlow=0, nhigh=-1):
+    def __init__(self, system, skin=0, nlow=0, nhigh=-1, cell_list=False,
+                 incremental=False):
         """
            **Arguments:**
 
@@ -89,6 +106,25 @@ class NeighborList(object):
                 pairs involving one atom of each part will be included. This is
                 useful to calculate interaction energies in Monte Carlo
                 simulations
+
+            cell_list
+                When set to True, the atoms are sorted into bins (cell lists)
+                during a rebuild, such that only pairs of atoms in nearby bins
+                are considered. The cost of a rebuild then scales linearly
+                with the number of atoms instead of quadratically. The
+                resulting neighbor list is exactly the same. This is
+                recommended for systems with more than a few thousand atoms.
+
+            incremental
+                When set to True, the displacement of each atom since the last
+                rebuild is tracked and a rebuild is only carried out when the
+                largest displacement exceeds half the skin. (This is less
+                conservative than the default criterion, which also accounts
+                for the number of periodic images.) In between rebuilds, only
+                the pairs that contain at least one atom that moved since the
+                previous update are recomputed. This is very efficient in
+                Monte Carlo simulations, where only a few atoms are moved in
+                each step. This option has no effect when skin is zero.
         """
         if skin < 0:
             raise ValueError('The skin parameter must be positive.')
@@ -100,6 +136,9 @@ class NeighborList(object):
         # the neighborlist:
         self.neighs = np.empty(10, dtype=neigh_dtype)
         self.nneigh = 0
+        # the pairs involving a subset of the atoms, see update_subset:
+        self.subset_neighs = np.empty(10, dtype=neigh_dtype)
+        self.subset_nneigh = 0
         self.rmax = None
         if nlow < 0:
             raise ValueError('nlow must be a positive number, received %d.'%nlow)
@@ -107,9 +146,14 @@ class NeighborList(object):
         if nhigh < self.nlow:
             raise ValueError('nhigh must not be smaller than nlow, received %d.'%nhigh)
         self.nhigh = nhigh
+        self.cell_list = cell_list
+        self.incremental = incremental
         # for skin algorithm:
         self._pos_old = None
         self.rebuild_next = False
+        # for the incremental algorithm, positions at the previous update:
+        self._pos_last = None
+        self.reset_stats()
 
     def request_rcut(self, rcut):
         """Make sure the internal rcut parameter is at least is high as rcut."""
@@ -152,10 +196,13 @@ class NeighborList(object):
            neighbor lists array is reallocated if needed. The memory allocation
            is done in Python for convenience.
         '''
-        with log.section('NLIST'), timer.section('Nlists'):
+        with log.section('NLIST'), timer.section('Nlists'), profiler.section('NeighborList'):
             assert self.rcut > 0
 
-            if self._need_rebuild():
+            self.nupdate += 1
+            reason = self._need_rebuild()
+            time0 = time.time()
+            if reason is not None:
                 # *rebuild* the entire neighborlist
                 if self.system.cell.volume != 0:
                     if self.system.natom/self.system.cell.volume > 10:
@@ -167,34 +214,96 @@ class NeighborList(object):
                 # for excluded atom pairs in the neighbourlist build
                 status[3] = self.nlow
                 # 2) a loop of consecutive update/allocate calls
+                if self.cell_list:
+                    build = nlist_build_cells
+                else:
+                    build = nlist_build
                 last_start = 0
                 while True:
-                    done = nlist_build(
+                    done = build(
                         self.system.pos, self.rcut + self.skin, self.rmax,
                         self.system.cell, status, self.neighs[last_start:], self.nlow, self.nhigh
                     )
                     if done:
                         break
-                    last_start = len(self.neighs)
+                    last_start = nlist_status_finish(status)
                     new_neighs = np.empty((len(self.neighs)*3)//2, dtype=neigh_dtype)
-                    new_neighs[:last_start] = self.neighs
+                    new_neighs[:last_start] = self.neighs[:last_start]
                     self.neighs = new_neighs
                     del new_neighs
                 # 3) get the number of neighbors in the list.
                 self.nneigh = nlist_status_finish(status)
-                if log.do_debug:
-                    log('Rebuilt, size = %i' % self.nneigh)
                 # 4) store the current state to check in future calls if we
                 #    need to do a rebuild or a recompute.
                 self._checkpoint()
                 self.rebuild_next = False
+                self.nrebuild += 1
+                self.rebuild_reasons[reason] = self.rebuild_reasons.get(reason, 0) + 1
+                self.time_rebuild += time.time() - time0
+                profiler.annotate(rebuild=1, nneigh=self.nneigh, nalloc=len(self.neighs))
+                if log.do_high:
+                    log('Rebuilt (%s), size = %i' % (reason, self.nneigh))
             else:
                 # just *recompute* the deltas and the distance in the
                 # neighborlist
-                nlist_recompute(self.system.pos, self._pos_old, self.system.cell, self.neighs[:self.nneigh])
+                if self.incremental:
+                    moved = (self.system.pos != self._pos_last).any(axis=1)
+                    if moved.any():
+                        nlist_recompute(self.system.pos, self._pos_old, self.system.cell,
+                                        self.neighs[:self.nneigh], moved.astype(np.intc))
+                    self._pos_last[:] = self.system.pos
+                else:
+                    nlist_recompute(self.system.pos, self._pos_old, self.system.cell, self.neighs[:self.nneigh])
+                self.nrecompute += 1
+                self.time_recompute += time.time() - time0
+                profiler.annotate(rebuild=0, nneigh=self.nneigh, nalloc=len(self.neighs))
                 if log.do_debug:
                     log('Recomputed')
 
+    def update_subset(self, iatoms, natom=None):
+        '''Search all pairs in which at least one atom belongs to a subset
+
+           **Arguments:**
+
+           iatoms
+                An array with the indexes of the atoms in the subset.
+
+           **Optional arguments:**
+
+           natom
+                When given, only the first natom atoms of the system are
+                considered. The other atoms are ignored.
+
+           The result is stored in the attributes ``subset_neighs`` and
+           ``subset_nneigh``, in the same format as ``neighs`` and ``nneigh``.
+           Only pairs with a distance below ``rcut`` are included, without the
+           skin, and the exclusions due to ``nlow`` and ``nhigh`` are taken
+           into account. The main neighbor list is not modified.
+
+           All pairs are searched with a single pass over the atoms, without
+           any bookkeeping of previous positions, such that the cost scales
+           linearly with the size of the subset. This is useful in Monte
+           Carlo simulations, where the energy change due to a displacement
+           of a single molecule only depends on the pairs that involve this
+           molecule.
+        '''
+        with timer.section('Nlists'):
+            assert self.rcut > 0
+            iatoms = np.unique(np.asarray(iatoms, dtype=int))
+            if natom is None:
+                pos = self.system.pos
+            else:
+                pos = self.system.pos[:natom]
+            while True:
+                nneigh = nlist_build_subset(
+                    pos, self.rcut, self.rmax, self.system.cell,
+                    iatoms, self.subset_neighs, self.nlow, self.nhigh
+                )
+                if nneigh <= len(self.subset_neighs):
+                    break
+                self.subset_neighs = np.empty((nneigh*3)//2, dtype=neigh_dtype)
+            self.subset_nneigh = nneigh
+
     def _checkpoint(self):
         '''Internal method called after a neighborlist rebuild.'''
         if self.skin > 0:
@@ -203,19 +312,108 @@ class NeighborList(object):
                 self._pos_old = self.system.pos.copy()
             else:
                 self._pos_old[:] = self.system.pos
+            if self.incremental:
+                if self._pos_last is None:
+                    self._pos_last = self.system.pos.copy()
+                else:
+                    self._pos_last[:] = self.system.pos
 
     def _need_rebuild(self):
-        '''Internal method that determines if a rebuild is needed.'''
-        if self.skin <= 0 or self._pos_old is None or self.rebuild_next:
-            return True
+        '''Internal method that determines if a rebuild is needed.
+
+           **Returns:** a short description of the reason for the rebuild, or
+           None if a recomputation is sufficient.
+        '''
+        if self.skin <= 0:
+            return 'no skin'
+        elif self._pos_old is None:
+            return 'first update'
+        elif self.rebuild_next:
+            return 'cutoff or cell changed'
+        elif self.incremental:
+            # Largest displacement of an atom since the last rebuild.
+            disp = np.sqrt(((self.system.pos - self._pos_old)**2).sum(axis=1).max())
+            self.max_displacement = disp
+            if log.do_debug:
+                log('Maximum displacement %s      Skin %s' % (log.length(disp), log.length(self.skin)))
+            if 2*disp >= self.skin:
+                return 'displacement'
         else:
             # Compute an upper bound for the maximum relative displacement.
             disp = np.sqrt(((self.system.pos - self._pos_old)**2).sum(axis=1).max())
+            self.max_displacement = disp
             disp *= 2*(self.rmax.max()+1)
             if log.do_debug:
                 log('Maximum relative displacement %s      Skin %s' % (log.length(disp), log.length(self.skin)))
             # Compare with skin parameter
-            return disp >= self.skin
+            if disp >= self.skin:
+                return 'displacement'
+
+    def reset_stats(self):
+        '''Reset the counters and timings of rebuilds and recomputations.'''
+        self.nupdate = 0
+        self.nrebuild = 0
+        self.nrecompute = 0
+        self.time_rebuild = 0.0
+        self.time_recompute = 0.0
+        self.rebuild_reasons = {}
+        self.max_displacement = 0.0
+
+    def get_stats(self):
+        '''Return statistics on the updates of the neighbor list.
+
+           **Returns:** a dictionary with the following keys:
+
+           nupdate, nrebuild, nrecompute
+                The number of calls to ``update``, of which the number of full
+                rebuilds and recomputations, respectively.
+
+           rebuild_fraction
+                The fraction of updates that required a full rebuild. When
+                this is close to one, increasing the skin may be beneficial.
+
+           time_rebuild, time_recompute
+                The total wall time spent in rebuilds and recomputations.
+
+           time_per_rebuild, time_per_recompute
+                The average wall time of a rebuild and a recomputation.
+
+           rebuild_reasons
+                A dictionary with the number of rebuilds for each reason.
+
+           nneigh
+                The current number of pairs in the neighbor list.
+
+           The statistics are accumulated since the creation of the neighbor
+           list or the last call to ``reset_stats``.
+        '''
+        return {
+            'nupdate': self.nupdate,
+            'nrebuild': self.nrebuild,
+            'nrecompute': self.nrecompute,
+            'rebuild_fraction': self.nrebuild/max(self.nupdate, 1),
+            'time_rebuild': self.time_rebuild,
+            'time_recompute': self.time_recompute,
+            'time_per_rebuild': self.time_rebuild/max(self.nrebuild, 1),
+            'time_per_recompute': self.time_recompute/max(self.nrecompute, 1),
+            'rebuild_reasons': dict(self.rebuild_reasons),
+            'nneigh': self.nneigh,
+        }
+
+    def log_stats(self):
+        '''Write the statistics of the neighbor list updates to the screen log.'''
+        if log.do_medium:
+            stats = self.get_stats()
+            with log.section('NLIST'):
+                log('Updates: %i, rebuilds: %i (%.1f%%), recomputations: %i' % (
+                    stats['nupdate'], stats['nrebuild'],
+                    100*stats['rebuild_fraction'], stats['nrecompute']
+                ))
+                log('Average time per rebuild: %.2e s, per recomputation: %.2e s' % (
+                    stats['time_per_rebuild'], stats['time_per_recompute']
+                ))
+                for reason, count in sorted(stats['rebuild_reasons'].items()):
+                    log('  rebuilds due to %s: %i' % (reason, count))
 
 
     def to_dictionary(self):
@@ -395,6 +593,7 @@ class BondedNeighborList(NeighborList):
         self.neighs = np.sort(neighs, order=['a','b']).copy()
         del neighs, selected, pairs
         self._pos_old = system.pos.copy()
+        self.reset_stats()
 
     def request_rcut(self, rcut):
         # Nothing to do...
@@ -406,5 +605,9 @@ class BondedNeighborList(NeighborList):
 
     def update(self):
         # Simply recompute distances, no need to rebuild
+        time0 = time.time()
         nlist_recompute(self.system.pos, self._pos_old, self.system.cell, self.neighs[:self.nneigh])
         self._pos_old[:] = self.system.pos
+        self.nupdate += 1
+        self.nrecompute += 1
+        self.time_recompute += time.time() - time0
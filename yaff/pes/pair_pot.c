@@ -81,16 +81,104 @@ double get_scaling(scaling_row_type *stab, long a, long b, long *row, long size)
 }
 
 
-double pair_pot_compute(neigh_row_type *neighs,
-                        long nneigh, scaling_row_type *stab,
-                        long nstab, pair_pot_type *pair_pot,
-                        double *gpos, double* vtens) {
-  long i, srow, center_index, other_index;
-  double s, energy, v, vg, h, hg;
+long get_scaling_start(scaling_row_type *stab, long a, long size) {
+  // Returns the first row in the scaling table for which stab[row].a >= a,
+  // using bisection. This is a safe starting point for get_scaling when
+  // the neighbor list is processed in chunks.
+  long low, high, mid;
+  low = 0;
+  high = size;
+  while (low < high) {
+    mid = (low + high)/2;
+    if (stab[mid].a < a) {
+      low = mid + 1;
+    } else {
+      high = mid;
+    }
+  }
+  return low;
+}
+
+
+static double pair_pot_eval(pair_pot_type *pair_pot, long center_index,
+                            long other_index, double d, double *delta,
+                            double *vg, double *vg_cart) {
+  // Evaluates one pair potential for one pair, including the truncation.
+  // When vg is NULL, no derivatives are computed. Otherwise, vg is the
+  // derivative of the pair potential to d divided by the distance and vg_cart
+  // contains the partial derivatives of the pair potential to cartesian
+  // coordinates. Implicit dependence (through d) of the pair potential on
+  // cartesian coordinates is captured by vg.
+  double v, h, hg;
+  if (vg == NULL) {
+    // Call the potential function without g argument.
+    v = (*pair_pot).pair_fn((*pair_pot).pair_data, center_index, other_index, d, delta, NULL, NULL);
+    // If a truncation scheme is defined, apply it.
+    if (((*pair_pot).trunc_scheme!=NULL) && (v!=0.0)) {
+      v *= (*(*pair_pot).trunc_scheme).trunc_fn(d, (*pair_pot).rcut, (*(*pair_pot).trunc_scheme).par, NULL);
+    }
+  } else {
+    vg_cart[0] = 0.0; //vg_cart is reset here because not all pair_fn set it.
+    vg_cart[1] = 0.0;
+    vg_cart[2] = 0.0;
+    v = (*pair_pot).pair_fn((*pair_pot).pair_data, center_index, other_index, d, delta, vg, vg_cart);
+    // If a truncation scheme is defined, apply it.
+    // TODO: include vg_cart (not necessary as long as the truncation scheme only depends on distance)
+    if (((*pair_pot).trunc_scheme!=NULL) && ((v!=0.0) || (*vg!=0.0))) {
+      // hg is (a pointer to) the derivative of the truncation function.
+      h = (*(*pair_pot).trunc_scheme).trunc_fn(d, (*pair_pot).rcut, (*(*pair_pot).trunc_scheme).par, &hg);
+      // chain rule:
+      *vg = (*vg)*h + v*hg/d;
+      vg_cart[0] = vg_cart[0]*h;
+      vg_cart[1] = vg_cart[1]*h;
+      vg_cart[2] = vg_cart[2]*h;
+      v *= h;
+    }
+  }
+  return v;
+}
+
+
+static void pair_pot_add_derivatives(neigh_row_type *neigh, double vg,
+                                     double *vg_cart, double *gpos,
+                                     double *vtens) {
+  // Adds the contribution of one pair to the gradient and the virial tensor.
+  double h;
+  if (gpos!=NULL) {
+    h = (*neigh).dx*vg;
+    gpos[3*(*neigh).b  ] += h + vg_cart[0];
+    gpos[3*(*neigh).a  ] -= h + vg_cart[0];
+    h = (*neigh).dy*vg;
+    gpos[3*(*neigh).b+1] += h + vg_cart[1];
+    gpos[3*(*neigh).a+1] -= h + vg_cart[1];
+    h = (*neigh).dz*vg;
+    gpos[3*(*neigh).b+2] += h + vg_cart[2];
+    gpos[3*(*neigh).a+2] -= h + vg_cart[2];
+  }
+  if (vtens!=NULL) {
+    vtens[0] += (*neigh).dx*((*neigh).dx*vg+vg_cart[0]);
+    vtens[4] += (*neigh).dy*((*neigh).dy*vg+vg_cart[1]);
+    vtens[8] += (*neigh).dz*((*neigh).dz*vg+vg_cart[2]);
+    vtens[1] += (*neigh).dx*((*neigh).dy*vg+vg_cart[1]);
+    vtens[3] += (*neigh).dy*((*neigh).dx*vg+vg_cart[0]);
+    vtens[2] += (*neigh).dx*((*neigh).dz*vg+vg_cart[2]);
+    vtens[6] += (*neigh).dz*((*neigh).dx*vg+vg_cart[0]);
+    vtens[5] += (*neigh).dy*((*neigh).dz*vg+vg_cart[2]);
+    vtens[7] += (*neigh).dz*((*neigh).dy*vg+vg_cart[1]);
+  }
+}
+
+
+double pair_pot_compute_chunk(neigh_row_type *neighs,
+                              long nneigh, scaling_row_type *stab,
+                              long nstab, long srow, pair_pot_type *pair_pot,
+                              double *gpos, double* vtens) {
+  // Computes the interactions for a contiguous part of the neighbor list. The
+  // argument srow is the starting point for the search in the scaling table.
+  long i, center_index, other_index;
+  double s, energy, v, vg;
   double delta[3], vg_cart[3];
   energy = 0.0;
-  // Reset the row counter for the scaling.
-  srow = 0;
   // Compute the interactions.
   for (i=0; i<nneigh; i++) {
     // Find the scale
@@ -109,64 +197,14 @@ double pair_pot_compute(neigh_row_type *neighs,
         delta[1] = neighs[i].dy;
         delta[2] = neighs[i].dz;
         if ((gpos==NULL) && (vtens==NULL)) {
-          // Call the potential function without g argument.
-          v = (*pair_pot).pair_fn((*pair_pot).pair_data, center_index, other_index, neighs[i].d, delta, NULL, NULL);
-          // If a truncation scheme is defined, apply it.
-          if (((*pair_pot).trunc_scheme!=NULL) && (v!=0.0)) {
-            v *= (*(*pair_pot).trunc_scheme).trunc_fn(neighs[i].d, (*pair_pot).rcut, (*(*pair_pot).trunc_scheme).par, NULL);
-          }
+          v = pair_pot_eval(pair_pot, center_index, other_index, neighs[i].d, delta, NULL, NULL);
         } else {
-          // Call the potential function with vg argument.
-          // vg_cart contains the (partial) derivatives of the pair potential to
-          // cartesian coordinates. Implicit dependence (through d) of the
-          // pair potential on cartesian coordinates is captured by vg.
-          vg_cart[0] = 0.0; //vg_cart is reset here because not all pair_fn set it.
-          vg_cart[1] = 0.0;
-          vg_cart[2] = 0.0;
-          // vg is the derivative of the pair potential to d divided by the distance.
-          v = (*pair_pot).pair_fn((*pair_pot).pair_data, center_index, other_index, neighs[i].d, delta, &vg, vg_cart);
-          // If a truncation scheme is defined, apply it.
-          // TODO: include vg_cart (not necessary as long as the truncation scheme only depends on distance)
-          if (((*pair_pot).trunc_scheme!=NULL) && ((v!=0.0) || (vg!=0.0))) {
-            // hg is (a pointer to) the derivative of the truncation function.
-            h = (*(*pair_pot).trunc_scheme).trunc_fn(neighs[i].d,    (*pair_pot).rcut, (*(*pair_pot).trunc_scheme).par, &hg);
-            // chain rule:
-            vg = vg*h + v*hg/neighs[i].d;
-            vg_cart[0] = vg_cart[0]*h;
-            vg_cart[1] = vg_cart[1]*h;
-            vg_cart[2] = vg_cart[2]*h;
-            v *= h;
-          }
-          //printf("C %3i %3i (% 3i % 3i % 3i) %10.7f %3.1f %10.3e\n", center_index, other_index, neighs[i].r0, neighs[i].r1, neighs[i].r2, neighs[i].d, s, s*v);
+          v = pair_pot_eval(pair_pot, center_index, other_index, neighs[i].d, delta, &vg, vg_cart);
           vg *= s;
           vg_cart[0] *= s;
           vg_cart[1] *= s;
           vg_cart[2] *= s;
-          if (gpos!=NULL) {
-            h = neighs[i].dx*vg;
-            gpos[3*other_index  ] += h + vg_cart[0];
-            gpos[3*center_index   ] -= h + vg_cart[0];
-            h = neighs[i].dy*vg;
-            gpos[3*other_index+1] += h + vg_cart[1];
-            gpos[3*center_index +1] -= h + vg_cart[1];
-            h = neighs[i].dz*vg;
-            gpos[3*other_index+2] += h + vg_cart[2];
-            gpos[3*center_index +2] -= h + vg_cart[2];
-          }
-          if (vtens!=NULL) {
-            vtens[0] += neighs[i].dx*(neighs[i].dx*vg+vg_cart[0]);
-            vtens[4] += neighs[i].dy*(neighs[i].dy*vg+vg_cart[1]);
-            vtens[8] += neighs[i].dz*(neighs[i].dz*vg+vg_cart[2]);
-            //h = neighs[i].dx*(neighs[i].dy*vg+vg_cart[1]);
-            vtens[1] += neighs[i].dx*(neighs[i].dy*vg+vg_cart[1]);
-            vtens[3] += neighs[i].dy*(neighs[i].dx*vg+vg_cart[0]);
-            //h = neighs[i].dx*(neighs[i].dz*vg+vg_cart[2]);
-            vtens[2] += neighs[i].dx*(neighs[i].dz*vg+vg_cart[2]);
-            vtens[6] += neighs[i].dz*(neighs[i].dx*vg+vg_cart[0]);
-            //h = neighs[i].dy*(neighs[i].dz*vg+vg_cart[2]);
-            vtens[5] += neighs[i].dy*(neighs[i].dz*vg+vg_cart[2]);
-            vtens[7] += neighs[i].dz*(neighs[i].dy*vg+vg_cart[1]);
-          }
+          pair_pot_add_derivatives(neighs + i, vg, vg_cart, gpos, vtens);
         }
         energy += s*v;
       }
@@ -175,6 +213,189 @@ double pair_pot_compute(neigh_row_type *neighs,
   return energy;
 }
 
+
+static void pair_pot_compute_multi_chunk(neigh_row_type *neighs, long nneigh,
+                                         scaling_row_type **stabs, long *nstabs,
+                                         long *srows, pair_pot_type **pair_pots,
+                                         long npot, double *energies,
+                                         double *gpos, double* vtens) {
+  // Computes the interactions of several pair potentials in a single pass
+  // over a contiguous part of the neighbor list. Each potential has its own
+  // scaling table, cutoff and truncation. The contributions to the gradient
+  // and the virial are summed over all potentials before they are added to
+  // gpos and vtens. The energy of each potential is added to energies.
+  long i, ipot, center_index, other_index;
+  int is_r0, do_derivs, any;
+  double s, d, v, vg, vg_sum;
+  double delta[3], vg_cart[3], vg_cart_sum[3];
+  do_derivs = (gpos!=NULL) || (vtens!=NULL);
+  for (i=0; i<nneigh; i++) {
+    // Load the pair once for all potentials.
+    d = neighs[i].d;
+    center_index = neighs[i].a;
+    other_index = neighs[i].b;
+    delta[0] = neighs[i].dx;
+    delta[1] = neighs[i].dy;
+    delta[2] = neighs[i].dz;
+    is_r0 = (neighs[i].r0 == 0) && (neighs[i].r1 == 0) && (neighs[i].r2 == 0);
+    any = 0;
+    vg_sum = 0.0;
+    vg_cart_sum[0] = 0.0;
+    vg_cart_sum[1] = 0.0;
+    vg_cart_sum[2] = 0.0;
+    for (ipot=0; ipot<npot; ipot++) {
+      if (d >= (*pair_pots[ipot]).rcut) continue;
+      if (is_r0) {
+        s = get_scaling(stabs[ipot], center_index, other_index, srows + ipot, nstabs[ipot]);
+      } else {
+        s = 1.0;
+      }
+      if (s == 0.0) continue;
+      if (do_derivs) {
+        v = pair_pot_eval(pair_pots[ipot], center_index, other_index, d, delta, &vg, vg_cart);
+        vg_sum += s*vg;
+        vg_cart_sum[0] += s*vg_cart[0];
+        vg_cart_sum[1] += s*vg_cart[1];
+        vg_cart_sum[2] += s*vg_cart[2];
+        any = 1;
+      } else {
+        v = pair_pot_eval(pair_pots[ipot], center_index, other_index, d, delta, NULL, NULL);
+      }
+      energies[ipot] += s*v;
+    }
+    // Scatter the derivatives once for all potentials.
+    if (any) {
+      pair_pot_add_derivatives(neighs + i, vg_sum, vg_cart_sum, gpos, vtens);
+    }
+  }
+}
+
+
+double pair_pot_compute(neigh_row_type *neighs,
+                        long nneigh, scaling_row_type *stab,
+                        long nstab, pair_pot_type *pair_pot,
+                        double *gpos, double* vtens) {
+  // Start with the first row of the scaling table.
+  return pair_pot_compute_chunk(neighs, nneigh, stab, nstab, 0, pair_pot, gpos, vtens);
+}
+
+
+double pair_pot_compute_parallel(neigh_row_type *neighs,
+                                 long nneigh, scaling_row_type *stab,
+                                 long nstab, pair_pot_type *pair_pot,
+                                 double *gpos, double* vtens, long natom,
+                                 double *work, int nthread) {
+  // Same as pair_pot_compute, but the neighbor list is split into nthread
+  // contiguous chunks that are processed by different OpenMP threads. Each
+  // thread has its own gradient (a slice of work with size 3*natom) and
+  // virial accumulators, which are added up at the end. When Yaff is compiled
+  // without OpenMP support, the chunks are processed sequentially.
+  long ithread, j, begin, end, srow;
+  double energy, vtens_thread[9];
+  energy = 0.0;
+  if (gpos!=NULL) {
+    for (j=0; j<3*natom*nthread; j++) work[j] = 0.0;
+  }
+#ifdef _OPENMP
+  #pragma omp parallel for num_threads(nthread) schedule(static,1) private(j, begin, end, srow, vtens_thread) reduction(+:energy)
+#endif
+  for (ithread=0; ithread<nthread; ithread++) {
+    begin = (nneigh*ithread)/nthread;
+    end = (nneigh*(ithread+1))/nthread;
+    if (begin >= end) continue;
+    // The scaling lookup must not depend on the preceding chunks.
+    srow = neighs[begin].a;
+    if (neighs[begin].b < srow) srow = neighs[begin].b;
+    srow = get_scaling_start(stab, srow, nstab);
+    for (j=0; j<9; j++) vtens_thread[j] = 0.0;
+    energy += pair_pot_compute_chunk(
+      neighs + begin, end - begin, stab, nstab, srow, pair_pot,
+      (gpos==NULL) ? NULL : work + 3*natom*ithread,
+      (vtens==NULL) ? NULL : vtens_thread
+    );
+    if (vtens!=NULL) {
+#ifdef _OPENMP
+      #pragma omp critical
+#endif
+      for (j=0; j<9; j++) vtens[j] += vtens_thread[j];
+    }
+  }
+  // Reduction of the gradients.
+  if (gpos!=NULL) {
+#ifdef _OPENMP
+    #pragma omp parallel for num_threads(nthread) private(ithread)
+#endif
+    for (j=0; j<3*natom; j++) {
+      for (ithread=0; ithread<nthread; ithread++) {
+        gpos[j] += work[3*natom*ithread + j];
+      }
+    }
+  }
+  return energy;
+}
+
+void pair_pot_compute_multi(neigh_row_type *neighs, long nneigh,
+                            scaling_row_type **stabs, long *nstabs,
+                            pair_pot_type **pair_pots, long npot,
+                            double *gpos, double* vtens, long natom,
+                            double *energies, long *srows, double *work,
+                            int nthread) {
+  // Fused evaluation of several pair potentials. The arrays energies and
+  // srows have nthread*npot elements and must be initialized with zeros.
+  // The energies of the potentials computed by thread i are stored in
+  // energies[i*npot:(i+1)*npot]. The work array is only used when nthread
+  // is larger than one and has the same layout as in
+  // pair_pot_compute_parallel.
+  long ithread, ipot, j, begin, end, first;
+  double vtens_thread[9];
+  if (nthread == 1) {
+    pair_pot_compute_multi_chunk(neighs, nneigh, stabs, nstabs, srows,
+                                 pair_pots, npot, energies, gpos, vtens);
+    return;
+  }
+  if (gpos!=NULL) {
+    for (j=0; j<3*natom*nthread; j++) work[j] = 0.0;
+  }
+#ifdef _OPENMP
+  #pragma omp parallel for num_threads(nthread) schedule(static,1) private(ipot, j, begin, end, first, vtens_thread)
+#endif
+  for (ithread=0; ithread<nthread; ithread++) {
+    begin = (nneigh*ithread)/nthread;
+    end = (nneigh*(ithread+1))/nthread;
+    if (begin >= end) continue;
+    // The scaling lookup must not depend on the preceding chunks.
+    first = neighs[begin].a;
+    if (neighs[begin].b < first) first = neighs[begin].b;
+    for (ipot=0; ipot<npot; ipot++) {
+      srows[ithread*npot + ipot] = get_scaling_start(stabs[ipot], first, nstabs[ipot]);
+    }
+    for (j=0; j<9; j++) vtens_thread[j] = 0.0;
+    pair_pot_compute_multi_chunk(
+      neighs + begin, end - begin, stabs, nstabs, srows + ithread*npot,
+      pair_pots, npot, energies + ithread*npot,
+      (gpos==NULL) ? NULL : work + 3*natom*ithread,
+      (vtens==NULL) ? NULL : vtens_thread
+    );
+    if (vtens!=NULL) {
+#ifdef _OPENMP
+      #pragma omp critical
+#endif
+      for (j=0; j<9; j++) vtens[j] += vtens_thread[j];
+    }
+  }
+  // Reduction of the gradients.
+  if (gpos!=NULL) {
+#ifdef _OPENMP
+    #pragma omp parallel for num_threads(nthread) private(ithread)
+#endif
+    for (j=0; j<3*natom; j++) {
+      for (ithread=0; ithread<nthread; ithread++) {
+        gpos[j] += work[3*natom*ithread + j];
+      }
+    }
+  }
+}
+
 void pair_pot_tailcorr_cut(double *corrs, long natom, long nlow, long nhigh, pair_pot_type *pair_pot) {
   /*
   The first element of ``corrs'' will contain
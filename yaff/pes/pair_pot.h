@@ -62,6 +62,18 @@ double pair_pot_compute(neigh_row_type *neighs,
                         long nneigh, scaling_row_type *scaling,
                         long scaling_size, pair_pot_type *pair_pot,
                         double *gpos, double* vtens);
+double pair_pot_compute_parallel(neigh_row_type *neighs,
+                                 long nneigh, scaling_row_type *scaling,
+                                 long scaling_size, pair_pot_type *pair_pot,
+                                 double *gpos, double* vtens, long natom,
+                                 double *work, int nthread);
+
+void pair_pot_compute_multi(neigh_row_type *neighs, long nneigh,
+                            scaling_row_type **stabs, long *nstabs,
+                            pair_pot_type **pair_pots, long npot,
+                            double *gpos, double* vtens, long natom,
+                            double *energies, long *srows, double *work,
+                            int nthread);
 
 void pair_pot_tailcorr_cut(double *corrs, long natom, long nlow, long nhigh, pair_pot_type *pair_pot);
 void pair_pot_tailcorr_switch3(double *corrs, long natom, long nlow, long nhigh, pair_pot_type *pair_pot);
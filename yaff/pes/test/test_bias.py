@@ -28,6 +28,7 @@ from __future__ import print_function
 
 import numpy as np
 import pkg_resources
+from nose.tools import assert_raises
 
 from yaff import *
 
@@ -290,3 +291,120 @@ def test_bias_gaussianhills_alanine_periodic():
     part.add_term(bias)
     check_gpos_part(ff.system, part)
     check_vtens_part(ff.system, part)
+
+
+def test_bias_gaussianhills_storage():
+    ff = get_alaninedipeptide_amber99ff()
+    cv = CVInternalCoordinate(ff.system, DihedAngle(4,6,8,14))
+    bias = GaussianHills(cv, 0.35*rad)
+    q0s = np.random.uniform(-np.pi, np.pi, (10, 1))
+    Ks = np.random.uniform(1.0, 2.0, 10)*kjmol
+    for q0, K in zip(q0s, Ks):
+        bias.add_hill(q0, K)
+    bias.add_hills(q0s, Ks)
+    assert bias.nhill == 20
+    assert bias.q0s.shape == (20, 1)
+    assert (bias.q0s[:10] == q0s).all()
+    assert (bias.q0s[10:] == q0s).all()
+    assert (bias.Ks[:10] == Ks).all()
+    assert (bias.Ks[10:] == Ks).all()
+    # The storage grows geometrically
+    assert bias._Ks.shape[0] == 32
+
+
+def test_bias_gridgaussianhills_alanine_periodic():
+    ff = get_alaninedipeptide_amber99ff()
+    cv = CVInternalCoordinate(ff.system, DihedAngle(4,6,8,14))
+    sigma = 0.35*rad
+    ref = GaussianHills(cv, sigma, periodicities=2.0*np.pi)
+    bias = GridGaussianHills(cv, sigma, (-np.pi, np.pi), 120, periodicities=2.0*np.pi)
+    assert bias.compute() == 0.0
+    phi = cv.compute()
+    q0s = phi + np.random.uniform(-1.0, 1.0, (20, 1))
+    # Also hills on the other side of the periodic boundary
+    q0s[::4] += 2.0*np.pi
+    Ks = np.random.uniform(1.0, 2.0, 20)*kjmol
+    ref.add_hills(q0s, Ks)
+    bias.add_hills(q0s, Ks)
+    assert (bias.q0s == ref.q0s).all()
+    assert abs(bias.compute() - ref.compute()) < 1e-4*kjmol
+    gpos_ref = np.zeros(ff.system.pos.shape)
+    vtens_ref = np.zeros((3, 3))
+    ref.compute(gpos_ref, vtens_ref)
+    gpos = np.zeros(ff.system.pos.shape)
+    vtens = np.zeros((3, 3))
+    bias.compute(gpos, vtens)
+    assert abs(gpos - gpos_ref).max() < 1e-3*abs(gpos_ref).max()
+    assert abs(vtens - vtens_ref).max() < 1e-3*abs(vtens_ref).max()
+    part = ForcePartBias(ff.system)
+    part.add_term(bias)
+    check_gpos_part(ff.system, part)
+    check_vtens_part(ff.system, part)
+
+
+def test_bias_gridgaussianhills_quartz():
+    system = get_system_quartz()
+    cv0 = CVVolume(system)
+    q0 = system.cell.volume
+    cv1 = CVInternalCoordinate(system, Bond(2,8))
+    delta = system.pos[2]-system.pos[8]
+    system.cell.mic(delta)
+    q1 = np.linalg.norm(delta)
+    sigmas = np.array([10.0*angstrom**3, 0.2*angstrom])
+    bounds = np.array([[q0-80*angstrom**3, q0+80*angstrom**3], [q1-1.5*angstrom, q1+1.5*angstrom]])
+    ref = GaussianHills([cv0, cv1], sigmas)
+    bias = GridGaussianHills([cv0, cv1], sigmas, bounds, np.array([81, 61]))
+    q0s = np.array([q0, q1]) + np.random.normal(0.0, 1.0, (10, 2))*sigmas
+    Ks = np.random.uniform(1.0, 2.0, 10)*kjmol
+    ref.add_hills(q0s, Ks)
+    bias.add_hills(q0s, Ks)
+    assert abs(bias.compute() - ref.compute()) < 1e-3*kjmol
+    part = ForcePartBias(system)
+    part.add_term(bias)
+    check_gpos_part(system, part)
+    check_vtens_part(system, part)
+
+
+def test_bias_gridgaussianhills_outside():
+    ff = get_alaninedipeptide_amber99ff()
+    cv = CVInternalCoordinate(ff.system, DihedAngle(4,6,8,14))
+    phi = cv.compute()
+    bias = GridGaussianHills(cv, 0.35*rad, (phi+0.5, phi+1.5), 20)
+    # Hills outside the grid are recorded, but not deposited.
+    bias.add_hill(phi-5.0, 1.0*kjmol)
+    assert bias.nhill == 1
+    assert (bias.grid == 0.0).all()
+    # A hill close to the lower bound of the grid
+    bias.add_hill(phi+0.8, 1.0*kjmol)
+    # The collective variable is below the grid: the bias is evaluated at the
+    # lower bound and there is no force.
+    assert bias.noutside == 0
+    gpos = np.zeros(ff.system.pos.shape)
+    vtens = np.zeros((3, 3))
+    energy = bias.compute(gpos, vtens)
+    assert bias.noutside == 1
+    assert (gpos == 0.0).all()
+    assert (vtens == 0.0).all()
+    energy_bound, grad_bound = bias._interpolate(np.array([phi+0.5]))
+    assert energy > 0.1*kjmol
+    assert abs(energy - energy_bound) < 1e-10*kjmol
+    # Inside the grid, there is a force.
+    assert abs(grad_bound).max() > 0.1*kjmol
+    # Also above the grid
+    energy_above, grad_above = bias._interpolate(np.array([phi+2.0]))
+    assert bias.noutside == 2
+    assert energy_above == bias._interpolate(np.array([phi+1.5]))[0]
+    assert (grad_above == 0.0).all()
+
+
+def test_bias_gridgaussianhills_invalid():
+    ff = get_alaninedipeptide_amber99ff()
+    cv = CVInternalCoordinate(ff.system, DihedAngle(4,6,8,14))
+    with assert_raises(ValueError):
+        GridGaussianHills(cv, 0.35*rad, (1.0, 0.0), 20)
+    with assert_raises(ValueError):
+        GridGaussianHills(cv, 0.35*rad, (0.0, 1.0), 1)
+    with assert_raises(ValueError):
+        GridGaussianHills(cv, 0.35*rad, (0.0, np.pi), 20, periodicities=2.0*np.pi)
+    with assert_raises(ValueError):
+        GridGaussianHills([cv]*4, np.ones(4)*0.35*rad, np.array([[0.0, 1.0]]*4), 10)
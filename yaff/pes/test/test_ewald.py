@@ -27,6 +27,7 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as np
+from nose.tools import assert_raises
 
 from yaff import *
 
@@ -339,3 +340,170 @@ def test_ewaldreciprocalinteraction_water32():
             cosfacs, sinfacs)
         e = ewald_interaction.compute_deltae(cosfacs, sinfacs)
         assert np.abs(e-eref)<1e-12
+
+
+def check_structurefactors_kvecs(system, alpha, gcut):
+    # compact list of reciprocal vectors within the cutoff
+    ewald_interaction = ForcePartEwaldReciprocalInteraction(system.cell, alpha,
+         gcut, pos=system.pos, charges=system.charges)
+    gmax = ewald_interaction.gmax
+    gints = ewald_interaction.gints
+    assert ewald_interaction.prefactors.shape == (len(gints),)
+    assert (ewald_interaction.prefactors > 0).all()
+    # structure factors on the full box of reciprocal vectors
+    shape = (2*gmax[0]+1, 2*gmax[1]+1, gmax[2]+1)
+    prefactors, cosfacs, sinfacs = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    compute_ewald_prefactors(system.cell, alpha, gmax, gcut, prefactors)
+    compute_ewald_structurefactors(system.pos, system.charges, system.cell,
+        alpha, gmax, gcut, cosfacs, sinfacs)
+    # the box routines store reciprocal vector (g0, g1, g2) at the flat index
+    # following the one of (g0+gmax[0], g1+gmax[1], g2)
+    indexes = np.ravel_multi_index((gints + [gmax[0], gmax[1], 0]).T, shape) + 1
+    assert (prefactors.ravel()[indexes] > 0).all()
+    assert (prefactors > 0).sum() == len(indexes)
+    assert abs(prefactors.ravel()[indexes] - ewald_interaction.prefactors).max() < 1e-12*prefactors.max()
+    assert abs(cosfacs.ravel()[indexes] - ewald_interaction.cosfacs).max() < 1e-10
+    assert abs(sinfacs.ravel()[indexes] - ewald_interaction.sinfacs).max() < 1e-10
+
+
+def test_structurefactors_kvecs_water32():
+    check_structurefactors_kvecs(get_system_water32(), 0.1, 0.2)
+
+
+def test_structurefactors_kvecs_quartz():
+    check_structurefactors_kvecs(get_system_quartz(), 0.25, 0.5)
+
+
+def check_pme_ewald(system, alpha, gcut, order, threshold, dielectric=1.0):
+    part_ewald_reci = ForcePartEwaldReciprocal(system, alpha, gcut=gcut, dielectric=dielectric)
+    gpos0 = np.zeros(system.pos.shape, float)
+    vtens0 = np.zeros((3, 3), float)
+    energy0 = part_ewald_reci.compute(gpos0, vtens0)
+    part_pme = ForcePartEwaldReciprocalPME(system, alpha, gcut=gcut, dielectric=dielectric, order=order)
+    gpos1 = np.zeros(system.pos.shape, float)
+    vtens1 = np.zeros((3, 3), float)
+    energy1 = part_pme.compute(gpos1, vtens1)
+    assert abs(energy1 - energy0) < threshold*abs(energy0)
+    assert abs(gpos1 - gpos0).max() < threshold*abs(gpos0).max()
+    assert abs(vtens1 - vtens0).max() < threshold*abs(vtens0).max()
+
+
+def test_pme_water32():
+    system = get_system_water32()
+    for alpha in 0.1, 0.2, 0.3:
+        check_pme_ewald(system, alpha, 2.0*alpha, 8, 1e-5, dielectric=1.3)
+
+
+def test_pme_quartz():
+    system = get_system_quartz().supercell(2, 2, 2)
+    check_pme_ewald(system, 0.2, 0.5, 8, 2e-5)
+    check_pme_ewald(system, 0.3, 0.6, 6, 2e-4)
+
+
+def test_pme_gpos_vtens_water32():
+    system = get_system_water32()
+    for alpha in 0.05, 0.1, 0.2:
+        part_pme = ForcePartEwaldReciprocalPME(system, alpha, gcut=alpha/0.75, dielectric=1.4)
+        check_gpos_part(system, part_pme)
+        check_vtens_part(system, part_pme)
+
+
+def test_pme_gpos_vtens_quartz():
+    system = get_system_quartz()
+    for order in 4, 6, 8:
+        part_pme = ForcePartEwaldReciprocalPME(system, 0.2, gridsize=[10, 12, 15], order=order)
+        check_gpos_part(system, part_pme)
+        check_vtens_part(system, part_pme)
+
+
+def test_pme_water32_exclusion():
+    system = get_system_water32()
+    alpha = 0.35
+    gcut = 2.0*alpha
+    def part_generator(system, **kwargs):
+        alpha = kwargs.pop('alpha')
+        gcut = kwargs.pop('gcut')
+        return ForcePartEwaldReciprocalPME(system, alpha, gcut=gcut, **kwargs)
+    for nlow, nhigh in [(15,33),(0,12),(81,96)]:
+        check_nlow_nhigh_part(system, part_generator, nlow, nhigh, alpha=alpha, gcut=gcut)
+
+
+def test_pme_invalid():
+    system = get_system_water32()
+    with assert_raises(ValueError):
+        ForcePartEwaldReciprocalPME(system, 0.2, order=5)
+    with assert_raises(ValueError):
+        ForcePartEwaldReciprocalPME(system, 0.2, gridsize=[3, 12, 12])
+
+
+def test_ewald_dd_reci_quartz_exclusion():
+    system = get_system_quartz().supercell(2, 2, 1)
+    system.dipoles = np.random.normal(0.0, 0.1, (system.natom, 3))
+    alpha = 0.3
+    gcut = 2.0*alpha
+    def part_generator(system, **kwargs):
+        alpha = kwargs.pop('alpha')
+        gcut = kwargs.pop('gcut')
+        return ForcePartEwaldReciprocalDD(system, alpha, gcut=gcut, **kwargs)
+    for nlow, nhigh in [(5,13),(0,12),(21,36)]:
+        check_nlow_nhigh_part(system, part_generator, nlow, nhigh, alpha=alpha, gcut=gcut)
+
+
+def test_ewald_dd_gpos_vtens_reci_quartz():
+    system = get_system_quartz().supercell(2, 2, 1)
+    system.dipoles = np.random.normal(0.0, 0.1, (system.natom, 3))
+    for alpha in 0.2, 0.3:
+        part_ewald_reci = ForcePartEwaldReciprocalDD(system, alpha, gcut=2.0*alpha)
+        check_gpos_part(system, part_ewald_reci)
+        check_vtens_part(system, part_ewald_reci, symm_vtens=False)
+
+def test_ewald_kvecs_quartz():
+    system = get_system_quartz()
+    alpha = 0.2
+    part_ewald_reci = ForcePartEwaldReciprocal(system, alpha, gcut=2.0*alpha)
+    part_ewald_reci.compute()
+    gints, kvecs, kfacs = part_ewald_reci.gints, part_ewald_reci.kvecs, part_ewald_reci.kfacs
+    # compare with a direct enumeration of all reciprocal vectors
+    gmax = part_ewald_reci.gmax
+    count = 0
+    for g0 in range(-gmax[0], gmax[0]+1):
+        for g1 in range(-gmax[1], gmax[1]+1):
+            for g2 in range(-gmax[2], gmax[2]+1):
+                if g0 == 0 and g1 == 0 and g2 == 0:
+                    continue
+                k = 2*np.pi*np.dot([g0, g1, g2], system.cell.gvecs)
+                if np.linalg.norm(k) <= 2*np.pi*2.0*alpha:
+                    count += 1
+    assert 2*len(gints) == count
+    assert abs(kvecs - 2*np.pi*np.dot(gints, system.cell.gvecs)).max() < 1e-10
+    ksq = (kvecs**2).sum(axis=1)
+    expected = 4*np.pi/system.cell.volume*np.exp(-ksq/(4*alpha**2))/ksq
+    assert abs(kfacs - expected).max() < 1e-10*abs(expected).max()
+    # energy from the structure factors with the same table
+    phases = np.exp(1j*np.dot(system.pos, kvecs.T))
+    sfacs = np.dot(system.charges, phases)
+    energy = (kfacs*abs(sfacs)**2).sum()
+    assert abs(part_ewald_reci.compute() - energy) < 1e-10*abs(energy)
+
+
+def test_ewald_kvecs_cache():
+    system = get_system_quartz()
+    part_ewald_reci = ForcePartEwaldReciprocal(system, 0.2, gcut=0.4)
+    energy1 = part_ewald_reci.compute()
+    kfacs = part_ewald_reci.kfacs
+    # no changes, the table must be reused
+    assert abs(part_ewald_reci.compute() - energy1) < 1e-12*abs(energy1)
+    assert part_ewald_reci.kfacs is kfacs
+    # change the cell with and without notifying the force part
+    reduced = np.dot(system.pos, system.cell.gvecs.transpose())
+    for notify in False, True:
+        rvecs = system.cell.rvecs*1.05
+        system.pos[:] = np.dot(reduced, rvecs)
+        system.cell.update_rvecs(rvecs)
+        if notify:
+            part_ewald_reci.update_rvecs(rvecs)
+        energy2 = part_ewald_reci.compute()
+        assert part_ewald_reci.kfacs is not kfacs
+        kfacs = part_ewald_reci.kfacs
+        part_ewald_ref = ForcePartEwaldReciprocal(system, 0.2, gcut=0.4)
+        assert abs(part_ewald_ref.compute() - energy2) < 1e-12*abs(energy2)
@@ -26,12 +26,16 @@
 from __future__ import division
 from __future__ import print_function
 
+import gc
+import sys
+import threading
+
 import pkg_resources
 from nose.tools import assert_raises
 import numpy as np
 
 from yaff import *
-from yaff.log import log
+from yaff.log import log, timer
 
 from yaff.test.common import get_system_water32, get_system_glycine, get_system_formaldehyde
 
@@ -850,6 +854,116 @@ def test_generator_water32_fixq_dielectric():
     assert part_pair_ei.pair_pot.dielectric == part_ewald_neut.dielectric
 
 
+def test_generator_water32_cell_list():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
+    ff0 = ForceField.generate(system, fn_pars)
+    ff1 = ForceField.generate(system, fn_pars, cell_list=True)
+    assert not ff0.nlist.cell_list
+    assert ff1.nlist.cell_list
+    gpos0 = np.zeros(system.pos.shape)
+    gpos1 = np.zeros(system.pos.shape)
+    assert abs(ff0.compute(gpos0) - ff1.compute(gpos1)) < 1e-10
+    assert abs(gpos0 - gpos1).max() < 1e-10
+
+
+def test_generator_water32_fixq_pme():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water_fixq.txt')
+    ff0 = ForceField.generate(system, fn_pars)
+    ff1 = ForceField.generate(system, fn_pars, reci_ei='pme')
+    assert isinstance(ff1.part_ewald_reci, ForcePartEwaldReciprocalPME)
+    assert ff1.part_ewald_reci.alpha == ff0.part_ewald_reci.alpha
+    e0 = ff0.part_ewald_reci.compute()
+    e1 = ff1.part_ewald_reci.compute()
+    assert abs(e0 - e1) < 1e-2*abs(e0)
+
+
+def test_generator_water32_fuse_pairs():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
+    ff0 = ForceField.generate(system, fn_pars)
+    ff1 = ForceField.generate(system, fn_pars, fuse_pairs=True)
+    assert len(ff1.parts) == 5
+    assert isinstance(ff1.part_pair_fused, ForcePartPairFused)
+    assert len(ff1.part_pair_fused.parts) == 3
+    assert not hasattr(ff1, 'part_pair_ei')
+    gpos0 = np.zeros(system.pos.shape, float)
+    vtens0 = np.zeros((3, 3), float)
+    e0 = ff0.compute(gpos0, vtens0)
+    gpos1 = np.zeros(system.pos.shape, float)
+    vtens1 = np.zeros((3, 3), float)
+    e1 = ff1.compute(gpos1, vtens1)
+    assert abs(e0 - e1) < 1e-10*abs(e0)
+    assert abs(gpos0 - gpos1).max() < 1e-10*abs(gpos0).max()
+    assert abs(vtens0 - vtens1).max() < 1e-10*abs(vtens0).max()
+    for name in 'dampdisp', 'exprep', 'ei':
+        part0 = getattr(ff0, 'part_pair_%s' % name)
+        part1 = [part for part in ff1.part_pair_fused.parts if part.name == part0.name][0]
+        assert abs(part0.energy - part1.energy) < 1e-10*abs(part0.energy)
+
+
+def test_generator_water32_nworker():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
+    ff0 = ForceField.generate(system, fn_pars)
+    ff1 = ForceField.generate(system, fn_pars, nworker=3)
+    assert ff1.nworker == 3
+    assert len(ff1.parts) == 7
+    gpos0 = np.zeros(system.pos.shape, float)
+    vtens0 = np.zeros((3, 3), float)
+    e0 = ff0.compute(gpos0, vtens0)
+    time0 = timer.parts['Valence'].total.cpu
+    gpos1 = np.zeros(system.pos.shape, float)
+    vtens1 = np.zeros((3, 3), float)
+    e1 = ff1.compute(gpos1, vtens1)
+    # The reduction is carried out in the same order as in the sequential code.
+    assert e0 == e1
+    assert (gpos0 == gpos1).all()
+    assert (vtens0 == vtens1).all()
+    for part0, part1 in zip(ff0.parts, ff1.parts):
+        assert part0.energy == part1.energy
+        assert (part0.gpos == part1.gpos).all()
+    # The time spent in the worker threads is added to the timer.
+    assert timer.parts['Valence'].total.cpu > time0
+    # Only the energy
+    assert ff1.compute() == e0
+    # Change the number of workers
+    ff1.nworker = 2
+    assert ff1.compute() == e0
+    assert ff1._pool_size == 2
+    # Stop the worker threads, which are restarted when needed.
+    ff1.close()
+    assert ff1._pool is None
+    assert ff1.compute() == e0
+    ff1.close()
+
+
+def test_generator_water32_nworker_close():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
+    nthread = threading.active_count()
+    ff = ForceField.generate(system, fn_pars, nworker=3)
+    ff.compute()
+    assert threading.active_count() > nthread
+    ff.close()
+    assert threading.active_count() == nthread
+    # The threads are also stopped when the force field is garbage collected.
+    ff.compute()
+    assert threading.active_count() > nthread
+    if sys.version_info[0] > 2:
+        del ff
+        gc.collect()
+        assert threading.active_count() == nthread
+
+
+def test_generator_water32_nworker_invalid():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
+    with assert_raises(ValueError):
+        ForceField.generate(system, fn_pars, nworker=0)
+
+
 def test_generator_water32():
     system = get_system_water32()
     fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
@@ -930,3 +1044,25 @@ def test_generator_formaldehyde_oopangle():
     assert (part_valence.vlist.vtab['kind'][0:3] == 5).all()
     assert abs(part_valence.vlist.vtab['par0'] - 1.0*kjmol).all() < 1e-10
     assert part_valence.vlist.nv == 3
+
+
+def test_compute_subset_water32():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
+    ff = ForceField.generate(system, fn_pars, rcut=9*angstrom, smooth_ei=True)
+    iatoms = np.array([9, 10, 11])
+    for irep in range(3):
+        # Energy before and after a random translation of one molecule
+        energies = []
+        for pos in system.pos.copy(), system.pos + np.random.normal(0, 0.3, 3)*np.isin(np.arange(system.natom), iatoms)[:,None]:
+            ff.update_pos(pos)
+            energies.append((ff.compute_subset(iatoms), ff.compute()))
+        delta_subset = energies[1][0] - energies[0][0]
+        delta_full = energies[1][1] - energies[0][1]
+        assert abs(delta_subset - delta_full) < 1e-8
+    # The pair parts only include interactions with the subset
+    ff.update_pos(system.pos)
+    ff.compute()
+    for part in ff.parts:
+        if isinstance(part, ForcePartPair):
+            assert abs(part.compute_subset(iatoms)) < abs(part.energy)
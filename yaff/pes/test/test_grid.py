@@ -25,8 +25,16 @@
 
 from __future__ import division
 
+import os
+
 import numpy as np
+from nose.tools import assert_raises
+
+from molmod.test.common import tmpdir
+
 from yaff import *
+from yaff.pes.ext import compute_grid3d, compute_grid3d_multi
+from yaff.pes.test.common import check_gpos_part
 
 
 def get_system_ne():
@@ -107,3 +115,139 @@ def test_grid_conincide():
         ff.update_pos(pos)
         e1 = ff.compute()
         assert abs(e0-e1) < 1e-10
+
+
+def get_system_mixture():
+    return System(
+        numbers=np.array([10, 18, 10, 18, 10]),
+        pos=np.random.uniform(-5, 15, (5, 3)),
+        ffatypes=['Ne', 'Ar', 'Ne', 'Ar', 'Ne'],
+        rvecs=np.array([[10.0, 0.0, 0.0], [1.0, 9.0, 0.0], [-1.0, 0.5, 11.0]]),
+    )
+
+
+def get_grids_smooth(system, shape):
+    # A smooth periodic function on the grid
+    frac = np.indices(shape).reshape(3, -1).T/np.array(shape)
+    grids = {}
+    for ffatype, phase in ('Ne', 0.3), ('Ar', 1.7):
+        values = np.sin(2*np.pi*frac[:,0] + phase)*np.cos(2*np.pi*(frac[:,1] - frac[:,2]))
+        grids[ffatype] = values.reshape(shape)
+    return grids
+
+
+def get_energy_smooth(system):
+    frac = np.dot(system.pos, system.cell.gvecs.T)
+    energy = 0.0
+    for iatom in range(system.natom):
+        phase = {'Ne': 0.3, 'Ar': 1.7}[system.get_ffatype(iatom)]
+        energy += np.sin(2*np.pi*frac[iatom,0] + phase)*np.cos(2*np.pi*(frac[iatom,1] - frac[iatom,2]))
+    return energy
+
+
+def test_grid_multi_trilinear():
+    np.random.seed(1)
+    system = get_system_mixture()
+    egrid = np.random.uniform(0, 1, (7, 8, 9))
+    for iatom in range(system.natom):
+        e0 = compute_grid3d(system.pos[iatom], system.cell, egrid)
+        e1 = compute_grid3d_multi(system.pos, np.array([iatom]), system.cell, egrid)
+        assert abs(e0 - e1) < 1e-12
+    e = compute_grid3d_multi(system.pos, np.array([1, 3]), system.cell, egrid)
+    assert abs(e - compute_grid3d(system.pos[1], system.cell, egrid)
+                 - compute_grid3d(system.pos[3], system.cell, egrid)) < 1e-12
+    assert compute_grid3d_multi(system.pos, np.zeros(0, int), system.cell, egrid) == 0.0
+
+
+def test_grid_multi_energies():
+    np.random.seed(2)
+    system = get_system_mixture()
+    egrid = np.random.uniform(0, 1, (7, 8, 9))
+    iatoms = np.array([4, 1, 3])
+    for tricubic in False, True:
+        energies = np.zeros(3)
+        e = compute_grid3d_multi(system.pos, iatoms, system.cell, egrid,
+                                 tricubic=tricubic, energies=energies)
+        assert abs(energies.sum() - e) < 1e-12
+        for i, iatom in enumerate(iatoms):
+            eref = compute_grid3d_multi(system.pos, iatoms[i:i+1], system.cell,
+                                        egrid, tricubic=tricubic)
+            assert abs(energies[i] - eref) < 1e-12
+
+
+def test_grid_multi_gpos_trilinear():
+    np.random.seed(3)
+    system = get_system_mixture()
+    shape = (7, 8, 9)
+    egrid = np.random.uniform(0, 1, shape)
+    # Put atoms in the middle of grid cells, away from kinks in the trilinear
+    # interpolation.
+    frac = (np.random.randint(0, 20, (system.natom, 3)) + 0.5)/np.array(shape)
+    system.pos[:] = np.dot(frac, system.cell.rvecs)
+    iatoms = np.arange(system.natom)
+    gpos = np.zeros(system.pos.shape)
+    compute_grid3d_multi(system.pos, iatoms, system.cell, egrid, gpos)
+    eps = 1e-6
+    for iatom in range(system.natom):
+        for icart in range(3):
+            pos = system.pos.copy()
+            pos[iatom, icart] += eps
+            ep = compute_grid3d_multi(pos, iatoms, system.cell, egrid)
+            pos[iatom, icart] -= 2*eps
+            em = compute_grid3d_multi(pos, iatoms, system.cell, egrid)
+            assert abs((ep - em)/(2*eps) - gpos[iatom, icart]) < 1e-6
+
+
+def test_grid_gpos_tricubic():
+    np.random.seed(4)
+    system = get_system_mixture()
+    grids = {'Ne': np.random.uniform(0, 1, (7, 8, 9)), 'Ar': np.random.uniform(0, 1, (5, 6, 4))}
+    part = ForcePartGrid(system, grids, tricubic=True)
+    check_gpos_part(system, part)
+
+
+def test_grid_tricubic_coincide():
+    np.random.seed(5)
+    system = get_system_mixture()
+    shape = (5, 6, 7)
+    egrid = np.random.uniform(0, 1, shape)
+    for i in range(20):
+        indexes = np.random.randint(-10, 20, 3)
+        pos = np.dot(indexes/np.array(shape), system.cell.rvecs).reshape(1, 3)
+        e = compute_grid3d_multi(pos, np.array([0]), system.cell, egrid, tricubic=True)
+        assert abs(e - egrid[tuple(indexes%shape)]) < 1e-10
+
+
+def test_grid_tricubic_accuracy():
+    np.random.seed(6)
+    system = get_system_mixture()
+    grids = get_grids_smooth(system, (20, 20, 20))
+    eref = get_energy_smooth(system)
+    e_linear = ForcePartGrid(system, grids).compute()
+    e_cubic = ForcePartGrid(system, grids, tricubic=True).compute()
+    assert abs(e_cubic - eref) < abs(e_linear - eref)
+    assert abs(e_cubic - eref) < 1e-2
+
+
+def test_grid_memmap():
+    system = get_system_mixture()
+    grids = get_grids_smooth(system, (10, 11, 12))
+    e0 = ForcePartGrid(system, grids, tricubic=True).compute()
+    with tmpdir(__name__, 'test_grid_memmap') as dirname:
+        fns = {}
+        for ffatype, grid in grids.items():
+            fns[ffatype] = os.path.join(dirname, '%s.npy' % ffatype)
+            np.save(fns[ffatype], grid)
+        part = ForcePartGrid(system, fns, tricubic=True)
+        assert isinstance(part.grids['Ne'], np.memmap)
+        assert not part.grids['Ne'].flags.writeable
+        gpos = np.zeros(system.pos.shape)
+        assert part.compute(gpos) == e0
+        assert (gpos != 0).all()
+        del part
+
+
+def test_grid_missing():
+    system = get_system_mixture()
+    with assert_raises(ValueError):
+        ForcePartGrid(system, {'Ne': np.zeros((2, 2, 2))})
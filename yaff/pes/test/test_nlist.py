@@ -317,3 +317,164 @@ def test_nlist_water32_6A_skin3A():
 def test_nlist_water32_10A_skin2A():
     system = get_system_water32()
     check_nlist_skin(system, 10*angstrom, 2*angstrom)
+
+
+def check_nlist_cell_list(system, rcut, skin=0, nlow=0, nhigh=-1):
+    nlist1 = NeighborList(system, skin, nlow, nhigh)
+    nlist1.request_rcut(rcut)
+    nlist1.update()
+    nlist2 = NeighborList(system, skin, nlow, nhigh, cell_list=True)
+    nlist2.request_rcut(rcut)
+    nlist2.update()
+    if nlow == 0 and nhigh == -1:
+        nlist2.check()
+    # Both neighbor lists must be identical, including the order of the rows.
+    assert nlist1.nneigh == nlist2.nneigh
+    assert (nlist1.neighs[:nlist1.nneigh] == nlist2.neighs[:nlist2.nneigh]).all()
+
+
+def test_nlist_cell_list_water32_4A():
+    check_nlist_cell_list(get_system_water32(), 4*angstrom)
+
+
+def test_nlist_cell_list_water32_9A_nlow_nhigh():
+    check_nlist_cell_list(get_system_water32(), 9*angstrom, nlow=12, nhigh=30)
+
+
+def test_nlist_cell_list_water32_222_6A_skin2A():
+    system = get_system_water32().supercell(2, 2, 2)
+    check_nlist_cell_list(system, 6*angstrom, 2*angstrom)
+
+
+def test_nlist_cell_list_graphene8_9A():
+    check_nlist_cell_list(get_system_graphene8(), 9*angstrom)
+
+
+def test_nlist_cell_list_polyethylene4_9A():
+    check_nlist_cell_list(get_system_polyethylene4(), 9*angstrom)
+
+
+def test_nlist_cell_list_quartz_20A():
+    check_nlist_cell_list(get_system_quartz(), 20*angstrom)
+
+
+def test_nlist_cell_list_glycine_9A():
+    check_nlist_cell_list(get_system_glycine(), 9*angstrom, nlow=3)
+
+
+def check_nlist_incremental(system, rcut, skin):
+    np.random.seed(1)
+    nlist1 = NeighborList(system, skin, incremental=True)
+    nlist1.request_rcut(rcut)
+    nlist1.update()
+    assert nlist1.get_stats()['rebuild_reasons'] == {'first update': 1}
+    for irep in range(4):
+        # Displace a few atoms, without triggering a rebuild
+        for i in np.random.choice(system.natom, 5, replace=False):
+            vec = np.random.normal(-1, 1, 3)
+            vec *= 0.1*skin/np.linalg.norm(vec)
+            system.pos[i] += vec
+        assert not nlist1._need_rebuild()
+        nlist1.update()
+        # Compare with a fresh neighbor list. The labels of the periodic
+        # images may differ, so only the pairs and distances are compared.
+        nlist2 = NeighborList(system)
+        nlist2.request_rcut(rcut)
+        nlist2.update()
+        pairs = []
+        for nlist in nlist1, nlist2:
+            neighs = nlist.neighs[:nlist.nneigh]
+            neighs = neighs[neighs['d'] < rcut]
+            pairs.append(np.array(sorted(zip(
+                np.maximum(neighs['a'], neighs['b']),
+                np.minimum(neighs['a'], neighs['b']),
+                neighs['d'].round(8),
+            ))))
+        assert pairs[0].shape == pairs[1].shape
+        assert abs(pairs[0] - pairs[1]).max() < 1e-8
+    # A larger displacement of one atom triggers a rebuild
+    system.pos[0] = nlist1._pos_old[0] + [0.0, 0.0, 0.55*skin]
+    assert nlist1._need_rebuild() == 'displacement'
+    nlist1.update()
+    stats = nlist1.get_stats()
+    assert stats['nupdate'] == 6
+    assert stats['nrebuild'] == 2
+    assert stats['nrecompute'] == 4
+    assert stats['rebuild_reasons'] == {'first update': 1, 'displacement': 1}
+    assert abs(stats['rebuild_fraction'] - 2.0/6.0) < 1e-10
+    assert stats['time_rebuild'] > 0
+    nlist1.reset_stats()
+    assert nlist1.get_stats()['nupdate'] == 0
+
+
+def test_nlist_incremental_quartz_6A_skin3A():
+    system = get_system_quartz()
+    check_nlist_incremental(system, 6*angstrom, 3*angstrom)
+
+
+def test_nlist_incremental_water32_9A_skin2A():
+    system = get_system_water32()
+    check_nlist_incremental(system, 9*angstrom, 2*angstrom)
+
+
+def test_nlist_stats_reasons():
+    system = get_system_water32()
+    nlist = NeighborList(system)
+    nlist.request_rcut(5*angstrom)
+    nlist.update()
+    nlist.update()
+    assert nlist.get_stats()['rebuild_reasons'] == {'no skin': 2}
+    nlist = NeighborList(system, skin=2*angstrom)
+    nlist.request_rcut(5*angstrom)
+    nlist.update()
+    nlist.update()
+    nlist.update_rmax()
+    nlist.update()
+    stats = nlist.get_stats()
+    assert stats['nrecompute'] == 1
+    assert stats['rebuild_reasons'] == {'first update': 1, 'cutoff or cell changed': 1}
+
+
+def check_nlist_subset(system, rcut, iatoms, nlow=0, nhigh=-1):
+    nlist = NeighborList(system, 0, nlow, nhigh)
+    nlist.request_rcut(rcut)
+    nlist.update()
+    nlist.update_subset(iatoms)
+    # The main neighbor list is not modified
+    assert nlist.nneigh >= nlist.subset_nneigh
+    # Pairs in the same image come first, sorted by a and b
+    neighs = nlist.subset_neighs[:nlist.subset_nneigh]
+    central = (neighs['r0'] == 0) & (neighs['r1'] == 0) & (neighs['r2'] == 0)
+    assert (neighs['a'][central] > neighs['b'][central]).all()
+    keys = neighs['a'][central]*system.natom + neighs['b'][central]
+    assert (keys[1:] > keys[:-1]).all()
+    # Compare with the pairs in the complete neighbor list that involve an
+    # atom of the subset.
+    insubset = np.zeros(system.natom, bool)
+    insubset[iatoms] = True
+    pairs = []
+    for neighs in nlist.neighs[:nlist.nneigh], nlist.subset_neighs[:nlist.subset_nneigh]:
+        neighs = neighs[insubset[neighs['a']] | insubset[neighs['b']]]
+        pairs.append(np.array(sorted(zip(
+            np.maximum(neighs['a'], neighs['b']),
+            np.minimum(neighs['a'], neighs['b']),
+            neighs['d'].round(8),
+        ))))
+    assert pairs[0].shape == pairs[1].shape
+    assert abs(pairs[0] - pairs[1]).max() < 1e-8
+
+
+def test_nlist_subset_water32_9A():
+    check_nlist_subset(get_system_water32(), 9*angstrom, [6, 7, 8])
+
+
+def test_nlist_subset_water32_9A_nlow_nhigh():
+    check_nlist_subset(get_system_water32(), 9*angstrom, [93, 94, 95], nlow=93, nhigh=93)
+
+
+def test_nlist_subset_quartz_20A():
+    check_nlist_subset(get_system_quartz(), 20*angstrom, [4, 1])
+
+
+def test_nlist_subset_graphene8_9A():
+    check_nlist_subset(get_system_graphene8(), 9*angstrom, [0, 5])
@@ -1475,3 +1475,109 @@ def test_pair_pot_eislater1sp1spcorr():
     # Check gradient and virial tensor
     check_gpos_part(system, part_pair, nlist)
     check_vtens_part(system, part_pair, nlist, symm_vtens=False)
+
+
+#
+# Multithreaded evaluation
+#
+
+
+def check_pair_pot_nthread(system, nlist, part_pair, nthread):
+    nlist.update()
+    gpos0 = np.zeros(system.pos.shape, float)
+    vtens0 = np.zeros((3, 3), float)
+    part_pair.nthread = 1
+    energy0 = part_pair.compute(gpos0, vtens0)
+    gpos1 = np.zeros(system.pos.shape, float)
+    vtens1 = np.zeros((3, 3), float)
+    part_pair.nthread = nthread
+    energy1 = part_pair.compute(gpos1, vtens1)
+    assert abs(energy0 - energy1) < 1e-10*abs(energy0)
+    assert abs(gpos0 - gpos1).max() < 1e-10*abs(gpos0).max()
+    assert abs(vtens0 - vtens1).max() < 1e-10*abs(vtens0).max()
+    # Energy only
+    part_pair.nthread = nthread
+    assert abs(part_pair.compute() - energy0) < 1e-10*abs(energy0)
+
+
+def test_pair_pot_nthread_water32_9A_mm3():
+    system, nlist, scalings, part_pair, pair_fn = get_part_water32_9A_mm3()
+    for nthread in 2, 3, 8:
+        check_pair_pot_nthread(system, nlist, part_pair, nthread)
+
+
+def test_pair_pot_nthread_water32_14A_ei():
+    system, nlist, scalings, part_pair, pair_fn = get_part_water32_14A_ei()
+    check_pair_pot_nthread(system, nlist, part_pair, 4)
+
+
+def test_pair_pot_nthread_caffeine_ei1_10A():
+    system, nlist, scalings, part_pair, pair_fn = get_part_caffeine_ei1_10A()
+    for nthread in 2, 5, 1000:
+        check_pair_pot_nthread(system, nlist, part_pair, nthread)
+
+
+def test_pair_pot_nthread_invalid():
+    system, nlist, scalings, part_pair, pair_fn = get_part_water32_9A_mm3()
+    with assert_raises(ValueError):
+        ForcePartPair(system, nlist, scalings, part_pair.pair_pot, nthread=0)
+
+
+def get_parts_fused_caffeine_10A(nthread=1):
+    system = get_system_caffeine()
+    nlist = NeighborList(system)
+    rcut = 10*angstrom
+    scalings_ei = Scalings(system, 0.0, 0.5, 1.0)
+    scalings_mm3 = Scalings(system, 0.0, 0.0, 1.0)
+    # Random charges and MM3 parameters
+    rs = np.random.RandomState(7)
+    charges = rs.uniform(-1, 1, system.natom)
+    charges -= charges.mean()
+    radii = rs.uniform(0.5, 1.0, system.natom)
+    sigmas = rs.uniform(1.5, 2.0, system.natom)*angstrom
+    epsilons = rs.uniform(0.1, 0.2, system.natom)*kcalmol
+    onlypaulis = np.zeros(system.natom, np.int32)
+    part_ei = ForcePartPair(system, nlist, scalings_ei, PairPotEI(charges, 0.2, rcut, radii=radii))
+    part_mm3 = ForcePartPair(system, nlist, scalings_mm3, PairPotMM3(sigmas, epsilons, onlypaulis, rcut-1*angstrom, Switch3(2*angstrom)))
+    part_lj = ForcePartPair(system, nlist, scalings_ei, PairPotLJ(sigmas, epsilons, rcut, Hammer(1*angstrom)))
+    parts = [part_ei, part_mm3, part_lj]
+    part_fused = ForcePartPairFused(system, nlist, parts, nthread)
+    nlist.update()
+    return system, nlist, parts, part_fused
+
+
+def test_pair_pot_fused_caffeine_10A():
+    for nthread in 1, 3:
+        system, nlist, parts, part_fused = get_parts_fused_caffeine_10A(nthread)
+        gpos0 = np.zeros(system.pos.shape, float)
+        vtens0 = np.zeros((3, 3), float)
+        energies0 = [part.compute(gpos0, vtens0) for part in parts]
+        gpos1 = np.zeros(system.pos.shape, float)
+        vtens1 = np.zeros((3, 3), float)
+        energy1 = part_fused.compute(gpos1, vtens1)
+        assert abs(sum(energies0) - energy1) < 1e-10*abs(energy1)
+        for part, energy0 in zip(parts, energies0):
+            assert abs(part.energy - energy0) < 1e-10*abs(energy0)
+        assert abs(part_fused.energies - energies0).max() < 1e-10*abs(energy1)
+        assert abs(gpos0 - gpos1).max() < 1e-10*abs(gpos0).max()
+        assert abs(vtens0 - vtens1).max() < 1e-10*abs(vtens0).max()
+        # Energy only
+        assert abs(part_fused.compute() - energy1) < 1e-10*abs(energy1)
+
+
+def test_pair_pot_fused_caffeine_10A_gpos_vtens():
+    system, nlist, parts, part_fused = get_parts_fused_caffeine_10A()
+    check_gpos_part(system, part_fused, nlist)
+    check_vtens_part(system, part_fused, nlist)
+
+
+def test_pair_pot_fused_invalid():
+    system, nlist, parts, part_fused = get_parts_fused_caffeine_10A()
+    with assert_raises(ValueError):
+        ForcePartPairFused(system, nlist, parts, nthread=0)
+    with assert_raises(ValueError):
+        ForcePartPairFused(system, nlist, [])
+    with assert_raises(ValueError):
+        ForcePartPairFused(system, NeighborList(system), parts)
+    with assert_raises(TypeError):
+        ForcePartPairFused(system, nlist, [part_fused])
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+
+from __future__ import division
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pkg_resources
+from nose.plugins.skip import SkipTest
+
+from molmod import angstrom
+
+from yaff.test.common import get_system_water32
+
+from yaff import *
+
+
+def check_gil_release(fn, nrep=10):
+    '''Check that a Python thread makes progress while ``fn`` is running
+
+       Forced switches between threads are disabled by setting a very long
+       switch interval. The second thread can then only run when the calling
+       thread voluntarily releases the GIL, i.e. in the body of ``fn``. This
+       does not depend on the timing or the load of the machine, except that
+       the second thread may not be woken up during a single call of ``fn``.
+       Hence, ``fn`` is called up to ``nrep`` times.
+    '''
+    if not hasattr(sys, 'getswitchinterval'):
+        raise SkipTest('The switch interval can not be controlled in Python 2.')
+    go = threading.Event()
+    progress = []
+    def work():
+        go.wait()
+        progress.append(True)
+    thread = threading.Thread(target=work)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(100.0)
+    try:
+        thread.start()
+        # Let the thread (and any other thread with a pending switch request)
+        # run until it waits for the event.
+        time.sleep(0.05)
+        go.set()
+        for irep in range(nrep):
+            fn()
+            if len(progress) > 0:
+                break
+        released = len(progress) > 0
+    finally:
+        sys.setswitchinterval(interval)
+        go.set()
+        thread.join()
+    assert released
+
+
+def check_gil_kept(fn):
+    '''The opposite of check_gil_release, to test the test'''
+    try:
+        check_gil_release(fn, nrep=1)
+    except AssertionError:
+        return
+    raise AssertionError('The GIL was released.')
+
+
+def test_check_gil_release():
+    check_gil_release(lambda: time.sleep(0.01))
+    def busy():
+        counter = 0
+        for i in range(100000):
+            counter += 1
+    check_gil_kept(busy)
+
+
+def get_large_water():
+    return get_system_water32().supercell(2, 2, 2)
+
+
+def test_gil_release_cell_compute_distances():
+    cell = Cell(np.identity(3)*20.0)
+    pos = np.random.uniform(0, 20, (500, 3))
+    output = np.zeros(27*500*499//2)
+    check_gil_release(lambda: cell.compute_distances(output, pos, nimage=1))
+
+
+def test_gil_release_nlist_build():
+    system = get_large_water()
+    nlist = NeighborList(system)
+    nlist.request_rcut(10*angstrom)
+    check_gil_release(nlist.update)
+
+
+def test_gil_release_pair_pot():
+    system = get_large_water()
+    nlist = NeighborList(system)
+    scalings = Scalings(system, 0.0, 0.0, 0.5)
+    pair_pot = PairPotLJ(
+        np.random.uniform(2.0, 3.0, system.natom),
+        np.random.uniform(1e-4, 2e-4, system.natom),
+        10*angstrom)
+    part = ForcePartPair(system, nlist, scalings, pair_pot)
+    nlist.update()
+    gpos = np.zeros(system.pos.shape)
+    vtens = np.zeros((3, 3))
+    def fn():
+        for irep in range(5):
+            pair_pot.compute(nlist.neighs, scalings.stab, gpos, vtens, nlist.nneigh)
+    check_gil_release(fn)
+
+
+def get_ff_water32():
+    system = get_system_water32()
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_water.txt')
+    return ForceField.generate(system, fn_pars)
+
+
+def compute_threaded(ffs):
+    results = [None]*len(ffs)
+    def compute(iff):
+        gpos = np.zeros(ffs[iff].system.pos.shape)
+        vtens = np.zeros((3, 3))
+        energy = ffs[iff].compute(gpos, vtens)
+        results[iff] = energy, gpos, vtens
+    threads = [threading.Thread(target=compute, args=(iff,)) for iff in range(len(ffs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_two_force_fields_two_threads():
+    ffs = [get_ff_water32(), get_ff_water32()]
+    ffs[1].system.pos[:] += np.random.normal(0.0, 0.05, ffs[1].system.pos.shape)*angstrom
+    ffs[1].update_pos(ffs[1].system.pos)
+    expected = []
+    for ff in ffs:
+        gpos = np.zeros(ff.system.pos.shape)
+        vtens = np.zeros((3, 3))
+        energy = ff.compute(gpos, vtens)
+        expected.append((energy, gpos, vtens))
+    results = compute_threaded(ffs)
+    for (e0, gpos0, vtens0), (e1, gpos1, vtens1) in zip(expected, results):
+        assert e0 == e1
+        assert (gpos0 == gpos1).all()
+        assert (vtens0 == vtens1).all()
+
+
+def test_two_force_fields_two_threads_speedup():
+    # Timing checks fail easily on loaded machines, so this one is only carried
+    # out when the environment variable YAFF_TIMING_TESTS is set.
+    if 'YAFF_TIMING_TESTS' not in os.environ:
+        raise SkipTest('Set YAFF_TIMING_TESTS to run timing checks.')
+    if multiprocessing.cpu_count() < 2:
+        raise SkipTest('A speedup can only be measured with at least two CPUs.')
+    ffs = [get_ff_water32(), get_ff_water32()]
+    for ff in ffs:
+        ff.compute()
+    time_seq = None
+    time_par = None
+    for irep in range(3):
+        begin = time.time()
+        for ff in ffs:
+            ff.compute(np.zeros(ff.system.pos.shape), np.zeros((3, 3)))
+        end = time.time()
+        if time_seq is None or end - begin < time_seq:
+            time_seq = end - begin
+        begin = time.time()
+        compute_threaded(ffs)
+        end = time.time()
+        if time_par is None or end - begin < time_par:
+            time_par = end - begin
+    assert time_par < 0.9*time_seq
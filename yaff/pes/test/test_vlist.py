@@ -29,12 +29,14 @@ from __future__ import print_function
 import numpy as np
 from molmod import bend_angle, bend_cos, dihed_angle, dihed_cos
 from nose.plugins.skip import SkipTest
+from nose.tools import assert_raises
 
 from yaff import *
 
 from yaff.test.common import get_system_quartz, get_system_water32, \
     get_system_2T, get_system_peroxide, get_system_mil53, get_system_formaldehyde
 from yaff.pes.test.common import check_gpos_part, check_vtens_part
+from yaff.pes.iclist import SqOopDist
 
 
 def test_vlist_quartz_bonds():
@@ -1001,3 +1003,143 @@ def test_gpos_vtens_pointlinedist_water32():
         part.add_term(Harmonic(0.3, 1.7, PointLineDistance(i,j,k)))
     check_gpos_part(system, part)
     check_vtens_part(system, part)
+
+
+def add_mixed_terms_mil53(system, part):
+    # Add terms in an order where the kinds of the terms and the internal
+    # coordinates are mixed.
+    bonds = list(system.iter_bonds())
+    angles = list(system.iter_angles())
+    diheds = list(system.iter_dihedrals())
+    oops = list(system.iter_oops())
+    for counter, (i, j) in enumerate(bonds):
+        part.add_term([
+            Harmonic(0.3, 2.0, Bond(i, j)),
+            Fues(0.3, 2.0, Bond(i, j)),
+            MM3Quartic(0.3, 2.0, Bond(i, j)),
+            Morse(0.1, 1.5, 2.0, Bond(i, j)),
+            BondDoubleWell(0.1, 1.9, 2.1, Bond(i, j)),
+            PolyFour([0.1, -0.2, 0.01, 0.001], Bond(i, j)),
+        ][counter%6])
+    for counter, (i, j, k) in enumerate(angles):
+        part.add_term([
+            Harmonic(0.2, 1.9, BendAngle(i, j, k)),
+            MM3Bend(0.2, 1.9, BendAngle(i, j, k)),
+            Harmonic(0.2, -0.3, BendCos(i, j, k)),
+            Harmonic(0.1, 4.0, UreyBradley(i, j, k)),
+            Cross(0.1, 2.0, 1.9, Bond(i, j), BendAngle(i, j, k)),
+            PolySix([0.1, -0.1, 0.01, 0.02, 0.001, 0.0001], BendCos(i, j, k)),
+            Poly4(0.1, 0.2, 0.1, 0.05, 0.01, 1.9, BendAngle(i, j, k)),
+            Harmonic(0.1, 0.5, SqPointLineDistance(i, k, j)),
+            Harmonic(0.1, 0.5, PointLineDistance(i, k, j)),
+        ][counter%9])
+    for counter, (i, j, k, l) in enumerate(diheds):
+        part.add_term([
+            Cosine(2, 0.01, 0.3, DihedAngle(i, j, k, l)),
+            Chebychev1(0.01, DihedCos(i, j, k, l)),
+            Chebychev2(0.01, DihedCos(i, j, k, l)),
+            Chebychev3(0.01, DihedCos(i, j, k, l)),
+            Chebychev4(0.01, DihedCos(i, j, k, l)),
+            Chebychev6(0.01, DihedCos(i, j, k, l)),
+            Harmonic(0.01, 0.1, DihedCos2(i, j, k, l)),
+            Harmonic(0.01, 0.1, DihedCos3(i, j, k, l)),
+            Harmonic(0.01, 0.1, DihedCos4(i, j, k, l)),
+            Harmonic(0.01, 0.1, DihedCos6(i, j, k, l)),
+        ][counter%10])
+    for counter, (i, j, k, l) in enumerate(oops):
+        part.add_term([
+            Harmonic(0.1, 1.0, OopCos(i, j, k, l)),
+            Harmonic(0.1, 1.0, OopMeanCos(i, j, k, l)),
+            Harmonic(0.1, 0.1, OopAngle(i, j, k, l)),
+            Harmonic(0.1, 0.1, OopMeanAngle(i, j, k, l)),
+            Harmonic(0.1, 0.1, OopDist(i, j, k, l)),
+            Harmonic(0.1, 0.1, SqOopDist(i, j, k, l)),
+        ][counter%6])
+
+
+def get_system_distorted_mil53():
+    # In the symmetric geometry, the gradient of the dihedral terms vanishes
+    # and the out-of-plane distances are zero, where OopDist is not
+    # differentiable. The geometry is distorted for the gradient checks.
+    system = get_system_mil53()
+    rng = np.random.RandomState(1)
+    system.pos += rng.normal(0.0, 0.1, system.pos.shape)*angstrom
+    return system
+
+
+def get_parts_nthread_mil53(options):
+    # Valence parts with the same terms, for a distorted geometry. The keyword
+    # arguments for each part are given in options.
+    system = get_system_distorted_mil53()
+    parts = [ForcePartValence(system, **kwargs) for kwargs in options]
+    for part in parts:
+        add_mixed_terms_mil53(system, part)
+    return system, parts
+
+
+def test_gpos_vtens_mixed_mil53():
+    system = get_system_distorted_mil53()
+    part = ForcePartValence(system)
+    add_mixed_terms_mil53(system, part)
+    check_gpos_part(system, part)
+    check_vtens_part(system, part)
+
+
+def test_vlist_nthread_mil53():
+    system, parts = get_parts_nthread_mil53([{}, {'nthread': 3}, {'nthread': 1}])
+    # All kinds of terms and internal coordinates must be present.
+    assert (np.unique(parts[0].vlist.vtab['kind'][:parts[0].vlist.nv]) == np.arange(16)).all()
+    assert (np.unique(parts[0].iclist.ictab['kind'][:parts[0].iclist.nic]) == np.arange(18)).all()
+    # Threads can also be configured after construction.
+    parts[2].nthread = 4
+    assert parts[2].dlist.nthread == 4
+    assert parts[2].iclist.nthread == 4
+    assert parts[2].vlist.nthread == 4
+    results = []
+    for part in parts:
+        gpos = np.zeros(system.pos.shape, float)
+        vtens = np.zeros((3, 3), float)
+        energy = part.compute(gpos, vtens)
+        results.append((energy, gpos, vtens, part.iclist.ictab[:part.iclist.nic].copy(),
+                        part.dlist.deltas[:part.dlist.ndelta].copy()))
+    energy0, gpos0, vtens0, ictab0, deltas0 = results[0]
+    for energy1, gpos1, vtens1, ictab1, deltas1 in results[1:]:
+        assert abs(energy0 - energy1) < 1e-10
+        assert abs(gpos0 - gpos1).max() < 1e-10
+        assert abs(vtens0 - vtens1).max() < 1e-10
+        assert (ictab0['value'] == ictab1['value']).all()
+        assert abs(ictab0['grad'] - ictab1['grad']).max() < 1e-10
+        for key in 'dx', 'dy', 'dz':
+            assert (deltas0[key] == deltas1[key]).all()
+        for key in 'gx', 'gy', 'gz':
+            assert abs(deltas0[key] - deltas1[key]).max() < 1e-10
+
+
+def test_vlist_nthread_more_than_rows():
+    # Some threads get an empty part of the tables.
+    system = get_system_water32()
+    part = ForcePartValence(system, nthread=8)
+    part_ref = ForcePartValence(system)
+    for p in part, part_ref:
+        p.add_term(Harmonic(0.3, 1.8, Bond(0, 1)))
+        p.add_term(Harmonic(0.3, 1.8, Bond(0, 2)))
+    gpos = np.zeros(system.pos.shape, float)
+    gpos_ref = np.zeros(system.pos.shape, float)
+    assert abs(part.compute(gpos) - part_ref.compute(gpos_ref)) < 1e-10
+    assert abs(gpos - gpos_ref).max() < 1e-10
+
+
+def test_vlist_nthread_invalid():
+    system = get_system_water32()
+    with assert_raises(ValueError):
+        ForcePartValence(system, nthread=0)
+    part = ForcePartValence(system)
+    with assert_raises(ValueError):
+        part.nthread = 0
+    assert part.nthread == 1
+
+
+def test_gpos_vtens_nthread_mil53():
+    system, parts = get_parts_nthread_mil53([{'nthread': 3}])
+    check_gpos_part(system, parts[0])
+    check_vtens_part(system, parts[0])
@@ -264,6 +264,69 @@ void vlist_back(iclist_row_type* ictab, vlist_row_type* vtab, long nv) {
   }
 }
 
+// Multithreaded evaluation
+// ------------------------
+//
+// The table is split into nthread contiguous chunks that are processed by
+// different OpenMP threads. In the forward step, the energies of the chunks
+// are independent and are added up at the end. In the back step, terms in
+// different chunks may contribute to the same internal coordinate. Therefore,
+// each thread except the first one works on a private copy of the internal
+// coordinates (a slice of work with size nic), with gradients initialized to
+// zero. These gradients are added to ictab at the end. When Yaff is compiled
+// without OpenMP support, the chunks are processed sequentially.
+
+double vlist_forward_parallel(iclist_row_type* ictab, vlist_row_type* vtab,
+                              long nv, int nthread) {
+  long ithread, begin, end;
+  double energy;
+  energy = 0.0;
+#ifdef _OPENMP
+  #pragma omp parallel for num_threads(nthread) schedule(static,1) private(begin, end) reduction(+:energy)
+#endif
+  for (ithread=0; ithread<nthread; ithread++) {
+    begin = (nv*ithread)/nthread;
+    end = (nv*(ithread+1))/nthread;
+    energy += vlist_forward(ictab, vtab + begin, end - begin);
+  }
+  return energy;
+}
+
+void vlist_back_parallel(iclist_row_type* ictab, vlist_row_type* vtab,
+                         long nv, long nic, iclist_row_type* work,
+                         int nthread) {
+  long ithread, k, begin, end;
+  iclist_row_type *my_ictab;
+#ifdef _OPENMP
+  #pragma omp parallel for num_threads(nthread) schedule(static,1) private(k, begin, end, my_ictab)
+#endif
+  for (ithread=0; ithread<nthread; ithread++) {
+    begin = (nv*ithread)/nthread;
+    end = (nv*(ithread+1))/nthread;
+    if (ithread == 0) {
+      my_ictab = ictab;
+    } else {
+      // Only the values are copied. The gradients in the original table are
+      // being updated by the first thread.
+      my_ictab = work + nic*(ithread-1);
+      for (k=0; k<nic; k++) {
+        my_ictab[k].value = ictab[k].value;
+        my_ictab[k].grad = 0.0;
+      }
+    }
+    vlist_back(my_ictab, vtab + begin, end - begin);
+  }
+  // Reduction of the gradients.
+#ifdef _OPENMP
+  #pragma omp parallel for num_threads(nthread) private(ithread)
+#endif
+  for (k=0; k<nic; k++) {
+    for (ithread=1; ithread<nthread; ithread++) {
+      ictab[k].grad += work[nic*(ithread-1) + k].grad;
+    }
+  }
+}
+
 typedef void (*v_hessian_type)(vlist_row_type*, iclist_row_type*, long nic, double* hessian);
 
 void hessian_harmonic(vlist_row_type* term, iclist_row_type* ictab, long nic, double* hessian) {
@@ -38,5 +38,10 @@ typedef struct {
 
 double vlist_forward(iclist_row_type* ictab, vlist_row_type* vtab, long nv);
 void vlist_back(iclist_row_type* ictab, vlist_row_type* vtab, long nv);
+double vlist_forward_parallel(iclist_row_type* ictab, vlist_row_type* vtab,
+                              long nv, int nthread);
+void vlist_back_parallel(iclist_row_type* ictab, vlist_row_type* vtab,
+                         long nv, long nic, iclist_row_type* work,
+                         int nthread);
 
 #endif
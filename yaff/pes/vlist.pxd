@@ -32,5 +32,10 @@ cdef extern from "vlist.h":
         long ic0, ic1
         double energy
 
-    double vlist_forward(iclist.iclist_row_type* ictab, vlist_row_type* vtab, long nv)
-    void vlist_back(iclist.iclist_row_type* ictab, vlist_row_type* vtab, long nv)
+    double vlist_forward(iclist.iclist_row_type* ictab, vlist_row_type* vtab, long nv) nogil
+    void vlist_back(iclist.iclist_row_type* ictab, vlist_row_type* vtab, long nv) nogil
+    double vlist_forward_parallel(iclist.iclist_row_type* ictab, vlist_row_type* vtab,
+                                  long nv, int nthread) nogil
+    void vlist_back_parallel(iclist.iclist_row_type* ictab, vlist_row_type* vtab,
+                             long nv, long nic, iclist.iclist_row_type* work,
+                             int nthread) nogil
@@ -75,16 +75,23 @@ class ValenceList(object):
     '''Contains a complete list of all valence energy terms. Computations are
        carried out in coordination with an ``InternalCoordinateList`` object.
     '''
-    def __init__(self, iclist):
+    def __init__(self, iclist, nthread=1):
         '''
            **Arguments:**
 
            iclist
                 An instance of the ``InternalCoordinateList`` object.
+
+           **Optional arguments:**
+
+           nthread
+                The number of OpenMP threads used in the forward and back
+                steps. Each thread processes a contiguous part of the table.
         '''
         self.iclist = iclist
         self.vtab = np.zeros(10, vlist_dtype)
         self.nv = 0
+        self.nthread = nthread
 
     def add_term(self, term):
         '''Register a new covalent energy term
@@ -117,7 +124,10 @@ class ValenceList(object):
 
            The actual computation is carried out by a low-level C routine.
         """
-        return vlist_forward(self.iclist.ictab, self.vtab, self.nv)
+        if self.nthread > 1:
+            return vlist_forward(self.iclist.ictab, self.vtab, self.nv, nthread=self.nthread)
+        else:
+            return vlist_forward(self.iclist.ictab, self.vtab, self.nv)
 
     def back(self):
         """Compute the derivatives of the energy terms towards the internal
@@ -125,7 +135,10 @@ class ValenceList(object):
 
            The actual computation is carried out by a low-level C routine.
         """
-        vlist_back(self.iclist.ictab, self.vtab, self.nv)
+        if self.nthread > 1:
+            vlist_back(self.iclist.ictab, self.vtab, self.nv, nthread=self.nthread)
+        else:
+            vlist_back(self.iclist.ictab, self.vtab, self.nv)
 
     def lookup_atoms(self, row):
         """Look up the atom for a given row index."""
@@ -31,6 +31,9 @@ from yaff.sampling.io import *
 from yaff.sampling.iterative import *
 from yaff.sampling.mc import *
 from yaff.sampling.mcutils import *
+from yaff.sampling.mcff import *
+from yaff.sampling.mcgrid import *
+from yaff.sampling.mcparallel import *
 from yaff.sampling.mctrials import *
 from yaff.sampling.npt import *
 from yaff.sampling.opt import *
@@ -31,7 +31,7 @@ import h5py as h5
 
 from molmod.constants import boltzmann
 
-from yaff.pes.bias import GaussianHills
+from yaff.pes.bias import GaussianHills, GridGaussianHills
 from yaff.pes.ff import ForcePartBias
 from yaff.sampling.iterative import Hook
 from yaff.log import log, timer
@@ -46,8 +46,11 @@ class MTDHook(Hook):
     """
     Metadynamics simulations
     """
+    state_keys = ()
+
     def __init__(self, ff, cv, sigma, K, f=None, start=0, step=1,
-                 restart_file=None, tempering=0, periodicities=None, comlist=None):
+                 restart_file=None, tempering=0, periodicities=None, comlist=None,
+                 bounds=None, npoints=None):
         """
            **Arguments:**
 
@@ -94,8 +97,26 @@ class MTDHook(Hook):
                 An optional layer to derive centers of mass from the atomic positions.
                 These centers of mass are used as input for the first layer, the relative
                 vectors.
+
+           bounds
+                When given, the hills are accumulated on a grid with these
+                bounds, see ``GridGaussianHills``. The cost of the bias then
+                no longer grows with the number of hills. Outside the grid,
+                the bias is constant along non-periodic collective variables,
+                so it no longer pushes the system. The run continues, but a
+                warning is printed. Choose bounds that cover the region of
+                interest with some margin.
+
+           npoints
+                The number of grid points for each collective variable. Only
+                used in combination with ``bounds``.
         """
-        self.hills = GaussianHills(cv, sigma, periodicities=periodicities)
+        if bounds is None:
+            self.hills = GaussianHills(cv, sigma, periodicities=periodicities)
+        else:
+            if npoints is None:
+                raise ValueError('The number of grid points must be given together with the bounds.')
+            self.hills = GridGaussianHills(cv, sigma, bounds, npoints, periodicities=periodicities)
         self.K = K
         self.f = f
         self.tempering = tempering
@@ -118,8 +139,7 @@ class MTDHook(Hook):
             K = restart_file['hills/K'][:]
             self.hills.add_hills(q0, K)
             if self.f is not None:
-                for istep in range(q0.shape[0]):
-                    self.dump_h5(q0[istep], K[istep])
+                self.dump_h5(q0, K)
         Hook.__init__(self, start, step)
 
     def __call__(self, iterative):
@@ -135,7 +155,9 @@ class MTDHook(Hook):
             self.dump_h5(q0s, K)
 
     def dump_h5(self, q0s, K):
-        # Write to HDF5 file
+        '''Write one hill, or an array of hills, to the HDF5 file'''
+        q0s = np.asarray(q0s, dtype=float).reshape(-1, self.hills.ncv)
+        K = np.asarray(K, dtype=float).reshape(-1)
         if 'hills' not in self.f:
             self.init_hills()
         hgrp = self.f['hills']
@@ -143,16 +165,18 @@ class MTDHook(Hook):
         row = min(hgrp[key].shape[0] for key in ['q0','K'] if key in hgrp.keys())
         for label, data in zip(['q0','K'], [q0s, K]):
             ds = hgrp[label]
-            if ds.shape[0] <= row:
+            if ds.shape[0] < row + data.shape[0]:
                 # Do not over-allocate. hdf5 works with chunks internally.
-                ds.resize(row+1, axis=0)
-            ds[row] = data
+                ds.resize(row + data.shape[0], axis=0)
+            ds[row:row + data.shape[0]] = data
 
     def init_hills(self):
         hgrp = self.f.create_group('hills')
         hgrp.create_dataset('sigma', data=self.hills.sigmas)
-        hgrp.create_dataset('q0', (0,self.hills.ncv), maxshape=(None,self.hills.ncv), dtype=float)
-        hgrp.create_dataset('K', (0,), maxshape=(None,), dtype=float)
+        # Chunks of 1024 hills keep the cost of resizing the datasets low.
+        hgrp.create_dataset('q0', (0,self.hills.ncv), maxshape=(None,self.hills.ncv),
+            chunks=(1024,self.hills.ncv), dtype=float)
+        hgrp.create_dataset('K', (0,), maxshape=(None,), chunks=(1024,), dtype=float)
         hgrp.attrs['tempering'] = self.tempering
         if self.hills.periodicities is not None:
             hgrp.create_dataset('periodicities', data=self.hills.periodicities)
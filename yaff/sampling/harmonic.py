@@ -31,12 +31,47 @@ import numpy as np
 from yaff.log import log
 from yaff.log import timer
 from yaff.sampling.dof import CartesianDOF, StrainCellDOF
+from yaff.sampling.utils import get_fork_context
 
 
 __all__ = ['estimate_hessian', 'estimate_cart_hessian', 'estimate_elastic']
 
 
-def estimate_hessian(dof, eps=1e-4):
+# Displacements (in units of eps) and the corresponding weights of the
+# gradients in the symmetric finite difference approximations, followed by the
+# common denominator of the weights.
+_stencils = {
+    2: ([1, -1], [1, -1], 2),
+    4: ([2, 1, -1, -2], [-1, 8, -8, 1], 12),
+}
+
+# The DOF object used by the worker processes of estimate_hessian. The workers
+# are always forked (see get_fork_context), such that each process inherits its
+# own copy when the pool is created. The DOF object cannot be pickled.
+_hessian_dof = None
+
+
+def _compute_hessian_row(dof, i, eps, order):
+    """Return the energies of the displaced geometries and the finite
+       difference approximation of row i of the Hessian."""
+    steps, weights, denominator = _stencils[order]
+    x1 = dof.x0.copy()
+    epots = []
+    row = 0.0
+    for step, weight in zip(steps, weights):
+        x1[i] = dof.x0[i] + step*eps
+        epot, gradient = dof.fun(x1, do_gradient=True)
+        epots.append(epot)
+        row = row + weight*gradient
+    return epots, row/(denominator*eps)
+
+
+def _compute_hessian_row_worker(args):
+    i, eps, order = args
+    return _compute_hessian_row(_hessian_dof, i, eps, order)
+
+
+def estimate_hessian(dof, eps=1e-4, order=2, nproc=1):
     """Estimate the Hessian using the symmetric finite difference approximation.
 
        **Arguments:**
@@ -48,35 +83,56 @@ def estimate_hessian(dof, eps=1e-4):
 
        eps
             The magnitude of the displacements
+
+       order
+            The order of the finite difference approximation: 2 (two
+            displacements per degree of freedom) or 4 (four displacements, at
+            +-eps and +-2*eps).
+
+       nproc
+            The number of processes over which the displacements are
+            distributed. Each process works with its own copy of the DOF
+            object and the underlying force field. The worker processes are
+            forked, which is not supported on Windows.
     """
+    global _hessian_dof
+    if order not in _stencils:
+        raise ValueError('The order of the finite differences must be 2 or 4.')
+    if nproc < 1:
+        raise ValueError('The number of processes must be at least one.')
     with log.section('HESS'), timer.section('Hessian'):
-        # Loop over all displacements
+        ndof = len(dof.x0)
+        if nproc > 1 and ndof > 1:
+            _hessian_dof = dof
+            try:
+                pool = get_fork_context().Pool(min(nproc, ndof))
+                try:
+                    results = pool.map(_compute_hessian_row_worker,
+                                       [(i, eps, order) for i in range(ndof)])
+                finally:
+                    pool.close()
+                    pool.join()
+            finally:
+                _hessian_dof = None
+        else:
+            results = [_compute_hessian_row(dof, i, eps, order) for i in range(ndof)]
+        dof.reset()
         if log.do_medium:
             log('The following displacements are computed:')
-            log('DOF     Dir Energy')
+            log('DOF    Step Energy')
             log.hline()
-        x1 = dof.x0.copy()
-        rows = np.zeros((len(x1), len(x1)), float)
-        for i in range(len(x1)):
-            x1[i] = dof.x0[i] + eps
-            epot, gradient_p = dof.fun(x1, do_gradient=True)
-            if log.do_medium:
-                log('% 7i pos %s' % (i, log.energy(epot)))
-            x1[i] = dof.x0[i] - eps
-            epot, gradient_m = dof.fun(x1, do_gradient=True)
-            if log.do_medium:
-                log('% 7i neg %s' % (i, log.energy(epot)))
-            rows[i] = (gradient_p-gradient_m)/(2*eps)
-            x1[i] = dof.x0[i]
-        dof.reset()
-        if log.do_medium:
+            steps = _stencils[order][0]
+            for i, (epots, row) in enumerate(results):
+                for step, epot in zip(steps, epots):
+                    log('% 7i %+4i %s' % (i, step, log.energy(epot)))
             log.hline()
+        rows = np.array([row for epots, row in results]).reshape(ndof, ndof)
 
         # Enforce symmetry and return
         return 0.5*(rows + rows.T)
 
 
-def estimate_cart_hessian(ff, eps=1e-4, select=None):
+def estimate_cart_hessian(ff, eps=1e-4, select=None, order=2, nproc=1):
     """Estimate the Cartesian Hessian with symmetric finite differences.
 
        **Arguments:**
@@ -92,12 +148,15 @@ def estimate_cart_hessian(ff, eps=1e-4, select=None):
        select
             A selection of atoms for which the hessian must be computed. If not
             given, the entire hessian is computed.
+
+       order, nproc
+            See :func:`estimate_hessian`.
     """
     dof = CartesianDOF(ff, select=select)
-    return estimate_hessian(dof, eps)
+    return estimate_hessian(dof, eps, order=order, nproc=nproc)
 
 
-def estimate_elastic(ff, eps=1e-4, do_frozen=False, ridge=1e-4):
+def estimate_elastic(ff, eps=1e-4, do_frozen=False, ridge=1e-4, order=2, nproc=1):
     """Estimate the elastic constants using the symmetric finite difference
        approximation.
 
@@ -122,6 +181,9 @@ def estimate_elastic(ff, eps=1e-4, do_frozen=False, ridge=1e-4):
             Threshold for the eigenvalues of the Cartesian Hessian. This only
             matters if ``do_frozen==False``.
 
+       order, nproc
+            See :func:`estimate_hessian`.
+
        The elastic constants are second order derivatives of the strain energy
        density with respect to uniform deformations. At the molecular scale,
        uniform deformations can be describe by a linear transformation of the
@@ -172,9 +234,9 @@ def estimate_elastic(ff, eps=1e-4, do_frozen=False, ridge=1e-4):
     dof = StrainCellDOF(ff, do_frozen=do_frozen)
     vol0 = cell.volume
     if do_frozen:
-        return estimate_hessian(dof, eps)/vol0
+        return estimate_hessian(dof, eps, order=order, nproc=nproc)/vol0
     else:
-        hessian = estimate_hessian(dof, eps)/vol0
+        hessian = estimate_hessian(dof, eps, order=order, nproc=nproc)/vol0
         # Do a VSA-like trick...
         i = (cell.nvec*(cell.nvec+1))//2
         h11 = hessian[:i, :i]
@@ -26,6 +26,14 @@
 
 from __future__ import division
 
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+import numpy as np
+
 from yaff.sampling.iterative import Hook, AttributeStateItem, PosStateItem, CellStateItem, ConsErrStateItem
 from yaff.sampling.nvt import NHCThermostat, NHCAttributeStateItem
 from yaff.sampling.npt import MTKBarostat, MTKAttributeStateItem, TBCombination
@@ -35,8 +43,113 @@ from yaff.sampling.mc import MC
 __all__ = ['HDF5Writer', 'MCHDF5Writer', 'XYZWriter', 'RestartWriter']
 
 
-class BaseHDF5Writer(Hook):
-    def __init__(self, f, start=0, step=1):
+class WriterThread(object):
+    """A background thread that carries out write operations in order"""
+    def __init__(self, max_pending):
+        """
+           **Argument:**
+
+           max_pending
+                The maximum number of write operations waiting in the queue.
+                When the queue is full, :meth:`submit` blocks until the thread
+                has caught up.
+        """
+        self.tasks = Queue(max_pending)
+        self.error = None
+        self.failed = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            # After a failure, the remaining tasks are discarded.
+            if not self.failed:
+                fn, args = task
+                try:
+                    fn(*args)
+                except Exception as e:
+                    self.error = e
+                    self.failed = True
+
+    def check(self):
+        """Raise the error of a failed write operation in the calling thread
+
+           Once a write operation failed, the error is raised on every call,
+           because all later tasks are discarded.
+        """
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, fn, *args):
+        """Schedule the call ``fn(*args)`` after all previously submitted calls"""
+        self.check()
+        self.tasks.put((fn, args))
+
+    def close(self):
+        """Wait until all write operations are done and stop the thread
+
+           The error of a failed write operation is raised after the thread
+           has stopped.
+        """
+        self.tasks.put(None)
+        self.thread.join()
+        self.check()
+
+
+class BaseWriter(Hook):
+    """Base class for hooks that can write their output in a background thread
+
+       In asynchronous mode, the hook only copies the data to be written and
+       hands it over to a :class:`WriterThread`, such that the iterative
+       algorithm is not blocked by slow file systems. The thread is closed in
+       :meth:`finalize`, i.e. at the end of each run, also when a write
+       operation failed. The next run then starts with a new thread.
+    """
+    # The maximum number of pending write operations in asynchronous mode
+    max_pending = 2
+
+    def __init__(self, start=0, step=1, async_write=False):
+        """
+           **Optional arguments:**
+
+           start
+                The first iteration at which this hook should be called.
+
+           step
+                The hook will be called every `step` iterations.
+
+           async_write
+                When True, the output is written in a background thread.
+        """
+        self.async_write = async_write
+        self.thread = None
+        Hook.__init__(self, start, step)
+
+    def write(self, fn, *args):
+        """Call ``fn(*args)``, in the writer thread in asynchronous mode
+
+           The arguments may not be modified after this call.
+        """
+        if not self.async_write:
+            fn(*args)
+            return
+        if self.thread is None:
+            self.thread = WriterThread(self.max_pending)
+        self.thread.submit(fn, *args)
+
+    def finalize(self, iterative):
+        if self.thread is not None:
+            thread, self.thread = self.thread, None
+            thread.close()
+
+
+class BaseHDF5Writer(BaseWriter):
+    def __init__(self, f, start=0, step=1, buffer_size=1, compression=None,
+                 async_write=False):
         """
            **Argument:**
 
@@ -50,13 +163,43 @@ class BaseHDF5Writer(Hook):
 
            step
                 The hook will be called every `step` iterations.
+
+           buffer_size
+                The number of iterations that are collected in memory before
+                they are written to the file in one slice per dataset. By
+                default, every iteration is written immediately. When larger
+                than one, the datasets are chunked along the time axis such
+                that a chunk contains (at most) `buffer_size` iterations. The
+                buffer is written at the end of each run, also when the run is
+                interrupted by an exception, or with an explicit call to
+                :meth:`flush`.
+
+           compression
+                A compression filter for the trajectory datasets, e.g. 'gzip'
+                or 'lzf'. See the h5py documentation for all options.
+
+           async_write
+                When True, the buffers are written to the file in a
+                background thread. A few buffers are used in turn, such that
+                the next iterations can be collected while a full buffer is
+                being written.
         """
+        if buffer_size < 1:
+            raise ValueError('The buffer size must be at least one.')
         self.f = f
-        Hook.__init__(self, start, step)
+        self.buffer_size = buffer_size
+        self.compression = compression
+        self.buffers = None
+        self.ibuffer = 0
+        self.nbuffer = 0
+        BaseWriter.__init__(self, start, step, async_write)
 
     def __call__(self, iterative):
         if 'trajectory' not in self.f:
             self.init_trajectory(iterative)
+        if self.buffer_size > 1 or self.async_write:
+            self.buffer_row(iterative)
+            return
         tgrp = self.f['trajectory']
         # determine the row to write the current iteration to. If a previous
         # iterations was not completely written, then the last row is reused.
@@ -72,9 +215,81 @@ class BaseHDF5Writer(Hook):
                 ds.resize(row+1, axis=0)
             ds[row] = item.value
 
+    def init_buffers(self, iterative):
+        # Preallocated buffers for every dataset in the trajectory. In
+        # asynchronous mode, the writer thread may still be writing the
+        # previous buffers, so these are not reused before the pending write
+        # operations are done.
+        if self.async_write:
+            nbuffers = self.max_pending + 2
+        else:
+            nbuffers = 1
+        tgrp = self.f['trajectory']
+        self.buffers = []
+        for ibuffer in range(nbuffers):
+            buffers = {}
+            for key in iterative.state:
+                if key in tgrp.keys():
+                    ds = tgrp[key]
+                    buffers[key] = np.zeros((self.buffer_size,) + ds.shape[1:], ds.dtype)
+            self.buffers.append(buffers)
+
+    def buffer_row(self, iterative):
+        if self.buffers is None:
+            self.init_buffers(iterative)
+        for key, buf in self.buffers[self.ibuffer].items():
+            value = iterative.state[key].value
+            if value is None:
+                # As in the unbuffered case, an iteration with missing values
+                # is not written. Its row is overwritten by the next one.
+                return
+            buf[self.nbuffer] = value
+        self.nbuffer += 1
+        if self.nbuffer == self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered iterations to the file
+
+           In asynchronous mode, the buffer is handed over to the writer
+           thread.
+        """
+        if self.nbuffer == 0:
+            return
+        self.write(self.write_buffers, self.buffers[self.ibuffer], self.nbuffer)
+        self.ibuffer = (self.ibuffer + 1) % len(self.buffers)
+        self.nbuffer = 0
+
+    def write_buffers(self, buffers, nrow):
+        tgrp = self.f['trajectory']
+        # Rows of an incompletely written iteration are overwritten, as in the
+        # unbuffered case.
+        row = min(tgrp[key].shape[0] for key in buffers)
+        for key, buf in buffers.items():
+            ds = tgrp[key]
+            ds.resize(row + nrow, axis=0)
+            ds[row:row + nrow] = buf[:nrow]
+
+    def finalize(self, iterative):
+        try:
+            self.flush()
+        finally:
+            BaseWriter.finalize(self, iterative)
+
     def dump_system(self, system, grp):
         system.to_hdf5(grp)
 
+    def get_chunks(self, item):
+        """Return the chunk shape of the dataset for a state item"""
+        if self.buffer_size == 1:
+            # Let h5py decide
+            return None
+        # Keep chunks below 1MB, but let them span many iterations such that
+        # time series of a single item can be read efficiently.
+        row_size = np.dtype(item.dtype).itemsize*int(np.prod(item.shape))
+        nrow = max(1, min(self.buffer_size, 1048576//max(row_size, 1)))
+        return (nrow,) + item.shape
+
     def init_trajectory(self, iterative):
         tgrp = self.f.create_group('trajectory')
         for key, item in iterative.state.items():
@@ -84,7 +299,9 @@ class BaseHDF5Writer(Hook):
                 continue
             maxshape = (None,) + item.shape
             shape = (0,) + item.shape
-            dset = tgrp.create_dataset(key, shape, maxshape=maxshape, dtype=item.dtype)
+            dset = tgrp.create_dataset(key, shape, maxshape=maxshape, dtype=item.dtype,
+                                       chunks=self.get_chunks(item),
+                                       compression=self.compression)
             for name, value in item.iter_attrs(iterative):
                tgrp.attrs[name] = value
 
@@ -104,14 +321,22 @@ class MCHDF5Writer(BaseHDF5Writer):
         # necessarily fixed during a simulation, so we can't just dump all
         # positions in a giant array as done during MD simulations
         if mc.current_configuration is not None:
-            grp = self.f.require_group("snapshots/%012d"%mc.counter)
-            self.dump_system(mc.current_configuration, grp)
+            system = mc.current_configuration
+            if self.async_write:
+                system = system.subsystem(np.arange(system.natom))
+            self.write(self.dump_snapshot, system, mc.counter)
         # The standard way of dumping simulation info to the trajectory group
         BaseHDF5Writer.__call__(self, mc)
 
+    def dump_snapshot(self, system, counter):
+        grp = self.f.require_group("snapshots/%012d"%counter)
+        self.dump_system(system, grp)
+
 
-class XYZWriter(Hook):
-    def __init__(self, fn_xyz, select=None, start=0, step=1):
+class XYZWriter(BaseWriter):
+    state_keys = ()
+
+    def __init__(self, fn_xyz, select=None, start=0, step=1, async_write=False):
         """
            **Argument:**
 
@@ -129,11 +354,14 @@ class XYZWriter(Hook):
 
            step
                 The hook will be called every `step` iterations.
+
+           async_write
+                When True, the frames are written in a background thread.
         """
         self.fn_xyz = fn_xyz
         self.select = select
         self.xyz_writer = None
-        Hook.__init__(self, start, step)
+        BaseWriter.__init__(self, start, step, async_write)
 
     def __call__(self, iterative):
         from molmod import angstrom
@@ -150,14 +378,17 @@ class XYZWriter(Hook):
         rvecs_string = " ".join([str(x[0]/angstrom) for x in rvecs.reshape((-1,1))])
         title = '%7i E_pot = %.10f    %s' % (iterative.counter, iterative.epot, rvecs_string)
         if self.select is None:
-            pos = iterative.ff.system.pos
+            pos = iterative.ff.system.pos.copy()
         else:
             pos = iterative.ff.system.pos[self.select]
-        self.xyz_writer.dump(title, pos)
+        self.write(self.xyz_writer.dump, title, pos)
 
 
-class RestartWriter(Hook):
-    def __init__(self, f, start=0, step=1000):
+class RestartWriter(BaseWriter):
+    # The restart state items are updated separately
+    state_keys = ()
+
+    def __init__(self, f, start=0, step=1000, async_write=False):
         """
             **Argument:**
 
@@ -171,11 +402,15 @@ class RestartWriter(Hook):
 
             step
                 The hook will be called every `step` iterations.
+
+            async_write
+                When True, the restart information is written in a background
+                thread.
         """
         self.f = f
         self.state = None
         self.default_state = None
-        Hook.__init__(self, start, step)
+        BaseWriter.__init__(self, start, step, async_write)
 
     def init_state(self, iterative):
         # Basic properties needed for the restart
@@ -231,22 +466,26 @@ class RestartWriter(Hook):
             self.dump_system(iterative.ff.system)
         if 'trajectory' not in self.f:
             self.init_trajectory(iterative)
-        tgrp = self.f['trajectory']
-        # determine the row to write the current iteration to. If a previous
-        # iterations was not completely written, then the last row is reused.
-        row = min(tgrp[key].shape[0] for key in self.state if key in tgrp.keys())
+        values = {}
         for key, item in self.state.items():
             if item.value is None:
                 continue
             if len(item.shape) > 0 and min(item.shape) == 0:
                 continue
-            if item.value is None:
-                continue
+            values[key] = np.copy(item.value)
+        self.write(self.write_row, values)
+
+    def write_row(self, values):
+        tgrp = self.f['trajectory']
+        # determine the row to write the current iteration to. If a previous
+        # iterations was not completely written, then the last row is reused.
+        row = min(tgrp[key].shape[0] for key in self.state if key in tgrp.keys())
+        for key, value in values.items():
             ds = tgrp[key]
             if ds.shape[0] <= row:
                 # do not over-allocate. hdf5 works with chunks internally.
                 ds.resize(row+1, axis=0)
-            ds[row] = item.value
+            ds[row] = value
 
     def dump_system(self, system):
         system.to_hdf5(self.f)
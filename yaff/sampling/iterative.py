@@ -32,7 +32,7 @@ from molmod.units import *
 
 from yaff import *
 
-from yaff.log import log, timer
+from yaff.log import log, timer, profiler
 from yaff.pes.ff import ForcePartValence, ForcePartPair
 from yaff.pes.ext import PairPotEI
 
@@ -104,14 +104,16 @@ class Iterative(object):
 
     def call_hooks(self):
         with timer.section('%s hooks' % self.log_name):
-            state_updated = False
             from yaff.sampling.io import RestartWriter
-            for hook in self.hooks:
-                if hook.expects_call(self.counter) and not (isinstance(hook, RestartWriter) and self.counter==self.counter0):
-                    if not state_updated:
-                        for item in self.state_list:
-                            item.update(self)
-                        state_updated = True
+            hooks = [
+                hook for hook in self.hooks
+                if hook.expects_call(self.counter) and not (isinstance(hook, RestartWriter) and self.counter==self.counter0)
+            ]
+            if len(hooks) > 0:
+                with profiler.section('State items'):
+                    update_state_items(self, hooks)
+            for hook in hooks:
+                with profiler.section('Hook %s' % hook.__class__.__name__):
                     if isinstance(hook, RestartWriter):
                         for item in hook.state_list:
                             item.update(self)
@@ -119,14 +121,17 @@ class Iterative(object):
 
     def run(self, nstep=None):
         with log.section(self.log_name), timer.section(self.log_name):
-            if nstep is None:
-                while True:
-                    if self.propagate():
-                        break
-            else:
-                for i in range(nstep):
-                    if self.propagate():
-                        break
+            try:
+                if nstep is None:
+                    while True:
+                        if self.propagate():
+                            break
+                else:
+                    for i in range(nstep):
+                        if self.propagate():
+                            break
+            finally:
+                finalize_hooks(self, self.hooks)
             self.finalize()
 
     def propagate(self):
@@ -137,6 +142,41 @@ class Iterative(object):
         raise NotImplementedError
 
 
+def update_state_items(iterative, hooks):
+    """Update the state items that are used by at least one of the hooks
+
+       Every state item is updated at most once. State items that are not
+       needed by any of the hooks keep their value of the last update.
+    """
+    keys = set()
+    for hook in hooks:
+        if hook.state_keys is None:
+            items = iterative.state_list
+            break
+        keys.update(hook.state_keys)
+    else:
+        items = [item for item in iterative.state_list if item.key in keys]
+    for item in items:
+        item.update(iterative)
+
+
+def finalize_hooks(iterative, hooks):
+    """Call the finalize method of all hooks
+
+       All hooks are finalized, also when some of them raise an exception. The
+       first exception is raised again after all hooks are finalized.
+    """
+    error = None
+    for hook in hooks:
+        try:
+            hook.finalize(iterative)
+        except Exception as e:
+            if error is None:
+                error = e
+    if error is not None:
+        raise error
+
+
 class StateItem(object):
     def __init__(self, key):
         self.key = key
@@ -420,6 +460,9 @@ class Hook(object):
     name = None
     kind = None
     method = None
+    # The keys of the state items used by the hook. When None, all state
+    # items are updated before the hook is called.
+    state_keys = None
     def __init__(self, start=0, step=1):
         """
            **Optional arguments:**
@@ -438,3 +481,7 @@ class Hook(object):
 
     def __call__(self, iterative):
         raise NotImplementedError
+
+    def finalize(self, iterative):
+        """Called at the end of a run, also when the run is interrupted by an exception"""
+        pass
@@ -40,7 +40,6 @@
         * Complete NPT MC simulator
         * Variable cell shape simulations?
         * Hybrid MD/MC
-        * Tabulating the external potential
 '''
 
 
@@ -50,13 +49,16 @@ import numpy as np
 
 from molmod import boltzmann, femtosecond, angstrom, kelvin, bar
 
-from yaff.log import log, timer
+from yaff.log import log, timer, profiler
 from yaff.pes.ff import ForceField, \
     ForcePartEwaldReciprocalInteraction
 from yaff.pes.ext import Cell
 from yaff.sampling.mcutils import *
+from yaff.sampling.mcgrid import compute_host_grids, get_grid_external_potential
+from yaff.sampling.mcff import GuestForceField
 from yaff.sampling import mctrials
-from yaff.sampling.iterative import AttributeStateItem
+from yaff.sampling.iterative import AttributeStateItem, update_state_items, \
+    finalize_hooks
 from yaff.system import System
 
 
@@ -92,19 +94,18 @@ class MC(object):
     def call_hooks(self):
         # Initialize hooks
         with timer.section('%s hooks' % self.log_name):
-            state_updated = False
-            for hook in self.hooks:
-                if hook.expects_call(self.counter):
-                    if not state_updated:
-                        for item in self.state_list:
-                            item.update(self)
-                        state_updated = True
+            hooks = [hook for hook in self.hooks if hook.expects_call(self.counter)]
+            if len(hooks) > 0:
+                with profiler.section('State items'):
+                    update_state_items(self, hooks)
+            for hook in hooks:
+                with profiler.section('Hook %s' % hook.__class__.__name__):
                     hook(self)
 
     def run(self, nsteps, mc_moves=None, initial=None, einit=0,
                 translation_stepsize=1.0*angstrom,
                 volumechange_stepsize=10.0*angstrom**3,
-                close_contact=0.4*angstrom):
+                close_contact=0.4*angstrom, ncandidates=10, counter=0):
         """
            Perform Monte-Carlo steps
 
@@ -136,6 +137,16 @@ class MC(object):
            close_contact
                 Automatically reject TrialMove if atoms are placed shorter
                 than this distance apart
+
+           ncandidates
+                The number of candidate positions of a guest in a
+                TrialCbmcinsertion or TrialCbmcdeletion
+
+           counter
+                The value of the step counter at the start. When nonzero, the
+                run continues a previous one: the hooks are not called for the
+                initial configuration, as this was already done at the end of
+                the previous run.
         """
         if log.do_warning:
             log.warn("Currently, Yaff does not consider interactions of a guest molecule "
@@ -147,16 +158,21 @@ class MC(object):
             self.translation_stepsize = translation_stepsize
             self.volumechange_stepsize = volumechange_stepsize
             self.close_contact = close_contact
+            self.ncandidates = ncandidates
             if initial is not None:
                 self.N = initial.natom//self.guest.natom
                 assert self.guest.natom*self.N==initial.natom, ("Initial configuration does not contain correct number of atoms")
-                self.current_configuration = initial
+                self.current_configuration = self.get_ff(self.N).system
                 self.get_ff(self.N).system.pos[:] = initial.pos
                 if self.ewald_reci is not None:
-                    self.ewald_reci.compute_structurefactors(
-                        initial.pos,
-                        initial.charges,
-                        self.ewald_reci.cosfacs, self.ewald_reci.sinfacs)
+                    # Discard the structure factors of previous guests
+                    self.ewald_reci.cosfacs[:] = self.host_cosfacs
+                    self.ewald_reci.sinfacs[:] = self.host_sinfacs
+                    if self.N > 0:
+                        self.ewald_reci.compute_structurefactors(
+                            initial.pos,
+                            initial.charges,
+                            self.ewald_reci.cosfacs, self.ewald_reci.sinfacs)
             else:
                 self.current_configuration = self.get_ff(self.N).system
             self.energy = einit
@@ -187,22 +203,26 @@ class MC(object):
             self.Nmean = self.N
             self.emean = self.energy
             self.Vmean = self.current_configuration.cell.volume
-            self.counter = 0
-            self.call_hooks()
-            for istep in range(nsteps):
-                switch = np.random.rand()
-                # Select one of the possible MC moves
-                imove = np.where(switch<probabilities)[0][0]
-                # Call the corresponding method
-                accepted = trials[imove]()
-                # Update records with accepted and tried MC moves
-                acceptance[imove,1] += 1
-                if accepted: acceptance[imove,0] += 1
-                self.counter += 1
-                self.Nmean += (self.N-self.Nmean)/self.counter
-                self.emean += (self.energy-self.emean)/self.counter
-                self.Vmean += (self.current_configuration.cell.volume-self.Vmean)/self.counter
-                self.call_hooks()
+            self.counter = counter
+            try:
+                if counter == 0:
+                    self.call_hooks()
+                for istep in range(nsteps):
+                    switch = np.random.rand()
+                    # Select one of the possible MC moves
+                    imove = np.where(switch<probabilities)[0][0]
+                    # Call the corresponding method
+                    accepted = trials[imove]()
+                    # Update records with accepted and tried MC moves
+                    acceptance[imove,1] += 1
+                    if accepted: acceptance[imove,0] += 1
+                    self.counter += 1
+                    self.Nmean += (self.N-self.Nmean)/(istep+1)
+                    self.emean += (self.energy-self.emean)/(istep+1)
+                    self.Vmean += (self.current_configuration.cell.volume-self.Vmean)/(istep+1)
+                    self.call_hooks()
+            finally:
+                finalize_hooks(self, self.hooks)
             return acceptance
 
     def reorder_guests(self, system, iguest):
@@ -226,10 +246,19 @@ class MC(object):
                 self.sinfacs_del = np.zeros(self.ewald_reci.cosfacs.shape)
         if self.ewald_reci is not None and self.external_potential is not None:
             nfw = self.external_potential.system.natom-self.guest.natom
-            self.ewald_reci.compute_structurefactors(
-                    self.external_potential.system.pos[:nfw],
-                    self.external_potential.system.charges[:nfw],
-                    self.ewald_reci.cosfacs, self.ewald_reci.sinfacs)
+            # When nfw is zero, the host is not part of the external potential,
+            # e.g. when it is described by energy grids that include the
+            # reciprocal space interactions.
+            if nfw > 0:
+                self.ewald_reci.compute_structurefactors(
+                        self.external_potential.system.pos[:nfw],
+                        self.external_potential.system.charges[:nfw],
+                        self.ewald_reci.cosfacs, self.ewald_reci.sinfacs)
+        if self.ewald_reci is not None:
+            # Keep the structure factors without guests, to restart from a
+            # given configuration of guests
+            self.host_cosfacs = self.ewald_reci.cosfacs.copy()
+            self.host_sinfacs = self.ewald_reci.sinfacs.copy()
 
 
 class FixedNMC(MC):
@@ -296,7 +325,9 @@ class CanonicalMC(FixedNMC):
                 external potential for the guest molecules. A ForceField
                 describing the framework-guest interactions can be easily
                 constructed by making use of the n_frame keyword when
-                generating a ForceField
+                generating a ForceField. Alternatively, the host can be
+                described by energy grids, see
+                :func:`yaff.sampling.mcgrid.get_grid_external_potential`.
 
             eguest
                 The intramolecular energy of one guest in the gas phase;
@@ -311,9 +342,8 @@ class CanonicalMC(FixedNMC):
                 that take or derive a property from the current state of the
                 MC algorithm.
         """
-        self.set_conditions(T)
         super(CanonicalMC, self).__init__(guest, ff,
-            external_potential=external_potential, eguest=0.0, hooks=hooks,
+            external_potential=external_potential, eguest=eguest, hooks=hooks,
             state=state)
 
     def set_external_conditions(self, T):
@@ -413,7 +443,8 @@ class GCMC(MC):
        as guests), optionally subjected to an external potential (for instance
        by adsorpion in a rigid framework).
     """
-    allowed_trials = ['insertion','deletion','translation','rotation']
+    allowed_trials = ['insertion','deletion','translation','rotation',
+                      'cbmcinsertion','cbmcdeletion']
     default_trials = {'insertion':0.25, 'deletion':0.25,
                       'translation': 0.25, 'rotation':0.25}
     log_name = 'GCMC'
@@ -426,7 +457,7 @@ class GCMC(MC):
     ]
 
     def __init__(self, guest, ff_generator, external_potential=None, eguest=0.0,
-                 hooks=[], nguests=10, state=None):
+                 hooks=[], nguests=10, state=None, resizable=False):
         """
            **Arguments:**
 
@@ -450,7 +481,9 @@ class GCMC(MC):
                 external potential for the guest molecules. A ForceField
                 describing the framework-guest interactions can be easily
                 constructed by making use of the n_frame keyword when
-                generating a ForceField
+                generating a ForceField. Alternatively, the host can be
+                described by energy grids, see
+                :func:`yaff.sampling.mcgrid.get_grid_external_potential`.
 
             eguest
                 The intramolecular energy of one guest in the gas phase;
@@ -470,6 +503,14 @@ class GCMC(MC):
                 A list with state items. State items are simple objects
                 that take or derive a property from the current state of the
                 MC algorithm.
+
+            resizable
+                When True, ff_generator is only called for a system with room
+                for a maximum number of guests, which is doubled when needed.
+                The force fields for different numbers of guests then share
+                all arrays, see :class:`yaff.sampling.mcff.GuestForceField`.
+                This saves a lot of time and memory at high loadings, but
+                only works for force fields that consist of nonbonding terms.
         """
         # Initialization
         if guest.cell.nvec==0:
@@ -480,8 +521,12 @@ class GCMC(MC):
         self.eguest = eguest
         self.hooks = hooks
         # Generate some guest-guest force fields;
-        self._ffs = []
-        self._generate_ffs(nguests)
+        if resizable:
+            self._guest_ff = GuestForceField(guest, ff_generator, nguests)
+        else:
+            self._guest_ff = None
+            self._ffs = []
+            self._generate_ffs(nguests)
         self.external_potential = external_potential
         self.initialize_structure_factors(self.get_ff(1))
         # The System describing the current configuration of guest molecules
@@ -541,6 +586,8 @@ class GCMC(MC):
             self._ffs.append(self.ff_generator(system, self.guest))
 
     def get_ff(self, nguests):
+        if self._guest_ff is not None:
+            return self._guest_ff.get_ff(nguests)
         if nguests>=len(self._ffs):
             self._generate_ffs(nguests+1)
         return self._ffs[nguests]
@@ -573,6 +620,22 @@ class GCMC(MC):
                 Two types are accepted: (i) the filename of a system file
                 describing the host system, (ii) a System instance of the host
 
+           grid_shape
+                When given, the host-guest interactions are tabulated on a grid
+                with this number of points along each cell vector, see
+                :func:`yaff.sampling.mcgrid.compute_host_grids`. The grids
+                replace the external potential.
+
+           grid_nproc
+                The number of processes used to compute the grids.
+
+           resizable
+                When True, a single guest-guest force field is generated for a
+                maximum number of guests, see
+                :class:`yaff.sampling.mcff.GuestForceField`. Otherwise
+                (default), a separate force field is generated for every
+                number of guests.
+
            All other keyword arguments are passed to the ForceField constructor
            See the constructor of the :class:`yaff.pes.generator.FFArgs` class
            for the available optional arguments.
@@ -592,6 +655,10 @@ class GCMC(MC):
         host = kwargs.pop('host', None)
         # Extract the hooks
         hooks = kwargs.pop('hooks', [])
+        # Settings for the tabulation of the host-guest interactions
+        grid_shape = kwargs.pop('grid_shape', None)
+        grid_nproc = kwargs.pop('grid_nproc', 1)
+        resizable = kwargs.pop('resizable', False)
         # Efficient treatment of reciprocal ewald contribution
         if not 'reci_ei' in kwargs.keys():
             kwargs['reci_ei'] = 'ewald_interaction'
@@ -605,9 +672,14 @@ class GCMC(MC):
                 guest.cell = Cell(host.cell.rvecs)
             # Construct a complex of host and one guest and the corresponding
             # force field excluding host-host interactions
-            hostguest = host.merge(guest)
-            external_potential = ForceField.generate(hostguest, parameters,
-                 nlow=host.natom, nhigh=host.natom, **kwargs)
+            if grid_shape is None:
+                hostguest = host.merge(guest)
+                external_potential = ForceField.generate(hostguest, parameters,
+                     nlow=host.natom, nhigh=host.natom, **kwargs)
+            else:
+                grids = compute_host_grids(host, guest, parameters, grid_shape,
+                     nproc=grid_nproc, **kwargs)
+                external_potential = get_grid_external_potential(guest, grids)
         else:
             external_potential = None
 #        # Compare the energy of the guest, once isolated, once in a periodic box
@@ -636,4 +708,4 @@ class GCMC(MC):
         def ff_generator(system, guest):
             return ForceField.generate(system, parameters, nlow=max(0,system.natom-guest.natom), nhigh=max(0,system.natom-guest.natom), **kwargs)
         return cls(guest, ff_generator, external_potential=external_potential,
-             eguest=eguest, hooks=hooks, nguests=nguests)
+             eguest=eguest, hooks=hooks, nguests=nguests, resizable=resizable)
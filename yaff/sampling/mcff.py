@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+'''Guest-guest force fields for a varying number of rigid guests
+
+   In a GCMC simulation, the number of guests changes all the time. Instead of
+   generating a new force field for every number of guests, a single force
+   field is generated for a system that has room for a maximum number of
+   guests. Only the first N guests are active. When more guests are needed,
+   the capacity is doubled, such that the force field is generated only a
+   few times during a simulation.
+'''
+
+
+from __future__ import division
+
+import numpy as np
+
+from yaff.log import log, timer
+from yaff.pes.ff import ForcePartPair, ForcePartPairFused, \
+    ForcePartEwaldReciprocalInteraction, ForcePartEwaldCorrection, \
+    ForcePartEwaldNeutralizing, ForcePartTailCorrection, ForcePartValence
+from yaff.system import System
+
+
+__all__ = ['GuestForceField', 'replicate_guest']
+
+
+def replicate_guest(guest, nguests):
+    '''Return a System that consists of nguests copies of a guest
+
+       **Arguments:**
+
+       guest
+            A System instance of one guest molecule.
+
+       nguests
+            The number of copies.
+
+       All per-atom attributes of the guest are repeated and the bonds are
+       renumbered, which is equivalent to (but much faster than) repeated
+       calls to ``System.merge``.
+    '''
+    def tile(array):
+        if array is None:
+            return None
+        array = np.asarray(array)
+        return np.tile(array, (nguests,) + (1,)*(array.ndim-1))
+
+    if guest.bonds is None:
+        bonds = None
+    else:
+        bonds = np.asarray(guest.bonds, dtype=int).reshape(-1, 2)
+        bonds = (bonds + guest.natom*np.arange(nguests)[:,None,None]).reshape(-1, 2)
+    return System(
+        numbers=tile(guest.numbers),
+        pos=tile(guest.pos),
+        scopes=guest.scopes,
+        scope_ids=tile(guest.scope_ids),
+        ffatypes=guest.ffatypes,
+        ffatype_ids=tile(guest.ffatype_ids),
+        bonds=bonds,
+        rvecs=guest.cell.rvecs,
+        charges=tile(guest.charges),
+        radii=tile(guest.radii),
+        valence_charges=tile(guest.valence_charges),
+        dipoles=tile(guest.dipoles),
+        radii2=tile(guest.radii2),
+        masses=tile(guest.masses),
+    )
+
+
+class GuestForceField(object):
+    '''Guest-guest interactions for a varying number of rigid guests
+
+       The force field for N guests is obtained with ``get_ff(N)``. It has the
+       same interface and gives the same energies as a force field that is
+       generated for a system with N guests with nlow=nhigh=(N-1)*n, where n
+       is the number of atoms in one guest. All these force fields share the
+       same arrays, i.e. the positions, the parameters of the pair potentials
+       and the scaling tables.
+    '''
+    def __init__(self, guest, ff_generator, nguests=10):
+        '''
+           **Arguments:**
+
+           guest
+                A System instance representing one guest molecule.
+
+           ff_generator
+                A method that returns a ForceField for a given system with
+                guests, see :class:`yaff.sampling.mc.GCMC`. It is called with
+                a system that has room for the maximum number of guests.
+
+           **Optional arguments:**
+
+           nguests
+                The initial maximum number of guests. When more guests are
+                requested, the maximum is doubled.
+
+           Only force parts for which the interaction of the last guest with
+           the other guests can be isolated are supported: pair potentials,
+           Ewald corrections, neutralizing backgrounds, tail corrections and
+           the reciprocal Ewald interaction. Valence terms must be excluded.
+        '''
+        if guest.natom == 0:
+            raise ValueError('The guest must contain at least one atom.')
+        self.guest = guest
+        self.ff_generator = ff_generator
+        self.capacity = 0
+        self.ff = None
+        self._views = {}
+        self._constants = {}
+        self.resize(max(nguests, 1))
+
+    def resize(self, capacity):
+        '''Make room for at least the given number of guests
+
+           **Arguments:**
+
+           capacity
+                The maximum number of guests.
+
+           The positions of the guests are retained. Force fields obtained
+           with ``get_ff`` before the resize should no longer be used.
+        '''
+        if capacity <= self.capacity:
+            return
+        with timer.section('MC guest FF'):
+            if log.do_medium:
+                with log.section('MCFF'):
+                    log('Generating guest-guest force field for %i guests' % capacity)
+            system = replicate_guest(self.guest, capacity)
+            if self.ff is not None:
+                system.pos[:self.ff.system.natom] = self.ff.system.pos
+            ff = self.ff_generator(system, self.guest)
+            self._pair_parts = []
+            self._constant_parts = []
+            for part in ff.parts:
+                if isinstance(part, (ForcePartPair, ForcePartPairFused)):
+                    self._pair_parts.append(part)
+                elif isinstance(part, (ForcePartEwaldNeutralizing, ForcePartTailCorrection)):
+                    self._constant_parts.append(part)
+                elif isinstance(part, ForcePartEwaldReciprocalInteraction):
+                    # This part does not contribute to the energy.
+                    continue
+                elif isinstance(part, ForcePartEwaldCorrection):
+                    # Only scaled pairs between different guests would
+                    # contribute.
+                    stab = part.scalings.stab
+                    if (stab['a']//self.guest.natom != stab['b']//self.guest.natom).any():
+                        raise TypeError('Scaled pairs between different guests are not supported.')
+                elif isinstance(part, ForcePartValence):
+                    if part.vlist.nv > 0:
+                        raise TypeError('Valence terms of the guests must be excluded.')
+                else:
+                    raise TypeError('Force part %s is not supported by GuestForceField.' % part.name)
+            self.ff = ff
+            self.capacity = capacity
+            self._views = {}
+            self._constants = {}
+
+    def get_ff(self, nguests):
+        '''Return the force field for the given number of guests
+
+           **Arguments:**
+
+           nguests
+                The number of active guests.
+
+           The returned object has the attributes ``system`` and ``parts``
+           and the methods ``update_pos``, ``compute`` and
+           ``compute_subset``. Its system shares the positions with the
+           force field for the maximum number of guests.
+        '''
+        if nguests > self.capacity:
+            self.resize(max(nguests, 2*self.capacity))
+        result = self._views.get(nguests)
+        if result is None:
+            result = _ActiveGuests(self, nguests)
+            # Only keep the force fields for nearby numbers of guests. The
+            # number of guests only changes by one in each MC step.
+            for key in list(self._views):
+                if abs(key - nguests) > 1:
+                    del self._views[key]
+            self._views[nguests] = result
+        return result
+
+    def compute_subset(self, nguests, iatoms):
+        '''Compute the interactions of a subset of the atoms with the other
+           active guests
+
+           **Arguments:**
+
+           nguests
+                The number of active guests.
+
+           iatoms
+                An array with the indexes of the atoms in the subset.
+        '''
+        natom = nguests*self.guest.natom
+        nlow = natom - self.guest.natom
+        nlist = self.ff.nlist
+        if nlist is not None:
+            nlist.nlow = nlow
+            nlist.nhigh = nlow
+            nlist.update_subset(iatoms, natom)
+        energy = self._get_constant(nguests)
+        for part in self._pair_parts:
+            energy += part.compute_subset(iatoms)
+        return energy
+
+    def _get_constant(self, nguests):
+        '''The energy of the parts that only depend on the number of guests'''
+        if nguests == 0:
+            return 0.0
+        result = self._constants.get(nguests)
+        if result is None:
+            result = 0.0
+            natom = nguests*self.guest.natom
+            nlow = natom - self.guest.natom
+            for part in self._constant_parts:
+                if isinstance(part, ForcePartTailCorrection):
+                    ecorr = part.part_pair.pair_pot.prepare_tailcorrections(natom, nlow, nlow)[0]
+                    result += 2.0*np.pi*ecorr/self.ff.system.cell.volume
+                else:
+                    part_neut = ForcePartEwaldNeutralizing(
+                        self.get_ff(nguests).system, part.alpha, part.dielectric,
+                        nlow, nlow, part.fluctuating_charges)
+                    result += part_neut.compute()
+            self._constants[nguests] = result
+        return result
+
+
+class _ActiveGuests(object):
+    '''The force field for a given number of guests, see GuestForceField.'''
+    def __init__(self, guest_ff, nguests):
+        self.guest_ff = guest_ff
+        self.nguests = nguests
+        natom = nguests*guest_ff.guest.natom
+        nbond = 0 if guest_ff.guest.bonds is None else len(guest_ff.guest.bonds)
+        system = guest_ff.ff.system
+
+        def view(array, n=natom):
+            if array is None:
+                return None
+            return array[:n]
+
+        self.system = System(
+            numbers=view(system.numbers),
+            pos=view(system.pos),
+            scopes=system.scopes,
+            scope_ids=view(system.scope_ids),
+            ffatypes=system.ffatypes,
+            ffatype_ids=view(system.ffatype_ids),
+            bonds=view(system.bonds, nguests*nbond),
+            rvecs=system.cell.rvecs,
+            charges=view(system.charges),
+            radii=view(system.radii),
+            valence_charges=view(system.valence_charges),
+            dipoles=view(system.dipoles),
+            radii2=view(system.radii2),
+            masses=view(system.masses),
+        )
+        self.parts = guest_ff.ff.parts
+
+    def update_pos(self, pos):
+        '''Set the positions of the active guests.'''
+        self.system.pos[:] = pos
+
+    def compute_subset(self, iatoms):
+        '''See :meth:`yaff.pes.ff.ForceField.compute_subset`'''
+        return self.guest_ff.compute_subset(self.nguests, iatoms)
+
+    def compute(self):
+        '''Compute the interactions of the last guest with the other guests.'''
+        if self.nguests == 0:
+            return 0.0
+        natom = self.system.natom
+        return self.compute_subset(np.arange(natom - self.guest_ff.guest.natom, natom))
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+'''Tabulation of host-guest interactions on grids for Monte-Carlo simulations
+
+   In a rigid framework, the interaction of a guest atom with the host only
+   depends on the position and the force-field type of the guest atom. These
+   interactions can therefore be computed once on a regular grid that spans
+   the unit cell of the host. During an MC simulation, the host-guest energy
+   is then obtained by interpolating these grids, which is much cheaper than
+   evaluating all host-guest pair interactions for every trial move.
+'''
+
+
+from __future__ import division
+
+import numpy as np
+
+from molmod.units import kjmol
+
+from yaff.log import log, timer
+from yaff.pes.ff import ForceField, ForcePartPair, ForcePartPairFused, \
+    ForcePartGrid, ForcePartEwaldReciprocalInteraction
+from yaff.pes.ext import PairPotEI
+from yaff.sampling.utils import get_fork_context
+
+
+__all__ = ['compute_host_grids', 'get_grid_external_potential']
+
+
+# The probe force fields are shared with the worker processes through this
+# global variable. The worker processes are always forked (see
+# get_fork_context), such that the force fields do not need to be pickled.
+_probes = None
+
+
+def _get_probe(host, guest, iatom, parameters, kwargs):
+    '''Construct a force field for the interaction of one guest atom with the host
+
+       The returned tuple contains the force field of the host and the probe
+       atom, the parts of that force field that are tabulated, and the part
+       for the reciprocal-space electrostatics (or None).
+    '''
+    probe = guest.subsystem([iatom])
+    probe.cell = host.cell
+    probe.bonds = np.zeros((0, 2), int)
+    system = host.merge(probe)
+    ff = ForceField.generate(system, parameters, nlow=host.natom,
+        nhigh=host.natom, **kwargs)
+    # Replace the charge of the probe by the charge the atom has in the guest
+    # molecule, which may be affected by bond charge increments.
+    if system.charges is None:
+        # No electrostatic interactions
+        charge = 0.0
+    else:
+        charge = guest.charges[iatom]
+        system.charges[-1] = charge
+    parts = []
+    part_reci = None
+    for part in ff.parts:
+        if isinstance(part, ForcePartPair):
+            pair_pots = [part.pair_pot]
+            parts.append(part)
+        elif isinstance(part, ForcePartPairFused):
+            pair_pots = [subpart.pair_pot for subpart in part.parts]
+            parts.append(part)
+        elif isinstance(part, ForcePartEwaldReciprocalInteraction):
+            part_reci = part
+            part.compute_structurefactors(
+                system.pos[:host.natom], system.charges[:host.natom],
+                part.cosfacs, part.sinfacs)
+            continue
+        else:
+            continue
+        for pair_pot in pair_pots:
+            if isinstance(pair_pot, PairPotEI):
+                pair_pot.charges[-1] = charge
+    return ff, parts, part_reci
+
+
+def _compute_probe_energies(args):
+    '''Compute the host-probe energies at a range of grid points'''
+    ffatype, begin, end = args
+    ff, parts, part_reci = _probes[ffatype]
+    system = ff.system
+    shape = _probes['shape']
+    frac = np.array(np.unravel_index(np.arange(begin, end), shape)).T/np.array(shape)
+    points = np.dot(frac, system.cell.rvecs)
+    energies = np.zeros(end - begin)
+    for ipoint, point in enumerate(points):
+        system.pos[-1] = point
+        ff.update_pos(system.pos)
+        if ff.needs_nlist_update:
+            ff.nlist.update()
+            ff.needs_nlist_update = False
+        energy = sum(part.compute() for part in parts)
+        if part_reci is not None:
+            energy += part_reci.insertion_energy(system.pos[-1:], system.charges[-1:])
+        energies[ipoint] = energy
+    return energies
+
+
+def compute_host_grids(host, guest, parameters, shape, nproc=1, emax=1000*kjmol,
+                       chunksize=1000, **kwargs):
+    '''Tabulate the interaction of each guest atom type with a rigid host
+
+       **Arguments:**
+
+       host
+            A System instance of the host, which must be 3D periodic.
+
+       guest
+            A System instance of one guest molecule. Only its atom types,
+            charges and radii are used.
+
+       parameters
+            Force-field parameters, in one of the formats accepted by
+            ``ForceField.generate``.
+
+       shape
+            The number of grid points along each cell vector. The grid points
+            are equally spaced in fractional coordinates, as assumed by
+            ``ForcePartGrid``.
+
+       **Optional arguments:**
+
+       nproc
+            The number of processes over which the grid points are
+            distributed. The worker processes are forked, which is not
+            supported on Windows.
+
+       emax
+            Energies above this value are set to emax. This avoids huge
+            values (or infinities) at grid points inside host atoms, which
+            would spoil the interpolation.
+
+       chunksize
+            The number of grid points treated by one task of the process pool.
+
+       All other keyword arguments are passed to ``ForceField.generate``.
+
+       The pair potentials (including the real-space electrostatics) between
+       the host and a single guest atom are computed with the same force-field
+       parts as the external potential of an MC simulation. When the
+       electrostatics are treated with an Ewald summation, the
+       reciprocal-space interaction with the host is included in the grids as
+       well. Other Ewald terms and tail corrections are not tabulated.
+
+       Returns a dictionary with (ffatype, grid) items, suitable for
+       ``ForcePartGrid``.
+    '''
+    if host.cell.nvec != 3:
+        raise ValueError('The host must be 3D periodic to compute energy grids.')
+    if nproc < 1:
+        raise ValueError('The number of processes must be at least one.')
+    shape = tuple(int(n) for n in shape)
+    if len(shape) != 3 or min(shape) < 1:
+        raise ValueError('The grid shape must consist of three positive integers.')
+    # The MC code takes care of the reciprocal-space interactions through
+    # structure factors, which is reproduced here.
+    if kwargs.get('reci_ei', 'ewald') != 'ignore':
+        kwargs['reci_ei'] = 'ewald_interaction'
+    kwargs.pop('nlow', None)
+    kwargs.pop('nhigh', None)
+    kwargs.pop('tailcorrections', None)
+    global _probes
+    with log.section('MCGRID'), timer.section('MC grids'):
+        # The charges of the guest atoms are those of the guest force field.
+        guest = guest.subsystem(np.arange(guest.natom))
+        guest.cell = host.cell
+        guest_kwargs = dict(kwargs)
+        guest_kwargs['reci_ei'] = 'ignore'
+        ForceField.generate(guest, parameters, **guest_kwargs)
+        # One probe force field for each atom type of the guest
+        probes = {'shape': shape}
+        for iatom in range(guest.natom):
+            ffatype = guest.get_ffatype(iatom)
+            if ffatype in probes:
+                other = probes[ffatype][0].system
+                if other.charges is not None and \
+                   abs(other.charges[-1] - guest.charges[iatom]) > 1e-10:
+                    raise ValueError('Atoms of type %s have different charges in the guest.' % ffatype)
+                continue
+            probes[ffatype] = _get_probe(host, guest, iatom, parameters, kwargs)
+        ffatypes = sorted(key for key in probes if key != 'shape')
+        npoint = shape[0]*shape[1]*shape[2]
+        if log.do_medium:
+            log('Tabulating %i atom types on a %i x %i x %i grid with %i processes' % (
+                (len(ffatypes),) + shape + (nproc,)))
+        tasks = [(ffatype, begin, min(begin + chunksize, npoint))
+                 for ffatype in ffatypes
+                 for begin in range(0, npoint, chunksize)]
+        _probes = probes
+        try:
+            if nproc > 1:
+                pool = get_fork_context().Pool(nproc)
+                try:
+                    results = pool.map(_compute_probe_energies, tasks)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [_compute_probe_energies(task) for task in tasks]
+        finally:
+            _probes = None
+        grids = {}
+        for ffatype in ffatypes:
+            energies = np.concatenate([result for task, result in zip(tasks, results)
+                                       if task[0] == ffatype])
+            energies[~(energies < emax)] = emax
+            grids[ffatype] = energies.reshape(shape)
+    return grids
+
+
+def get_grid_external_potential(guest, grids, tricubic=False):
+    '''Construct an external potential for MC simulations from energy grids
+
+       **Arguments:**
+
+       guest
+            A System instance of one guest molecule.
+
+       grids
+            A dictionary with (ffatype, grid) items, e.g. obtained with
+            ``compute_host_grids``. Filenames of grids stored with
+            ``numpy.save`` are also accepted, see ``ForcePartGrid``.
+
+       **Optional arguments:**
+
+       tricubic
+            Use tricubic instead of trilinear interpolation.
+
+       The returned ForceField can be passed as the ``external_potential``
+       argument of ``GCMC`` or ``CanonicalMC``. Its system contains only the
+       guest molecule, the host is fully described by the grids.
+    '''
+    system = guest.subsystem(np.arange(guest.natom))
+    system.cell = guest.cell
+    return ForceField(system, [ForcePartGrid(system, grids, tricubic=tricubic)])
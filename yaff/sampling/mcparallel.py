@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+'''Many Monte-Carlo chains at different external conditions
+
+   An adsorption isotherm requires a separate simulation for every
+   temperature and fugacity. The function ``run_mc_chains`` runs such a series
+   of chains in a number of processes. Optionally, configurations of chains at
+   neighboring conditions are swapped at regular intervals (parallel
+   tempering), which helps to sample phase space at conditions where a single
+   chain would get stuck, e.g. close to a condensation step in the isotherm.
+'''
+
+
+from __future__ import division
+
+import traceback
+
+import numpy as np
+
+from yaff.log import log, timer
+from yaff.sampling.io import MCHDF5Writer
+from yaff.sampling.iterative import Hook
+from yaff.sampling.mc import GCMC
+from yaff.sampling.mcff import replicate_guest
+from yaff.sampling.utils import get_fork_context
+
+
+__all__ = ['run_mc_chains']
+
+
+class _SampleRecorder(Hook):
+    '''Keep the number of guests and the energy of every step'''
+    state_keys = ()
+    def __init__(self, step=1):
+        self.N = []
+        self.energy = []
+        Hook.__init__(self, 0, step)
+
+    def __call__(self, mc):
+        self.N.append(mc.N)
+        self.energy.append(mc.energy)
+
+
+class _Chain(object):
+    '''A single MC simulation that is continued in segments'''
+    def __init__(self, mc, conditions, fn_h5, h5_step, sample_step):
+        mc.set_external_conditions(*conditions)
+        self.mc = mc
+        self.recorder = _SampleRecorder(sample_step)
+        hooks = [self.recorder]
+        if fn_h5 is None:
+            self.f = None
+        else:
+            import h5py as h5
+            self.f = h5.File(fn_h5, 'w')
+            hooks.append(MCHDF5Writer(self.f, step=h5_step))
+        # Do not modify the list of hooks in place, it may be shared.
+        mc.hooks = list(mc.hooks) + hooks
+        self.counter = 0
+        self.initial = None
+        self.einit = 0.0
+        self.acceptance = None
+
+    def get_log_activity(self):
+        '''Logarithm of the factor with which the statistical weight of a
+           configuration is multiplied for every guest, omitting factors that
+           do not depend on the external conditions.'''
+        if isinstance(self.mc, GCMC):
+            if self.mc.fugacity == 0.0:
+                return -np.inf
+            return np.log(self.mc.beta*self.mc.fugacity)
+        return 0.0
+
+    def run(self, nsteps, mc_moves, kwargs):
+        acceptance = self.mc.run(nsteps, mc_moves=mc_moves, initial=self.initial,
+            einit=self.einit, counter=self.counter, **kwargs)
+        if self.acceptance is None:
+            self.acceptance = acceptance
+        else:
+            self.acceptance += acceptance
+        self.counter += nsteps
+        self.initial = None
+        self.einit = self.mc.energy
+        return self.mc.N, self.mc.energy
+
+    def get_configuration(self):
+        return self.mc.N, self.mc.get_ff(self.mc.N).system.pos.copy(), self.mc.energy
+
+    def set_configuration(self, N, pos, energy):
+        # The configuration is loaded at the start of the next segment.
+        self.initial = replicate_guest(self.mc.guest, N)
+        self.initial.pos[:] = pos
+        self.einit = energy
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+class _ChainGroup(object):
+    '''The chains that are simulated in one process'''
+    def __init__(self, mc_generator, chains, h5_step, sample_step):
+        self.chains = {}
+        for ichain, conditions, fn_h5 in chains:
+            self.chains[ichain] = _Chain(mc_generator(), conditions, fn_h5,
+                                         h5_step, sample_step)
+
+    def info(self):
+        return dict((ichain, (chain.mc.beta, chain.get_log_activity()))
+                    for ichain, chain in self.chains.items())
+
+    def run(self, nsteps, mc_moves, kwargs):
+        return dict((ichain, chain.run(nsteps, mc_moves, kwargs))
+                    for ichain, chain in self.chains.items())
+
+    def get_configuration(self, ichain):
+        return self.chains[ichain].get_configuration()
+
+    def set_configuration(self, ichain, N, pos, energy):
+        self.chains[ichain].set_configuration(N, pos, energy)
+
+    def finish(self):
+        result = {}
+        for ichain, chain in self.chains.items():
+            chain.close()
+            result[ichain] = (np.array(chain.recorder.N),
+                              np.array(chain.recorder.energy),
+                              chain.acceptance)
+        return result
+
+
+def _chain_worker(conn, mc_generator, chains, h5_step, sample_step, seed):
+    '''Serve requests of run_mc_chains for the chains of one process'''
+    # Processes created by forking inherit the state of the random number
+    # generator, so they must be reseeded.
+    np.random.seed(seed)
+    try:
+        group = _ChainGroup(mc_generator, chains, h5_step, sample_step)
+        conn.send((True, group.info()))
+    except Exception:
+        conn.send((False, traceback.format_exc()))
+        return
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        method, args = request
+        try:
+            conn.send((True, getattr(group, method)(*args)))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+
+
+class _RemoteChainGroup(object):
+    '''A _ChainGroup that lives in another process'''
+    def __init__(self, mc_generator, chains, h5_step, sample_step, seed):
+        # Forking is needed because mc_generator is typically a closure or a
+        # lambda function, which cannot be pickled.
+        context = get_fork_context()
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_chain_worker, args=(child_conn,
+            mc_generator, chains, h5_step, sample_step, seed))
+        self.process.daemon = True
+        self.process.start()
+
+    def send(self, method, *args):
+        self.conn.send((method, args))
+
+    def receive(self):
+        success, result = self.conn.recv()
+        if not success:
+            raise RuntimeError('A Monte-Carlo chain failed in a worker process:\n%s' % result)
+        return result
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (IOError, OSError):
+            # The worker already stopped after an error.
+            pass
+        self.process.join()
+
+
+class _LocalChainGroup(object):
+    '''A _ChainGroup in the current process, with the interface of
+       _RemoteChainGroup'''
+    def __init__(self, mc_generator, chains, h5_step, sample_step, seed):
+        if seed is not None:
+            np.random.seed(seed)
+        self.group = _ChainGroup(mc_generator, chains, h5_step, sample_step)
+        self.result = self.group.info()
+
+    def send(self, method, *args):
+        self.result = getattr(self.group, method)(*args)
+
+    def receive(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+def _get_error(signal, minblock):
+    from yaff.analysis.blav import blav
+    try:
+        return blav(signal.astype(float), minblock)[0]
+    except ValueError:
+        if log.do_warning:
+            log.warn('Too few samples (%i) for a block-averaging error estimate.' % len(signal))
+        return np.nan
+
+
+def run_mc_chains(mc_generator, conditions, nsteps, nproc=1, exchange=None,
+                  mc_moves=None, fn_h5=None, h5_step=1000, sample_step=1,
+                  nequil=0, minblock=100, seed=None, **kwargs):
+    '''Run Monte-Carlo chains at different external conditions
+
+       **Arguments:**
+
+       mc_generator
+            A function without arguments that returns a new instance of an
+            MC class, e.g. ``GCMC`` or ``CanonicalMC``. It is called once
+            for every chain, in the process that runs the chain. It does not
+            need to be picklable because the worker processes are forked,
+            which is not supported on Windows.
+
+       conditions
+            A list of tuples with the arguments of
+            ``set_external_conditions``, e.g. (T, fugacity) for GCMC. When
+            configurations are exchanged, neighbors in this list are
+            considered, so it should be sorted along the temperature or
+            fugacity axis.
+
+       nsteps
+            The number of MC steps of every chain.
+
+       **Optional arguments:**
+
+       nproc
+            The number of processes. Chain ``i`` is simulated in process
+            ``i % nproc``.
+
+       exchange
+            When given, the chains are interrupted every ``exchange`` steps to
+            attempt swaps of configurations between neighboring conditions.
+            Alternately, the pairs (0,1), (2,3), ... and (1,2), (3,4), ... are
+            tried. A swap is accepted with the parallel-tempering criterion,
+            which also takes into account the difference in fugacity in case
+            of GCMC.
+
+       mc_moves
+            The relative probabilities of the trial moves, see ``MC.run``.
+
+       fn_h5
+            When given, the trajectory of every chain is written to an HDF5
+            file with the ``MCHDF5Writer``. This must be a format string with
+            one integer field for the chain index, e.g. ``'gcmc_%03i.h5'``.
+
+       h5_step
+            The ``step`` argument of the ``MCHDF5Writer``.
+
+       sample_step
+            The number of guests and the energy are sampled every
+            ``sample_step`` steps to compute the averages and errors.
+
+       nequil
+            The number of initial steps that is not included in the averages.
+
+       minblock
+            The minimum number of blocks for the block-averaging error
+            estimate, see :func:`yaff.analysis.blav.blav`.
+
+       seed
+            When given, the random number generators are seeded with this
+            value (the worker processes with ``seed+iproc+1``), which makes
+            runs reproducible for a fixed number of processes. Otherwise,
+            the worker processes are seeded from the operating system.
+
+       All other keyword arguments are passed to ``MC.run``.
+
+       **Returns:** a dictionary with the following items:
+
+       Nmean, Nerr, emean, eerr
+            Arrays with the average number of guests and the average energy of
+            every chain, and the errors on these averages estimated with block
+            averaging.
+
+       acceptance
+            A list with the acceptance array of every chain, see ``MC.run``.
+
+       exchange
+            An integer array with shape (nchain-1, 2) with the number of
+            accepted (first column) and attempted (second column) swaps
+            between chains i and i+1.
+    '''
+    nchain = len(conditions)
+    if nchain == 0:
+        raise ValueError('At least one set of conditions is required.')
+    if nproc < 1:
+        raise ValueError('The number of processes must be at least one.')
+    if exchange is not None and exchange < 1:
+        raise ValueError('The exchange interval must be at least one step.')
+    nproc = min(nproc, nchain)
+    if kwargs.get('counter', 0) != 0:
+        raise TypeError('The counter can not be set for a series of chains.')
+    with log.section('MCCHAIN'), timer.section('MC chains'):
+        if log.do_medium:
+            log('Running %i chains with %i processes' % (nchain, nproc))
+        rng = np.random.RandomState(seed)
+        owners = [ichain % nproc for ichain in range(nchain)]
+        groups = []
+        try:
+            for iproc in range(nproc):
+                chains = [(ichain, conditions[ichain],
+                           None if fn_h5 is None else fn_h5 % ichain)
+                          for ichain in range(iproc, nchain, nproc)]
+                if nproc == 1:
+                    group_seed = seed
+                    cls = _LocalChainGroup
+                else:
+                    group_seed = None if seed is None else seed + iproc + 1
+                    cls = _RemoteChainGroup
+                groups.append(cls(mc_generator, chains, h5_step, sample_step, group_seed))
+            info = {}
+            for group in groups:
+                info.update(group.receive())
+            exchanges = np.zeros((max(nchain-1, 0), 2), dtype=int)
+            istep = 0
+            isegment = 0
+            while istep < nsteps:
+                nsegment = nsteps - istep
+                if exchange is not None:
+                    nsegment = min(nsegment, exchange)
+                for group in groups:
+                    group.send('run', nsegment, mc_moves, kwargs)
+                states = {}
+                for group in groups:
+                    states.update(group.receive())
+                istep += nsegment
+                if exchange is None or istep == nsteps:
+                    continue
+                # Attempt swaps between neighboring chains
+                for ichain0 in range(isegment % 2, nchain-1, 2):
+                    ichain1 = ichain0 + 1
+                    beta0, activity0 = info[ichain0]
+                    beta1, activity1 = info[ichain1]
+                    N0, energy0 = states[ichain0]
+                    N1, energy1 = states[ichain1]
+                    x = (beta0 - beta1)*(energy0 - energy1)
+                    if N0 != N1:
+                        x += (activity0 - activity1)*(N1 - N0)
+                    exchanges[ichain0,1] += 1
+                    if not (np.log(rng.rand()) < x):
+                        continue
+                    exchanges[ichain0,0] += 1
+                    configurations = []
+                    for ichain in ichain0, ichain1:
+                        group = groups[owners[ichain]]
+                        group.send('get_configuration', ichain)
+                        configurations.append(group.receive())
+                    for ichain, configuration in zip((ichain1, ichain0), configurations):
+                        group = groups[owners[ichain]]
+                        group.send('set_configuration', ichain, *configuration)
+                        group.receive()
+                isegment += 1
+            samples = {}
+            for group in groups:
+                group.send('finish')
+                samples.update(group.receive())
+        finally:
+            for group in groups:
+                group.close()
+        # Averages and block-averaging errors
+        result = {
+            'Nmean': np.zeros(nchain), 'Nerr': np.zeros(nchain),
+            'emean': np.zeros(nchain), 'eerr': np.zeros(nchain),
+            'acceptance': [], 'exchange': exchanges,
+        }
+        for ichain in range(nchain):
+            N, energy, acceptance = samples[ichain]
+            N = N[nequil//sample_step:]
+            energy = energy[nequil//sample_step:]
+            result['Nmean'][ichain] = N.mean()
+            result['Nerr'][ichain] = _get_error(N, minblock)
+            result['emean'][ichain] = energy.mean()
+            result['eerr'][ichain] = _get_error(energy, minblock)
+            result['acceptance'].append(acceptance)
+        if log.do_medium:
+            log.hline()
+            log('Chain %10s %10s %10s %10s' % ('<N>', 'error', '<E>', 'error'))
+            log.hline()
+            for ichain in range(nchain):
+                log('%5i %10.4f %10.4f %s %s' % (ichain, result['Nmean'][ichain],
+                    result['Nerr'][ichain], log.energy(result['emean'][ichain]),
+                    log.energy(result['eerr'][ichain])))
+            log.hline()
+    return result
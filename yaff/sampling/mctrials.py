@@ -35,7 +35,8 @@ from molmod.units import kjmol
 
 
 __all__ = ['Trial','TrialInsertion','TrialDeletion','TrialRotation',
-    'TrialTranslation','TrialVolumechange']
+    'TrialTranslation','TrialVolumechange','TrialCbmcinsertion',
+    'TrialCbmcdeletion']
 
 
 class Trial(object):
@@ -66,12 +67,20 @@ class Trial(object):
                 % (self.__class__.__name__, self.mc.N, log.energy(e), p*100.0, accepted))
         return accepted
 
-    def insertion_energy(self, ff, sign=1):
+    def insertion_energy(self, ff, sign=1, external=True):
         """Compute U(N+1)-U(N), assuming the inserted guest is positioned
-        last."""
+        last.
+
+        Only the interactions that involve the atoms of the last guest are
+        computed, see :meth:`yaff.pes.ff.ForceField.compute_subset`, such that
+        the cost does not depend on the interactions among the other guests.
+        When external is False, the interaction with the external potential
+        is left out, see :meth:`candidate_energies`.
+        """
         assert sign in [-1,1]
         # Calculate the energy difference for guest-guest interactions
         ff.update_pos(ff.system.pos)
+        iatoms = np.arange(ff.system.natom-self.mc.guest.natom, ff.system.natom)
         # Check for close contact distance to other guest atoms
         if self.mc.close_contact>=0.0:
             ndists = (ff.system.natom-self.mc.guest.natom)*self.mc.guest.natom
@@ -84,12 +93,12 @@ class Trial(object):
         else: dmin = self.mc.close_contact+1
         # Only do computation if there is no close contact
         if dmin>=self.mc.close_contact:
-            e = ff.compute() - self.mc.eguest
+            e = ff.compute_subset(iatoms) - self.mc.eguest
         else:
             e = 1e10
         # Calculate the energy difference for guest-host interactions
         extpot = self.mc.external_potential
-        if extpot is not None:
+        if extpot is not None and external:
             # Check for close contact to guest atoms
             if self.mc.close_contact>=0.0:
                 ndists = (extpot.system.natom-self.mc.guest.natom)*self.mc.guest.natom
@@ -98,12 +107,17 @@ class Trial(object):
                     ff.system.cell.compute_distances(distances, ff.system.pos[-self.mc.guest.natom:],
                         pos1=extpot.system.pos[:-self.mc.guest.natom])
                     dmin_host = np.amin(distances)
+                else:
+                    # The host is not part of the system, e.g. when it is
+                    # described by energy grids.
+                    dmin_host = self.mc.close_contact+1
             else: dmin_host = self.mc.close_contact+1
             # Only do computation if there is no close contact
             if dmin_host>=self.mc.close_contact:
                 extpot.system.pos[-self.mc.guest.natom:] = ff.system.pos[-self.mc.guest.natom:]
                 extpot.update_pos(extpot.system.pos)
-                e += extpot.compute() - self.mc.eguest
+                e += extpot.compute_subset(np.arange(extpot.system.natom-self.mc.guest.natom,
+                    extpot.system.natom)) - self.mc.eguest
             else:
                 e += 1e10
         # Energy difference for reciprocal Ewald (guest-guest and guest-host)
@@ -125,6 +139,38 @@ class Trial(object):
                      cosfacs=cosfacs, sinfacs=sinfacs, sign=sign)
         return sign*e
 
+    def candidate_energies(self, candidates):
+        """Compute the interaction energies of a guest with the external
+        potential, for several candidate positions of the guest.
+
+        **Arguments:**
+
+        candidates
+            An array with shape (ncandidate, guest.natom, 3).
+
+        All candidates are passed at once to
+        :meth:`yaff.pes.ff.ForceField.compute_batch`, such that energy grids
+        are interpolated in a single call. Candidates that are in close
+        contact with the host get an infinite energy.
+        """
+        candidates = np.ascontiguousarray(candidates)
+        energies = np.zeros(len(candidates))
+        extpot = self.mc.external_potential
+        if extpot is None:
+            return energies
+        natom = self.mc.guest.natom
+        nhost = extpot.system.natom - natom
+        if self.mc.close_contact>=0.0 and nhost>0:
+            distances = np.zeros((nhost*natom,))
+            for icandidate in range(len(candidates)):
+                extpot.system.cell.compute_distances(distances,
+                    candidates[icandidate], pos1=extpot.system.pos[:nhost])
+                if np.amin(distances)<self.mc.close_contact:
+                    energies[icandidate] = np.inf
+        iatoms = np.arange(nhost, extpot.system.natom)
+        energies += extpot.compute_batch(iatoms, candidates) - self.mc.eguest
+        return energies
+
     def compute(self):
         # Subclasses implement their code here.
         raise NotImplementedError
@@ -336,3 +382,90 @@ class TrialDeletion(Trial):
         if self.mc.ewald_reci is not None and self.mc.N>0:
             self.mc.ewald_reci.cosfacs[:] += self.mc.cosfacs_del
             self.mc.ewald_reci.sinfacs[:] += self.mc.sinfacs_del
+
+
+def _log_rosenbluth_weight(energies, beta):
+    """Return the logarithm of the average Boltzmann factor of a set of
+    candidate energies, and the normalized Boltzmann factors.
+
+    The logarithm is -inf and the factors are None when all candidates have
+    an infinite energy.
+    """
+    x = -beta*energies
+    xmax = x.max()
+    if not np.isfinite(xmax):
+        return -np.inf, None
+    weights = np.exp(x - xmax)
+    total = weights.sum()
+    return xmax + np.log(total/len(energies)), weights/total
+
+
+class TrialCbmcinsertion(TrialInsertion):
+    """Insertion of a guest, selected from several random candidates
+
+    A number of candidate positions and orientations (``mc.ncandidates``) is
+    generated, and their interaction energies with the external potential are
+    computed at once. One candidate is selected with a probability
+    proportional to its Boltzmann factor. The bias is removed by including the
+    Rosenbluth weight (the average Boltzmann factor of the candidates) in the
+    acceptance rule, see Frenkel and Smit, Section 13.2. At high loadings,
+    much more insertions are accepted than with TrialInsertion. The matching
+    move is TrialCbmcdeletion.
+    """
+    log_name = 'cbins.'
+
+    def compute(self):
+        # e contains U(N+1) - U(N)
+        self.mc.N += 1
+        ff = self.mc.get_ff(self.mc.N)
+        if self.mc.N>1:
+            ff.system.pos[:(self.mc.N-1)*self.mc.guest.natom] = self.mc.current_configuration.pos
+        candidates = random_insertions(self.mc.guest, self.mc.ncandidates)
+        energies = self.candidate_energies(candidates)
+        self.log_weight, weights = _log_rosenbluth_weight(energies, self.mc.beta)
+        if weights is None:
+            # All candidates are in close contact with the host
+            return np.inf
+        icandidate = np.random.choice(len(candidates), p=weights)
+        ff.system.pos[(self.mc.N-1)*self.mc.guest.natom:] = candidates[icandidate]
+        self.eext = energies[icandidate]
+        return self.insertion_energy(ff, external=False) + self.eext
+
+    def probability(self, e):
+        if not np.isfinite(self.log_weight):
+            return 0.0
+        # The Boltzmann factor of the external energy is replaced by the
+        # Rosenbluth weight.
+        return min(1.0, self.mc.guest.cell.volume*self.mc.beta*self.mc.fugacity/self.mc.N*
+            np.exp(self.log_weight - self.mc.beta*(e - self.eext)))
+
+
+class TrialCbmcdeletion(TrialDeletion):
+    """Deletion of a guest, the reverse of TrialCbmcinsertion
+
+    The Rosenbluth weight of the guest to be deleted is computed with the
+    actual position of the guest and ``mc.ncandidates-1`` random candidates,
+    as required by detailed balance.
+    """
+    log_name = 'cbdel.'
+
+    def compute(self):
+        if self.mc.N==0:
+            return 0.0
+        # e contains U(N-1) - U(N)
+        iguest = np.random.randint(self.mc.N)
+        ff = self.mc.get_ff(self.mc.N)
+        self.mc.reorder_guests(ff.system, iguest)
+        candidates = np.concatenate([
+            random_insertions(self.mc.guest, self.mc.ncandidates-1),
+            [ff.system.pos[-self.mc.guest.natom:]]])
+        energies = self.candidate_energies(candidates)
+        self.log_weight = _log_rosenbluth_weight(energies, self.mc.beta)[0]
+        self.eext = -energies[-1]
+        return self.insertion_energy(ff, sign=-1, external=False) + self.eext
+
+    def probability(self, e):
+        if self.mc.N==0 or not np.isfinite(self.log_weight):
+            return 0.0
+        return min(1.0, self.mc.N/(self.mc.guest.cell.volume*self.mc.beta*self.mc.fugacity)*
+            np.exp(-self.log_weight - self.mc.beta*(e - self.eext)))
@@ -34,7 +34,7 @@ from yaff.system import System
 from yaff.log import log, timer
 
 
-__all__ = ['get_random_rotation_matrix', 'random_insertion',
+__all__ = ['get_random_rotation_matrix', 'random_insertion', 'random_insertions',
            'MCScreenLog', 'MCVolumeStateItem',
           ]
 
@@ -103,8 +103,49 @@ def random_insertion(guest):
     return pos+translation
 
 
+def random_insertions(guest, ninsertion):
+    """
+    Generate several random positions and orientations of a guest molecule
+    at once
+
+    **Arguments:**
+
+        guest
+            A System instance that is 3D periodic
+
+        ninsertion
+            The number of insertions
+
+    Returns an array with shape (ninsertion, guest.natom, 3). Each insertion
+    follows the same distribution as ``random_insertion``, but all random
+    rotation matrices are constructed with array operations.
+    """
+    assert guest.cell.nvec==3
+    pos = guest.pos - np.average(guest.pos, axis=0)
+    theta, phi, z = np.random.uniform(size=(3, ninsertion))
+    theta = theta*2.0*np.pi
+    phi = phi*2.0*np.pi
+    z = z*2.0
+    # See get_random_rotation_matrix
+    r = np.sqrt(z)
+    V = np.array([np.sin(phi)*r, np.cos(phi)*r, np.sqrt(2.0 - z)]).T
+    st = np.sin(theta)
+    ct = np.cos(theta)
+    R = np.zeros((ninsertion, 3, 3))
+    R[:,0,0] = ct
+    R[:,0,1] = st
+    R[:,1,0] = -st
+    R[:,1,1] = ct
+    R[:,2,2] = 1.0
+    M = np.einsum('ni,nj->nij', V, V) - np.eye(3)
+    M = np.einsum('nij,njk->nik', M, R)
+    translations = np.dot(np.random.rand(ninsertion, 3)-0.5, guest.cell.rvecs)
+    return np.einsum('ib,nab->nia', pos, M) + translations[:,None,:]
+
+
 class MCScreenLog(Hook):
     '''A screen logger for MC simulations'''
+    state_keys = ()
     def __init__(self, start=0, step=1):
         Hook.__init__(self, start, step)
         self.time0 = None
@@ -44,6 +44,7 @@ __all__ = [
 
 class TBCombination(VerletHook):
     name = 'TBCombination'
+    state_keys = ()
     def __init__(self, thermostat, barostat, start=0):
         """
             VerletHook combining an arbitrary Thermostat and Barostat instance, which
@@ -159,6 +160,7 @@ class McDonaldBarostat(VerletHook):
     name = 'McDonald'
     kind = 'stochastic'
     method = 'barostat'
+    state_keys = ()
     def __init__(self, temp, press, start=0, step=1, amp=1e-3):
         """
            Warning: this code is not fully tested yet!
@@ -233,6 +235,7 @@ class BerendsenBarostat(VerletHook):
     name = 'Berendsen'
     kind = 'deterministic'
     method = 'barostat'
+    state_keys = ()
     def __init__(self, ff, temp, press, start=0, step=1, timecon=1000*femtosecond, beta=4.57e-5/bar, anisotropic=True, vol_constraint=False, restart=False):
         """
             This hook implements the Berendsen barostat. The equations are derived in:
@@ -334,6 +337,7 @@ class LangevinBarostat(VerletHook):
     name = 'Langevin'
     kind = 'stochastic'
     method = 'barostat'
+    state_keys = ()
     def __init__(self, ff, temp, press, start=0, step=1, timecon=1000*femtosecond, anisotropic=True, vol_constraint=False):
         """
             This hook implements the Langevin barostat. The equations are derived in:
@@ -515,6 +519,7 @@ class MTKBarostat(VerletHook):
     name = 'MTTK'
     kind = 'deterministic'
     method = 'barostat'
+    state_keys = ()
     def __init__(self, ff, temp, press, start=0, step=1, timecon=1000*femtosecond, anisotropic=True, vol_constraint=False, baro_thermo=None, vel_press0=None, restart=False):
         """
             This hook implements the Martyna-Tobias-Klein barostat. The equations
@@ -731,6 +736,7 @@ class PRBarostat(VerletHook):
     name = 'PR'
     kind = 'deterministic'
     method = 'barostat'
+    state_keys = ()
     def __init__(self, ff, temp, press, start=0, step=1, timecon=1000*femtosecond, anisotropic=True, vol_constraint=False, baro_thermo=None, vel_press0=None, restart=False):
         """
             This hook implements the Parrinello-Rahman barostat for finite strains.
@@ -943,6 +949,7 @@ class TadmorBarostat(VerletHook):
     name = 'Tadmor'
     kind = 'deterministic'
     method = 'barostat'
+    state_keys = ()
     def __init__(self, ff, temp, press, start=0, step=1, timecon=1000*femtosecond, anisotropic=True, vol_constraint=False, baro_thermo=None, vel_press0=None, restart=False):
         """
             This hook implements the Tadmor-Miller barostat for finite strains.
@@ -47,6 +47,7 @@ class AndersenThermostat(VerletHook):
     name = 'Andersen'
     kind = 'stochastic'
     method = 'thermostat'
+    state_keys = ()
     def __init__(self, temp, start=0, step=1, select=None, annealing=1.0):
         """
            This is an implementation of the Andersen thermostat. The method
@@ -111,6 +112,7 @@ class BerendsenThermostat(VerletHook):
     name = 'Berendsen'
     kind = 'deterministic'
     method = 'thermostat'
+    state_keys = ()
     def __init__(self, temp, start=0, timecon=100*femtosecond, restart=False):
         """
            This is an implementation of the Berendsen thermostat. The algorithm
@@ -163,6 +165,7 @@ class LangevinThermostat(VerletHook):
     name = 'Langevin'
     kind = 'stochastic'
     method = 'thermostat'
+    state_keys = ()
     def __init__(self, temp, start=0, timecon=100*femtosecond):
         """
            This is an implementation of the Langevin thermostat. The algorithm
@@ -216,6 +219,7 @@ class CSVRThermostat(VerletHook):
     name = 'CSVR'
     kind = 'stochastic'
     method = 'thermostat'
+    state_keys = ()
     def __init__(self, temp, start=0, timecon=100*femtosecond):
         """
             This is an implementation of the CSVR thermostat. The equations are
@@ -272,6 +276,7 @@ class GLEThermostat(VerletHook):
     name = 'GLE'
     kind = 'stochastic'
     method = 'thermostat'
+    state_keys = ()
     def __init__(self, temp, a_p, c_p=None, start=0):
         """
             This hook implements the coloured noise thermostat. The equations
@@ -431,6 +436,7 @@ class NHCThermostat(VerletHook):
     name = 'NHC'
     kind = 'deterministic'
     method = 'thermostat'
+    state_keys = ()
     def __init__(self, temp, start=0, timecon=100*femtosecond, chainlength=3, chain_pos0=None, chain_vel0=None, restart=False):
         """
             This hook implements the Nose-Hoover chain thermostat. The equations
@@ -47,6 +47,7 @@ __all__ = [
 
 
 class OptScreenLog(Hook):
+    state_keys = ()
     def __init__(self, start=0, step=1):
         Hook.__init__(self, start, step)
         self.time0 = None
@@ -25,6 +25,10 @@
 
 from __future__ import division
 
+from contextlib import contextmanager
+import multiprocessing
+
+from nose.plugins.skip import SkipTest
 import pkg_resources
 import numpy as np
 
@@ -36,7 +40,7 @@ from yaff.test.common import get_system_water32, get_system_water, \
 
 __all__ = [
     'get_ff_water32', 'get_ff_water', 'get_ff_bks', 'get_ff_graphene',
-    'get_ff_polyethylene', 'get_ff_nacl',
+    'get_ff_polyethylene', 'get_ff_nacl', 'spawn_start_method',
 ]
 
 
@@ -85,3 +89,19 @@ def get_ff_nacl(**kwargs):
     system = get_system_nacl_cubic()
     fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_nacl.txt')
     return ForceField.generate(system, fn_pars, **kwargs)
+
+
+@contextmanager
+def spawn_start_method():
+    '''Temporarily make spawn the default start method of multiprocessing
+
+       This mimics the platforms on which processes are not forked by default.
+    '''
+    if not hasattr(multiprocessing, 'get_start_method'):
+        raise SkipTest('Start methods are not supported by this Python version.')
+    old = multiprocessing.get_start_method(allow_none=True)
+    multiprocessing.set_start_method('spawn', force=True)
+    try:
+        yield
+    finally:
+        multiprocessing.set_start_method(old, force=True)
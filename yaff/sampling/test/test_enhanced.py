@@ -31,6 +31,7 @@ import pkg_resources
 import h5py as h5
 import numpy as np
 import os
+from nose.tools import assert_raises
 
 from yaff import *
 from yaff.test.common import get_alaninedipeptide_amber99ff
@@ -157,3 +158,38 @@ def test_mtd_restart():
             assert np.all(f1['hills/K'][:]==mtd_restart.hills.Ks)
             assert f1['hills/sigma'].shape[0]==1
             assert f1['hills/sigma'][0]==sigma
+
+
+def test_mtd_grid_alanine():
+    # MTD settings
+    sigma = 0.35*rad
+    pace = 4
+    K = 1.2*kjmol
+    ff = get_alaninedipeptide_amber99ff()
+    cv = CVInternalCoordinate(ff.system, DihedAngle(4,6,8,14))
+    mtd = MTDHook(ff, cv, sigma, K, start=pace, step=pace, periodicities=2*np.pi)
+    nvt = VerletIntegrator(ff, 1.0*femtosecond, hooks=[mtd])
+    vel0 = nvt.vel.copy()
+    nvt.run(12)
+    # Same simulation with the hills on a grid
+    ff = get_alaninedipeptide_amber99ff()
+    cv = CVInternalCoordinate(ff.system, DihedAngle(4,6,8,14))
+    with h5.File('yaff.sampling.test.test_enhanced.test_mtd_grid_alanine.h5',
+            driver='core', backing_store=False) as f:
+        mtd_grid = MTDHook(ff, cv, sigma, K, f=f, start=pace, step=pace,
+            periodicities=2*np.pi, bounds=(-np.pi, np.pi), npoints=200)
+        assert isinstance(mtd_grid.hills, GridGaussianHills)
+        nvt = VerletIntegrator(ff, 1.0*femtosecond, hooks=[mtd_grid], vel0=vel0)
+        nvt.run(12)
+        assert np.all(f['hills/q0'][:]==mtd_grid.hills.q0s)
+        assert np.all(f['hills/K'][:]==mtd_grid.hills.Ks)
+    assert mtd_grid.hills.nhill == 3
+    assert np.all(np.abs(mtd_grid.hills.q0s-mtd.hills.q0s)<1e-6*rad)
+    assert abs(mtd_grid.hills.compute()-mtd.hills.compute())<1e-5*kjmol
+
+
+def test_mtd_grid_invalid():
+    ff = get_alaninedipeptide_amber99ff()
+    cv = CVInternalCoordinate(ff.system, DihedAngle(4,6,8,14))
+    with assert_raises(ValueError):
+        MTDHook(ff, cv, 0.35*rad, 1.2*kjmol, bounds=(-np.pi, np.pi))
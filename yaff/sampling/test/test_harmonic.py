@@ -29,7 +29,8 @@ from __future__ import print_function
 import numpy as np
 
 from yaff import *
-from yaff.sampling.test.common import get_ff_water32, get_ff_water, get_ff_bks
+from yaff.sampling.test.common import get_ff_water32, get_ff_water, get_ff_bks, \
+    spawn_start_method
 
 
 def test_hessian_partial_water32():
@@ -136,3 +137,57 @@ def test_bulk_elastic_bks():
     e2 = ff.compute()
     C = (e1 + e2 - 2*e0)/(eps**2)/vol0
     assert abs(C - elastic[0,0]) < C*0.02
+
+
+def test_hessian_order4_x2():
+    K, d = np.random.uniform(1.0, 2.0, 2)
+    system = System(
+        numbers=np.array([1, 1]),
+        pos=np.array([[0.0, 0.0, 0.0], [0.3, 0.4, d]]),
+        ffatypes=['H', 'H'],
+        bonds=np.array([[0, 1]]),
+    )
+    part = ForcePartValence(system)
+    part.add_term(Harmonic(K, 0.8*d, Bond(0, 1)))
+    ff = ForceField(system, [part])
+    # Analytic Hessian of the bond stretch
+    delta = system.pos[1] - system.pos[0]
+    r = np.linalg.norm(delta)
+    u = delta/r
+    block = K*np.outer(u, u) + K*(r - 0.8*d)/r*(np.identity(3) - np.outer(u, u))
+    hessian_ref = np.zeros((6, 6))
+    hessian_ref[:3,:3] = block
+    hessian_ref[3:,3:] = block
+    hessian_ref[:3,3:] = -block
+    hessian_ref[3:,:3] = -block
+    error2 = abs(estimate_cart_hessian(ff, eps=1e-2) - hessian_ref).max()
+    error4 = abs(estimate_cart_hessian(ff, eps=1e-2, order=4) - hessian_ref).max()
+    assert error2 < 1e-3
+    assert error4 < error2*1e-2
+
+
+def test_hessian_nproc_water32():
+    ff = get_ff_water32()
+    select = [1, 2, 3, 14, 15, 16]
+    pos0 = ff.system.pos.copy()
+    for order in 2, 4:
+        hessian1 = estimate_cart_hessian(ff, select=select, order=order)
+        hessian2 = estimate_cart_hessian(ff, select=select, order=order, nproc=2)
+        assert abs(hessian1 - hessian2).max() < 1e-10*abs(hessian1).max()
+    assert (ff.system.pos == pos0).all()
+
+
+def test_hessian_nproc_spawn_water32():
+    ff = get_ff_water32()
+    select = [1, 2, 3]
+    hessian1 = estimate_cart_hessian(ff, select=select)
+    with spawn_start_method():
+        hessian2 = estimate_cart_hessian(ff, select=select, nproc=2)
+    assert abs(hessian1 - hessian2).max() < 1e-10*abs(hessian1).max()
+
+
+def test_elastic_nproc_water32():
+    ff = get_ff_water32()
+    elastic1 = estimate_elastic(ff, do_frozen=True)
+    elastic2 = estimate_elastic(ff, do_frozen=True, nproc=3)
+    assert abs(elastic1 - elastic2).max() < 1e-10*abs(elastic1).max()
@@ -30,6 +30,7 @@ import h5py as h5
 import pkg_resources
 
 from yaff import *
+from yaff.sampling.mcutils import random_insertion
 from molmod.units import angstrom, bar, kelvin, kcalmol
 from molmod.constants import boltzmann
 
@@ -88,6 +89,23 @@ def test_gcmc_lj():
         assert np.abs(relerr)<0.2
 
 
+def test_gcmc_lj_energy():
+    # The energy is updated with local energy differences during the
+    # simulation. Compare with the energy of the final configuration.
+    gcmc = setup_gcmc_lj(20.0*angstrom)
+    gcmc.set_external_conditions(180.0, 50.0*bar)
+    gcmc.run(2000, mc_moves={'insertion':1.0, 'deletion':1.0, 'translation':1.0})
+    system = gcmc.current_configuration
+    assert system.natom > 10
+    sigmas = np.ones((system.natom,))*3.4*angstrom
+    epsilons = np.ones((system.natom,))*120.0*boltzmann
+    pair_pot = PairPotLJ(sigmas, epsilons, 2.5*3.4*angstrom, None)
+    nlist = NeighborList(system)
+    part_pair = ForcePartPair(system, nlist, Scalings(system), pair_pot)
+    ff = ForceField(system, [part_pair], nlist=nlist)
+    assert abs(ff.compute() - gcmc.energy) < 1e-8
+
+
 def test_gcmc_probabilities():
     gcmc = setup_gcmc_lj(20.0*angstrom)
     # We're not interested in the simulation results, so we choose a low
@@ -122,3 +140,51 @@ def test_gcmc_hdf5writer():
         assert 'emean' in f['trajectory']
         assert 'N' in f['trajectory']
         assert 'Nmean' in f['trajectory']
+
+
+def test_gcmc_hdf5writer_buffer():
+    fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    with h5.File('yaff.sampling.test.test_mc.test_gcmc_hdf5writer_buffer1.h5', driver='core', backing_store=False) as f1, \
+         h5.File('yaff.sampling.test.test_mc.test_gcmc_hdf5writer_buffer2.h5', driver='core', backing_store=False) as f2, \
+         h5.File('yaff.sampling.test.test_mc.test_gcmc_hdf5writer_buffer3.h5', driver='core', backing_store=False) as f3:
+        hdf5_1 = MCHDF5Writer(f1)
+        hdf5_2 = MCHDF5Writer(f2, buffer_size=4)
+        hdf5_3 = MCHDF5Writer(f3, buffer_size=4, async_write=True)
+        gcmc = GCMC.from_files(fn_guest, fn_pars, host=fn_host, hooks=[hdf5_1, hdf5_2, hdf5_3])
+        gcmc.set_external_conditions(200*kelvin, 1000*bar)
+        gcmc.run(10)
+        assert hdf5_2.nbuffer == 0
+        assert f2['trajectory/counter'][-1] == 10
+        for f in f2, f3:
+            for key, ds in f1['trajectory'].items():
+                assert (f['trajectory'][key][:] == ds[:]).all()
+            assert len(f['snapshots']) == 11
+        for name, grp in f1['snapshots'].items():
+            assert (f3['snapshots'][name]['system/pos'][:] == grp['system/pos'][:]).all()
+
+
+def test_gcmc_initial_structurefactors():
+    fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    gcmc = GCMC.from_files(fn_guest, fn_pars, host=fn_host)
+    gcmc.set_external_conditions(200*kelvin, 1000*bar)
+    initial = replicate_guest(gcmc.guest, 2)
+    for iguest in range(2):
+        initial.pos[iguest*gcmc.guest.natom:(iguest+1)*gcmc.guest.natom] = \
+            random_insertion(gcmc.guest)
+    cosfacs = gcmc.ewald_reci.cosfacs.copy()
+    sinfacs = gcmc.ewald_reci.sinfacs.copy()
+    gcmc.ewald_reci.compute_structurefactors(initial.pos, initial.charges,
+        cosfacs, sinfacs)
+    # Starting twice from the same configuration gives the same structure
+    # factors, those of the previous guests are discarded.
+    for counter in 0, 10:
+        gcmc.run(0, initial=initial, counter=counter)
+        assert gcmc.N == 2
+        assert gcmc.counter == counter
+        assert gcmc.current_configuration is gcmc.get_ff(2).system
+        assert abs(gcmc.ewald_reci.cosfacs - cosfacs).max() < 1e-10
+        assert abs(gcmc.ewald_reci.sinfacs - sinfacs).max() < 1e-10
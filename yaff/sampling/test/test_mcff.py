@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+
+from __future__ import division
+
+import numpy as np
+import pkg_resources
+from nose.tools import assert_raises
+
+from yaff import *
+from yaff.sampling.mcutils import random_insertion
+from molmod.units import angstrom, bar
+from molmod.constants import boltzmann
+
+
+def get_xylene():
+    fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    host = System.from_file(fn_host)
+    guest = System.from_file(fn_guest)
+    guest.cell = Cell(host.cell.rvecs)
+    return guest, fn_pars
+
+
+def get_ff_generator(fn_pars, **kwargs):
+    def ff_generator(system, guest):
+        nlow = max(0, system.natom-guest.natom)
+        return ForceField.generate(system, fn_pars, nlow=nlow, nhigh=nlow,
+            reci_ei='ewald_interaction', **kwargs)
+    return ff_generator
+
+
+def test_replicate_guest():
+    guest, fn_pars = get_xylene()
+    system = replicate_guest(guest, 3)
+    ref = guest.merge(guest).merge(guest)
+    assert system.natom == ref.natom
+    assert (system.numbers == ref.numbers).all()
+    assert (system.pos == ref.pos).all()
+    assert (system.bonds == ref.bonds).all()
+    assert (system.charges == ref.charges).all()
+    assert (system.cell.rvecs == ref.cell.rvecs).all()
+    for iatom in range(system.natom):
+        assert system.get_ffatype(iatom) == ref.get_ffatype(iatom)
+
+
+def test_guest_ff_xylene():
+    guest, fn_pars = get_xylene()
+    ff_generator = get_ff_generator(fn_pars, tailcorrections=True, rcut=10*angstrom)
+    guest_ff = GuestForceField(guest, ff_generator, nguests=2)
+    assert guest_ff.capacity == 2
+    system = None
+    for nguests in range(1, 5):
+        # Add a guest at a random position
+        if system is None:
+            system = replicate_guest(guest, 1)
+        else:
+            system = system.merge(guest)
+        system.pos[-guest.natom:] = random_insertion(guest)
+        # Reference energy with a force field for this number of guests
+        ff_ref = ff_generator(system, guest)
+        eref = ff_ref.compute()
+        ff = guest_ff.get_ff(nguests)
+        assert ff.system.natom == system.natom
+        ff.update_pos(system.pos)
+        assert abs(ff.compute() - eref) < 1e-10
+        iatoms = np.arange(system.natom - guest.natom, system.natom)
+        assert abs(ff.compute_subset(iatoms) - eref) < 1e-10
+    # The capacity was doubled once
+    assert guest_ff.capacity == 4
+    # Positions are retained after a resize
+    guest_ff.resize(8)
+    assert (guest_ff.get_ff(4).system.pos == system.pos).all()
+
+
+def test_guest_ff_valence():
+    guest, fn_pars = get_xylene()
+    def ff_generator(system, guest):
+        return ForceField.generate(system, fn_pars)
+    with assert_raises(TypeError):
+        GuestForceField(guest, ff_generator)
+
+
+def test_gcmc_resizable_lj():
+    # Identical simulations with and without resizable force field
+    numbers = np.array([18])
+    guest = System(numbers, np.zeros((1, 3)), rvecs=np.eye(3)*20*angstrom,
+        bonds=np.zeros((0, 2), int))
+    def ff_generator(system, guest):
+        sigmas = np.ones(system.natom)*3.4*angstrom
+        epsilons = np.ones(system.natom)*120.0*boltzmann
+        pair_pot = PairPotLJ(sigmas, epsilons, 8.5*angstrom, None)
+        nlow = max(0, system.natom-guest.natom)
+        nlist = NeighborList(system, nlow=nlow, nhigh=nlow)
+        part_pair = ForcePartPair(system, nlist, Scalings(system), pair_pot)
+        return ForceField(system, [part_pair], nlist=nlist)
+    results = []
+    for resizable in False, True:
+        np.random.seed(1)
+        gcmc = GCMC(guest, ff_generator, nguests=2, resizable=resizable)
+        assert (gcmc._guest_ff is not None) == resizable
+        gcmc.set_external_conditions(180.0, 50*bar)
+        gcmc.run(1000, mc_moves={'insertion':1.0, 'deletion':1.0, 'translation':1.0})
+        system = gcmc.current_configuration
+        assert system.natom == gcmc.N
+        results.append((gcmc.N, gcmc.energy, system.pos.copy()))
+    assert results[0][0] > 2
+    assert results[0][0] == results[1][0]
+    assert abs(results[0][1] - results[1][1]) < 1e-10
+    assert abs(results[0][2] - results[1][2]).max() < 1e-10
+    # The capacity grows by doubling
+    assert gcmc._guest_ff.capacity >= gcmc.N
+    assert gcmc._guest_ff.capacity < 2*max(gcmc.N, 2)+2
+
+
+def test_gcmc_from_files_resizable():
+    guest, fn_pars = get_xylene()
+    gcmc = GCMC.from_files(guest, fn_pars, rcut=10*angstrom, nguests=2)
+    assert gcmc._guest_ff is None
+    gcmc = GCMC.from_files(guest, fn_pars, rcut=10*angstrom, nguests=2,
+                           resizable=True)
+    assert gcmc._guest_ff is not None
+    gcmc.set_external_conditions(300.0, 10*bar)
+    gcmc.run(100, mc_moves={'insertion':1.0, 'deletion':0.2, 'translation':1.0})
+    assert gcmc.current_configuration.natom == gcmc.N*guest.natom
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+
+from __future__ import division
+
+import numpy as np
+import pkg_resources
+from nose.tools import assert_raises
+
+from yaff import *
+from yaff.pes.ff import ForcePartPair
+from yaff.sampling.test.common import spawn_start_method
+from molmod.units import angstrom, bar, kelvin, kjmol
+
+
+def get_cau13_xylene():
+    fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
+    fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
+    fn_guest = pkg_resources.resource_filename(__name__, '../../data/test/xylene.chk')
+    host = System.from_file(fn_host)
+    guest = System.from_file(fn_guest)
+    guest.cell = Cell(host.cell.rvecs)
+    return host, guest, fn_pars
+
+
+def test_compute_host_grids_cau13():
+    host, guest, fn_pars = get_cau13_xylene()
+    shape = (3, 4, 5)
+    grids = compute_host_grids(host, guest, fn_pars, shape, emax=np.inf)
+    assert sorted(grids.keys()) == sorted(set(guest.ffatypes))
+    for grid in grids.values():
+        assert grid.shape == shape
+    # Reference: pair interactions and reciprocal-space electrostatics of the
+    # host with a complete guest molecule.
+    hostguest = host.merge(guest)
+    extpot = ForceField.generate(hostguest, fn_pars, nlow=host.natom,
+        nhigh=host.natom, reci_ei='ewald_interaction')
+    for part in extpot.parts:
+        if isinstance(part, ForcePartEwaldReciprocalInteraction):
+            reci = part
+            reci.compute_structurefactors(hostguest.pos[:host.natom],
+                hostguest.charges[:host.natom], reci.cosfacs, reci.sinfacs)
+    def compute_reference(pos):
+        hostguest.pos[host.natom:] = pos
+        extpot.update_pos(hostguest.pos)
+        extpot.compute()
+        energy = sum(part.energy for part in extpot.parts if isinstance(part, ForcePartPair))
+        energy += reci.insertion_energy(pos, hostguest.charges[host.natom:])
+        return energy
+    # The interactions are pairwise additive, so moving a single atom of the
+    # guest between two grid points changes the energy by the difference of
+    # the corresponding grid values.
+    for iatom in [0, 5, 17]:
+        ffatype = guest.get_ffatype(iatom)
+        grid = grids[ffatype]
+        indexes = [np.unravel_index(i, shape) for i in np.argsort(grid.ravel())[:2]]
+        energies = []
+        for index in indexes:
+            pos = guest.pos.copy()
+            pos[iatom] = np.dot(np.array(index)/np.array(shape), host.cell.rvecs)
+            energies.append(compute_reference(pos))
+        assert abs((energies[1] - energies[0]) - (grid[indexes[1]] - grid[indexes[0]])) < 1e-8
+
+
+def test_compute_host_grids_nproc():
+    host, guest, fn_pars = get_cau13_xylene()
+    grids0 = compute_host_grids(host, guest, fn_pars, (3, 3, 3), chunksize=5)
+    grids1 = compute_host_grids(host, guest, fn_pars, (3, 3, 3), chunksize=5, nproc=2)
+    for ffatype in grids0:
+        assert (grids0[ffatype] == grids1[ffatype]).all()
+        assert grids0[ffatype].max() <= 1000*kjmol
+
+
+def test_compute_host_grids_nproc_spawn():
+    # The worker processes must also get the probe force fields when fork is
+    # not the default start method.
+    host, guest, fn_pars = get_cau13_xylene()
+    grids0 = compute_host_grids(host, guest, fn_pars, (2, 2, 2), chunksize=3)
+    with spawn_start_method():
+        grids1 = compute_host_grids(host, guest, fn_pars, (2, 2, 2), chunksize=3, nproc=2)
+    for ffatype in grids0:
+        assert (grids0[ffatype] == grids1[ffatype]).all()
+
+
+def test_compute_host_grids_invalid():
+    host, guest, fn_pars = get_cau13_xylene()
+    with assert_raises(ValueError):
+        compute_host_grids(host, guest, fn_pars, (3, 3, 3), nproc=0)
+    with assert_raises(ValueError):
+        compute_host_grids(host, guest, fn_pars, (3, 0, 3))
+
+
+def test_gcmc_grids_cau13():
+    host, guest, fn_pars = get_cau13_xylene()
+    gcmc = GCMC.from_files(guest, fn_pars, host=host, grid_shape=(6, 6, 5))
+    assert gcmc.external_potential.system.natom == guest.natom
+    assert isinstance(gcmc.external_potential.parts[0], ForcePartGrid)
+    gcmc.set_external_conditions(200*kelvin, 1000*bar)
+    gcmc.run(20)
+    assert gcmc.counter == 20
+
+
+def test_canonical_mc_grid():
+    # Single-site guests in a random external potential
+    L = 20.0*angstrom
+    guest = System(np.array([18]), np.zeros((1, 3)), ffatypes=['Ar'],
+        rvecs=np.eye(3)*L, bonds=np.zeros((0, 2), int))
+    system = guest.supercell(1, 1, 1)
+    for iguest in range(4):
+        system = system.merge(guest)
+    system.pos[:] = np.random.uniform(0, L, system.pos.shape)
+    nlist = NeighborList(system, nlow=system.natom-1, nhigh=system.natom-1)
+    pair_pot = PairPotLJ(np.ones(system.natom)*3.4*angstrom,
+        np.ones(system.natom)*kjmol, 8.0*angstrom)
+    part_pair = ForcePartPair(system, nlist, Scalings(system), pair_pot)
+    ff = ForceField(system, [part_pair], nlist=nlist)
+    grids = {'Ar': np.random.uniform(-1.0, 1.0, (10, 10, 10))*kjmol}
+    extpot = get_grid_external_potential(guest, grids)
+    mc = CanonicalMC(guest, ff, external_potential=extpot)
+    mc.set_external_conditions(300*kelvin)
+    acceptance = mc.run(50, close_contact=-1.0)
+    assert mc.counter == 50
+    assert acceptance[:,1].sum() == 50
+
+
+def test_compute_batch_cau13():
+    host, guest, fn_pars = get_cau13_xylene()
+    batch = random_insertions(guest, 5)
+    iatoms = np.arange(guest.natom)
+    # Vectorized evaluation of grids
+    grids = dict((ffatype, np.random.uniform(0, 1, (4, 5, 6)))
+                 for ffatype in set(guest.ffatypes))
+    for tricubic in False, True:
+        extpot = get_grid_external_potential(guest, grids, tricubic=tricubic)
+        pos0 = extpot.system.pos.copy()
+        energies = extpot.compute_batch(iatoms, batch)
+        assert (extpot.system.pos == pos0).all()
+        for ibatch in range(5):
+            extpot.update_pos(batch[ibatch])
+            assert abs(energies[ibatch] - extpot.compute()) < 1e-10
+    # Parts without a vectorized implementation
+    hostguest = host.merge(guest)
+    extpot = ForceField.generate(hostguest, fn_pars, nlow=host.natom,
+        nhigh=host.natom, reci_ei='ignore')
+    pos0 = hostguest.pos.copy()
+    energies = extpot.compute_batch(iatoms + host.natom, batch)
+    assert (extpot.system.pos == pos0).all()
+    for ibatch in range(5):
+        pos = pos0.copy()
+        pos[host.natom:] = batch[ibatch]
+        extpot.update_pos(pos)
+        assert abs(energies[ibatch] - extpot.compute()) < 1e-10
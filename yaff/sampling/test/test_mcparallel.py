@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+
+from __future__ import division
+
+import os
+
+import numpy as np
+import h5py as h5
+from nose.tools import assert_raises
+
+from yaff import *
+from yaff.sampling.test.common import spawn_start_method
+from yaff.sampling.test.test_mc import setup_gcmc_lj
+from molmod.test.common import tmpdir
+from molmod.units import angstrom, bar
+from molmod.constants import boltzmann
+
+
+def compute_lj_energy(system):
+    sigmas = np.ones((system.natom,))*3.4*angstrom
+    epsilons = np.ones((system.natom,))*120.0*boltzmann
+    pair_pot = PairPotLJ(sigmas, epsilons, 2.5*3.4*angstrom, None)
+    nlist = NeighborList(system)
+    part_pair = ForcePartPair(system, nlist, Scalings(system), pair_pot)
+    ff = ForceField(system, [part_pair], nlist=nlist)
+    return ff.compute()
+
+
+def test_mc_chains_exchange():
+    mcs = []
+    def mc_generator():
+        mcs.append(setup_gcmc_lj(20.0*angstrom))
+        return mcs[-1]
+    conditions = [(180.0, 10.0*bar), (180.0, 20.0*bar), (200.0, 20.0*bar)]
+    result = run_mc_chains(mc_generator, conditions, 600, exchange=20,
+        minblock=10, seed=1)
+    assert len(mcs) == 3
+    for ichain, mc in enumerate(mcs):
+        assert mc.T == conditions[ichain][0]
+        assert mc.fugacity == conditions[ichain][1]
+        assert mc.counter == 600
+        # The energy is continued after swaps of configurations.
+        system = mc.get_ff(mc.N).system
+        assert abs(compute_lj_energy(system) - mc.energy) < 1e-8
+        assert result['acceptance'][ichain][:,1].sum() == 600
+    assert result['exchange'].shape == (2, 2)
+    assert result['exchange'][:,1].sum() == 29
+    assert result['exchange'][:,0].sum() > 0
+    assert (result['exchange'][:,0] <= result['exchange'][:,1]).all()
+    for key in 'Nmean', 'Nerr', 'emean', 'eerr':
+        assert result[key].shape == (3,)
+    assert (result['Nerr'] > 0).all()
+
+
+def test_mc_chains_processes():
+    conditions = [(180.0, 1.0*bar), (180.0, 50.0*bar)]
+    with tmpdir(__name__, 'test_mc_chains_processes') as dn:
+        fn_h5 = os.path.join(dn, 'gcmc_%i.h5')
+        result = run_mc_chains(lambda: setup_gcmc_lj(20.0*angstrom),
+            conditions, 1000, nproc=2, fn_h5=fn_h5, h5_step=500, minblock=10)
+        for ichain in range(2):
+            with h5.File(fn_h5 % ichain, 'r') as f:
+                assert (f['trajectory/counter'][:] == [0, 500, 1000]).all()
+                assert len(f['snapshots']) == 3
+    assert result['Nmean'][1] > result['Nmean'][0]
+    assert (result['exchange'] == 0).all()
+
+
+def test_mc_chains_processes_spawn():
+    # A lambda function cannot be pickled, so this only works when the worker
+    # processes are forked, regardless of the default start method.
+    conditions = [(180.0, 1.0*bar), (180.0, 50.0*bar)]
+    with spawn_start_method():
+        result = run_mc_chains(lambda: setup_gcmc_lj(20.0*angstrom),
+            conditions, 1000, nproc=2, minblock=10)
+    for ichain in range(2):
+        assert result['acceptance'][ichain][:,1].sum() == 1000
+
+
+def test_mc_chains_failure():
+    def mc_generator():
+        raise RuntimeError('broken chain')
+    with assert_raises(RuntimeError):
+        run_mc_chains(mc_generator, [(180.0, 1.0*bar)]*2, 10, nproc=2)
+    with assert_raises(ValueError):
+        run_mc_chains(mc_generator, [], 10)
@@ -95,6 +95,23 @@ def check_rotation_energy(gcmc, fn_host, fn_pars, fn_guest):
     trial.reject()
 
 
+def check_cbmc_energy(gcmc, fn_host, fn_pars, fn_guest):
+    # The energy difference is the same as for a regular insertion or
+    # deletion of the selected candidate.
+    for trial, sign in (TrialCbmcinsertion(gcmc), 1), (TrialCbmcdeletion(gcmc), -1):
+        e = trial.compute()
+        assert np.isfinite(trial.log_weight)
+        system0 = System.from_file(fn_host).merge(trial.mc.get_ff(trial.mc.N).system)
+        ff0 = ForceField.generate(system0, fn_pars)
+        system1 = system0.subsystem(np.arange(system0.natom-gcmc.guest.natom))
+        ff1 = ForceField.generate(system1, fn_pars)
+        system2 = system0.subsystem(np.arange(system0.natom-gcmc.guest.natom,system0.natom))
+        ff2 = ForceField.generate(system2, fn_pars)
+        eref = sign*(ff0.compute() - ff1.compute() - ff2.compute())
+        assert np.abs(e-eref)<1e-10
+        trial.reject()
+
+
 def test_trials_xylene_in_cau13():
     fn_host = pkg_resources.resource_filename(__name__, '../../data/test/CAU_13.chk')
     fn_pars = pkg_resources.resource_filename(__name__, '../../data/test/parameters_CAU-13_xylene.txt')
@@ -114,3 +131,48 @@ def test_trials_xylene_in_cau13():
     check_deletion_energy(gcmc, fn_host, fn_pars, fn_guest)
     check_translation_energy(gcmc, fn_host, fn_pars, fn_guest)
     check_rotation_energy(gcmc, fn_host, fn_pars, fn_guest)
+    check_cbmc_energy(gcmc, fn_host, fn_pars, fn_guest)
+
+
+def test_random_insertions():
+    guest = System(np.array([8, 1, 1]), np.array([[0.0, 0.0, 0.0],
+        [1.8, 0.0, 0.0], [-0.4, 1.75, 0.0]]), rvecs=np.eye(3)*20*angstrom)
+    candidates = random_insertions(guest, 100)
+    assert candidates.shape == (100, 3, 3)
+    # Rigid rotations and translations
+    for candidate in candidates:
+        for i, j in (0, 1), (0, 2), (1, 2):
+            assert abs(np.linalg.norm(candidate[i] - candidate[j]) -
+                       np.linalg.norm(guest.pos[i] - guest.pos[j])) < 1e-10
+    centers = candidates.mean(axis=1)
+    assert (abs(centers) <= 10*angstrom).all()
+
+
+def test_gcmc_cbmc_ideal_gas():
+    # Single-site guests without mutual interactions in an external potential.
+    # The average number of guests is beta*fugacity*V*<exp(-beta*U)>.
+    np.random.seed(3)
+    L = 20.0*angstrom
+    T = 300.0*kelvin
+    beta = 1.0/boltzmann/T
+    guest = System(np.array([18]), np.zeros((1, 3)), ffatypes=['Ar'],
+        rvecs=np.eye(3)*L, bonds=np.zeros((0, 2), int))
+    grid = np.random.uniform(0, 8, (6, 6, 6))/beta
+    grid[1,2,3] = -6/beta
+    grid[4,4,1] = -6/beta
+    extpot = get_grid_external_potential(guest, {'Ar': grid})
+    n = 40
+    frac = (np.indices((n, n, n)).reshape(3, -1).T + 0.5)/n
+    energies = extpot.compute_batch(np.array([0]), np.dot(frac, guest.cell.rvecs)[:,None,:])
+    fugacity = 4.0/(beta*guest.cell.volume*np.exp(-beta*energies).mean())
+    gcmc = GCMC(guest, lambda system, guest: ForceField(system, []),
+        external_potential=extpot, resizable=True)
+    gcmc.set_external_conditions(T, fugacity)
+    acceptance = gcmc.run(10000, mc_moves={'cbmcinsertion':1.0,
+        'cbmcdeletion':1.0}, ncandidates=5)
+    assert acceptance[0,0] > 0
+    assert abs(gcmc.Nmean/4.0 - 1.0) < 0.15
+    # The energy is the sum of the external energies of the guests
+    system = gcmc.current_configuration
+    eref = extpot.compute_batch(np.array([0]), system.pos[:,None,:]).sum()
+    assert abs(gcmc.energy - eref) < 1e-10
@@ -26,12 +26,14 @@
 from __future__ import division
 
 import os
+import time
 
 import pkg_resources
 import h5py as h5
 import numpy as np
 
 from yaff import *
+from yaff.sampling.io import WriterThread
 from yaff.test.common import get_system_water
 from yaff.sampling.test.common import get_ff_water32, get_ff_water
 from molmod.test.common import tmpdir
@@ -123,6 +125,192 @@ def test_hdf5_simple():
         assert f['trajectory/counter'][15] == 15
 
 
+def test_hdf5_buffer():
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_buffer1.h5', driver='core', backing_store=False) as f1, \
+         h5.File('yaff.sampling.test.test_verlet.test_hdf5_buffer2.h5', driver='core', backing_store=False) as f2:
+        hdf5_1 = HDF5Writer(f1)
+        hdf5_2 = HDF5Writer(f2, buffer_size=4, compression='gzip')
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=[hdf5_1, hdf5_2])
+        # Only the initial state is buffered
+        assert f2['trajectory/counter'].shape == (0,)
+        nve.run(6)
+        assert hdf5_2.nbuffer == 0
+        nve.run(9)
+        check_hdf5_common(f2)
+        assert get_last_trajectory_row(f2['trajectory']) == 16
+        for key, ds in f1['trajectory'].items():
+            assert f2['trajectory'][key].compression == 'gzip'
+            assert f2['trajectory'][key].chunks[0] == 4
+            assert (f2['trajectory'][key][:] == ds[:]).all()
+
+
+class GapStateItem(StateItem):
+    # A state item without a value in the fifth iteration
+    def __init__(self, key='gap'):
+        StateItem.__init__(self, key)
+        self.ncall = 0
+
+    def get_value(self, iterative):
+        self.ncall += 1
+        if self.ncall == 5:
+            return None
+        return float(self.ncall)
+
+    def copy(self):
+        return self.__class__(self.key)
+
+
+def test_hdf5_buffer_none():
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_buffer_none1.h5', driver='core', backing_store=False) as f1, \
+         h5.File('yaff.sampling.test.test_verlet.test_hdf5_buffer_none2.h5', driver='core', backing_store=False) as f2:
+        hooks = [HDF5Writer(f1), HDF5Writer(f2, buffer_size=4)]
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, state=[GapStateItem()], hooks=hooks)
+        nve.run(9)
+        # The iteration without a value is not written, also not with values
+        # from a previous buffered iteration.
+        assert (f1['trajectory/counter'][:] == [0, 1, 2, 3, 5, 6, 7, 8, 9]).all()
+        assert (f1['trajectory/gap'][:] == [1, 2, 3, 4, 6, 7, 8, 9, 10]).all()
+        for key, ds in f1['trajectory'].items():
+            assert f2['trajectory'][key].shape == ds.shape
+            assert (f2['trajectory'][key][:] == ds[:]).all()
+
+
+class RaiseHook(Hook):
+    def __call__(self, iterative):
+        if iterative.counter == 10:
+            raise RuntimeError
+
+
+def test_hdf5_buffer_exception():
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_buffer_exception.h5', driver='core', backing_store=False) as f:
+        hdf5 = HDF5Writer(f, buffer_size=4)
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=[hdf5, RaiseHook()])
+        try:
+            nve.run(15)
+            assert False
+        except RuntimeError:
+            pass
+        assert get_last_trajectory_row(f['trajectory']) == 11
+        assert f['trajectory/counter'][10] == 10
+
+
+def test_hdf5_async():
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_async1.h5', driver='core', backing_store=False) as f1, \
+         h5.File('yaff.sampling.test.test_verlet.test_hdf5_async2.h5', driver='core', backing_store=False) as f2, \
+         h5.File('yaff.sampling.test.test_verlet.test_hdf5_async3.h5', driver='core', backing_store=False) as f3, \
+         h5.File('yaff.sampling.test.test_verlet.test_hdf5_async4.h5', driver='core', backing_store=False) as f4, \
+         h5.File('yaff.sampling.test.test_verlet.test_hdf5_async5.h5', driver='core', backing_store=False) as f5:
+        hooks = [
+            HDF5Writer(f1), HDF5Writer(f2, async_write=True),
+            HDF5Writer(f3, buffer_size=4, async_write=True),
+            RestartWriter(f4, step=3), RestartWriter(f5, step=3, async_write=True),
+        ]
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=hooks)
+        nve.run(15)
+        for hook in hooks[:5]:
+            assert hook.thread is None
+        for f in f2, f3:
+            check_hdf5_common(f)
+            for key, ds in f1['trajectory'].items():
+                assert (f['trajectory'][key][:] == ds[:]).all()
+        assert f4['trajectory/counter'].shape == (5,)
+        for key, ds in f4['trajectory'].items():
+            assert (f5['trajectory'][key][:] == ds[:]).all()
+
+
+class FailingHDF5Writer(HDF5Writer):
+    def write_buffers(self, buffers, nrow):
+        if buffers['counter'][0] >= 8:
+            raise IOError('Disk full')
+        HDF5Writer.write_buffers(self, buffers, nrow)
+
+
+def test_hdf5_async_error():
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_async_error.h5', driver='core', backing_store=False) as f:
+        hdf5 = FailingHDF5Writer(f, buffer_size=4, async_write=True)
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=hdf5)
+        try:
+            nve.run(15)
+            assert False
+        except IOError:
+            pass
+        assert hdf5.thread is None
+        assert get_last_trajectory_row(f['trajectory']) == 8
+
+
+def test_hdf5_async_error_two_writers():
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_async_error_two_writers1.h5', driver='core', backing_store=False) as f1, \
+         h5.File('yaff.sampling.test.test_verlet.test_hdf5_async_error_two_writers2.h5', driver='core', backing_store=False) as f2:
+        # The first writer fails when its last rows are flushed in finalize.
+        hdf5_1 = FailingHDF5Writer(f1, buffer_size=4, async_write=True)
+        hdf5_2 = HDF5Writer(f2, buffer_size=4, async_write=True)
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=[hdf5_1, hdf5_2])
+        try:
+            nve.run(9)
+            assert False
+        except IOError:
+            pass
+        assert get_last_trajectory_row(f1['trajectory']) == 8
+        # The second writer is still finalized.
+        assert hdf5_2.thread is None
+        assert hdf5_2.nbuffer == 0
+        assert (f2['trajectory/counter'][:] == np.arange(10)).all()
+
+
+class FailOnceHDF5Writer(HDF5Writer):
+    # The second write operation fails
+    nwrite = 0
+
+    def write_buffers(self, buffers, nrow):
+        self.nwrite += 1
+        if self.nwrite == 2:
+            raise IOError('Disk full')
+        HDF5Writer.write_buffers(self, buffers, nrow)
+
+
+def test_hdf5_async_error_rerun():
+    with h5.File('yaff.sampling.test.test_verlet.test_hdf5_async_error_rerun.h5', driver='core', backing_store=False) as f:
+        hdf5 = FailOnceHDF5Writer(f, buffer_size=2, async_write=True)
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=hdf5)
+        try:
+            nve.run(4)
+            assert False
+        except IOError:
+            pass
+        assert hdf5.thread is None
+        nrow = get_last_trajectory_row(f['trajectory'])
+        assert nrow == 2
+        # The next run starts a new writer thread and adds rows.
+        nve.run(4)
+        assert hdf5.thread is None
+        assert get_last_trajectory_row(f['trajectory']) > nrow
+        assert f['trajectory/counter'][-1] == nve.counter
+
+
+def test_writer_thread_error():
+    thread = WriterThread(2)
+    def fail():
+        raise IOError('Disk full')
+    thread.submit(fail)
+    # Wait until the thread has carried out the failing task.
+    for irep in range(1000):
+        if thread.failed:
+            break
+        time.sleep(0.01)
+    # The error is raised on every later call, also after the first one.
+    for irep in range(3):
+        try:
+            thread.submit(len, [])
+            assert False
+        except IOError:
+            pass
+    try:
+        thread.close()
+        assert False
+    except IOError:
+        pass
+
+
 def test_hdf5_cvs():
     # This test checks that CVStateItem and BiasStateItem writes output
     ff = get_ff_water32()
@@ -165,6 +353,75 @@ def test_hdf5_cvs():
         assert 'cv_names' in f['trajectory'].attrs
 
 
+class CountingStateItem(StateItem):
+    def __init__(self, key='ncall'):
+        StateItem.__init__(self, key)
+        self.ncall = 0
+
+    def get_value(self, iterative):
+        self.ncall += 1
+        return self.ncall
+
+    def copy(self):
+        return self.__class__(self.key)
+
+
+class RecordHook(Hook):
+    state_keys = ['ncall1']
+
+    def __init__(self, start=0, step=1):
+        self.values = []
+        Hook.__init__(self, start, step)
+
+    def __call__(self, iterative):
+        self.values.append(iterative.state['ncall1'].value)
+
+
+def test_state_demand():
+    item1 = CountingStateItem('ncall1')
+    item2 = CountingStateItem('ncall2')
+    record = RecordHook()
+    with h5.File('yaff.sampling.test.test_verlet.test_state_demand.h5', driver='core', backing_store=False) as f:
+        hooks = [VerletScreenLog(step=1), record, HDF5Writer(f, step=5)]
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, state=[item1, item2], hooks=hooks)
+        nve.run(10)
+        # Only updated when the HDF5Writer is called
+        assert item2.ncall == 3
+        assert (f['trajectory/ncall2'][:] == [1, 2, 3]).all()
+        # Updated once per step for the RecordHook
+        assert item1.ncall == 11
+        assert record.values == list(range(1, 12))
+
+
+class RecordVerletHook(VerletHook):
+    # A VerletHook outside Yaff does not declare its state items.
+    def __init__(self):
+        self.values = []
+        VerletHook.__init__(self)
+
+    def init(self, iterative):
+        pass
+
+    def pre(self, iterative):
+        pass
+
+    def post(self, iterative):
+        pass
+
+    def __call__(self, iterative):
+        self.values.append(iterative.state['ncall'].value)
+
+
+def test_state_demand_verlet_hook():
+    item = CountingStateItem()
+    record = RecordVerletHook()
+    hooks = [VerletScreenLog(step=1), AndersenThermostat(300, step=5), record]
+    nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, state=[item], hooks=hooks)
+    nve.run(5)
+    # Updated in every step
+    assert record.values == list(range(1, 7))
+
+
 def test_xyz():
     with tmpdir(__name__, 'test_xyz') as dn:
         fn_xyz = os.path.join(dn, 'foobar.xyz')
@@ -181,6 +438,21 @@ def test_xyz():
         xyz.xyz_writer._f.close()
 
 
+def test_xyz_async():
+    with tmpdir(__name__, 'test_xyz_async') as dn:
+        fn_xyz1 = os.path.join(dn, 'foobar1.xyz')
+        fn_xyz2 = os.path.join(dn, 'foobar2.xyz')
+        xyz1 = XYZWriter(fn_xyz1)
+        xyz2 = XYZWriter(fn_xyz2, async_write=True)
+        nve = VerletIntegrator(get_ff_water32(), 1.0*femtosecond, hooks=[xyz1, xyz2])
+        nve.run(15)
+        for xyz in xyz1, xyz2:
+            xyz.xyz_writer._auto_close = False
+            xyz.xyz_writer._f.close()
+        with open(fn_xyz1) as f1, open(fn_xyz2) as f2:
+            assert f1.read() == f2.read()
+
+
 def test_xyz_select():
     with tmpdir(__name__, 'test_xyz_select') as dn:
         fn_xyz = os.path.join(dn, 'foobar.xyz')
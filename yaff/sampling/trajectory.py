@@ -40,6 +40,7 @@ __all__ = [
 ]
 
 class TrajScreenLog(Hook):
+    state_keys = ()
     def __init__(self, start=0, step=1):
         Hook.__init__(self, start, step)
         self.time0 = None
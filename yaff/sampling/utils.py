@@ -26,6 +26,8 @@
 
 from __future__ import division
 
+import multiprocessing
+
 from molmod import boltzmann
 
 import numpy as np
@@ -460,3 +462,22 @@ def stabilized_cholesky_decomp(mat):
 
         D = np.sqrt(D.clip(min=0))
         return L*D
+
+
+def get_fork_context():
+    '''Return a multiprocessing context in which new processes are forked
+
+       Force fields cannot be pickled, so they are passed to worker processes
+       by forking: every worker inherits a copy of the parent process. The
+       default start method is not ``fork`` on all platforms and Python
+       versions (e.g. ``spawn`` on macOS and Windows), hence the explicit
+       context. A NotImplementedError is raised when forking is not
+       supported.
+    '''
+    if not hasattr(multiprocessing, 'get_context'):
+        # Python 2 always forks on POSIX systems.
+        return multiprocessing
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        raise NotImplementedError('Parallel computations need the fork start '
+                                  'method, which is not available on this platform.')
+    return multiprocessing.get_context('fork')
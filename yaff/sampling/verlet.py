@@ -448,6 +448,7 @@ class VerletHook(Hook):
 
 class VerletScreenLog(Hook):
     '''A screen logger for the Verlet algorithm'''
+    state_keys = ()
     def __init__(self, start=0, step=1):
         Hook.__init__(self, start, step)
         self.time0 = None
@@ -517,6 +518,7 @@ class ConsErrTracker(object):
 
 
 class KineticAnnealing(VerletHook):
+    state_keys = ()
     def __init__(self, annealing=0.99999, select=None, start=0, step=1):
         """
            This annealing hook is designed to be used with a plain Verlet
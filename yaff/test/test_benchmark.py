@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+from __future__ import division
+
+import os
+
+from molmod.test.common import tmpdir
+
+from yaff.benchmark import run_benchmarks, dump_results, load_results, \
+    compare_results, get_scaling, load_forcefield
+
+
+def test_load_forcefield_water():
+    ff = load_forcefield('water', (2, 1, 1))
+    assert ff.system.natom == 192
+    names = [part.name for part in ff.parts]
+    for name in 'pair_ei', 'ewald_reci', 'ewald_cor', 'pair_lj', 'pair_mm3', \
+                'pair_ljcross', 'pair_exprep', 'pair_dampdisp', 'valence':
+        assert name in names
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(['water'], [(1, 1, 1)], nrep=1, nstep=2)
+    labels = [record['label'] for record in results['records']]
+    assert labels[:2] == ['nlist rebuild', 'nlist recompute']
+    assert labels[-2:] == ['ff compute', 'verlet step']
+    assert 'part pair_lj' in labels
+    for record in results['records']:
+        assert record['case'] == 'water'
+        assert record['supercell'] == '1.1.1'
+        assert record['natom'] == 96
+        assert record['time'] > 0
+    with tmpdir(__name__, 'test_run_benchmarks') as dn:
+        fn_json = os.path.join(dn, 'bench.json')
+        dump_results(results, fn_json)
+        assert load_results(fn_json) == results
+
+
+def test_compare_results():
+    baseline = {'records': [
+        {'case': 'water', 'supercell': '1.1.1', 'natom': 96, 'label': 'ff compute', 'time': 1.0},
+        {'case': 'water', 'supercell': '1.1.1', 'natom': 96, 'label': 'verlet step', 'time': 2.0},
+        {'case': 'mil53', 'supercell': '1.1.1', 'natom': 152, 'label': 'ff compute', 'time': 1.0},
+    ]}
+    results = {'records': [
+        {'case': 'water', 'supercell': '1.1.1', 'natom': 96, 'label': 'ff compute', 'time': 1.5},
+        {'case': 'water', 'supercell': '1.1.1', 'natom': 96, 'label': 'verlet step', 'time': 2.2},
+        {'case': 'water', 'supercell': '2.1.1', 'natom': 192, 'label': 'ff compute', 'time': 3.0},
+    ]}
+    comparison = compare_results(results, baseline, threshold=1.2)
+    assert comparison == [
+        ('water', '1.1.1', 'ff compute', 1.5, 1.0, 1.5, True),
+        ('water', '1.1.1', 'verlet step', 2.2, 2.0, 1.1, False),
+    ]
+
+
+def test_get_scaling():
+    results = {'records': [
+        {'case': 'water', 'supercell': sc, 'natom': natom, 'label': label, 'time': time}
+        for sc, natom in [('1.1.1', 96), ('2.1.1', 192), ('2.2.1', 384)]
+        for label, time in [('linear', natom*1e-5), ('quadratic', natom**2*1e-7)]
+    ]}
+    scaling = get_scaling(results)
+    assert sorted(scaling) == [('water', 'linear'), ('water', 'quadratic')]
+    assert abs(scaling['water', 'linear'] - 1) < 1e-10
+    assert abs(scaling['water', 'quadratic'] - 2) < 1e-10
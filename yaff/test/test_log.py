@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# YAFF is yet another force-field code.
+# Copyright (C) 2011 Toon Verstraelen <Toon.Verstraelen@UGent.be>,
+# Louis Vanduyfhuys <Louis.Vanduyfhuys@UGent.be>, Center for Molecular Modeling
+# (CMM), Ghent University, Ghent, Belgium; all rights reserved unless otherwise
+# stated.
+#
+# This file is part of YAFF.
+#
+# YAFF is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# YAFF is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+# --
+
+
+from __future__ import division
+
+import json
+import os
+import threading
+import time
+
+import h5py as h5
+import numpy as np
+
+from molmod.test.common import tmpdir
+
+from yaff import *
+from yaff.log import ThreadTimerGroup, Profiler
+from yaff.sampling.test.common import get_ff_water32
+
+
+def test_thread_timer_group():
+    timer = ThreadTimerGroup()
+    records = []
+
+    def work():
+        # Sections outside collect are not recorded.
+        with timer.section('Ignored'):
+            pass
+        with timer.collect() as result:
+            with timer.section('Outer'):
+                with timer.section('Inner'):
+                    time.sleep(0.02)
+                    sum(range(100000))
+                time.sleep(0.01)
+        records.extend(result)
+        with timer.collect() as result:
+            pass
+        assert result == []
+
+    with timer.section('Main'):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    # The worker did not touch the shared timers.
+    assert sorted(timer.parts) == ['Main', 'Total']
+    assert [record[0] for record in records] == ['Inner', 'Outer']
+    inner, outer = records
+    assert inner[1] == inner[2]
+    assert inner[1] >= 0.02
+    assert outer[1] >= 0.03
+    assert abs(outer[1] - inner[1] - outer[2]) < 1e-10
+    assert inner[3] == inner[4]
+    assert abs(outer[3] - inner[3] - outer[4]) < 1e-10
+    # Sleeping does not take CPU time in the worker thread.
+    assert inner[3] < inner[1]
+    timer.merge(records)
+    timer.merge(records)
+    assert abs(timer.parts['Inner'].total.cpu - 2*inner[3]) < 1e-10
+    assert abs(timer.parts['Outer'].own.cpu - 2*outer[4]) < 1e-10
+    assert abs(timer.wall['Inner'][0] - 2*inner[1]) < 1e-10
+    assert abs(timer.wall['Outer'][1] - 2*outer[2]) < 1e-10
+    timer.reset()
+    assert timer.parts['Inner'].total.cpu == 0.0
+    assert timer.wall == {}
+
+
+def test_profiler_sections():
+    profiler = Profiler()
+    with profiler.section('Foo'):
+        profiler.annotate(size=3)
+    assert profiler.get_labels() == []
+    profiler.enable()
+    with profiler.section('Foo'):
+        time.sleep(0.01)
+    with profiler.section('Foo'):
+        with profiler.section('Bar'):
+            profiler.annotate(size=5)
+        profiler.annotate(size=4)
+    profiler.disable()
+    with profiler.section('Foo'):
+        pass
+    assert profiler.get_labels() == ['Bar', 'Foo']
+    records = profiler.get_records('Foo')
+    assert sorted(records) == ['cpu', 'size', 'start', 'wall']
+    assert records['wall'][0] >= 0.01
+    assert records['start'][1] >= records['start'][0] + records['wall'][0]
+    assert np.isnan(records['size'][0])
+    assert records['size'][1] == 4
+    assert profiler.get_records('Bar')['size'][0] == 5
+    summary = profiler.get_summary()
+    assert summary['Foo']['ncall'] == 2
+    assert abs(summary['Foo']['wall'] - records['wall'].sum()) < 1e-10
+    profiler.reset()
+    assert profiler.get_labels() == []
+
+
+def test_profiler_maxrecords():
+    profiler = Profiler(maxrecords=3)
+    profiler.enable()
+    for i in range(5):
+        with profiler.section('Foo'):
+            if i == 3:
+                profiler.annotate(size=i)
+    # Only the last three records are kept.
+    records = profiler.get_records('Foo')
+    assert records['wall'].shape == (3,)
+    assert (np.diff(records['start']) > 0).all()
+    assert np.isnan(records['size'][[0, 2]]).all()
+    assert records['size'][1] == 3
+    # The summary includes all calls.
+    summary = profiler.get_summary()
+    assert summary['Foo']['ncall'] == 5
+    assert summary['Foo']['wall'] >= records['wall'].sum()
+    with h5.File('yaff.test.test_log.test_profiler_maxrecords.h5', driver='core', backing_store=False) as f:
+        profiler.dump_hdf5(f)
+        assert f['Foo'].attrs['ncall'] == 5
+        assert f['Foo/wall'].shape == (3,)
+    # Unlimited after a reset
+    profiler.maxrecords = None
+    profiler.reset()
+    for i in range(5):
+        with profiler.section('Foo'):
+            pass
+    assert profiler.get_records('Foo')['wall'].shape == (5,)
+
+
+def test_profiler_verlet():
+    profiler.reset()
+    profiler.enable()
+    try:
+        ff = get_ff_water32()
+        nve = VerletIntegrator(ff, 1.0*femtosecond, hooks=VerletScreenLog(step=5))
+        nve.run(10)
+    finally:
+        profiler.disable()
+    labels = profiler.get_labels()
+    for part in ff.parts:
+        assert profiler.get_records('ForcePart %s' % part.name)['wall'].shape == (11,)
+    assert 'ForcePart all' in labels
+    assert 'Hook VerletScreenLog' in labels
+    assert profiler.get_records('ForcePart pair_ei')['nneigh'][0] > 0
+    records = profiler.get_records('NeighborList')
+    assert records['rebuild'].sum() == ff.nlist.nrebuild
+    assert (records['nalloc'] >= records['nneigh']).all()
+    with tmpdir(__name__, 'test_profiler_verlet') as dn:
+        fn_json = os.path.join(dn, 'profile.json')
+        profiler.dump_json(fn_json)
+        with open(fn_json) as f:
+            data = json.load(f)
+        assert sorted(data) == labels
+        assert data['NeighborList']['nneigh'] == records['nneigh'].tolist()
+    with h5.File('yaff.test.test_log.test_profiler_verlet.h5', driver='core', backing_store=False) as f:
+        profiler.dump_hdf5(f)
+        assert (f['NeighborList/wall'][:] == records['wall']).all()
+    profiler.reset()